@@ -0,0 +1,173 @@
+"""
+Compare kNN recall, latency and memory across dense_vector index types.
+
+Copies the stored vectors of a live index (public KB by default) into one
+throwaway index per type (``hnsw`` = float32, ``int8_hnsw`` = quantized),
+force-merges each to a single segment, then runs the same queries against all
+of them:
+
+  * recall@k against exact cosine ranking (``script_score`` over every doc)
+  * client-side p50 / p95 latency of the ``knn`` search
+  * on-disk store size and an estimate of the off-heap HNSW memory
+    (vectors plus graph links), which is what has to fit in the page cache
+
+Queries are the eval prompts (seeds/evals/risk/en.jsonl by default) embedded
+with the model the index was built with, so results reflect our own data.
+
+Usage (from repo root, Elasticsearch running and the KB ingested):
+
+  PYTHONPATH=services/api python scripts/bench_knn.py
+  PYTHONPATH=services/api python scripts/bench_knn.py --index providers_places \
+      --types hnsw int8_hnsw --k 5 --num-candidates 50 --repeat 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+from typing import Any, Dict, List
+
+from elasticsearch import helpers
+
+from app.config import settings
+from app.tools import embeddings, es_client, knn_bench
+
+logging.basicConfig(level=logging.INFO)
+
+BENCH_PREFIX = "bench-knn-"
+
+
+def _load_vectors(es: Any, index: str, limit: int) -> Dict[str, List[float]]:
+    vectors: Dict[str, List[float]] = {}
+    for hit in helpers.scan(
+        es,
+        index=index,
+        query={"query": {"match_all": {}}},
+        source_includes=["embedding"],
+    ):
+        vector = (hit.get("_source") or {}).get("embedding")
+        if vector:
+            vectors[hit["_id"]] = vector
+        if len(vectors) >= limit:
+            break
+    return vectors
+
+
+def _vector_memory_mb(docs: int, dims: int, options: Dict[str, Any]) -> float:
+    # Float vectors: 4 bytes/dim; int8: 1 byte/dim plus a float correction each
+    per_vector = dims + 4 if str(options["type"]).startswith("int8") else dims * 4
+    # Level-0 HNSW links: up to 2*m neighbours of 4 bytes each
+    graph = 4 * 2 * int(options["m"]) if "m" in options else 0
+    return docs * (per_vector + graph) / (1024 * 1024)
+
+
+def _build(
+    es: Any,
+    name: str,
+    dims: int,
+    options: Dict[str, Any],
+    vectors: Dict[str, List[float]],
+) -> None:
+    if es.indices.exists(index=name):
+        es.indices.delete(index=name)
+    es.indices.create(
+        index=name,
+        mappings={
+            "properties": {
+                "embedding": {
+                    "type": "dense_vector",
+                    "dims": dims,
+                    "index": True,
+                    "similarity": "cosine",
+                    "index_options": options,
+                }
+            }
+        },
+        settings=es_client.index_settings("ingest"),
+    )
+    helpers.bulk(
+        es,
+        (
+            {"_index": name, "_id": doc_id, "_source": {"embedding": vector}}
+            for doc_id, vector in vectors.items()
+        ),
+        chunk_size=500,
+    )
+    es.indices.refresh(index=name)
+    # One segment per index, so the comparison is not about merge state
+    es.indices.forcemerge(index=name, max_num_segments=1)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--index", default=settings.es_public_index)
+    ap.add_argument("--queries", default="seeds/evals/risk/en.jsonl")
+    ap.add_argument("--max-queries", type=int, default=100)
+    ap.add_argument("--max-docs", type=int, default=100_000)
+    ap.add_argument(
+        "--types",
+        nargs="+",
+        choices=es_client.VECTOR_INDEX_TYPES,
+        default=["hnsw", "int8_hnsw"],
+    )
+    ap.add_argument("--k", type=int, default=8)
+    ap.add_argument("--num-candidates", type=int, default=64)
+    ap.add_argument("--repeat", type=int, default=10, help="timed runs per query")
+    ap.add_argument("--keep", action="store_true", help="keep the bench indices")
+    args = ap.parse_args()
+
+    es = es_client.get_es_client()
+    es_client.sync_embeddings_model(es, force=True)
+    vectors = _load_vectors(es, args.index, args.max_docs)
+    if not vectors:
+        raise SystemExit(f"No embeddings found in {args.index}")
+    dims = len(next(iter(vectors.values())))
+    queries = embeddings.embed(knn_bench.load_queries([args.queries], args.max_queries))
+    logging.info(
+        "%d docs x %d dims from %s, %d queries, k=%d, num_candidates=%d",
+        len(vectors),
+        dims,
+        args.index,
+        len(queries),
+        args.k,
+        args.num_candidates,
+    )
+
+    names = {kind: f"{BENCH_PREFIX}{kind.replace('_', '-')}" for kind in args.types}
+    try:
+        for kind, name in names.items():
+            _build(es, name, dims, es_client.vector_index_options(kind), vectors)
+        # Ground truth is the same for every type: exact scoring over raw floats
+        truth = [
+            knn_bench.exact_ids(es, names[args.types[0]], q, args.k) for q in queries
+        ]
+
+        print(
+            f"{'type':<10} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'store MB':>9} {'hnsw MB':>8}"
+        )
+        for kind, name in names.items():
+            options = es_client.vector_index_options(kind)
+            result = knn_bench.measure(
+                es,
+                name,
+                queries,
+                truth,
+                args.k,
+                args.num_candidates,
+                repeat=args.repeat,
+            )
+            store = es.indices.stats(index=name, metric="store")["_all"]["primaries"]
+            print(
+                f"{kind:<10} {result.recall:>9.3f} {result.p50_ms:>8.1f} "
+                f"{result.p95_ms:>8.1f} "
+                f"{store['store']['size_in_bytes'] / (1024 * 1024):>9.1f} "
+                f"{_vector_memory_mb(len(vectors), dims, options):>8.1f}"
+            )
+    finally:
+        if not args.keep:
+            es.indices.delete(index=",".join(names.values()), ignore_unavailable=True)
+
+
+if __name__ == "__main__":
+    main()
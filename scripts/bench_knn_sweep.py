@@ -0,0 +1,139 @@
+"""
+Sweep kNN k / num_candidates / similarity cutoffs against the live indices.
+
+Replays a query set (golden inputs, risk eval seeds and any extra JSON/JSONL
+given with --queries; records need a "query" or "text" field), embedded with
+the model the indices were built with, against each index and reports per
+combination:
+
+  * recall@k against exact brute-force cosine ranking
+  * hits returned per query (similarity cutoffs drop weak hits)
+  * client-side p50 / p95 latency
+
+and, per index, the fewest candidates that reach --target-recall for the
+configured k, as KNN_<KIND>_* settings to copy into .env. Private-index
+queries are assigned round-robin to the --users users with the most memories
+and scoped like the API scopes them (owner filter and routing), for the exact
+ground truth as well as the kNN search.
+
+Usage (from repo root, Elasticsearch running and the indices ingested):
+
+  PYTHONPATH=services/api python scripts/bench_knn_sweep.py
+  PYTHONPATH=services/api python scripts/bench_knn_sweep.py --kinds public \
+      --k 4 8 16 --num-candidates 16 32 64 128 --similarity 0.3 0.5 \
+      --queries my_queries.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+from typing import List, Optional
+
+from app.config import settings
+from app.tools import embeddings, es_client, knn_bench
+
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_QUERY_FILES = [
+    "services/api/tests/golden/inputs.jsonl",
+    "seeds/evals/risk/en.jsonl",
+]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "--kinds",
+        nargs="+",
+        choices=es_client.INDEX_KINDS,
+        default=list(es_client.INDEX_KINDS),
+    )
+    ap.add_argument(
+        "--queries", nargs="*", default=[], help="extra JSON/JSONL query files"
+    )
+    ap.add_argument(
+        "--no-default-queries",
+        action="store_true",
+        help="only replay the --queries files",
+    )
+    ap.add_argument("--max-queries", type=int, default=200)
+    ap.add_argument("--k", nargs="+", type=int, default=[4, 8, 10, 16])
+    ap.add_argument(
+        "--num-candidates", nargs="+", type=int, default=[16, 32, 50, 64, 100, 200]
+    )
+    ap.add_argument(
+        "--similarity",
+        nargs="*",
+        type=float,
+        default=[],
+        help="cosine cutoffs to try besides none",
+    )
+    ap.add_argument("--repeat", type=int, default=5, help="timed runs per query")
+    ap.add_argument(
+        "--users", type=int, default=50, help="private-index users to sample"
+    )
+    ap.add_argument("--target-recall", type=float, default=0.95)
+    args = ap.parse_args()
+
+    paths = ([] if args.no_default_queries else DEFAULT_QUERY_FILES) + args.queries
+    texts = knn_bench.load_queries(paths, args.max_queries)
+    if not texts:
+        raise SystemExit(f"No queries found in {', '.join(paths)}")
+
+    es = es_client.get_es_client()
+    es_client.sync_embeddings_model(es, force=True)
+    vectors = embeddings.embed(texts)
+    similarities: List[Optional[float]] = [None, *args.similarity]
+    names = es_client.index_names()
+    logging.info(
+        "Replaying %d queries from %s with %s",
+        len(texts),
+        ", ".join(paths),
+        embeddings.MODEL,
+    )
+
+    suggestions: List[str] = []
+    for kind in args.kinds:
+        k_configured = int(getattr(settings, f"knn_{kind}_k"))
+        ks = sorted(set(args.k) | {k_configured})
+        user_ids: Optional[List[str]] = None
+        if kind == "private":
+            users = knn_bench.sample_users(es, names[kind], args.users)
+            if not users:
+                logging.warning("No private memories in %s; skipping", names[kind])
+                continue
+            user_ids = [users[i % len(users)] for i in range(len(vectors))]
+        results = knn_bench.sweep(
+            es,
+            names[kind],
+            vectors,
+            ks,
+            args.num_candidates,
+            similarities,
+            repeat=args.repeat,
+            user_ids=user_ids,
+        )
+        print(knn_bench.HEADER)
+        for result in results:
+            print(result.row())
+        print()
+        best = knn_bench.recommend(results, k_configured, args.target_recall)
+        prefix = f"KNN_{kind.upper()}"
+        if best is None:
+            suggestions.append(
+                f"# {prefix}: no swept num_candidates reaches recall "
+                f"{args.target_recall} at k={k_configured}"
+            )
+        else:
+            suggestions.append(
+                f"{prefix}_K={best.k}\n{prefix}_NUM_CANDIDATES={best.num_candidates}"
+                f"  # recall {best.recall:.3f}, p95 {best.p95_ms:.1f} ms"
+            )
+
+    print("Suggested settings:")
+    print("\n".join(suggestions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Measure logging overhead per request at INFO vs DEBUG.
+
+Replays the log calls one graph run makes (request start/end, risk
+classification, provider search with its raw hits and scored candidates,
+planner preferences) against the real ``configure_logging`` pipeline, writing
+to a temporary log directory, and reports the time spent on the calling
+thread per request for:
+
+  * direct handlers (``LOG_QUEUE=false``) vs the queue (``LOG_QUEUE=true``)
+  * ``LOG_LEVEL=INFO`` vs ``DEBUG``
+  * eager f-strings vs lazy ``%s`` arguments (the f-string variant builds every
+    message even when its level is disabled, as the hot paths used to; the lazy
+    one sends payload lines through ``log_payload``, so ``LOG_PAYLOAD_SAMPLE``
+    and ``LOG_PAYLOAD_MAX_CHARS`` apply)
+
+The stream handler is pointed at /dev/null so terminal speed does not skew the
+numbers.
+
+Usage (from repo root):
+
+  PYTHONPATH=services/api python scripts/bench_logging.py
+  PYTHONPATH=services/api python scripts/bench_logging.py --requests 5000 --format json
+  LOG_PAYLOAD_SAMPLE=100 PYTHONPATH=services/api python scripts/bench_logging.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from app.config import logging as logging_config
+from app.config.logging import log_payload
+
+# Shaped like a provider search response and its scored candidates
+_RAW = {
+    "hits": {
+        "hits": [
+            {
+                "_id": f"prov-{i}",
+                "_score": 1.0 / (i + 1),
+                "_source": {
+                    "name": f"Clinic {i}",
+                    "kind": "clinic",
+                    "services": ["lab", "blood_test", "vaccination"],
+                    "hours": "Sun-Thu 08:00-18:00",
+                    "geo": {"lat": 32.08 + i / 100, "lon": 34.78},
+                },
+            }
+            for i in range(10)
+        ]
+    }
+}
+_CANDIDATES = [hit["_source"] for hit in _RAW["hits"]["hits"]]
+_PREFS = {"preferred_kinds": ["lab", "clinic"], "max_travel_km": 7.5}
+_PAIRS = [("urgent_care", 0.12), ("see_doctor", 0.31), ("self_care", 0.72)]
+
+
+def _lazy_request(log: Dict[str, logging.Logger]) -> None:
+    log["main"].info("Running graph for user %s", "bench-user")
+    log["risk"].info("Starting risk classification")
+    log["risk"].debug("Parsed thresholds: %s", {"urgent_care": 0.65})
+    log_payload(log["risk"], "Base query text: %s", "I need a blood test tomorrow")
+    log_payload(log["risk"], "Classification results: %s", _PAIRS)
+    for label, score in _PAIRS:
+        log["risk"].debug("Checking %s (score=%.3f) against %s", label, score, 0.5)
+    log_payload(log["places"], "Searching providers for query: %s", "blood test")
+    log_payload(log["places"], "Raw provider search results: %s", _RAW)
+    log_payload(log["places"], "Final candidates after scoring: %s", _CANDIDATES)
+    log_payload(log["planner"], "Planner: User preferences: %s", _PREFS)
+    log_payload(log["planner"], "Planner: Best candidate: %s", _CANDIDATES[0])
+    log["main"].info("Graph run completed for user %s rid=%s", "bench-user", "rid")
+
+
+def _eager_request(log: Dict[str, logging.Logger]) -> None:
+    log["main"].info(f"Running graph for user {'bench-user'}")
+    log["risk"].info("Starting risk classification")
+    log["risk"].info(f"Parsed thresholds: {({'urgent_care': 0.65})}")
+    log["risk"].debug(f"Base query text: {'I need a blood test tomorrow morning'}")
+    log["risk"].debug(f"Classification results: {_PAIRS}")
+    for label, score in _PAIRS:
+        log["risk"].debug(f"Checking {label} (score={score:.3f}) against {0.5}")
+    log["places"].debug(f"Searching providers for query: {'blood test'}")
+    log["places"].debug(f"Raw provider search results: {_RAW}")
+    log["places"].debug(f"Final candidates after scoring: {_CANDIDATES}")
+    log["planner"].debug(f"Planner: User preferences: {_PREFS}")
+    log["planner"].debug(f"Planner: Best candidate: {_CANDIDATES[0]}")
+    log["main"].info(f"Graph run completed for user {'bench-user'} rid={'rid'}")
+
+
+def _measure(
+    request: Callable[[Dict[str, logging.Logger]], None],
+    requests: int,
+    level: str,
+    queued: bool,
+    fmt: str,
+) -> float:
+    """Mean microseconds per request spent on the calling thread."""
+
+    os.environ["LOG_LEVEL"] = level
+    os.environ["LOG_QUEUE"] = "true" if queued else "false"
+    os.environ["LOG_FORMAT"] = fmt
+    logging_config.configure_logging()
+    handlers: List[Any] = list(logging.getLogger().handlers)
+    if logging_config._listener is not None:
+        handlers += list(logging_config._listener.handlers)
+    for handler in handlers:
+        if type(handler) is logging.StreamHandler:
+            handler.setStream(open(os.devnull, "w"))
+    log = {
+        name: logging.getLogger(f"app.graph.nodes.{name}")
+        for name in ("main", "risk", "places", "planner")
+    }
+    for _ in range(min(100, requests)):
+        request(log)
+    started = time.perf_counter()
+    for n in range(requests):
+        logging_config.set_request_id(f"bench-{n}")
+        request(log)
+    elapsed = time.perf_counter() - started
+    # Drain the queue outside the timed section
+    logging_config.stop_logging()
+    return elapsed / requests * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--format", choices=["text", "json"], default="text")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        os.environ["APP_LOG_DIR"] = log_dir
+        print(
+            f"{'level':<6} {'pipeline':<8} {'eager f-str':>12} {'lazy %s':>10}  (us/req)"
+        )
+        for level in ("INFO", "DEBUG"):
+            for queued in (False, True):
+                eager = _measure(
+                    _eager_request, args.requests, level, queued, args.format
+                )
+                lazy = _measure(
+                    _lazy_request, args.requests, level, queued, args.format
+                )
+                print(
+                    f"{level:<6} {'queue' if queued else 'direct':<8} "
+                    f"{eager:>12.1f} {lazy:>10.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Compare per-worker memory with and without pre-fork model preloading.
+
+Boots gunicorn twice with the same worker count:
+
+  * ``worker`` — every worker loads models after the fork (private copies)
+  * ``master`` — the master loads models, freezes the GC heap, then forks
+
+and reports RSS / PSS / private bytes per worker from /proc/<pid>/smaps_rollup
+(Linux only). PSS is the fair share of shared pages, so the drop in PSS and
+private memory is the saving from copy-on-write sharing.
+
+Usage (from repo root, real models recommended):
+
+  PYTHONPATH=services/api python scripts/bench_prefork_memory.py --workers 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import requests
+
+logging.basicConfig(level=logging.INFO)
+
+API_DIR = Path(__file__).resolve().parent.parent / "services" / "api"
+
+
+def _children(pid: int) -> list[int]:
+    kids: list[int] = []
+    for task in Path(f"/proc/{pid}/task").iterdir():
+        raw = (task / "children").read_text().split()
+        kids.extend(int(k) for k in raw)
+    return kids
+
+
+def _smaps_rollup(pid: int) -> dict[str, int]:
+    out: dict[str, int] = {}
+    for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and parts[2] == "kB":
+            out[parts[0].rstrip(":")] = int(parts[1])
+    return out
+
+
+def _wait_ready(port: int, workers: int, master: int, timeout_s: float) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/healthz", timeout=1).ok:
+                if len(_children(master)) >= workers:
+                    return
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    raise SystemExit(f"gunicorn did not become ready within {timeout_s:.0f}s")
+
+
+def measure(mode: str, workers: int, port: int, settle_s: float) -> list[dict]:
+    env = os.environ | {
+        "PRELOAD_MODELS": mode,
+        "WEB_CONCURRENCY": str(workers),
+        "PORT": str(port),
+        "APP_ENV": os.getenv("APP_ENV", "test"),
+    }
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "python:app.gunicorn_conf"]
+        + ["app.main:app"],
+        cwd=API_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_ready(port, workers, proc.pid, timeout_s=600)
+        # Let post_worker_init preloads finish and the first GC cycles run
+        time.sleep(settle_s)
+        rows = []
+        for pid in _children(proc.pid):
+            stats = _smaps_rollup(pid)
+            rows.append(
+                {
+                    "pid": pid,
+                    "rss_mb": stats.get("Rss", 0) / 1024,
+                    "pss_mb": stats.get("Pss", 0) / 1024,
+                    "private_mb": (
+                        stats.get("Private_Clean", 0) + stats.get("Private_Dirty", 0)
+                    )
+                    / 1024,
+                }
+            )
+        return rows
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=60)
+
+
+def _summary(label: str, rows: list[dict]) -> None:
+    n = max(len(rows), 1)
+    logging.info(
+        "%-7s workers=%d avg rss=%.1f MB avg pss=%.1f MB avg private=%.1f MB total pss=%.1f MB",
+        label,
+        len(rows),
+        sum(r["rss_mb"] for r in rows) / n,
+        sum(r["pss_mb"] for r in rows) / n,
+        sum(r["private_mb"] for r in rows) / n,
+        sum(r["pss_mb"] for r in rows),
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--port", type=int, default=8055)
+    ap.add_argument("--settle", type=float, default=10.0, help="seconds after ready")
+    args = ap.parse_args()
+
+    if not Path("/proc/self/smaps_rollup").exists():
+        raise SystemExit("smaps_rollup not available; run on Linux >= 4.14")
+
+    results = {}
+    for mode in ("worker", "master"):
+        logging.info("Booting %d workers with PRELOAD_MODELS=%s", args.workers, mode)
+        results[mode] = measure(mode, args.workers, args.port, args.settle)
+    for mode, rows in results.items():
+        _summary(mode, rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Delete (or archive, then delete) expired private memory facts.
+
+Facts written by the API carry ``expires_at`` (``updated_at + ttl_days``);
+reads already skip expired ones, this removes them from the index in
+throttled ``delete_by_query`` batches. Schedule it from cron, or set
+MEMORY_COMPACTION_INTERVAL_S to run it inside the API instead.
+
+Usage (from repo root):
+
+  PYTHONPATH=services/api python scripts/compact_memory.py
+  PYTHONPATH=services/api python scripts/compact_memory.py \
+      --archive-index private_user_memory-archive --requests-per-second 200
+
+  # Count what would go
+  PYTHONPATH=services/api python scripts/compact_memory.py --dry-run
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+
+from app.config import settings
+from app.tools import es_client, memory_ttl
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--index", default=settings.es_private_index)
+    ap.add_argument(
+        "--archive-index", help="copy expired facts here first (MEMORY_ARCHIVE_INDEX)"
+    )
+    ap.add_argument("--batch-size", type=int, help="docs per scroll batch")
+    ap.add_argument(
+        "--requests-per-second", type=float, help="throttle; 0 = unthrottled"
+    )
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+
+    es = es_client.get_es_client()
+    if args.dry_run:
+        count = es.count(index=args.index, query=memory_ttl.expired_query())["count"]
+        logging.info("%d expired facts in %s", count, args.index)
+        return
+    stats = memory_ttl.compact(
+        es,
+        index=args.index,
+        archive_index=args.archive_index,
+        batch_size=args.batch_size,
+        requests_per_second=args.requests_per_second,
+    )
+    logging.info("%s: %s", args.index, stats.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,65 +1,55 @@
 import os
 import logging
-import json
 import re
 import hashlib
-from elasticsearch import Elasticsearch, helpers
-from sentence_transformers import SentenceTransformer
-from app.config import settings
+from typing import Iterator
+
+from elasticsearch import Elasticsearch
+from app.tools import embeddings, es_client, ingest, jsonstream
 
 
 logging.basicConfig(level=logging.INFO)
 
 ES = os.getenv("ES_HOST", "http://localhost:9200")
 INDEX = os.getenv("ES_PLACES_INDEX", "providers_places")
-MODEL = settings.embeddings_model
-VEC_DIMS = 384
 es = Elasticsearch(ES)
+# Embed with the model the live indices were built with (see scripts/reembed.py)
+es_client.sync_embeddings_model(es, force=True)
 
-# Init model only if needed
-_model = None
-if MODEL != "__stub__":
-    _model = SentenceTransformer(MODEL)
-
-
-def embed_one(text: str) -> list[float]:
-    if MODEL == "__stub__" or _model is None:
-        h = int(hashlib.sha1(text.encode("utf-8")).hexdigest(), 16)
-        idx = h % VEC_DIMS
-        v = [0.0] * VEC_DIMS
-        v[idx] = 1.0
-        return v
-    return _model.encode([text], normalize_embeddings=True)[0].tolist()
-
+# JSON array or JSONL, optionally gzipped; records are streamed one at a time
+PROVIDERS_FILE = os.getenv("PROVIDERS_FILE", "seeds/providers/tel_aviv_providers.json")
 
-with open("seeds/providers/tel_aviv_providers.json", "r", encoding="utf-8") as f:
-    data = json.load(f)
+if es.indices.exists(index=INDEX):
+    es.indices.put_mapping(
+        index=INDEX, properties={"content_hash": {"type": "keyword"}}
+    )
 
-logging.info("Indexing %d providers into %s using model %s.", len(data), INDEX, MODEL)
+logging.info(
+    "Indexing providers from %s into %s using model %s.",
+    PROVIDERS_FILE,
+    INDEX,
+    embeddings.MODEL,
+)
 
-actions = []
-for p in data:
-    text = f"{p['name']} {p.get('kind','')} {' '.join(p.get('services', []))} {p.get('hours','')}"
-    vec = embed_one(text)  # <-- FLAT VECTOR
-    assert (
-        isinstance(vec, list)
-        and len(vec) == VEC_DIMS
-        and all(isinstance(x, (int, float)) for x in vec)
-    ), f"Bad embedding shape or dimensions: type={type(vec)}, len={len(vec)}"
 
-    doc = p | {"embedding": vec}
-    slug = re.sub(r"[^a-z0-9]+", "-", p["name"].lower()).strip("-")
-    geokey = f"{p.get('geo',{}).get('lat','')},{p.get('geo',{}).get('lon','')}"
-    doc_id = hashlib.sha1(f"{slug}|{geokey}".encode("utf-8")).hexdigest()
+def records() -> Iterator[ingest.Record]:
+    for p in jsonstream.iter_records(PROVIDERS_FILE):
+        slug = re.sub(r"[^a-z0-9]+", "-", p["name"].lower()).strip("-")
+        geokey = f"{p.get('geo',{}).get('lat','')},{p.get('geo',{}).get('lon','')}"
+        doc_id = hashlib.sha1(f"{slug}|{geokey}".encode("utf-8")).hexdigest()
 
-    actions.append(
-        {
+        action = {
             "_op_type": "index",
             "_index": INDEX,
             "_id": doc_id,
-            "_source": doc,
+            "_source": dict(p),
         }
-    )
+        yield action, ingest.places_text(p)
+
 
-helpers.bulk(es, actions)
-logging.info("Indexed %d providers into %s", len(actions), INDEX)
+# Only new or changed providers are re-embedded; ones dropped from the feed
+# are deleted. Bulk-load settings apply only while the index is still empty;
+# a refresh follows.
+with ingest.ingest_settings(es, INDEX):
+    stats = ingest.run(es, records(), prune_index=INDEX)
+logging.info("Indexed providers into %s: %s", INDEX, stats.summary())
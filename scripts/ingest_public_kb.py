@@ -3,90 +3,93 @@ import logging
 import glob
 import hashlib
 from datetime import datetime
-from typing import Any, List
+from typing import Any, Iterator
 
-from elasticsearch import Elasticsearch, helpers
-from sentence_transformers import SentenceTransformer
-from app.config import settings
+from elasticsearch import Elasticsearch
+from app.tools import embeddings, es_client, ingest
+from app.tools.passages import DEFAULT_PASSAGE_TOKENS, split_passages
 
 logging.basicConfig(level=logging.INFO)
 
 ES = os.getenv("ES_HOST", "http://localhost:9200")
 INDEX = os.getenv("ES_PUBLIC_INDEX", "public_medical_kb")
-MODEL = settings.embeddings_model
-VEC_DIMS = 384
 es = Elasticsearch(ES)
+# Embed with the model the live indices were built with (see scripts/reembed.py)
+es_client.sync_embeddings_model(es, force=True)
 
-# init model lazily
-_model = None
-if MODEL != "__stub__":
-    _model = SentenceTransformer(MODEL)
-
-
-def embed_one(text: str) -> List[float]:
-    """Return a single embedding vector (length VEC_DIMS)."""
-    if MODEL == "__stub__" or _model is None:
-        h = int(hashlib.sha1(text.encode("utf-8")).hexdigest(), 16)
-        idx = h % VEC_DIMS
-        v = [0.0] * VEC_DIMS
-        v[idx] = 1.0
-        return v
-    return _model.encode([text], normalize_embeddings=True)[0].tolist()
-
+PASSAGE_TOKENS = int(os.getenv("KB_PASSAGE_TOKENS", str(DEFAULT_PASSAGE_TOKENS)))
 
 paths = sorted(glob.glob("seeds/public_medical_kb/*.md"))
 logging.info(
-    "Indexing %d public medical KB docs into %s using model %s.",
+    "Indexing %d public medical KB docs into %s using model %s (passages <= %d tokens).",
     len(paths),
     INDEX,
-    MODEL,
+    embeddings.MODEL,
+    PASSAGE_TOKENS,
 )
 
-actions = []
-for path in paths:
-    with open(path, "r", encoding="utf-8") as f:
-        text = f.read()
-
-    title = os.path.basename(path).replace(".md", "").replace("_", " ")
-    section = (
-        "general"
-        if "home" in path
-        else (
-            "interactions"
-            if "warfarin" in path
-            else "warnings" if "ibuprofen" in path else "general"
-        )
+if es.indices.exists(index=INDEX):
+    # Older indices were created before passage fields existed
+    es.indices.put_mapping(
+        index=INDEX,
+        properties={
+            "doc_id": {"type": "keyword"},
+            "position": {"type": "integer"},
+            "heading": {"type": "text"},
+            "content_hash": {"type": "keyword"},
+        },
     )
-    source_url = f"file://{path}"
 
-    doc: dict[str, Any] = {
-        "title": title.title(),
-        "section": section,
-        "language": "en",
-        "jurisdiction": "generic",
-        "source_url": source_url,
-        "updated_on": datetime.utcnow().isoformat(),
-        "text": text,
-    }
 
-    vec = embed_one(doc["title"] + "\n" + doc["text"])  # <-- FLAT LIST
-    assert (
-        isinstance(vec, list)
-        and len(vec) == VEC_DIMS
-        and isinstance(vec[0], (int, float))
-    ), f"Bad embedding shape/type: {type(vec)} len={getattr(vec, '__len__', None)}"
+def records() -> Iterator[ingest.Record]:
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+
+        title = os.path.basename(path).replace(".md", "").replace("_", " ")
+        section = (
+            "general"
+            if "home" in path
+            else (
+                "interactions"
+                if "warfarin" in path
+                else "warnings" if "ibuprofen" in path else "general"
+            )
+        )
+        source_url = f"file://{path}"
+        doc_id = hashlib.sha1((source_url + "|" + section).encode("utf-8")).hexdigest()
+        updated_on = datetime.utcnow().isoformat()
 
-    doc["embedding"] = vec
-    doc_id = hashlib.sha1((source_url + "|" + section).encode("utf-8")).hexdigest()
+        for passage in split_passages(text, max_tokens=PASSAGE_TOKENS):
+            doc: dict[str, Any] = {
+                "title": title.title(),
+                "section": section,
+                "language": "en",
+                "jurisdiction": "generic",
+                "source_url": source_url,
+                "updated_on": updated_on,
+                "doc_id": doc_id,
+                "position": passage["position"],
+                "heading": passage["heading"],
+                "text": passage["text"],
+            }
+            action = {
+                "_op_type": "index",
+                "_index": INDEX,
+                "_id": f"{doc_id}:{passage['position']}",
+                "_source": doc,
+            }
+            yield action, ingest.public_text(doc)
 
-    actions.append(
-        {
-            "_op_type": "index",
-            "_index": INDEX,
-            "_id": doc_id,
-            "_source": doc,
-        }
-    )
 
-helpers.bulk(es, actions)
-logging.info("Indexed %d KB docs into %s", len(actions), INDEX)
+# Unchanged passages are skipped; whole-file docs from before passage chunking
+# and trailing passages of documents that got shorter are pruned. Bulk-load
+# settings apply only while the index is still empty; a refresh follows.
+with ingest.ingest_settings(es, INDEX):
+    stats = ingest.run(es, records(), prune_index=INDEX)
+logging.info(
+    "Indexed passages from %d KB docs into %s: %s",
+    len(paths),
+    INDEX,
+    stats.summary(),
+)
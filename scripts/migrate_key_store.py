@@ -0,0 +1,61 @@
+"""
+Move per-user encryption keys from one file each into the SQLite key store.
+
+Copies every ``<user_id>.key`` under ``data_dir/keys`` (or --from) into the
+SQLite store (``data_dir/keys.db`` or --to), wrapped under
+``KEY_STORE_MASTER_KEY``. Users already in the store keep their key; a
+different key for the same user aborts the run, since data encrypted under
+either would become unreadable. Set ``KEY_STORE=sqlite`` for the API once the
+copy is done; --delete-files removes the key files as they are copied.
+
+--rewrap re-encrypts every stored key under the first ``KEY_STORE_MASTER_KEY``
+(list the old master key after it while rotating).
+
+Usage (from repo root):
+
+  PYTHONPATH=services/api KEY_STORE_MASTER_KEY=... python scripts/migrate_key_store.py
+  PYTHONPATH=services/api python scripts/migrate_key_store.py --delete-files
+  PYTHONPATH=services/api KEY_STORE_MASTER_KEY=new,old \
+      python scripts/migrate_key_store.py --rewrap
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+from pathlib import Path
+
+from app.config import settings
+from app.tools import key_store
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--from", dest="source", default=None, help="key file directory")
+    ap.add_argument("--to", dest="target", default=None, help="SQLite key store file")
+    ap.add_argument("--delete-files", action="store_true")
+    ap.add_argument("--rewrap", action="store_true", help="only rotate the master key")
+    args = ap.parse_args()
+
+    data_dir = Path(settings.data_dir)
+    target = key_store.SQLiteKeyStore(
+        Path(args.target) if args.target else data_dir / "keys.db",
+        key_store.master_key(),
+    )
+    if args.rewrap:
+        logging.info("Re-wrapped %d keys in %s", target.rewrap(), target.path)
+        return
+
+    source = key_store.FileKeyStore(
+        Path(args.source) if args.source else data_dir / "keys"
+    )
+    copied = key_store.migrate(source, target, delete_source=args.delete_files)
+    logging.info(
+        "Copied %d keys from %s into %s", copied, source.directory, target.path
+    )
+
+
+if __name__ == "__main__":
+    main()
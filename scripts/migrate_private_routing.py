@@ -0,0 +1,53 @@
+"""
+Move private memory onto per-user routing.
+
+Private memory documents are written and looked up with ``routing=user_id``
+so a user's facts live on one shard. Indices created before that hold
+documents placed by ``_id``; on a multi-shard index routed lookups would miss
+them. This script installs the index template that requires ``_routing``,
+rebuilds the private index as ``<ES_PRIVATE_INDEX>-<version>`` with every
+document routed by its ``user_id`` (stored vectors are copied when the index
+records the active model), catches up on writes made meanwhile and swaps the
+alias. Run it once before scaling the private index past one shard.
+
+Usage (from repo root):
+
+  PYTHONPATH=services/api python scripts/migrate_private_routing.py
+  PYTHONPATH=services/api python scripts/migrate_private_routing.py --version v2 \
+      --delete-old
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+
+from app.tools import embeddings, es_client, reembed
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--version", help="suffix for the new index (default: UTC time)")
+    ap.add_argument("--max-docs-per-s", type=float, help="copy rate cap")
+    ap.add_argument("--delete-old", action="store_true")
+    args = ap.parse_args()
+
+    es = es_client.get_es_client()
+    # Copy under the model the live indices use; only memory is rebuilt
+    es_client.sync_embeddings_model(es, force=True)
+    es_client.ensure_index_templates(es)
+    stats = reembed.run(
+        es,
+        embeddings.MODEL,
+        version=args.version,
+        max_docs_per_s=args.max_docs_per_s,
+        delete_old=args.delete_old,
+        kinds=["private"],
+    )
+    logging.info("private: %s", stats["private"].summary())
+
+
+if __name__ == "__main__":
+    main()
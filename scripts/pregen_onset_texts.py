@@ -0,0 +1,57 @@
+"""
+Pre-generate onset paraphrases and onset LLM fallbacks.
+
+Paraphrases are produced for every ingredient in the med facts file (per
+language), validated with the same numeric-token check used at request time and
+stored in <DATA_DIR>/paraphrases/onset.db. The API then serves them from
+memory and never calls the LLM for onset answers inline.
+
+Usage (from repo root; Ollama must be reachable for paraphrases):
+
+  PYTHONPATH=services/api python scripts/pregen_onset_texts.py --langs en he
+
+  # Also warm neutral fallbacks for ingredients without vetted facts
+  PYTHONPATH=services/api LLM_PROVIDER=ollama python scripts/pregen_onset_texts.py \
+      --langs en he --fallback-ingredients "" naproxen cetirizine
+
+Re-run after editing seeds/med_facts.json: paraphrase keys include the facts
+file digest, so stale entries are replaced.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+
+from app.graph.nodes import answer_gen
+from app.tools import onset_texts
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--langs", nargs="+", default=["en", "he"])
+    ap.add_argument(
+        "--fallback-ingredients",
+        nargs="*",
+        default=[],
+        help='ingredients without facts; "" warms the generic fallback',
+    )
+    args = ap.parse_args()
+
+    counts = answer_gen.precompute_onset_texts(args.langs, args.fallback_ingredients)
+    store = onset_texts.get_store()
+    logging.info(
+        "Onset texts: stored=%d rejected=%d skipped=%d failed=%d (%d entries in %s)",
+        counts["stored"],
+        counts["rejected"],
+        counts["skipped"],
+        counts["failed"],
+        len(store),
+        store.path,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Re-embed all indices with a new embeddings model, then swap aliases.
+
+Builds versioned indices (<name>-<version>) next to the live ones, copies and
+re-embeds every document from _source (private memory included) in batches,
+catches up on writes made meanwhile and swaps every alias atomically. The API
+keeps serving throughout and moves its query model to the new one on its next
+check (EMBEDDINGS_MODEL_SYNC_S).
+
+Usage (from repo root):
+
+  PYTHONPATH=services/api python scripts/reembed.py \
+      --model sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2
+
+  # Gentler on a busy cluster
+  PYTHONPATH=services/api python scripts/reembed.py --model BAAI/bge-small-en-v1.5 \
+      --max-docs-per-s 200 --threads 2
+
+Re-running with the model the indices already use migrates index settings
+(e.g. float hnsw to int8_hnsw via ES_VECTOR_INDEX_TYPE or --index-type): the
+stored vectors are copied, nothing is re-embedded.
+
+  PYTHONPATH=services/api python scripts/reembed.py \
+      --model sentence-transformers/all-MiniLM-L6-v2 --index-type int8_hnsw
+
+The model is loaded before anything is built; if it cannot be loaded the job
+stops instead of indexing stub vectors. Old indices are kept for rollback
+(re-point the aliases by hand) unless --delete-old is given; an index from
+before aliases were used is kept as a <name>-pre-<version> clone. Set EMBEDDINGS_MODEL to the new model afterwards so
+fresh deployments start on it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+
+from app.tools import es_client, reembed
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", required=True, help="sentence-transformers model id")
+    ap.add_argument("--version", help="suffix for the new indices (default: UTC time)")
+    ap.add_argument("--batch-size", type=int, help="texts per embedding call")
+    ap.add_argument("--chunk-size", type=int, help="actions per bulk request")
+    ap.add_argument("--threads", type=int, help="concurrent bulk requests")
+    ap.add_argument("--max-docs-per-s", type=float, help="copy rate cap")
+    ap.add_argument(
+        "--catch-up-passes", type=int, default=reembed.DEFAULT_CATCH_UP_PASSES
+    )
+    ap.add_argument("--delete-old", action="store_true")
+    ap.add_argument(
+        "--index-type",
+        choices=es_client.VECTOR_INDEX_TYPES,
+        help="dense_vector index type (default: ES_VECTOR_INDEX_TYPE)",
+    )
+    ap.add_argument(
+        "--reuse-vectors",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="copy stored embeddings (default: when already built with --model)",
+    )
+    args = ap.parse_args()
+
+    stats = reembed.run(
+        es_client.get_es_client(),
+        args.model,
+        version=args.version,
+        batch_size=args.batch_size,
+        chunk_size=args.chunk_size,
+        threads=args.threads,
+        max_docs_per_s=args.max_docs_per_s,
+        catch_up_passes=args.catch_up_passes,
+        delete_old=args.delete_old,
+        index_type=args.index_type,
+        reuse_vectors=args.reuse_vectors,
+    )
+    for kind, kind_stats in stats.items():
+        logging.info("%s: %s", kind, kind_stats.summary())
+
+
+if __name__ == "__main__":
+    main()
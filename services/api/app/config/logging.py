@@ -1,10 +1,32 @@
+"""Root logging setup.
+
+Records are stamped with the request id and graph node on the calling thread,
+then handed to a ``QueueHandler`` that only merges the message with its args;
+a ``QueueListener`` thread does the formatting (timestamps, JSON, tracebacks)
+and the file/stream I/O, so request threads never block on disk.
+``LOG_QUEUE=false`` attaches the handlers directly instead (e.g. to debug the
+pipeline itself), and ``LOG_FORMAT=json`` writes one JSON object per line.
+
+Payload-style DEBUG lines (candidate lists, preferences, classifier text) go
+through ``log_payload``: only 1 in ``LOG_PAYLOAD_SAMPLE`` requests (per logger,
+chosen by request_id hash or arrival order) log them in full; the rest get a
+bounded summary of at most ``LOG_PAYLOAD_MAX_CHARS`` (0 drops the line).
+"""
+
 from __future__ import annotations
 import os
+import json
 import logging
 import contextvars
+import copy
+import itertools
+import queue
 import tempfile
+import zlib
+from datetime import datetime, timezone
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, List, Optional, Tuple
 
 
 def _resolve_log_dir() -> Path:
@@ -21,6 +43,16 @@ def _resolve_log_dir() -> Path:
 _rid_var: contextvars.ContextVar[str] = contextvars.ContextVar(
     "request_id", default="-"
 )
+_node_var: contextvars.ContextVar[str] = contextvars.ContextVar("node", default="-")
+# Arrival order of the current request, for LOG_PAYLOAD_SAMPLE_BY=count
+_seq_var: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "request_seq", default=-1
+)
+_request_seq = itertools.count()
+
+TEXT_FORMAT = "%(asctime)s | [%(levelname)s] [%(name)s] rid=%(request_id)s %(message)s"
+
+_listener: Optional[QueueListener] = None
 
 
 class RequestIdFilter(logging.Filter):
@@ -29,18 +61,236 @@ class RequestIdFilter(logging.Filter):
             record.request_id = _rid_var.get()  # type: ignore[attr-defined]
         except Exception:  # pragma: no cover - defensive fallback
             record.request_id = "-"  # type: ignore[attr-defined]
+        record.node = _node_var.get()  # type: ignore[attr-defined]
         return True
 
 
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the request id and graph node."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "node": getattr(record, "node", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _SnapshotQueueHandler(QueueHandler):
+    """Enqueues records without running a formatter on the calling thread.
+
+    ``QueueHandler.prepare`` formats the record and folds any traceback into
+    the message; this only merges ``msg % args`` (so later changes to the args
+    do not show up in the log) and passes ``exc_info`` through for the
+    listener's formatter to render.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
 def set_request_id(rid: str) -> None:
     try:
         _rid_var.set(rid)
     except Exception:  # pragma: no cover - defensive fallback
         _rid_var.set("-")
+    _seq_var.set(next(_request_seq))
 
 
 def clear_request_id() -> None:
     _rid_var.set("-")
+    _seq_var.set(-1)
+
+
+def get_request_id() -> str:
+    return _rid_var.get()
+
+
+DEFAULT_PAYLOAD_MAX_CHARS = 200
+
+
+def _clip(obj: Any, limit: int) -> str:
+    """``repr(obj)`` cut to ``limit`` chars, walking containers only that far.
+
+    Work is bounded by ``limit`` rather than by the payload, so a summary of a
+    large candidate list costs about the same as one of a short list.
+    """
+
+    parts: List[str] = []
+    size = 0
+
+    def emit(text: str) -> bool:
+        nonlocal size
+        parts.append(text)
+        size += len(text)
+        return size <= limit
+
+    def walk(o: Any) -> bool:
+        if isinstance(o, dict):
+            if not emit("{"):
+                return False
+            for i, (k, v) in enumerate(o.items()):
+                if (i and not emit(", ")) or not emit(f"{k!r}: ") or not walk(v):
+                    return False
+            return emit("}")
+        if isinstance(o, (list, tuple)):
+            if not emit("[" if isinstance(o, list) else "("):
+                return False
+            for i, v in enumerate(o):
+                if (i and not emit(", ")) or not walk(v):
+                    return False
+            return emit("]" if isinstance(o, list) else ")")
+        if isinstance(o, str) and len(o) > limit:
+            return emit(repr(o[: limit + 1]))
+        return emit(repr(o))
+
+    if isinstance(obj, str):
+        complete = len(obj) <= limit
+        text = obj[:limit]
+    else:
+        complete = walk(obj)
+        text = "".join(parts)[:limit]
+    return text if complete else f"{text}...[truncated]"
+
+
+class _Summary:
+    """Formats as ``_clip(obj, limit)``, only if the record is emitted."""
+
+    __slots__ = ("obj", "limit")
+
+    def __init__(self, obj: Any, limit: int) -> None:
+        self.obj = obj
+        self.limit = limit
+
+    def __str__(self) -> str:
+        return _clip(self.obj, self.limit)
+
+
+_rates_cache: Tuple[str, Dict[str, int]] = ("", {})
+
+
+def _sample_rates() -> Dict[str, int]:
+    """``LOG_PAYLOAD_SAMPLE``: ``N`` or ``logger=N,...,*=N`` (1 = every request)."""
+
+    global _rates_cache
+    spec = os.getenv("LOG_PAYLOAD_SAMPLE", "1").strip()
+    if spec == _rates_cache[0]:
+        return _rates_cache[1]
+    rates: Dict[str, int] = {}
+    for part in spec.split(","):
+        name, _, value = part.rpartition("=")
+        try:
+            rates[name.strip() or "*"] = max(0, int(value))
+        except ValueError:
+            logging.getLogger(__name__).warning(
+                "Invalid LOG_PAYLOAD_SAMPLE entry %r", part
+            )
+    _rates_cache = (spec, rates)
+    return rates
+
+
+def _sample_rate(logger_name: str) -> int:
+    rates = _sample_rates()
+    name = logger_name
+    # Most specific configured ancestor wins: app.graph.nodes.places, app.graph, ...
+    while name:
+        if name in rates:
+            return rates[name]
+        name = name.rpartition(".")[0]
+    return rates.get("*", 1)
+
+
+def payload_sampled(logger_name: str) -> bool:
+    """Whether the current request logs full payloads for ``logger_name``.
+
+    Every logger with the same rate samples the same requests, so a sampled
+    request keeps its full detail end to end.
+    """
+
+    rate = _sample_rate(logger_name)
+    if rate <= 1:
+        return rate == 1
+    if os.getenv("LOG_PAYLOAD_SAMPLE_BY", "request_id").strip().lower() == "count":
+        seq = _seq_var.get()
+        return seq >= 0 and seq % rate == 0
+    rid = _rid_var.get()
+    return rid != "-" and zlib.crc32(rid.encode("utf-8")) % rate == 0
+
+
+def _max_chars() -> int:
+    try:
+        return max(
+            0,
+            int(os.getenv("LOG_PAYLOAD_MAX_CHARS", str(DEFAULT_PAYLOAD_MAX_CHARS))),
+        )
+    except ValueError:
+        return DEFAULT_PAYLOAD_MAX_CHARS
+
+
+def log_payload(logger: logging.Logger, msg: str, *payloads: Any) -> None:
+    """DEBUG-log ``msg % payloads``: in full if sampled, else summarized.
+
+    Nothing is formatted (or even summarized) unless DEBUG is enabled.
+    """
+
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if payload_sampled(logger.name):
+        logger.debug(msg, *payloads)
+        return
+    limit = _max_chars()
+    if limit:
+        logger.debug(msg, *(_Summary(p, limit) for p in payloads))
+
+
+def set_node(name: str) -> contextvars.Token:
+    """Tag records logged in this context with graph node ``name``."""
+
+    return _node_var.set(name)
+
+
+def reset_node(token: contextvars.Token) -> None:
+    _node_var.reset(token)
+
+
+def _formatter() -> logging.Formatter:
+    if os.getenv("LOG_FORMAT", "text").strip().lower() == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+def _queue_enabled() -> bool:
+    return os.getenv("LOG_QUEUE", "true").strip().lower() != "false"
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread (idempotent).
+
+    Its handlers move onto the root logger, so anything logged afterwards
+    (e.g. during interpreter shutdown) is still written, synchronously.
+    """
+
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        if isinstance(h, QueueHandler):
+            root.removeHandler(h)
+    for h in _listener.handlers:
+        h.addFilter(RequestIdFilter())
+        root.addHandler(h)
+    _listener = None
 
 
 def configure_logging() -> Path:
@@ -59,21 +309,30 @@ def configure_logging() -> Path:
     root.setLevel(log_level)
 
     # Clear existing handlers (avoid duplicates under reload)
+    stop_logging()
     for h in list(root.handlers):
         root.removeHandler(h)
 
-    fmt = logging.Formatter(
-        "%(asctime)s | [%(levelname)s] [%(name)s] rid=%(request_id)s %(message)s"
-    )
+    fmt = _formatter()
     fileh = RotatingFileHandler(logfile, maxBytes=2_000_000, backupCount=2)
     fileh.setFormatter(fmt)
-    fileh.addFilter(RequestIdFilter())
     rooth = logging.StreamHandler()
     rooth.setFormatter(fmt)
-    rooth.addFilter(RequestIdFilter())
+    handlers: List[logging.Handler] = [fileh, rooth]
 
-    root.addHandler(fileh)
-    root.addHandler(rooth)
+    if _queue_enabled():
+        global _listener
+        records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        queueh = _SnapshotQueueHandler(records)
+        # Filters run on the calling thread, where the request's context vars live
+        queueh.addFilter(RequestIdFilter())
+        root.addHandler(queueh)
+        _listener = QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+    else:
+        for h in handlers:
+            h.addFilter(RequestIdFilter())
+            root.addHandler(h)
 
     logging.getLogger(__name__).info("Logging to %s", logfile)
     return logfile
@@ -1,5 +1,7 @@
 """Settings for the API service."""
 
+from typing import Optional
+
 from pydantic import BaseModel
 import os
 
@@ -8,6 +10,11 @@ _SYMPTOM_REGISTRY_DEFAULT = os.path.abspath(
 )
 
 
+def _optional_float(name: str) -> Optional[float]:
+    raw = os.getenv(name, "").strip()
+    return float(raw) if raw else None
+
+
 class Settings(BaseModel):
     app_env: str = os.getenv("APP_ENV", "dev")
     host: str = os.getenv("HOST", "0.0.0.0")
@@ -18,6 +25,18 @@ class Settings(BaseModel):
     es_public_index: str = os.getenv("ES_PUBLIC_INDEX", "public_medical_kb")
     es_places_index: str = os.getenv("ES_PLACES_INDEX", "providers_places")
 
+    # kNN query parameters per index kind; measure with scripts/bench_knn_sweep.py.
+    # similarity is the minimum raw cosine a hit needs (unset = no cutoff).
+    knn_private_k: int = int(os.getenv("KNN_PRIVATE_K", 8))
+    knn_private_num_candidates: int = int(os.getenv("KNN_PRIVATE_NUM_CANDIDATES", 50))
+    knn_private_similarity: Optional[float] = _optional_float("KNN_PRIVATE_SIMILARITY")
+    knn_public_k: int = int(os.getenv("KNN_PUBLIC_K", 16))
+    knn_public_num_candidates: int = int(os.getenv("KNN_PUBLIC_NUM_CANDIDATES", 64))
+    knn_public_similarity: Optional[float] = _optional_float("KNN_PUBLIC_SIMILARITY")
+    knn_places_k: int = int(os.getenv("KNN_PLACES_K", 10))
+    knn_places_num_candidates: int = int(os.getenv("KNN_PLACES_NUM_CANDIDATES", 50))
+    knn_places_similarity: Optional[float] = _optional_float("KNN_PLACES_SIMILARITY")
+
     embeddings_model: str = os.getenv(
         "EMBEDDINGS_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
     )
@@ -1,8 +1,18 @@
 from langgraph.graph import StateGraph, END
-from time import perf_counter
-from typing import Callable
+from time import perf_counter, thread_time
+from typing import Any, Callable, Dict
 
+from app.config.logging import reset_node, set_node
 from app.graph.state import BodyState
+from app.tools import spans
+from app.tools.metrics import node_duration, node_errors
+from app.tools.trace_store import (
+    UNCLASSIFIED,
+    latency,
+    memory_start,
+    memory_stop,
+    profile,
+)
 from app.graph.nodes import (
     supervisor,
     scrub,
@@ -32,12 +42,50 @@ def _wrap_node(
 ) -> Callable[[BodyState], BodyState]:
     def wrapped(state: BodyState) -> BodyState:
         start = perf_counter()
-        result = fn(state)
-        elapsed_ms = (perf_counter() - start) * 1000.0
+        # CPU of this thread only: waiting on ES, an LLM or a slot costs none
+        cpu_start = thread_time()
+        mem_start = memory_start()
+        token = set_node(name)
+        try:
+            with spans.span(name) as node_span:
+                result = fn(state)
+        except Exception:
+            elapsed = perf_counter() - start
+            intent = state.get("intent") or UNCLASSIFIED
+            latency.observe(name, intent, elapsed * 1000.0, True)
+            node_duration.observe(elapsed, name, intent)
+            node_errors.inc(name, intent)
+            raise
+        finally:
+            reset_node(token)
+        elapsed = perf_counter() - start
+        cpu_ms = (thread_time() - cpu_start) * 1000.0
+        memory = memory_stop(mem_start)
+        elapsed_ms = elapsed * 1000.0
         target = result if isinstance(result, dict) else state
+        # The supervisor sets the intent, so its own timing counts under it too
+        intent = target.get("intent") or state.get("intent") or UNCLASSIFIED
+        latency.observe(name, intent, elapsed_ms)
+        node_duration.observe(elapsed, name, intent)
+        profile.observe(
+            name,
+            elapsed_ms,
+            cpu_ms,
+            memory.get("alloc_bytes"),
+            memory.get("peak_bytes"),
+        )
         debug = target.setdefault("debug", {})
         trace = debug.setdefault("trace", [])
-        trace.append({"node": name, "elapsed_ms": elapsed_ms})
+        entry: Dict[str, Any] = {
+            "node": name,
+            "elapsed_ms": elapsed_ms,
+            "cpu_ms": cpu_ms,
+            **memory,
+        }
+        if node_span.children:
+            entry["self_ms"] = node_span.self_ms()
+            entry["spans"] = [child.to_dict() for child in node_span.children]
+        trace.append(entry)
         return result
 
     return wrapped
@@ -6,10 +6,22 @@ import os
 import re
 from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
+
 from app.config import settings
 from app.graph.state import BodyState
 from app.tools.language import DEFAULT_LANGUAGE
-from app.tools import med_facts
+from app.tools import (
+    answer_cache,
+    embeddings,
+    extractive,
+    inference,
+    llm_clients,
+    med_facts,
+    onset_texts,
+    passages,
+)
+from app.tools.spans import span
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +65,10 @@ LANG_CONFIG = {
 DISCLAIMER = LANG_CONFIG[DEFAULT_LANGUAGE]["disclaimer"]
 URGENT_LINE = LANG_CONFIG[DEFAULT_LANGUAGE]["urgent_line"]
 FALLBACK_HIGHLIGHT_LENGTH = 160
+DEFAULT_PROMPT_TOKEN_BUDGET = 1500
+_SKIP_PROVIDERS = {"", "none", "disabled"}
+# Answers from the snippets themselves, no LLM call
+EXTRACTIVE_PROVIDER = "extractive"
 URGENT_TRIGGERS = {"urgent_care", "see_doctor"}
 
 # Lightweight, reviewed fallback templates for symptom buckets (EN/HE)
@@ -279,7 +295,7 @@ def _language_config(state: BodyState) -> Tuple[str, dict]:
 
 def _should_skip(state: BodyState) -> bool:
     provider = _resolve_provider()
-    return provider in {"", "none", "disabled"}
+    return provider in _SKIP_PROVIDERS
 
 
 def _candidate_ingredients(state: BodyState) -> List[str]:
@@ -318,7 +334,7 @@ def _meds_onset_message(state: BodyState) -> Optional[Tuple[str, List[str]]]:
         summary = fact["summary"]
         follow_up = fact.get("follow_up")
 
-        paraphrased = _paraphrase_onset_fact(fact, lang)
+        paraphrased = _stored_onset_paraphrase(fact, lang)
         if paraphrased:
             summary, follow_up = paraphrased
 
@@ -366,59 +382,163 @@ def _finalize_response(state: BodyState, content: str) -> None:
     state.setdefault("messages", []).append(message)
 
 
-def _build_prompt(state: BodyState) -> str:
+def _prompt_token_budget() -> int:
+    raw = os.getenv("PROMPT_TOKEN_BUDGET", str(DEFAULT_PROMPT_TOKEN_BUDGET))
+    try:
+        return max(0, int(raw))
+    except ValueError:
+        logger.warning("Invalid PROMPT_TOKEN_BUDGET=%s; not trimming sources", raw)
+        return 0
+
+
+def _format_source(idx: int, snip: dict, text: str) -> str:
+    return (
+        f"[{idx}] {snip.get('title', 'Untitled')} - {snip.get('section', '')}: {text}"
+    )
+
+
+def _select_passages(
+    query: str,
+    snippets: List[dict],
+    budget: int,
+    query_vector: Optional[List[float]] = None,
+) -> Tuple[Dict[int, List[dict]], int]:
+    """Best-matching passages per snippet index that fit ``budget`` tokens.
+
+    Returns the selection keyed by the snippet's 1-based ``[n]`` index and the
+    total number of candidate passages. ``query_vector`` (already computed for
+    the answer cache) saves embedding the query again.
+    """
+
+    candidates: List[Tuple[int, dict]] = [
+        (idx, passage)
+        for idx, snip in enumerate(snippets, start=1)
+        for passage in passages.split_passages(str(snip.get("text", "")))
+    ]
+    if not candidates:
+        return {}, 0
+
+    texts = [f"{p['heading']}\n{p['text']}" for _, p in candidates]
+    try:
+        if query_vector is None:
+            vectors = np.asarray(embeddings.embed([query] + texts), dtype=np.float32)
+        else:
+            vectors = np.asarray(
+                [query_vector] + embeddings.embed(texts), dtype=np.float32
+            )
+        scores = vectors[1:] @ vectors[0]
+        order = [int(i) for i in np.argsort(-scores, kind="stable")]
+    except Exception as exc:  # pragma: no cover - embedding backend failure
+        logger.warning("Passage ranking failed; keeping document order: %s", exc)
+        order = list(range(len(candidates)))
+
+    selected: Dict[int, List[dict]] = {}
+    used = 0
+    for i in order:
+        idx, passage = candidates[i]
+        cost = passages.count_tokens(passage["text"])
+        if idx not in selected:
+            cost += passages.count_tokens(_format_source(idx, snippets[idx - 1], ""))
+        if used + cost > budget:
+            continue
+        selected.setdefault(idx, []).append(passage)
+        used += cost
+    return selected, len(candidates)
+
+
+def _build_prompt(state: BodyState, query_vector: Optional[List[float]] = None) -> str:
+    """Prompt for the LLM, trimmed to ``PROMPT_TOKEN_BUDGET``.
+
+    When the sources do not fit, snippets are split into passages, ranked
+    against the query embedding and only the best ones are kept. Each kept
+    passage stays under its snippet's original ``[n]`` so citations still line
+    up. The estimated token count is recorded in ``debug.prompt_tokens``.
+    """
+
     user_query = state.get("user_query_redacted", state.get("user_query", ""))
     snippets = state.get("public_snippets", []) or []
     memory_facts = state.get("memory_facts", []) or []
     _, config = _language_config(state)
-    parts: List[str] = [
+    head: List[str] = [
         *config["prompt_intro"],
         f"{config['user_question_label']} {user_query}",
     ]
-
-    if snippets:
-        formatted = [
-            f"[{idx+1}] {snip.get('title', 'Untitled')} - {snip.get('section', '')}: {snip.get('text', '')}"
-            for idx, snip in enumerate(snippets)
-        ]
-        parts.append(f"{config['sources_label']}\n" + "\n".join(formatted))
+    tail: List[str] = []
 
     if memory_facts:
         memories = [
             f"- {fact.get('entity', 'fact')}: {fact.get('name', fact.get('value', ''))}"
             for fact in memory_facts
         ]
-        parts.append(f"{config['context_label']}\n" + "\n".join(memories))
+        tail.append(f"{config['context_label']}\n" + "\n".join(memories))
 
     triggers = _risk_triggers(state)
     if triggers:
-        parts.append(f"{config['risk_flags_label']} " + ", ".join(triggers))
+        tail.append(f"{config['risk_flags_label']} " + ", ".join(triggers))
 
-    return "\n\n".join(parts)
+    debug = state.setdefault("debug", {})
+    sources: List[str] = []
+    if snippets:
+        formatted = [
+            _format_source(idx, snip, snip.get("text", ""))
+            for idx, snip in enumerate(snippets, start=1)
+        ]
+        budget = _prompt_token_budget()
+        fixed = passages.count_tokens(
+            "\n\n".join(head + tail + [config["sources_label"]])
+        )
+        if budget and fixed + passages.count_tokens("\n".join(formatted)) > budget:
+            selected, total = _select_passages(
+                user_query, snippets, max(budget - fixed, 0), query_vector
+            )
+            formatted = [
+                _format_source(
+                    idx,
+                    snippets[idx - 1],
+                    "\n".join(
+                        p["text"]
+                        for p in sorted(selected[idx], key=lambda p: p["position"])
+                    ),
+                )
+                for idx in sorted(selected)
+            ]
+            debug["prompt_passages"] = {
+                "kept": sum(len(v) for v in selected.values()),
+                "total": total,
+            }
+        if formatted:
+            sources.append(f"{config['sources_label']}\n" + "\n".join(formatted))
+
+    prompt = "\n\n".join(head + sources + tail)
+    debug["prompt_tokens"] = passages.count_tokens(prompt)
+    return prompt
+
+
+def _chat_messages(prompt: str, language: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": _system_prompt(language)},
+        {"role": "user", "content": prompt},
+    ]
 
 
+@span("llm.ollama")
 def _call_ollama(prompt: str, language: str) -> str | None:
     model = os.getenv("OLLAMA_MODEL", "llama3")
     try:
-        import ollama  # type: ignore
-
         logger.debug("Calling Ollama model %s", model)
-        response = ollama.chat(
-            model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": _system_prompt(language),
-                },
-                {"role": "user", "content": prompt},
-            ],
-        )
+        # Queueing for the slot counts against the request budget too
+        with inference.slot("ollama", timeout=llm_clients.call_timeout()):
+            response = llm_clients.ollama_chat(model, _chat_messages(prompt, language))
         return response.get("message", {}).get("content")  # type: ignore[arg-type]
+    except (llm_clients.DeadlineExceeded, inference.SlotTimeout) as exc:
+        logger.warning("Ollama generation hit the request deadline: %s", exc)
+        return None
     except Exception as exc:  # pragma: no cover - depends on external runtime
         logger.warning("Ollama generation failed: %s", exc)
         return None
 
 
+@span("llm.openai")
 def _call_openai(prompt: str, language: str) -> str | None:
     model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
     api_key = os.getenv("OPENAI_API_KEY")
@@ -426,24 +546,15 @@ def _call_openai(prompt: str, language: str) -> str | None:
         logger.warning("OPENAI_API_KEY missing; falling back to template response")
         return None
     try:
-        from openai import OpenAI  # type: ignore
-
-        client = OpenAI(api_key=api_key)
         logger.debug("Calling OpenAI model %s", model)
-        chat = client.chat.completions.create(
-            model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": _system_prompt(language),
-                },
-                {"role": "user", "content": prompt},
-            ],
-        )
+        chat = llm_clients.openai_chat(api_key, model, _chat_messages(prompt, language))
         if not chat.choices:
             logger.warning("OpenAI generation returned no choices")
             return None
         return chat.choices[0].message.content  # type: ignore[index]
+    except llm_clients.DeadlineExceeded as exc:
+        logger.warning("OpenAI generation hit the request deadline: %s", exc)
+        return None
     except Exception as exc:  # pragma: no cover - depends on external runtime
         logger.warning("OpenAI generation failed: %s", exc)
         return None
@@ -479,6 +590,46 @@ def _fallback_message(state: BodyState) -> str:
     return "\n\n".join(parts) if parts else config["fallback_empty"]
 
 
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        logger.warning("Invalid %s; using %s", name, default)
+        return default
+
+
+def _extractive_message(state: BodyState) -> Optional[str]:
+    """Query-relevant snippet sentences, each tagged with its ``[n]`` citation."""
+
+    snippets = state.get("public_snippets", []) or []
+    if not snippets:
+        return None
+    lang, config = _language_config(state)
+    query = state.get("user_query_redacted", state.get("user_query", ""))
+    picked = extractive.summarize(
+        query,
+        snippets,
+        max_chars=_env_int("EXTRACTIVE_MAX_CHARS", 600),
+        max_sentences=_env_int("EXTRACTIVE_MAX_SENTENCES", 4),
+        language=lang,
+    )
+    if not picked:
+        return None
+
+    parts: List[str] = []
+    summary_line = _fallback_summary_line(state, config)
+    if summary_line:
+        parts.append(summary_line)
+    parts.append(
+        f"{config['fallback_key_points_label']}\n"
+        + "\n".join(f"- {sentence} [{idx}]" for idx, sentence in picked)
+    )
+    risk_notice = _risk_notice(state, config)
+    if risk_notice:
+        parts.append(risk_notice)
+    return "\n\n".join(parts)
+
+
 def _build_reply(content: str, state: BodyState) -> str:
     triggers = _risk_triggers(state)
     _, config = _language_config(state)
@@ -508,6 +659,95 @@ def _generate_with_provider(provider: str, prompt: str, language: str) -> str |
     return None
 
 
+def _provider_model(provider: str) -> str:
+    if provider == "ollama":
+        return os.getenv("OLLAMA_MODEL", "llama3")
+    if provider == "openai":
+        return os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    return ""
+
+
+def _prompt_inputs(state: BodyState) -> str:
+    """Everything ``_build_prompt`` reads (bar the language), as one string.
+
+    Equal inputs give equal prompts, so the exact cache key can be taken
+    before the prompt (and its passage ranking embeddings) is built.
+    """
+
+    snippets = [
+        [snip.get("title"), snip.get("section"), snip.get("text")]
+        for snip in state.get("public_snippets", []) or []
+    ]
+    return json.dumps(
+        [
+            state.get("user_query_redacted", state.get("user_query", "")),
+            snippets,
+            state.get("memory_facts", []) or [],
+            _risk_triggers(state),
+            _prompt_token_budget(),
+            embeddings.MODEL,
+        ],
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+
+
+def _generate_cached(state: BodyState, provider: str, language: str) -> str | None:
+    """LLM answer via the two-level answer cache, recording the outcome in debug.
+
+    The prompt is only built on a miss; the query vector from the semantic
+    lookup is reused for its passage ranking.
+    """
+
+    if not answer_cache.enabled():
+        return _generate_with_provider(provider, _build_prompt(state), language)
+
+    cache = answer_cache.cache
+    model = _provider_model(provider)
+    scope = answer_cache.scope_for(
+        state.get("user_id"), state.get("memory_facts") or []
+    )
+    key = answer_cache.exact_key(
+        provider, model, language, _prompt_inputs(state), scope
+    )
+    gate = answer_cache.make_gate(
+        provider,
+        model,
+        language,
+        state.get("citations", []) or [],
+        _risk_triggers(state),
+        scope,
+    )
+    info: Dict[str, Any] = {"result": "miss"}
+
+    content = cache.get(key)
+    vector: Optional[List[float]] = None
+    if content is not None:
+        info["result"] = "exact"
+    else:
+        query = state.get("user_query_redacted", state.get("user_query", ""))
+        try:
+            vector = embeddings.embed([query])[0]
+        except Exception as exc:  # pragma: no cover - embedding backend failure
+            logger.warning("Answer cache embedding failed: %s", exc)
+        similar = cache.get_similar(vector, gate)
+        if similar is not None:
+            content, score = similar
+            info.update(result="semantic", similarity=round(score, 4))
+        else:
+            prompt = _build_prompt(state, vector)
+            content = _generate_with_provider(provider, prompt, language)
+            if content:
+                cache.put(key, content, gate, vector)
+
+    stats = cache.stats()
+    info["hit_rate"] = round(stats["hit_rate"], 4)
+    info["entries"] = stats["entries"]
+    state.setdefault("debug", {})["answer_cache"] = info
+    return content
+
+
 def run(state: BodyState) -> BodyState:
     onset_message = _meds_onset_message(state)
     if onset_message:
@@ -537,9 +777,11 @@ def run(state: BodyState) -> BodyState:
             return state
 
         provider = _resolve_provider()
-        prompt = _build_prompt(state)
-        lang_choice, _ = _language_config(state)
-        content = _generate_with_provider(provider, prompt, lang_choice)
+        if provider == EXTRACTIVE_PROVIDER:
+            content = _extractive_message(state)
+        else:
+            lang_choice, _ = _language_config(state)
+            content = _generate_cached(state, provider, lang_choice)
     if not content:
         snippets = state.get("public_snippets", []) or []
         if snippets:
@@ -607,20 +849,8 @@ def _contains_time_or_number(text: str) -> bool:
     return bool(_NUMERIC_PATTERN.search(text) or _TIME_TOKEN_PATTERN.search(text))
 
 
-def _paraphrase_onset_fact(
-    fact: Dict[str, Any], language: str
-) -> Optional[Tuple[str, Optional[str]]]:
-    if not _paraphrase_enabled():
-        return None
-
-    summary = str(fact.get("summary", "")).strip()
-    follow_up = str(fact.get("follow_up", "")).strip()
-    if not summary:
-        return None
-
-    original_numbers = _numeric_tokens(summary, follow_up)
-
-    prompt = (
+def _paraphrase_prompt(summary: str, follow_up: str, language: str) -> str:
+    return (
         "You paraphrase medication onset guidance without changing factual meaning.\n"
         "Language: {language}.\n"
         "Rules:\n"
@@ -632,9 +862,11 @@ def _paraphrase_onset_fact(
         "Original follow_up: {follow_up}"
     ).format(language=language, summary=summary, follow_up=follow_up or "<none>")
 
-    rewritten = _call_ollama(prompt, language)
-    if not rewritten:
-        return None
+
+def _validate_paraphrase(
+    rewritten: str, summary: str, follow_up: str
+) -> Optional[Tuple[str, Optional[str]]]:
+    original_numbers = _numeric_tokens(summary, follow_up)
 
     data = _parse_json_object(rewritten)
     if not isinstance(data, dict):
@@ -678,35 +910,61 @@ def _paraphrase_onset_fact(
     return new_summary, (new_follow_up or None)
 
 
-def _onset_llm_fallback_enabled() -> bool:
-    return os.getenv("ONSET_LLM_FALLBACK", "false").strip().lower() == "true"
+def _paraphrase_entry(fact: Dict[str, Any], language: str) -> Optional[dict]:
+    """Store value for a paraphrase; None when the LLM gave no answer (retry later)."""
 
+    summary = str(fact.get("summary", "")).strip()
+    follow_up = str(fact.get("follow_up", "")).strip()
+    if not summary:
+        return dict(onset_texts.REJECTED)
+    rewritten = _call_ollama(_paraphrase_prompt(summary, follow_up, language), language)
+    if not rewritten:
+        return None
+    validated = _validate_paraphrase(rewritten, summary, follow_up)
+    if not validated:
+        return dict(onset_texts.REJECTED)
+    new_summary, new_follow_up = validated
+    return {"summary": new_summary, "follow_up": new_follow_up or ""}
 
-def _onset_llm_fallback(state: BodyState) -> Optional[str]:
-    if not _onset_llm_fallback_enabled():
+
+def _stored_onset_paraphrase(
+    fact: Dict[str, Any], language: str
+) -> Optional[Tuple[str, Optional[str]]]:
+    """Precomputed paraphrase for ``fact``; a miss queues a background warm-up."""
+
+    if not _paraphrase_enabled():
         return None
 
-    provider = _resolve_provider()
-    if provider in {"", "none", "disabled"}:
+    key = onset_texts.paraphrase_key(str(fact.get("ingredient", "")), language)
+    found, value = onset_texts.get_store().get(key)
+    if not found:
+        onset_texts.warm(key, lambda: _paraphrase_entry(fact, language))
+        return None
+    if not value or value.get("rejected"):
         return None
+    summary = str(value.get("summary", "")).strip()
+    if not summary:
+        return None
+    return summary, (str(value.get("follow_up", "")).strip() or None)
+
+
+def _onset_llm_fallback_enabled() -> bool:
+    return os.getenv("ONSET_LLM_FALLBACK", "false").strip().lower() == "true"
 
-    lang, config = _language_config(state)
-    user_query = state.get("user_query_redacted", state.get("user_query", ""))
 
-    prompt = (
+def _onset_fallback_prompt(ingredient: str, language: str) -> str:
+    return (
         "You are a cautious medical assistant. The knowledge base does not contain a vetted onset fact for this medication.\n"
         "Provide a short, neutral response in {language} that:\n"
         "- Avoids any specific times, durations, numbers, or dosing guidance.\n"
         "- Encourages the user to monitor symptoms and consult a clinician.\n"
         "- Stays factual without speculating.\n"
         "Keep it to 2-3 sentences. No markdown or bullet points.\n"
-        "User question: {question}"
-    ).format(language=lang, question=user_query)
+        "User question: When will {medication} start working?"
+    ).format(language=language, medication=ingredient or "my medication")
 
-    content = _generate_with_provider(provider, prompt, lang)
-    if not content:
-        return None
 
+def _clean_onset_fallback(content: str, language: str) -> Optional[str]:
     content = content.strip()
     if not content:
         return None
@@ -717,8 +975,102 @@ def _onset_llm_fallback(state: BodyState) -> Optional[str]:
         )
         return None
 
+    config = LANG_CONFIG.get(language) or LANG_CONFIG[DEFAULT_LANGUAGE]
     disclaimer_text = config.get("disclaimer")
     if isinstance(disclaimer_text, str) and disclaimer_text in content:
         content = content.replace(disclaimer_text, "").strip()
 
     return content or None
+
+
+def _onset_fallback_entry(
+    provider: str, ingredient: str, language: str
+) -> Optional[dict]:
+    """Store value for an onset fallback; None when the LLM gave no answer."""
+
+    content = _generate_with_provider(
+        provider, _onset_fallback_prompt(ingredient, language), language
+    )
+    if not content:
+        return None
+    cleaned = _clean_onset_fallback(content, language)
+    if not cleaned:
+        return dict(onset_texts.REJECTED)
+    return {"text": cleaned}
+
+
+def _onset_llm_fallback(state: BodyState) -> Optional[str]:
+    """Precomputed neutral onset reply for an ingredient without vetted facts.
+
+    Never calls the LLM inline: a miss queues a background warm-up and the
+    request falls through to the template response.
+    """
+
+    if not _onset_llm_fallback_enabled():
+        return None
+
+    provider = _resolve_provider()
+    if provider in _SKIP_PROVIDERS or provider == EXTRACTIVE_PROVIDER:
+        return None
+
+    lang, _ = _language_config(state)
+    candidates = _candidate_ingredients(state)
+    ingredient = candidates[0].strip().lower() if candidates else ""
+
+    key = onset_texts.fallback_key(ingredient, lang)
+    found, value = onset_texts.get_store().get(key)
+    if not found:
+        onset_texts.warm(key, lambda: _onset_fallback_entry(provider, ingredient, lang))
+        return None
+    if not value or value.get("rejected"):
+        return None
+    return str(value.get("text", "")).strip() or None
+
+
+def precompute_onset_texts(
+    languages: List[str], fallback_ingredients: Optional[List[str]] = None
+) -> Dict[str, int]:
+    """Generate and store onset paraphrases (and fallbacks) ahead of time.
+
+    Paraphrases are built for every ingredient in the facts file; fallbacks for
+    ``fallback_ingredients`` (ingredients without vetted facts, plus ``""`` for
+    the generic reply). Entries already stored are skipped.
+    """
+
+    store = onset_texts.get_store()
+    counts = {"stored": 0, "rejected": 0, "skipped": 0, "failed": 0}
+
+    def _record(key: str, make: Any) -> None:
+        found, _ = store.get(key)
+        if found:
+            counts["skipped"] += 1
+            return
+        value = make()
+        if value is None:
+            counts["failed"] += 1
+            return
+        store.put(key, value)
+        counts["rejected" if value.get("rejected") else "stored"] += 1
+
+    for ingredient in med_facts.ingredients():
+        for lang in languages:
+            fact = med_facts.onset_for(ingredient, lang)
+            if not fact:
+                continue
+            _record(
+                onset_texts.paraphrase_key(ingredient, lang),
+                lambda: _paraphrase_entry(fact, lang),
+            )
+
+    provider = _resolve_provider()
+    has_llm = provider not in _SKIP_PROVIDERS and provider != EXTRACTIVE_PROVIDER
+    if fallback_ingredients and has_llm:
+        for ingredient in fallback_ingredients:
+            name = ingredient.strip().lower()
+            for lang in languages:
+                _record(
+                    onset_texts.fallback_key(name, lang),
+                    lambda: _onset_fallback_entry(provider, name, lang),
+                )
+
+    return counts
@@ -4,7 +4,7 @@ from typing import Iterable
 from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from app.graph.state import BodyState
-from app.tools.es_client import get_es_client
+from app.tools.es_client import get_es_client, knn_clause
 from app.tools.embeddings import embed
 from app.config import settings
 from app.tools.language import DEFAULT_LANGUAGE, normalize_language_code
@@ -119,6 +119,55 @@ def _merge_docs(*groups: Iterable[dict]) -> list[dict]:
     return merged
 
 
+# Passage hits requested per search; collapsed to at most MAX_DOCS parent docs
+PASSAGE_HITS = 16
+MAX_DOCS = 8
+REGISTRY_PASSAGES = 4
+
+
+def _passage_hits() -> int:
+    """Hits to request: at least ``PASSAGE_HITS`` and never fewer than kNN's k."""
+
+    return max(PASSAGE_HITS, settings.knn_public_k)
+
+
+def _collapse_passages(hits: Iterable[dict], limit: int = MAX_DOCS) -> list[dict]:
+    """Group passage hits by parent ``doc_id`` in rank order.
+
+    The best-scoring passage decides where a document ranks; other passages of
+    the same document are folded into it in reading order (by ``position``).
+    Hits without a ``doc_id`` (whole-document indices) pass through unchanged.
+    """
+
+    grouped: dict[str, list[dict]] = {}
+    order: list[tuple[str, dict | None]] = []
+    for hit in hits or []:
+        if not isinstance(hit, dict):
+            continue
+        doc_id = hit.get("doc_id")
+        if not doc_id:
+            order.append(("", hit))
+            continue
+        if doc_id not in grouped:
+            grouped[doc_id] = []
+            order.append((doc_id, None))
+        grouped[doc_id].append(hit)
+
+    docs: list[dict] = []
+    for doc_id, single in order:
+        if single is not None:
+            docs.append(single)
+            continue
+        parts = sorted(grouped[doc_id], key=lambda h: h.get("position") or 0)
+        doc = {k: v for k, v in parts[0].items() if k not in {"text", "heading"}}
+        doc["text"] = "\n\n".join(
+            str(p.get("text", "")).strip() for p in parts if p.get("text")
+        )
+        doc["passages"] = [p.get("position") for p in parts]
+        docs.append(doc)
+    return docs[:limit]
+
+
 def _fetch_registry_docs(es, refs: list[dict]) -> list[dict]:
     docs: list[dict] = []
     if not refs:
@@ -144,7 +193,11 @@ def _fetch_registry_docs(es, refs: list[dict]) -> list[dict]:
             {
                 "query": {"bool": {"must": must}},
                 "_source": {"excludes": ["embedding"]},
-                "size": 1,
+                "sort": [
+                    "_score",
+                    {"position": {"order": "asc", "unmapped_type": "integer"}},
+                ],
+                "size": REGISTRY_PASSAGES,
             }
         )
 
@@ -166,11 +219,13 @@ def _fetch_registry_docs(es, refs: list[dict]) -> list[dict]:
         if res.get("error"):
             logger.warning("Registry doc msearch returned error: %s", res.get("error"))
             continue
-        hit = (res.get("hits", {}).get("hits") or [None])[0]
-        if hit and isinstance(hit, dict):
-            doc = hit.get("_source")
-            if isinstance(doc, dict):
-                docs.append(doc)
+        sources: list[dict] = [
+            hit["_source"]
+            for hit in res.get("hits", {}).get("hits") or []
+            if isinstance(hit, dict) and isinstance(hit.get("_source"), dict)
+        ]
+        # One registry ref names one document
+        docs.extend(_collapse_passages(sources, limit=1))
 
     return docs
 
@@ -204,19 +259,16 @@ def run(state: BodyState, es_client=None) -> BodyState:
             vector_query = " ".join([combined_query] + expansion_terms)
         vector = embed([vector_query])[0]
         knn_body = {
-            "knn": {
-                "field": "embedding",
-                "query_vector": vector,
-                "k": 8,
-                "num_candidates": 64,
-            },
+            "knn": knn_clause("public", vector),
             "_source": {"excludes": ["embedding"]},
-            "size": 8,
+            "size": _passage_hits(),
         }
         res = es.search(index=settings.es_public_index, body=knn_body)
-        docs = [h["_source"] for h in res.get("hits", {}).get("hits", [])]
+        docs = _collapse_passages(
+            h["_source"] for h in res.get("hits", {}).get("hits", [])
+        )
     except (TransportError, RequestError) as e:  # pragma: no cover
-        logger.warning(f"kNN search failed: {e}. Falling back to BM25.")
+        logger.warning("kNN search failed: %s. Falling back to BM25.", e)
         docs = []
     except Exception as e:  # pragma: no cover
         logger.error(
@@ -267,12 +319,16 @@ def run(state: BodyState, es_client=None) -> BodyState:
             bm25_body = {
                 "query": {"bool": {"should": should, "minimum_should_match": 1}},
                 "_source": {"excludes": ["embedding"]},
-                "size": 8,
+                "size": _passage_hits(),
             }
             res = es.search(index=settings.es_public_index, body=bm25_body)
-            docs.extend([h["_source"] for h in res.get("hits", {}).get("hits", [])])
+            docs.extend(
+                _collapse_passages(
+                    h["_source"] for h in res.get("hits", {}).get("hits", [])
+                )
+            )
         except (TransportError, RequestError) as e:  # pragma: no cover
-            logger.warning(f"BM25 search failed: {e}.")
+            logger.warning("BM25 search failed: %s.", e)
         except Exception as e:  # pragma: no cover
             logger.error(
                 f"An unexpected error occurred during BM25 search: {e}", exc_info=True
@@ -1,9 +1,10 @@
 from typing import Any, Dict
 
 from app.graph.state import BodyState
-from app.tools.es_client import get_es_client
+from app.tools.es_client import get_es_client, knn_clause, user_routing
 from app.tools.embeddings import embed
 from app.tools.med_normalize import normalize_fact
+from app.tools.memory_ttl import not_expired
 from app.config import settings
 
 
@@ -67,15 +68,21 @@ def run(state: BodyState, es_client=None) -> BodyState:
     user_id = state.get("user_id")
     hits = []
     es = es_client if es_client else get_es_client()
+    # The user's facts that have not expired (see memory_ttl)
+    owned = {"bool": {"filter": [{"term": {"user_id": user_id}}, not_expired()]}}
 
     # Prefer exact user_id term search.
     if user_id:
         body = {
-            "query": {"term": {"user_id": user_id}},
+            "query": owned,
             "_source": {"excludes": ["embedding"]},
             "size": 16,
         }
-        res = es.search(index=settings.es_private_index, body=body)
+        res = es.search(
+            index=settings.es_private_index,
+            body=body,
+            routing=user_routing(user_id),
+        )
         hits = res.get("hits", {}).get("hits", [])
 
     # Optional: if nothing found, fallback to semantic (dev convenience)
@@ -83,16 +90,14 @@ def run(state: BodyState, es_client=None) -> BodyState:
         q = state.get("user_query_redacted", state["user_query"])
         vector = embed([q])[0]
         body = {
-            "knn": {
-                "field": "embedding",
-                "query_vector": vector,
-                "k": 8,
-                "num_candidates": 50,
-                "filter": {"term": {"user_id": user_id}},
-            },
+            "knn": knn_clause("private", vector, filter=owned),
             "_source": {"excludes": ["embedding"]},
         }
-        res = es.search(index=settings.es_private_index, body=body)
+        res = es.search(
+            index=settings.es_private_index,
+            body=body,
+            routing=user_routing(user_id),
+        )
         hits = res.get("hits", {}).get("hits", [])
     facts = []
     for hit in hits:
@@ -6,6 +6,7 @@ import os
 import re
 from typing import Any, Dict, List, Tuple, Set
 
+from app.config.logging import log_payload
 from app.graph.state import BodyState
 from app.graph.nodes.rationale_codes import (
     HOURS_MATCH,
@@ -290,9 +291,9 @@ def _compute_candidate_meta(
 def run(state: BodyState, es_client=None) -> BodyState:
     es = es_client if es_client else get_es_client()
     q = state.get("user_query_redacted", state.get("user_query", ""))
-    logger.debug(f"Searching providers for query: {q}")
+    log_payload(logger, "Searching providers for query: %s", q)
     raw = search_providers(es, q, lat=TLV[0], lon=TLV[1], radius_km=DEFAULT_RADIUS_KM)
-    logger.debug(f"Raw provider search results: {raw}")
+    log_payload(logger, "Raw provider search results: %s", raw)
 
     prefs: Dict[str, Any] = dict(state.get("preferences") or {})
     travel_limit_km = _get_travel_limit(prefs)
@@ -353,5 +354,5 @@ def run(state: BodyState, es_client=None) -> BodyState:
 
     ranked.sort(key=lambda c: c.get("score", 0.0), reverse=True)
     state["candidates"] = ranked
-    logger.debug(f"Final candidates after scoring: {state['candidates']}")
+    log_payload(logger, "Final candidates after scoring: %s", state["candidates"])
     return state
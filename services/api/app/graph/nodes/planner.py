@@ -3,6 +3,7 @@ import logging
 import os
 from typing import Any, Dict, List
 
+from app.config.logging import log_payload
 from app.graph.nodes.memory import extract_preferences
 from app.graph.nodes.rationale_codes import (
     HOURS_MATCH,
@@ -12,7 +13,8 @@ from app.graph.nodes.rationale_codes import (
 )
 from app.graph.state import BodyState, SubIntent
 from app.tools.calendar_tools import CalendarEvent, create_event
-from app.tools.es_client import get_es_client
+from app.tools.es_client import get_es_client, user_routing
+from app.tools.memory_ttl import not_expired
 
 logger = logging.getLogger(__name__)
 
@@ -179,12 +181,14 @@ def run(state: BodyState, es_client: Any = None) -> BodyState:
             es = es_client if es_client else get_es_client()
             docs = es.search(
                 index=os.environ["ES_PRIVATE_INDEX"],
+                routing=user_routing(user_id),
                 body={
                     "query": {
                         "bool": {
                             "must": [
                                 {"term": {"user_id": user_id}},
                                 {"term": {"entity": "preference"}},
+                                not_expired(),
                             ]
                         }
                     }
@@ -194,7 +198,7 @@ def run(state: BodyState, es_client: Any = None) -> BodyState:
             prefs = extract_preferences(facts)
             if prefs:
                 state["preferences"] = prefs
-        logger.debug(f"Planner: User preferences: {prefs}")
+        log_payload(logger, "Planner: User preferences: %s", prefs)
 
         candidates: List[Dict[str, Any]] = state.get("candidates", [])
         if not candidates:
@@ -202,7 +206,7 @@ def run(state: BodyState, es_client: Any = None) -> BodyState:
         else:
             best = candidates[0]
             reasons = best.get("reasons", []) or []
-            logger.debug(f"Planner: Best candidate: {best}")
+            log_payload(logger, "Planner: Best candidate: %s", best)
 
             rationale = _format_rationale(state.get("language", "en"), best, prefs)
 
@@ -215,7 +219,7 @@ def run(state: BodyState, es_client: Any = None) -> BodyState:
                 location=best.get("name"),
             )
             path = create_event(evt)
-            logger.debug(f"Planner: Event path created: {path}")
+            log_payload(logger, "Planner: Event path created: %s", path)
             explanations = [rationale] if rationale else []
             explanations.extend(reasons)
             reasons_str = ", ".join(explanations)
@@ -4,7 +4,9 @@ import logging
 import re
 from functools import lru_cache
 from typing import List, Dict, Tuple, Pattern, cast
+from app.config.logging import log_payload
 from app.graph.state import BodyState
+from app.tools import inference
 
 logger = logging.getLogger(__name__)
 
@@ -113,11 +115,11 @@ def _get_pipe():
     try:
         from transformers import pipeline  # type: ignore[import-untyped]
 
-        logger.info(f"Loading ML model: {model_id}")
+        logger.info("Loading ML model: %s", model_id)
         _PIPE = pipeline("zero-shot-classification", model=model_id, device=-1)
         logger.info("ML pipeline initialized successfully")
     except Exception as e:
-        logger.error(f"Failed to load ML pipeline: {str(e)}", exc_info=True)
+        logger.error("Failed to load ML pipeline: %s", e, exc_info=True)
         _PIPE = None
     return _PIPE
 
@@ -127,16 +129,17 @@ def _parse_thresholds(spec: str) -> Dict[str, float]:
     if not spec:
         logger.debug("No risk thresholds specified")
         return out
-    logger.debug(f"Parsing risk thresholds from spec: {spec}")
+    logger.debug("Parsing risk thresholds from spec: %s", spec)
     for part in spec.split(","):
         if ":" in part:
             k, v = part.split(":", 1)
             try:
                 out[k.strip()] = float(v)
-                logger.debug(f"Added threshold {k.strip()}={float(v)}")
+                logger.debug("Added threshold %s=%s", k.strip(), out[k.strip()])
             except ValueError:
-                logger.warning(f"Invalid threshold value in RISK_THRESHOLDS: {part}")
-    logger.info(f"Parsed thresholds: {out}")
+                logger.warning("Invalid threshold value in RISK_THRESHOLDS: %s", part)
+    # Parsed on every request: keep it out of INFO
+    logger.debug("Parsed thresholds: %s", out)
     return out
 
 
@@ -167,13 +170,13 @@ def run(state: BodyState) -> BodyState:
         ).split(",")
         if s.strip()
     ]
-    logger.debug(f"Using risk labels: {labels}")
+    logger.debug("Using risk labels: %s", labels)
 
     thresholds = _parse_thresholds(
         os.getenv("RISK_THRESHOLDS", "urgent_care:0.55,see_doctor:0.50")
     )
     hyp = os.getenv("RISK_HYPOTHESIS", "This situation requires {}.")
-    logger.debug(f"Using hypothesis template: {hyp}")
+    logger.debug("Using hypothesis template: %s", hyp)
 
     # Build text with lightweight context (med names only)
     base_query = state.get("user_query_redacted") or state.get("user_query", "")
@@ -187,7 +190,7 @@ def run(state: BodyState) -> BodyState:
         text_components.append(base_query)
 
     text = "\n".join(text_components)
-    logger.debug(f"Base query text: {text}")
+    log_payload(logger, "Base query text: %s", text)
 
     meds = []
     for m in state.get("memory_facts") or []:
@@ -195,11 +198,11 @@ def run(state: BodyState) -> BodyState:
             med_name = m.get("normalized", {}).get("ingredient") or m.get("name") or ""
             if med_name:
                 meds.append(med_name)
-                logger.debug(f"Added medication context: {med_name}")
+                log_payload(logger, "Added medication context: %s", med_name)
 
     if meds:
         text += "\nContext meds: " + ", ".join(sorted(set(meds)))
-        logger.debug(f"Final text with med context: {text}")
+        log_payload(logger, "Final text with med context: %s", text)
 
     if not labels:
         logger.warning("No risk labels configured - skipping classification")
@@ -208,18 +211,22 @@ def run(state: BodyState) -> BodyState:
     try:
         logger.info("Running risk classification")
         # Use multi_label=True so each label is independently scored
-        res = cast(
-            dict,
-            pipe(
-                text, candidate_labels=labels, hypothesis_template=hyp, multi_label=True
-            ),
-        )
+        with inference.slot("risk_ml"):
+            res = cast(
+                dict,
+                pipe(
+                    text,
+                    candidate_labels=labels,
+                    hypothesis_template=hyp,
+                    multi_label=True,
+                ),
+            )
         pairs: List[Tuple[str, float]] = list(
             zip(res.get("labels", []), [float(s) for s in res.get("scores", [])])
         )
-        logger.debug(f"Classification results: {pairs}")
+        log_payload(logger, "Classification results: %s", pairs)
     except Exception as e:
-        logger.error(f"Risk classification failed: {str(e)}", exc_info=True)
+        logger.error("Risk classification failed: %s", e, exc_info=True)
         return state
 
     # Map to UX
@@ -229,26 +236,26 @@ def run(state: BodyState) -> BodyState:
         "self_care": "Likely self-care with monitoring.",
         "info_only": "General information only.",
     }
-    logger.debug(f"Using message map: {msg_map}")
+    logger.debug("Using message map: %s", msg_map)
 
     triggered = []
     for label, score in pairs:
         thr = thresholds.get(
             label, 1.1
         )  # default high so only listed thresholds can trigger
-        logger.debug(f"Checking {label} (score={score:.3f}) against threshold {thr}")
+        logger.debug("Checking %s (score=%.3f) against threshold %s", label, score, thr)
 
         if score >= thr:
             triggered.append((label, score))
-            logger.info(f"Triggered risk label: {label} with score {score:.3f}")
+            logger.info("Triggered risk label: %s with score %.3f", label, score)
 
             if label in ("urgent_care", "see_doctor"):
                 alert = f"ML risk: {label} (p={score:.2f})"
                 state.setdefault("alerts", []).append(alert)
                 message = {"role": "assistant", "content": msg_map.get(label, "")}
                 state.setdefault("messages", []).append(message)
-                logger.info(f"Added alert: {alert}")
-                logger.info(f"Added message: {message}")
+                logger.debug("Added alert: %s", alert)
+                log_payload(logger, "Added message: %s", message)
 
     # If nothing triggered and we have no messages yet, provide the top-scoring label as gentle guidance
     if not triggered and not state.get("messages") and pairs:
@@ -257,7 +264,7 @@ def run(state: BodyState) -> BodyState:
         label, score = pairs_sorted[0]
         message = {"role": "assistant", "content": msg_map.get(label, "")}
         state.setdefault("messages", []).append(message)
-        logger.info(f"Added gentle guidance message for {label} (score={score:.3f})")
+        logger.info("Added gentle guidance message for %s (score=%.3f)", label, score)
 
     # Stash raw results for debugging
     state.setdefault("debug", {})["risk"] = {
@@ -2,10 +2,11 @@ from __future__ import annotations
 import json
 import os
 import re
-from typing import Dict, List, Literal, Optional
+from typing import Any, Dict, Iterable, List, Literal, Optional, Tuple
 import numpy as np
 import logging
 from app.graph.state import BodyState, SubIntent
+from app.tools import embeddings, jsonstream
 from app.tools.embeddings import embed
 from app.tools.med_normalize import find_medications_in_text
 
@@ -66,15 +67,15 @@ _DEFAULT_EXAMPLES: Dict[str, List[str]] = {
 }
 
 
-def _parse_json_exemplars(obj: dict) -> Dict[str, List[str]]:
+def _parse_json_exemplars(items: Iterable[Tuple[str, Any]]) -> Dict[str, List[str]]:
     out: Dict[str, List[str]] = {}
-    for k, vals in obj.items():
+    for k, vals in items:
         if k in {"symptom", "meds", "appointment", "routine", "other"}:
             out[k] = [v for v in vals if isinstance(v, str) and v.strip()]
     return out
 
 
-def _parse_jsonl_exemplars(lines: List[str]) -> Dict[str, List[str]]:
+def _parse_jsonl_exemplars(lines: Iterable[str]) -> Dict[str, List[str]]:
     buckets: Dict[str, List[str]] = {
         k: [] for k in ["symptom", "meds", "appointment", "routine", "other"]
     }
@@ -116,11 +117,12 @@ def _load_exemplars() -> Dict[str, List[str]]:
     path = _current_path()
     if path and os.path.exists(path):
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                if path.endswith(".jsonl"):
-                    data = _parse_jsonl_exemplars(f.readlines())
+            # Streamed line by line / member by member; .gz is accepted
+            with jsonstream.open_text(path) as f:
+                if jsonstream.is_jsonl(path):
+                    data = _parse_jsonl_exemplars(f)
                 else:
-                    data = _parse_json_exemplars(json.load(f))
+                    data = _parse_json_exemplars(jsonstream.iter_json_object(f))
             if data:
                 _ACTIVE_PATH = path
                 _EX_MTIME_NS = _stat_mtime_ns(path)
@@ -151,12 +153,15 @@ def _load_exemplars() -> Dict[str, List[str]]:
 
 _EXEMPLARS = _load_exemplars()
 _EX_VECS: Dict[str, np.ndarray] = {}
+# Model the exemplar vectors were built with; queries must use the same one
+_EX_MODEL: Optional[str] = None
 
 
 def _rebuild_vectors() -> None:
-    global _EX_VECS
+    global _EX_VECS, _EX_MODEL
+    _EX_MODEL = embeddings.MODEL
     _EX_VECS = {
-        k: np.array(embed(v)) if v else np.zeros((0, 384))
+        k: np.array(embed(v)) if v else np.zeros((0, embeddings.VEC_DIMS))
         for k, v in _EXEMPLARS.items()
     }
 
@@ -165,6 +170,10 @@ _rebuild_vectors()
 
 
 def _maybe_reload() -> None:
+    if _EX_MODEL != embeddings.MODEL:
+        # The active embeddings model changed (re-embed alias swap)
+        _rebuild_vectors()
+        logging.info(f"Rebuilt intent exemplar vectors for {embeddings.MODEL}")
     if not _WATCH:
         return
     global _ACTIVE_PATH, _EX_MTIME_NS, _EXEMPLARS
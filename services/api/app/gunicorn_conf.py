@@ -0,0 +1,58 @@
+"""Gunicorn settings for the pre-fork (shared model) deployment mode.
+
+Run with::
+
+    PRELOAD_MODELS=true gunicorn -c python:app.gunicorn_conf app.main:app
+
+The master imports the app, loads models and seed data (torch on one thread),
+freezes the GC heap and only then forks ``WEB_CONCURRENCY`` Uvicorn workers,
+each of which starts its own torch thread pool with one warm-up encode.
+``PRELOAD_MODELS=worker`` warms each worker after the fork instead (no sharing;
+used as the benchmark baseline). Elasticsearch clients and the graph are still
+created per worker in the FastAPI lifespan, so no sockets are shared across
+processes.
+"""
+
+from __future__ import annotations
+
+import gc
+import os
+
+from app.preload import (
+    freeze_heap,
+    preload_enabled,
+    preload_mode,
+    preload_models,
+    warm_worker,
+)
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = preload_enabled()
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+
+def on_starting(server) -> None:
+    if not preload_app:
+        return
+    # Keep the collector from touching preloaded objects until they are frozen
+    gc.disable()
+    preload_models(master=True)
+
+
+def pre_fork(server, worker) -> None:
+    if preload_app:
+        freeze_heap()
+        # Frozen objects are never scanned, so collecting again is safe; the
+        # master (which lives as long as the server) and the child both need it
+        gc.enable()
+
+
+def post_worker_init(worker) -> None:
+    mode = preload_mode()
+    if mode == "master":
+        warm_worker()
+    elif mode == "worker":
+        # Baseline for the memory benchmark: same warm state, but private
+        preload_models()
@@ -1,19 +1,31 @@
-from fastapi import FastAPI, Query as QueryParam, Request
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Query as QueryParam, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from starlette.routing import Route
 from pydantic import BaseModel, Field
-from typing import List, AsyncGenerator, Any, Dict, cast, Literal
+from typing import List, AsyncGenerator, Any, Dict, Optional, cast, Literal
 import logging
 import os
-import re
 import json
 from datetime import datetime, timezone
 import uuid
 
 from app.config import settings
-from app.config.logging import configure_logging, set_request_id, clear_request_id
-
-from app.tools.es_client import ensure_indices, get_es_client
+from app.config.logging import (
+    clear_request_id,
+    configure_logging,
+    log_payload,
+    set_request_id,
+    stop_logging,
+)
+
+from app.tools.es_client import (
+    ensure_indices,
+    get_es_client,
+    start_model_sync,
+    sync_embeddings_model,
+    user_routing,
+    write_embeddings_model,
+)
 from app.graph.state import BodyState
 from app.tools.language import normalize_language_code
 from app.graph.build import build_graph
@@ -21,8 +33,17 @@ from app.graph.nodes import risk_ml
 from contextlib import asynccontextmanager
 
 from app.tools.embeddings import embed
-from app.tools.crypto import encrypt_for_user
-from app.tools.med_normalize import normalize_medication_name
+from app.tools import (
+    inference,
+    llm_clients,
+    memory_admin,
+    memory_ttl,
+    memory_writer,
+    metrics,
+    spans,
+    trace_store,
+)
+from app.tools.crypto import encrypt_for_user, get_user_cipher
 from scalar_fastapi import Layout, Theme, get_scalar_api_reference
 
 logger = logging.getLogger(__name__)
@@ -32,18 +53,36 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     configure_logging()
     # Avoid bootstrapping indices when running under pytest or explicit test env
+    compaction = None
+    model_sync = None
     if os.getenv("PYTEST_CURRENT_TEST") or os.getenv("APP_ENV") == "test":
         logger.info("Skipping index bootstrap in test mode")
     else:
         ensure_indices()
+        sync_embeddings_model(force=True)
+        # Follows alias swaps made by scripts/reembed.py, off the request path
+        model_sync = start_model_sync()
+        compaction = memory_ttl.start_scheduler(get_es_client)
     app.state.graph = build_graph()
+    # Resolved per flush, so the writer follows whatever client is current
+    app.state.memory_writer = memory_writer.MemoryWriter(lambda: get_es_client())
+    app.state.memory_writer.start()
     app.state.last_trace = []
     app.state.last_risk = {}
     app.state.last_run_completed_at = None
     yield
+    app.state.memory_writer.close()
+    if compaction is not None:
+        compaction.stop()
+    if model_sync is not None:
+        model_sync.stop()
+    llm_clients.close()
+    spans.close()
+    stop_logging()
 
 
 app = FastAPI(title="Body Agent API", lifespan=lifespan, docs_url=None, redoc_url=None)
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 @app.get("/docs", include_in_schema=False)
@@ -79,10 +118,23 @@ def _initial_state(
 
 def _record_run_metadata(final_state: BodyState) -> None:
     debug = final_state.get("debug") or {}
-    trace = debug.get("trace") or []
-    app.state.last_trace = list(trace)
+    trace = list(debug.get("trace") or [])
+    completed_at = datetime.now(timezone.utc).isoformat()
+    app.state.last_trace = trace
     app.state.last_risk = debug.get("risk", {})
-    app.state.last_run_completed_at = datetime.now(timezone.utc).isoformat()
+    app.state.last_run_completed_at = completed_at
+    rid = debug.get("request_id")
+    if rid:
+        trace_store.traces.put(
+            rid,
+            {
+                "request_id": rid,
+                "completed_at": completed_at,
+                "intent": final_state.get("intent"),
+                "trace": trace,
+                "risk": debug.get("risk", {}),
+            },
+        )
 
 
 def _request_id_from(request: Request) -> str:
@@ -100,7 +152,9 @@ def _request_id_from(request: Request) -> str:
 async def run_graph(
     request: Request, q: Query, lang: str | None = QueryParam(default=None)
 ) -> dict:
-    logger.info(f"Running graph for user {q.user_id}")
+    logger.info("Running graph for user %s", q.user_id)
+    priority_token = inference.set_priority(inference.PRIORITY_INTERACTIVE)
+    budget_token = llm_clients.start_request_budget()
     try:
         rid = _request_id_from(request)
         set_request_id(rid)
@@ -108,26 +162,34 @@ async def run_graph(
         final_state = await app.state.graph.ainvoke(state)
         # Defensive: ensure request_id remains present even if nodes overwrite debug
         final_state.setdefault("debug", {})["request_id"] = rid
-        logger.debug(f"Query: {final_state.get('user_query_redacted', q.query)}")
-        logger.info(f"Graph run completed for user {q.user_id} rid={rid}")
+        log_payload(
+            logger, "Query: %s", final_state.get("user_query_redacted", q.query)
+        )
+        logger.info("Graph run completed for user %s rid=%s", q.user_id, rid)
         _record_run_metadata(final_state)
         return {"state": final_state}
     except Exception as e:
-        logger.error(f"Graph run failed for user {q.user_id}: {str(e)}", exc_info=True)
+        logger.error("Graph run failed for user %s: %s", q.user_id, e, exc_info=True)
         raise
     finally:
         clear_request_id()
+        llm_clients.reset_request_budget(budget_token)
+        inference.reset_priority(priority_token)
 
 
 @app.post("/api/graph/stream")
 async def stream_graph(
     request: Request, q: Query, lang: str | None = QueryParam(default=None)
 ) -> StreamingResponse:
-    logger.info(f"Streaming graph for user {q.user_id}")
+    logger.info("Streaming graph for user %s", q.user_id)
     rid = _request_id_from(request)
     state = _initial_state(q, lang, rid)
 
     async def _stream_chunks() -> AsyncGenerator[str, None]:
+        # Scoped to the response task; no reset needed (the generator may be
+        # closed from another context on client disconnect)
+        inference.set_priority(inference.PRIORITY_INTERACTIVE)
+        llm_clients.start_request_budget()
         try:
             # Keep an accumulated view of the state while streaming deltas
             current_state: Dict[str, Any] = dict(state)
@@ -154,6 +216,8 @@ async def stream_graph(
 
             # Emit the exact final state. Prefer a fresh ainvoke; fallback to accumulated
             try:
+                # The final run gets its own LLM budget
+                llm_clients.start_request_budget()
                 final_state: BodyState = await app.state.graph.ainvoke(state)
             except Exception:
                 final_state = cast(BodyState, current_state)
@@ -161,7 +225,7 @@ async def stream_graph(
             # Defensive: ensure request_id remains in final state
             final_state.setdefault("debug", {})["request_id"] = rid
             yield f"data: {json.dumps({'request_id': rid, 'final': {'state': final_state}})}\n\n"
-            logger.info(f"Graph stream completed for user {q.user_id} rid={rid}")
+            logger.info("Graph stream completed for user %s rid=%s", q.user_id, rid)
             _record_run_metadata(final_state)
         except Exception as e:
             logger.error(
@@ -180,7 +244,7 @@ async def run_legacy(
     request: Request, q: Query, lang: str | None = QueryParam(default=None)
 ) -> dict:
     """Legacy endpoint; now routes through the compiled LangGraph graph."""
-    logger.info(f"Legacy endpoint called for user {q.user_id}")
+    logger.info("Legacy endpoint called for user %s", q.user_id)
     return await run_graph(request, q, lang)
 
 
@@ -190,6 +254,12 @@ def healthz():
     return {"ok": True}
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint() -> Response:
+    """This worker's metrics in the Prometheus text format."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/api/debug/risk")
 def debug_risk():
     thresholds = risk_ml._parse_thresholds(
@@ -211,9 +281,48 @@ def debug_risk():
 
 @app.get("/api/debug/trace")
 def debug_trace():
+    """Trace of the last run to complete, plus the ids of every stored run."""
     return {
         "completed_at": getattr(app.state, "last_run_completed_at", None),
         "trace": getattr(app.state, "last_trace", []),
+        "recent": trace_store.traces.request_ids(),
+    }
+
+
+@app.get("/api/debug/trace/{rid}")
+def debug_trace_for(rid: str):
+    """Trace of one recent run; only the last ``TRACE_STORE_SIZE`` are kept."""
+    record = trace_store.traces.get(rid)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"No trace for request {rid}")
+    return record
+
+
+@app.get("/api/debug/latency")
+def debug_latency():
+    """Rolling per-node p50/p95/p99 and error counts, overall and by intent."""
+    return {
+        "window": trace_store.latency.window,
+        "nodes": trace_store.latency.snapshot(),
+    }
+
+
+@app.get("/api/debug/profile")
+def debug_profile():
+    """Nodes ranked by mean CPU time and (with ``TRACE_MEMORY``) peak memory."""
+    return {
+        "memory_tracking": trace_store.memory_tracking(),
+        "window": trace_store.profile.window,
+        **trace_store.profile.ranking(),
+    }
+
+
+@app.get("/api/debug/inference")
+def debug_inference():
+    """Per-model slot usage and queue-time stats from the inference scheduler."""
+    return {
+        "torch_threads": inference.scheduler.torch_threads(),
+        "models": inference.scheduler.stats(),
     }
 
 
@@ -222,34 +331,104 @@ class MedInput(BaseModel):
     user_id: str = Field(..., min_length=1)
     name: str
     value: str = ""
+    # Days until the fact expires; default MEMORY_TTL_DAYS, 0 = never
+    ttl_days: Optional[int] = Field(None, ge=0)
 
 
 @app.post("/api/memory/add_med")
 def add_med(m: MedInput):
-    base = (
-        re.sub(r"\b(\d+\s?mg|\d+\s?mcg|\d+\s?ml)\b", "", m.name, flags=re.IGNORECASE)
-        .strip()
-        .lower()
+    es = get_es_client()
+    # The index's own model, even if this worker has not followed a swap yet
+    model = write_embeddings_model(es, settings.es_private_index)
+    doc_id, doc = memory_writer.med_fact(
+        m.user_id,
+        m.name,
+        encrypt_for_user(m.user_id, m.value),
+        embed([m.name], model=model)[0],
+    )
+    memory_ttl.stamp(doc, m.ttl_days)
+    es.index(
+        index=settings.es_private_index,
+        id=doc_id,
+        document=doc,
+        routing=user_routing(m.user_id),
     )
-    doc_id = f"{m.user_id}:med:{base}"
-    normalized = normalize_medication_name(m.name)
-    ingredient = normalized["ingredient"] if normalized else base
-
-    doc = {
-        "user_id": m.user_id,
-        "entity": "medication",
-        "name": m.name.strip(),
-        "normalized": {"ingredient": ingredient},
-        # Store sensitive value encrypted at rest
-        "value": encrypt_for_user(m.user_id, m.value),
-        "value_encrypted": True,
-        "confidence": 0.95,
-        "embedding": embed([m.name])[0],
-    }
-    get_es_client().index(index=settings.es_private_index, id=doc_id, document=doc)
     return {"ok": True}
 
 
+class MedItem(BaseModel):
+    name: str = Field(..., min_length=1)
+    value: str = ""
+    ttl_days: Optional[int] = Field(None, ge=0)
+
+
+class PreferenceItem(BaseModel):
+    name: str = Field(..., min_length=1)
+    value: Any
+    ttl_days: Optional[int] = Field(None, ge=0)
+
+
+class BulkMemoryInput(BaseModel):
+    user_id: str = Field(..., min_length=1)
+    meds: List[MedItem] = Field(default_factory=list)
+    preferences: List[PreferenceItem] = Field(default_factory=list)
+    # Default for items without their own ttl_days
+    ttl_days: Optional[int] = Field(None, ge=0)
+    # Write before returning and refresh, so the next read sees the facts
+    wait_for: bool = False
+
+
+@app.post("/api/memory/bulk")
+def add_memory_bulk(b: BulkMemoryInput, request: Request) -> Dict[str, Any]:
+    """Add many facts with one embedding batch, one key read and one bulk write."""
+
+    items: List[Any] = [*b.meds, *b.preferences]
+    if not items:
+        return {"ok": True, "queued": 0}
+    model = write_embeddings_model(get_es_client(), settings.es_private_index)
+    vectors = embed([item.name for item in items], model=model)
+    cipher = get_user_cipher(b.user_id) if b.meds else None
+    actions = []
+    for item, vector in zip(items, vectors):
+        if isinstance(item, MedItem):
+            token = (
+                cipher.encrypt(item.value.encode("utf-8")).decode("utf-8")
+                if cipher is not None and item.value
+                else ""
+            )
+            doc_id, doc = memory_writer.med_fact(b.user_id, item.name, token, vector)
+        else:
+            doc_id, doc = memory_writer.preference_fact(
+                b.user_id, item.name, item.value, vector
+            )
+        ttl = item.ttl_days if item.ttl_days is not None else b.ttl_days
+        actions.append(memory_writer.index_action(b.user_id, doc_id, doc, ttl))
+    return request.app.state.memory_writer.submit(actions, wait_for=b.wait_for)
+
+
+class UserRef(BaseModel):
+    user_id: str = Field(..., min_length=1)
+
+
+@app.get("/api/memory/export")
+def export_memory(user_id: str = QueryParam(..., min_length=1)) -> StreamingResponse:
+    """Stream every private memory fact of ``user_id`` as NDJSON, decrypted."""
+
+    return StreamingResponse(
+        memory_admin.export_ndjson(get_es_client(), user_id),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.post("/api/memory/delete")
+def delete_memory(u: UserRef, request: Request) -> Dict[str, Any]:
+    """Erase a user's private memory, queued writes and encryption key."""
+
+    return memory_admin.delete_user_memory(
+        get_es_client(), u.user_id, writer=request.app.state.memory_writer
+    )
+
+
 @app.get("/__routes")
 def routes() -> List[str]:
     return [r.path for r in app.routes if isinstance(r, Route)]
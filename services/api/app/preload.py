@@ -0,0 +1,134 @@
+"""Pre-fork warm-up for multi-worker deployments.
+
+Under gunicorn with ``preload_app`` the master process imports the app once and
+forks workers from it. Loading the heavy, read-only pieces (embedding model,
+NLI pipeline, intent exemplar matrix, seed data) before the fork lets every
+worker share those pages copy-on-write instead of paying for its own copy.
+"""
+
+from __future__ import annotations
+
+import gc
+import logging
+import os
+from time import perf_counter
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+def preload_mode() -> str:
+    """Return ``master`` (load before fork), ``worker`` (load after fork) or ``off``."""
+
+    raw = os.getenv("PRELOAD_MODELS", "false").strip().lower()
+    if raw in {"true", "master"}:
+        return "master"
+    if raw == "worker":
+        return "worker"
+    return "off"
+
+
+def preload_enabled() -> bool:
+    return preload_mode() == "master"
+
+
+def _load_embeddings() -> None:
+    from app.tools.embeddings import embed
+
+    # One real encode initialises lazy tokenizer/torch state as well
+    embed(["warm-up"])
+
+
+def _load_exemplars() -> None:
+    from app.graph.nodes import supervisor
+
+    # Importing the module builds the exemplar matrix; nothing else to do
+    _ = supervisor._EX_VECS
+
+
+def _load_risk_pipeline() -> None:
+    from app.graph.nodes import risk_ml
+
+    risk_ml._get_pipe()
+
+
+def _load_seed_data() -> None:
+    from app.tools import med_facts, symptom_registry
+    from app.graph.nodes import answer_gen
+
+    med_facts._load_facts()
+    med_facts._alias_map()
+    symptom_registry.get_registry()
+    answer_gen._init_templates_map()
+
+
+_STEPS: tuple[tuple[str, Callable[[], None]], ...] = (
+    ("embeddings", _load_embeddings),
+    ("exemplars", _load_exemplars),
+    ("risk_pipeline", _load_risk_pipeline),
+    ("seed_data", _load_seed_data),
+)
+
+
+def preload_models(master: bool = False) -> Dict[str, float]:
+    """Load shared models and seed data; return per-step timings in ms.
+
+    Failures are logged and skipped so a missing optional model never blocks
+    startup; the affected worker falls back to lazy loading as before. With
+    ``master`` torch runs single-threaded, so no OpenMP pool exists at fork
+    time (a child inherits the pool's state but not its threads and can hang
+    on its first encode); ``warm_worker`` sizes and starts the pool after it.
+    """
+
+    if master:
+        from app.tools import inference
+
+        inference.scheduler.pin_torch_threads(1)
+    timings: Dict[str, float] = {}
+    for name, step in _STEPS:
+        start = perf_counter()
+        try:
+            step()
+        except Exception as exc:
+            logger.warning("Preload step %s failed: %s", name, exc)
+            continue
+        timings[name] = (perf_counter() - start) * 1000.0
+        logger.info("Preloaded %s in %.1f ms", name, timings[name])
+    return timings
+
+
+def warm_worker() -> None:
+    """Size torch threads for this worker and start its pool with one encode."""
+
+    from app.tools import inference
+
+    inference.scheduler.reset_torch()
+    start = perf_counter()
+    try:
+        _load_embeddings()
+    except Exception as exc:
+        logger.warning("Worker warm-up failed: %s", exc)
+        return
+    logger.info("Warmed worker in %.1f ms", (perf_counter() - start) * 1000.0)
+
+
+def freeze_heap() -> int:
+    """Move all tracked objects to the permanent generation before forking.
+
+    Without this, the first GC pass in each worker touches the refcount/GC
+    headers of every preloaded object and un-shares their pages.
+    """
+
+    gc.freeze()
+    frozen = gc.get_freeze_count()
+    logger.info("Froze %d objects before fork", frozen)
+    return frozen
+
+
+__all__ = [
+    "preload_mode",
+    "preload_enabled",
+    "preload_models",
+    "warm_worker",
+    "freeze_heap",
+]
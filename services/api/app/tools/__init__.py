@@ -3,23 +3,57 @@
 from __future__ import annotations
 
 from . import (
+    answer_cache,
     crypto,
     embeddings,
     es_client,
+    extractive,
     geo_tools,
+    inference,
+    ingest,
+    jsonstream,
+    key_store,
+    knn_bench,
     language,
+    llm_clients,
     med_facts,
     med_normalize,
+    memory_admin,
+    memory_ttl,
+    memory_writer,
+    metrics,
+    onset_texts,
+    passages,
+    reembed,
+    spans,
     symptom_registry,
+    trace_store,
 )
 
 __all__ = [
+    "answer_cache",
     "crypto",
     "embeddings",
     "es_client",
+    "extractive",
     "geo_tools",
+    "inference",
+    "ingest",
+    "jsonstream",
+    "key_store",
+    "knn_bench",
     "language",
+    "llm_clients",
     "med_facts",
     "med_normalize",
+    "memory_admin",
+    "memory_ttl",
+    "memory_writer",
+    "metrics",
+    "onset_texts",
+    "passages",
+    "reembed",
+    "spans",
     "symptom_registry",
+    "trace_store",
 ]
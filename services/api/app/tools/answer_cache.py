@@ -0,0 +1,241 @@
+"""Two-level cache for generated answers.
+
+Level one is an exact hash of (provider, model, language, prompt inputs, scope). Level
+two is a semantic lookup on the query embedding, but only among entries whose
+*gate* matches exactly: same provider/model/language, same citation set, same
+risk triggers and same scope. Entries built from personal memory facts are scoped to
+that user (and those facts), so they are never served to anyone else.
+
+Entries expire after a TTL and the least recently used entry is evicted once
+the cache is full.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.tools.metrics import cache_lookups
+
+logger = logging.getLogger(__name__)
+
+SHARED_SCOPE = "shared"
+
+Gate = Tuple[str, ...]
+
+
+@dataclass
+class _Entry:
+    answer: str
+    gate: Gate
+    vector: Optional[np.ndarray]
+    expires_at: float
+
+
+def exact_key(
+    provider: str,
+    model: str,
+    language: str,
+    prompt_inputs: str,
+    scope: str = SHARED_SCOPE,
+) -> str:
+    # Scope keeps prompts that embed personal facts from matching across users
+    raw = "\x1f".join((provider, model, language, prompt_inputs, scope))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def scope_for(user_id: Optional[str], memory_facts: Sequence[dict]) -> str:
+    """``shared`` unless the answer was built from personal memory facts."""
+
+    if not memory_facts:
+        return SHARED_SCOPE
+    digest = hashlib.sha256(
+        repr(sorted(repr(sorted(f.items())) for f in memory_facts)).encode("utf-8")
+    ).hexdigest()[:16]
+    return f"user:{user_id or ''}:{digest}"
+
+
+def make_gate(
+    provider: str,
+    model: str,
+    language: str,
+    citations: Iterable[str],
+    triggers: Iterable[str],
+    scope: str,
+) -> Gate:
+    return (
+        provider,
+        model,
+        language,
+        "\x1f".join(sorted(set(citations))),
+        "\x1f".join(sorted(set(triggers))),
+        scope,
+    )
+
+
+def _unit(vector: Optional[Sequence[float]]) -> Optional[np.ndarray]:
+    if vector is None:
+        return None
+    arr = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(arr))
+    if norm == 0.0:
+        return None
+    return arr / norm
+
+
+class AnswerCache:
+    def __init__(
+        self, max_entries: int = 512, ttl_s: float = 3600.0, similarity: float = 0.95
+    ) -> None:
+        self.max_entries = max(1, max_entries)
+        self.ttl_s = ttl_s
+        self.similarity = similarity
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+            "invalidated": 0,
+        }
+
+    def _drop_expired(self, now: float) -> None:
+        stale = [k for k, e in self._entries.items() if e.expires_at <= now]
+        for key in stale:
+            del self._entries[key]
+        self._stats["expired"] += len(stale)
+
+    def get(self, key: str) -> Optional[str]:
+        """Exact lookup; counts a hit but not a miss (the semantic level may follow)."""
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= now:
+                del self._entries[key]
+                self._stats["expired"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["exact_hits"] += 1
+        cache_lookups.inc("answer", "exact_hit")
+        return entry.answer
+
+    def get_similar(
+        self, vector: Optional[Sequence[float]], gate: Gate
+    ) -> Optional[Tuple[str, float]]:
+        """Best entry with the same gate whose similarity clears the threshold."""
+
+        query = _unit(vector)
+        now = time.monotonic()
+        with self._lock:
+            best: Optional[Tuple[str, float]] = None
+            best_key = None
+            if query is not None:
+                self._drop_expired(now)
+                for key, entry in self._entries.items():
+                    if entry.gate != gate or entry.vector is None:
+                        continue
+                    if entry.vector.shape != query.shape:
+                        continue
+                    score = float(entry.vector @ query)
+                    if score >= self.similarity and (best is None or score > best[1]):
+                        best, best_key = (entry.answer, score), key
+            if best is None:
+                self._stats["misses"] += 1
+            else:
+                self._entries.move_to_end(best_key)  # type: ignore[arg-type]
+                self._stats["semantic_hits"] += 1
+        cache_lookups.inc("answer", "miss" if best is None else "semantic_hit")
+        return best
+
+    def put(
+        self,
+        key: str,
+        answer: str,
+        gate: Gate,
+        vector: Optional[Sequence[float]] = None,
+    ) -> None:
+        with self._lock:
+            self._entries[key] = _Entry(
+                answer=answer,
+                gate=gate,
+                vector=_unit(vector),
+                expires_at=time.monotonic() + self.ttl_s,
+            )
+            self._entries.move_to_end(key)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate_user(self, user_id: str) -> int:
+        """Drop entries built from ``user_id``'s memory facts; returns how many."""
+
+        prefix = f"user:{user_id}:"
+        with self._lock:
+            stale = [
+                k for k, e in self._entries.items() if e.gate[-1].startswith(prefix)
+            ]
+            for key in stale:
+                del self._entries[key]
+            self._stats["invalidated"] += len(stale)
+        return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            for name in self._stats:
+                self._stats[name] = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            out: Dict[str, float] = dict(self._stats)
+            out["entries"] = len(self._entries)
+        lookups = out["exact_hits"] + out["semantic_hits"] + out["misses"]
+        out["hit_rate"] = (
+            (out["exact_hits"] + out["semantic_hits"]) / lookups if lookups else 0.0
+        )
+        return out
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        logger.warning("Invalid %s; using %s", name, default)
+        return default
+
+
+def enabled() -> bool:
+    return os.getenv("ANSWER_CACHE_ENABLED", "false").strip().lower() == "true"
+
+
+cache = AnswerCache(
+    max_entries=int(_env_number("ANSWER_CACHE_MAX_ENTRIES", 512)),
+    ttl_s=_env_number("ANSWER_CACHE_TTL_S", 3600.0),
+    similarity=_env_number("ANSWER_CACHE_SIMILARITY", 0.95),
+)
+
+
+__all__ = [
+    "AnswerCache",
+    "SHARED_SCOPE",
+    "cache",
+    "enabled",
+    "exact_key",
+    "make_gate",
+    "scope_for",
+]
@@ -1,46 +1,35 @@
 from __future__ import annotations
 
-import os
-from pathlib import Path
 from typing import Optional
 import logging
 
 from cryptography.fernet import Fernet  # type: ignore[import-not-found]
 
-from app.config import settings
+from app.tools import key_store
 
 logger = logging.getLogger(__name__)
 
 
-def _keys_dir() -> Path:
-    d = Path(settings.data_dir) / "keys"
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+def ensure_user_key(user_id: str) -> bytes:
+    return key_store.get_store().ensure(user_id)
 
 
-def _key_path(user_id: str) -> Path:
-    # Keep filename simple; user_id is already a stable key partition for ES
-    return _keys_dir() / f"{user_id}.key"
+def has_user_key(user_id: str) -> bool:
+    return key_store.get_store().get(user_id) is not None
 
 
-def ensure_user_key(user_id: str) -> bytes:
-    kp = _key_path(user_id)
-    if not kp.exists():
-        key = Fernet.generate_key()
-        # Best-effort to restrict permissions; platform dependent
-        with open(kp, "wb") as f:
-            f.write(key)
-        try:
-            os.chmod(kp, 0o600)
-        except OSError as e:
-            logger.warning(f"Failed to set permissions on key file {kp}: {e}")
-        return key
-    return kp.read_bytes()
+def delete_user_key(user_id: str) -> bool:
+    """Remove the user's key; anything still encrypted with it is unreadable.
+
+    Returns whether a key was removed.
+    """
+
+    return key_store.get_store().delete(user_id)
 
 
 def get_user_cipher(user_id: str) -> Fernet:
-    key = ensure_user_key(user_id)
-    return Fernet(key)
+    # Cached per store (KEY_CACHE_SIZE), so hot users cost no key I/O
+    return key_store.get_store().cipher(user_id)
 
 
 def encrypt_for_user(user_id: str, text: Optional[str]) -> str:
@@ -60,7 +49,9 @@ def decrypt_for_user(user_id: str, token: Optional[str]) -> str:
 
 
 __all__ = [
+    "delete_user_key",
     "ensure_user_key",
+    "has_user_key",
     "get_user_cipher",
     "encrypt_for_user",
     "decrypt_for_user",
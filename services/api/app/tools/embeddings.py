@@ -2,10 +2,17 @@ from __future__ import annotations
 
 import os
 import hashlib
-from typing import Callable, List, Sequence, Union
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Set, Union
 import numpy as np
 from sentence_transformers import SentenceTransformer
 
+from app.tools import inference
+from app.tools.spans import span
+
+logger = logging.getLogger(__name__)
+
 # Public constants
 VEC_DIMS: int = 384
 
@@ -13,6 +20,10 @@ VEC_DIMS: int = 384
 MODEL = os.getenv("EMBEDDINGS_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 DEVICE = os.getenv("EMBEDDINGS_DEVICE", "cpu")
 
+STUB_MODEL = "__stub__"
+
+Backend = Callable[[Sequence[str]], List[List[float]]]
+
 
 def _one_hot(text: str, dims: int = VEC_DIMS) -> List[float]:
     """Deterministic non-zero stub vector for cosine similarity."""
@@ -23,37 +34,111 @@ def _one_hot(text: str, dims: int = VEC_DIMS) -> List[float]:
     return v
 
 
-# Choose backend once, without redefining the public 'embed' symbol
-_embed_impl: Callable[[Sequence[str]], List[List[float]]]
+def _embed_stub(texts: Sequence[str]) -> List[List[float]]:
+    return [_one_hot(t) for t in texts]
 
-if MODEL == "__stub__":
 
-    def _embed_stub(texts: Sequence[str]) -> List[List[float]]:
-        return [_one_hot(t) for t in texts]
+def _load_model(model: str) -> Backend:
+    """Load ``model``; raises if it cannot be loaded."""
 
-    _embed_impl = _embed_stub
-else:
-    try:
-        _model = SentenceTransformer(MODEL, device=DEVICE)
+    if model == STUB_MODEL:
+        return _embed_stub
+    st_model = SentenceTransformer(model, device=DEVICE)
+
+    def _embed_real(texts: Sequence[str]) -> List[List[float]]:
+        embeddings = st_model.encode(list(texts), normalize_embeddings=True)
+        return np.asarray(embeddings).tolist()
+
+    return _embed_real
 
-        def _embed_real(texts: Sequence[str]) -> List[List[float]]:
-            embeddings = _model.encode(list(texts), normalize_embeddings=True)
-            return np.asarray(embeddings).tolist()
 
-        _embed_impl = _embed_real
-    except Exception:
+def _load_backend(model: str) -> Backend:
+    try:
+        return _load_model(model)
+    except Exception as exc:
         # Safe fallback: if model load fails in dev/CI, use stub
+        logger.warning("Failed loading embeddings model %s: %s", model, exc)
+        _fallbacks.add(model)
+
         def _embed_stub_fallback(texts: Sequence[str]) -> List[List[float]]:
             return [_one_hot(t) for t in texts]
 
-        _embed_impl = _embed_stub_fallback
+        return _embed_stub_fallback
+
+
+# Loaded models, so a re-embed job or a model switch does not reload them
+_backends: Dict[str, Backend] = {}
+_dims: Dict[str, int] = {}
+# Models whose load failed and that are served by the stub fallback
+_fallbacks: Set[str] = set()
+_backends_lock = threading.Lock()
+
+
+def _backend(model: str) -> Backend:
+    with _backends_lock:
+        impl = _backends.get(model)
+        if impl is None:
+            impl = _load_backend(model)
+            _backends[model] = impl
+        return impl
 
 
-def embed(texts: Union[str, Sequence[str]]) -> List[List[float]]:
-    """Public embedding API: returns List[List[float]] for str or Sequence[str]."""
+# Choose the startup backend once, without redefining the public 'embed' symbol
+_embed_impl: Backend = _backend(MODEL)
+
+
+def embed(
+    texts: Union[str, Sequence[str]], model: Optional[str] = None
+) -> List[List[float]]:
+    """Public embedding API: returns List[List[float]] for str or Sequence[str].
+
+    ``model`` defaults to the active model (``MODEL``).
+    """
     if isinstance(texts, str):
         texts = [texts]
-    return _embed_impl(texts)
+    impl = _embed_impl if model is None or model == MODEL else _backend(model)
+    with span("embed", batch=len(texts)) as s:
+        with inference.slot("embed", batch_size=len(texts)) as wait_ms:
+            s.attrs["queued_ms"] = wait_ms
+            return impl(texts)
+
+
+def require_model(model: str) -> None:
+    """Load ``model`` without the stub fallback; raises if it cannot be loaded.
+
+    For jobs that write vectors into an index (re-embedding), where stub
+    vectors would silently replace real ones.
+    """
+
+    global _embed_impl
+    with _backends_lock:
+        if model in _backends and model not in _fallbacks:
+            return
+        impl = _load_model(model)
+        _backends[model] = impl
+        _fallbacks.discard(model)
+        _dims.pop(model, None)
+        if model == MODEL:
+            _embed_impl = impl
+
+
+def dims(model: Optional[str] = None) -> int:
+    """Vector size produced by ``model`` (probed once with a short encode)."""
+
+    name = model or MODEL
+    if name not in _dims:
+        _dims[name] = len(_backend(name)(["dimension probe"])[0])
+    return _dims[name]
+
+
+def set_model(model: str) -> None:
+    """Make ``model`` the active query/ingest model (loads it if needed)."""
+
+    global MODEL, VEC_DIMS, _embed_impl
+    impl = _backend(model)
+    size = dims(model)
+    MODEL, VEC_DIMS, _embed_impl = model, size, impl
+    logger.info("Active embeddings model is now %s (%d dims)", model, size)
 
 
-__all__ = ["embed", "VEC_DIMS"]
+__all__ = ["embed", "dims", "require_model", "set_model", "VEC_DIMS"]
@@ -1,8 +1,42 @@
+import os
+import threading
 import time
 import logging
-from elasticsearch import Elasticsearch
+from typing import Any, Dict, List, Optional, Tuple
+
+from elasticsearch import Elasticsearch as _Elasticsearch
 from elastic_transport import ConnectionError
 from app.config import settings
+from app.tools import embeddings
+from app.tools.metrics import es_duration, es_errors
+from app.tools.spans import span
+
+
+class Elasticsearch(_Elasticsearch):
+    """The stock client, recording every call's latency by index and API.
+
+    Every API method (and ``helpers.*``) goes through ``perform_request``;
+    ``endpoint_id`` names the API (``search``, ``msearch``, ``bulk``...).
+    Each call is also an ``es.<api>`` span tagged with its index, and with
+    ``knn`` when the body has a kNN clause.
+    """
+
+    def perform_request(self, method: str, path: str, **kwargs: Any) -> Any:
+        index = str((kwargs.get("path_parts") or {}).get("index") or "-")
+        operation = kwargs.get("endpoint_id") or method.lower()
+        attrs: Dict[str, Any] = {"index": index}
+        body = kwargs.get("body")
+        if isinstance(body, dict) and "knn" in body:
+            attrs["knn"] = True
+        start = time.perf_counter()
+        with span(f"es.{operation}", **attrs):
+            try:
+                return super().perform_request(method, path, **kwargs)
+            except Exception:
+                es_errors.inc(index, operation)
+                raise
+            finally:
+                es_duration.observe(time.perf_counter() - start, index, operation)
 
 
 _es_client = None  # Internal variable to hold the Elasticsearch client
@@ -33,18 +67,130 @@ def get_es_client():
     return _es_client
 
 
-def ensure_indices():
-    # Called on startup by the API to ensure mappings exist
-    es = get_es_client()
-    indices = es.indices
+# Logical index kinds; the configured names may be concrete indices or aliases
+INDEX_KINDS = ("private", "public", "places")
 
-    def create_index(name: str, mapping: dict):
-        if not indices.exists(index=name):
-            indices.create(index=name, mappings=mapping)
 
-    vec_dims = 384  # all-MiniLM-L6-v2
+def index_names() -> Dict[str, str]:
+    return {
+        "private": settings.es_private_index,
+        "public": settings.es_public_index,
+        "places": settings.es_places_index,
+    }
+
+
+# hnsw/flat keep float32 vectors in memory; int8_* quantize them to one byte
+# per dimension, about 4x less kNN memory for a small recall cost
+VECTOR_INDEX_TYPES = ("int8_hnsw", "hnsw", "int8_flat", "flat")
+DEFAULT_VECTOR_INDEX_TYPE = "int8_hnsw"
+
+
+def _env_int(name: str, default: int, minimum: int = 1) -> int:
+    try:
+        return max(minimum, int(os.getenv(name, str(default))))
+    except ValueError:
+        logging.warning(f"Invalid {name}; using {default}")
+        return default
+
+
+def vector_index_options(index_type: Optional[str] = None) -> dict:
+    """``dense_vector.index_options`` from ``ES_VECTOR_INDEX_TYPE``/``ES_HNSW_*``."""
+
+    kind = (
+        (index_type or os.getenv("ES_VECTOR_INDEX_TYPE") or DEFAULT_VECTOR_INDEX_TYPE)
+        .strip()
+        .lower()
+    )
+    if kind not in VECTOR_INDEX_TYPES:
+        logging.warning(
+            f"Unknown ES_VECTOR_INDEX_TYPE {kind!r}; using {DEFAULT_VECTOR_INDEX_TYPE}"
+        )
+        kind = DEFAULT_VECTOR_INDEX_TYPE
+    options: Dict[str, object] = {"type": kind}
+    if kind.endswith("hnsw"):
+        options["m"] = _env_int("ES_HNSW_M", 16, minimum=2)
+        options["ef_construction"] = _env_int("ES_HNSW_EF_CONSTRUCTION", 100)
+    return options
+
+
+INDEX_PHASES = ("serving", "ingest")
+
+
+def index_settings(phase: str = "serving") -> Dict[str, object]:
+    """Index settings for ``phase``.
+
+    Serving uses ``ES_NUMBER_OF_REPLICAS``/``ES_REFRESH_INTERVAL``; bulk loads
+    use ``ES_INGEST_REPLICAS``/``ES_INGEST_REFRESH_INTERVAL`` (by default no
+    replicas and no periodic refresh) and are switched back afterwards.
+    Shard count is fixed at creation (``ES_NUMBER_OF_SHARDS``).
+    """
+
+    if phase not in INDEX_PHASES:
+        raise ValueError(f"Unknown index phase {phase!r}")
+    if phase == "ingest":
+        replicas = _env_int("ES_INGEST_REPLICAS", 0, minimum=0)
+        refresh = os.getenv("ES_INGEST_REFRESH_INTERVAL", "-1")
+    else:
+        replicas = _env_int("ES_NUMBER_OF_REPLICAS", 1, minimum=0)
+        refresh = os.getenv("ES_REFRESH_INTERVAL", "1s")
+    return {
+        "number_of_shards": _env_int("ES_NUMBER_OF_SHARDS", 1),
+        "number_of_replicas": replicas,
+        "refresh_interval": refresh,
+    }
+
+
+def dynamic_index_settings(phase: str = "serving") -> Dict[str, object]:
+    """The part of ``index_settings`` that can change on a live index."""
+
+    values = index_settings(phase)
+    values.pop("number_of_shards")
+    return values
+
+
+def knn_clause(kind: str, vector: List[float], **extra: Any) -> Dict[str, Any]:
+    """``knn`` search clause for an index kind from the ``KNN_<KIND>_*`` settings.
+
+    ``extra`` (e.g. ``filter``) is merged in as-is.
+    """
+
+    k = int(getattr(settings, f"knn_{kind}_k"))
+    clause: Dict[str, Any] = {
+        "field": "embedding",
+        "query_vector": vector,
+        "k": k,
+        # Elasticsearch rejects fewer candidates than k
+        "num_candidates": max(k, int(getattr(settings, f"knn_{kind}_num_candidates"))),
+    }
+    similarity = getattr(settings, f"knn_{kind}_similarity")
+    if similarity is not None:
+        clause["similarity"] = float(similarity)
+    clause.update(extra)
+    return clause
+
+
+def index_mappings(
+    vec_dims: int, model: str, index_options: Optional[dict] = None
+) -> Dict[str, dict]:
+    """Mappings per index kind; ``_meta`` records the model behind the vectors."""
+
+    options = index_options or vector_index_options()
+
+    def _embedding() -> dict:
+        return {
+            "type": "dense_vector",
+            "dims": vec_dims,
+            "index": True,
+            "similarity": "cosine",
+            "index_options": dict(options),
+        }
+
+    meta = {"embeddings_model": model}
 
     private_mapping = {
+        "_meta": dict(meta),
+        # Routed by user_id: a user's memory lives on one shard (user_routing)
+        "_routing": {"required": True},
         "properties": {
             "user_id": {"type": "keyword"},
             "entity": {"type": "keyword"},
@@ -54,16 +200,14 @@ def ensure_indices():
             "confidence": {"type": "float"},
             "ttl_days": {"type": "integer"},
             "updated_at": {"type": "date"},
-            "embedding": {
-                "type": "dense_vector",
-                "dims": vec_dims,
-                "index": True,
-                "similarity": "cosine",
-            },
-        }
+            # updated_at + ttl_days; reads skip and compaction deletes past it
+            "expires_at": {"type": "date"},
+            "embedding": _embedding(),
+        },
     }
 
     public_mapping = {
+        "_meta": dict(meta),
         "properties": {
             "title": {"type": "text"},
             "section": {"type": "keyword"},
@@ -72,16 +216,18 @@ def ensure_indices():
             "source_url": {"type": "keyword"},
             "updated_on": {"type": "date"},
             "text": {"type": "text"},
-            "embedding": {
-                "type": "dense_vector",
-                "dims": vec_dims,
-                "index": True,
-                "similarity": "cosine",
-            },
-        }
+            # Passage-level docs: parent document id, reading order, heading path
+            "doc_id": {"type": "keyword"},
+            "position": {"type": "integer"},
+            "heading": {"type": "text"},
+            # Written by ingest to skip unchanged documents on re-runs
+            "content_hash": {"type": "keyword"},
+            "embedding": _embedding(),
+        },
     }
 
     places_mapping = {
+        "_meta": dict(meta),
         "properties": {
             "name": {"type": "text"},
             "kind": {"type": "keyword"},
@@ -91,15 +237,200 @@ def ensure_indices():
             "book_url": {"type": "keyword"},
             "phone": {"type": "keyword"},
             "text": {"type": "text"},
-            "embedding": {
-                "type": "dense_vector",
-                "dims": vec_dims,
-                "index": True,
-                "similarity": "cosine",
-            },
-        }
+            "content_hash": {"type": "keyword"},
+            "embedding": _embedding(),
+        },
+    }
+
+    return {
+        "private": private_mapping,
+        "public": public_mapping,
+        "places": places_mapping,
     }
 
-    create_index(settings.es_private_index, private_mapping)
-    create_index(settings.es_public_index, public_mapping)
-    create_index(settings.es_places_index, places_mapping)
+
+def user_routing(user_id: str) -> str:
+    """Routing value for a user's private memory documents and lookups."""
+
+    return str(user_id)
+
+
+def private_template_name() -> str:
+    return f"{settings.es_private_index}-routing"
+
+
+def ensure_index_templates(es) -> None:
+    """Require ``_routing`` on the private index and its versioned rebuilds.
+
+    Any index matching the name, including one auto-created by a stray write
+    or a ``scripts/reembed.py`` version, rejects unrouted documents.
+    """
+
+    name = settings.es_private_index
+    es.indices.put_index_template(
+        name=private_template_name(),
+        index_patterns=[name, f"{name}-*"],
+        priority=100,
+        template={
+            "mappings": {
+                "_routing": {"required": True},
+                "properties": {
+                    "user_id": {"type": "keyword"},
+                    "expires_at": {"type": "date"},
+                },
+            }
+        },
+    )
+
+
+def ensure_indices():
+    # Called on startup by the API to ensure mappings exist
+    es = get_es_client()
+    indices = es.indices
+
+    def create_index(name: str, mapping: dict):
+        if not indices.exists(index=name):
+            indices.create(index=name, mappings=mapping, settings=index_settings())
+
+    ensure_index_templates(es)
+    mappings = index_mappings(embeddings.VEC_DIMS, embeddings.MODEL)
+    for kind, name in index_names().items():
+        create_index(name, mappings[kind])
+
+
+def indexed_embeddings_model(es, index: Optional[str] = None) -> Optional[str]:
+    """Model recorded in the index ``_meta`` (None when not recorded).
+
+    ``index`` defaults to the public index, which queries are embedded for.
+    """
+
+    resp = es.indices.get_mapping(index=index or settings.es_public_index)
+    for body in dict(resp).values():
+        model = ((body or {}).get("mappings", {}).get("_meta") or {}).get(
+            "embeddings_model"
+        )
+        if isinstance(model, str) and model:
+            return model
+    return None
+
+
+_model_checked_at: Optional[float] = None
+_model_sync_lock = threading.Lock()
+DEFAULT_MODEL_SYNC_S = 30.0
+# index -> (model in its _meta or None, monotonic time it was read)
+_write_models: Dict[str, Tuple[Optional[str], float]] = {}
+
+
+def _model_sync_interval_s() -> float:
+    try:
+        return float(os.getenv("EMBEDDINGS_MODEL_SYNC_S", str(DEFAULT_MODEL_SYNC_S)))
+    except ValueError:
+        return DEFAULT_MODEL_SYNC_S
+
+
+def sync_embeddings_model(es=None, force: bool = False) -> Optional[str]:
+    """Switch query embeddings to the model the indices were built with.
+
+    After a re-embed job swaps the aliases, every worker picks up the new model
+    on its next check (at most every ``EMBEDDINGS_MODEL_SYNC_S`` seconds; ``0``
+    disables the check; ``start_model_sync`` runs it in the background).
+    Returns the model switched to, if any.
+    """
+
+    global _model_checked_at
+    interval = _model_sync_interval_s()
+    # Only piggyback on an existing connection; never block a request on connecting
+    es = es or _es_client
+    if es is None or (interval <= 0 and not force):
+        return None
+    now = time.monotonic()
+    with _model_sync_lock:
+        if (
+            not force
+            and _model_checked_at is not None
+            and now - _model_checked_at < interval
+        ):
+            return None
+        _model_checked_at = now
+    try:
+        model = indexed_embeddings_model(es)
+    except Exception as exc:
+        logging.debug(f"Embeddings model check skipped: {exc}")
+        return None
+    if not model or model == embeddings.MODEL:
+        return None
+    # The indices were swapped; re-read the write models too
+    _write_models.clear()
+    logging.warning(
+        f"Indices were embedded with {model}, not {embeddings.MODEL}; switching"
+    )
+    embeddings.set_model(model)
+    return model
+
+
+class ModelSync:
+    """Daemon thread running ``sync_embeddings_model`` every ``interval_s``.
+
+    Keeps the ES round trip (and a possible model load) off the request path
+    and out of the event loop.
+    """
+
+    def __init__(self, interval_s: float) -> None:
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._loop, name="embeddings-model-sync", daemon=True
+        )
+        self._thread.start()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                sync_embeddings_model(force=True)
+            except Exception as exc:
+                logging.warning(f"Embeddings model sync failed: {exc}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+def start_model_sync() -> Optional[ModelSync]:
+    """Start the background model check unless ``EMBEDDINGS_MODEL_SYNC_S`` is 0."""
+
+    interval = _model_sync_interval_s()
+    if interval <= 0:
+        return None
+    sync = ModelSync(interval)
+    sync.start()
+    return sync
+
+
+def write_embeddings_model(es, index: str) -> str:
+    """Model to embed documents written to ``index`` with.
+
+    The model recorded in the index ``_meta``, cached per index for
+    ``EMBEDDINGS_MODEL_SYNC_S`` seconds (30 with the sync off) so writes skip
+    the mapping round trip. A model switch seen by ``sync_embeddings_model``
+    drops the cache, so writes follow a re-embed swap no later than queries.
+    Falls back to the active model when nothing is recorded or the mapping
+    cannot be read.
+    """
+
+    ttl = _model_sync_interval_s()
+    if ttl <= 0:
+        ttl = DEFAULT_MODEL_SYNC_S
+    now = time.monotonic()
+    cached = _write_models.get(index)
+    if cached is None or now - cached[1] >= ttl:
+        try:
+            recorded = indexed_embeddings_model(es, index)
+        except Exception as exc:
+            logging.debug("Write model check for %s skipped: %s", index, exc)
+            return (cached[0] if cached else None) or embeddings.MODEL
+        cached = _write_models[index] = (recorded, now)
+    return cached[0] or embeddings.MODEL
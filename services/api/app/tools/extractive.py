@@ -0,0 +1,136 @@
+"""Extractive summaries: pick the snippet sentences closest to the query.
+
+Used by ``LLM_PROVIDER=extractive`` as a no-LLM answer mode. Sentences are
+embedded with the regular embedding model (KB sentences are static, so their
+vectors are kept in a small LRU), scored by cosine similarity to the query and
+picked greedily under a character budget. Each picked sentence keeps the
+``[n]`` index of the snippet it came from.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.tools import embeddings
+from app.tools.language import normalize_language_code
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+_MARKDOWN_PREFIX = re.compile(r"^\s*(?:#{1,6}\s+|[-*+]\s+|\d+[.)]\s+|>\s*)")
+_MIN_SENTENCE_CHARS = 12
+
+_VECTOR_CACHE_SIZE = 4096
+# Keyed by (embedding model, sentence)
+_vector_cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences and list items with markdown markers removed; headings dropped."""
+
+    sentences: List[str] = []
+    for line in (text or "").splitlines():
+        if line.lstrip().startswith("#"):
+            continue
+        for raw in _SENTENCE_SPLIT.split(line):
+            sentence = _MARKDOWN_PREFIX.sub("", raw).strip()
+            if len(sentence) >= _MIN_SENTENCE_CHARS:
+                sentences.append(sentence)
+    return sentences
+
+
+def _sentence_vectors(sentences: Sequence[str]) -> np.ndarray:
+    model = embeddings.MODEL
+    unique = list(dict.fromkeys(sentences))
+    with _cache_lock:
+        found = {
+            s: _vector_cache[(model, s)] for s in unique if (model, s) in _vector_cache
+        }
+        for s in found:
+            _vector_cache.move_to_end((model, s))
+    missing = [s for s in unique if s not in found]
+    if missing:
+        fresh = [_unit(v) for v in embeddings.embed(missing)]
+        found.update(zip(missing, fresh))
+        with _cache_lock:
+            for sentence, vector in zip(missing, fresh):
+                _vector_cache[(model, sentence)] = vector
+            while len(_vector_cache) > _VECTOR_CACHE_SIZE:
+                _vector_cache.popitem(last=False)
+    return np.vstack([found[s] for s in sentences])
+
+
+def _unit(vector: Sequence[float]) -> np.ndarray:
+    arr = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(arr))
+    return arr / norm if norm else arr
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _vector_cache.clear()
+
+
+def summarize(
+    query: str,
+    snippets: Sequence[dict],
+    max_chars: int = 600,
+    max_sentences: int = 4,
+    language: Optional[str] = None,
+) -> List[Tuple[int, str]]:
+    """Pick up to ``max_sentences`` sentences (``max_chars`` total) for ``query``.
+
+    Returns ``(n, sentence)`` pairs where ``n`` is the 1-based snippet index,
+    in snippet order and then reading order. When some snippets are in
+    ``language``, only those are used.
+    """
+
+    preferred = normalize_language_code(language) if language else None
+    indexed = list(enumerate(snippets, start=1))
+    if preferred:
+        in_language = [
+            (idx, snip)
+            for idx, snip in indexed
+            if normalize_language_code(str(snip.get("language") or "")) == preferred
+        ]
+        indexed = in_language or indexed
+
+    candidates: List[Tuple[int, int, str]] = []
+    seen: set[str] = set()
+    for idx, snip in indexed:
+        for pos, sentence in enumerate(split_sentences(str(snip.get("text", "")))):
+            key = sentence.casefold()
+            if key in seen:
+                continue
+            seen.add(key)
+            candidates.append((idx, pos, sentence))
+    if not candidates or not query.strip():
+        return []
+
+    query_vec = _unit(embeddings.embed([query])[0])
+    vectors = _sentence_vectors([c[2] for c in candidates])
+    scores = vectors @ query_vec if vectors.shape[1] == query_vec.shape[0] else None
+    if scores is None:
+        return []
+
+    picked: List[Tuple[int, int, str]] = []
+    used = 0
+    for i in np.argsort(-scores, kind="stable"):
+        idx, pos, sentence = candidates[int(i)]
+        # The best sentence is always kept, even if it alone exceeds the budget
+        if used + len(sentence) > max_chars and picked:
+            continue
+        picked.append((idx, pos, sentence))
+        used += len(sentence)
+        if len(picked) >= max_sentences:
+            break
+
+    picked.sort()
+    return [(idx, sentence) for idx, _, sentence in picked]
+
+
+__all__ = ["clear_cache", "split_sentences", "summarize"]
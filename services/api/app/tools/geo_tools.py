@@ -1,11 +1,14 @@
 from typing import Dict, Any
 from app.config import settings
 from app.tools.embeddings import embed
+from app.tools.es_client import knn_clause
+from app.tools.spans import span
 
 
 # Very simple provider search using semantic + optional geo bounding box
 
 
+@span("search_providers")
 def search_providers(
     es_client,
     query: str,
@@ -15,12 +18,7 @@ def search_providers(
 ) -> list[Dict[str, Any]]:
     es = es_client
     vector = embed([query])[0]
-    knn = {
-        "field": "embedding",
-        "query_vector": vector,
-        "k": 10,
-        "num_candidates": 50,
-    }
+    knn = knn_clause("places", vector)
     must = []
     if lat is not None and lon is not None:
         must.append(
@@ -35,7 +33,7 @@ def search_providers(
         "knn": knn,
         "query": {"bool": {"must": must}} if must else {"match_all": {}},
         "_source": {"excludes": ["embedding"]},
-        "size": 10,
+        "size": knn["k"],
     }
     res = es.search(index=settings.es_places_index, body=body)
     return [hit["_source"] | {"_score": hit["_score"]} for hit in res["hits"]["hits"]]
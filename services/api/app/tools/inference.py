@@ -0,0 +1,318 @@
+"""Bounded, priority-aware scheduling for CPU inference.
+
+Every model (``embed``, ``risk_ml``, ``ollama``) gets a fixed number of slots.
+Callers wait for a free slot in priority order (interactive API traffic before
+batch jobs before ingest), FIFO within a class, so a burst of requests queues
+instead of oversubscribing torch threads. Priority travels in a context var, so
+it follows graph nodes into LangGraph's executor threads. A caller with a
+deadline passes ``timeout`` and gets ``SlotTimeout`` instead of waiting on.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, Iterator, List, Tuple
+
+from app.tools import metrics
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITY_INGEST = "ingest"
+_PRIORITY_RANK = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 1, PRIORITY_INGEST: 2}
+
+# Models whose work runs on local torch threads (ollama runs out of process)
+TORCH_MODELS = ("embed", "risk_ml")
+_DEFAULT_SLOTS_SPEC = "embed:2,risk_ml:1,ollama:1"
+
+_priority_var: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "inference_priority", default=PRIORITY_BATCH
+)
+
+
+def set_priority(priority: str) -> contextvars.Token[str]:
+    if priority not in _PRIORITY_RANK:
+        raise ValueError(f"Unknown inference priority: {priority!r}")
+    return _priority_var.set(priority)
+
+
+def reset_priority(token: contextvars.Token[str]) -> None:
+    _priority_var.reset(token)
+
+
+def current_priority() -> str:
+    return _priority_var.get()
+
+
+@contextmanager
+def priority(name: str) -> Iterator[None]:
+    token = set_priority(name)
+    try:
+        yield
+    finally:
+        reset_priority(token)
+
+
+def _parse_slots(spec: str) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for part in (spec or "").split(","):
+        if ":" not in part:
+            continue
+        name, raw = part.split(":", 1)
+        try:
+            slots = int(raw)
+        except ValueError:
+            logger.warning("Invalid slot count in INFERENCE_SLOTS: %s", part)
+            continue
+        if name.strip() and slots > 0:
+            out[name.strip()] = slots
+    return out
+
+
+class SlotTimeout(TimeoutError):
+    """No slot of the model freed up within the caller's timeout."""
+
+
+class _ModelQueue:
+    def __init__(self, name: str, slots: int) -> None:
+        self.name = name
+        self.slots = slots
+        self._free = slots
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._run_ms = 0.0
+        self._batch_items = 0
+
+    def acquire(self, prio: str, timeout: float | None = None) -> float:
+        ticket = (_PRIORITY_RANK[prio], next(self._seq))
+        start = perf_counter()
+        deadline = None if timeout is None else start + timeout
+        with self._cond:
+            heapq.heappush(self._heap, ticket)
+            granted = False
+            try:
+                while self._free <= 0 or self._heap[0] != ticket:
+                    if deadline is None:
+                        self._cond.wait()
+                        continue
+                    remaining = deadline - perf_counter()
+                    if remaining <= 0:
+                        raise SlotTimeout(
+                            f"No {self.name} slot free within {timeout:.3f}s"
+                        )
+                    self._cond.wait(remaining)
+                heapq.heappop(self._heap)
+                self._free -= 1
+                granted = True
+            finally:
+                # A waiter that gives up (timeout, KeyboardInterrupt) must not
+                # leave its ticket at the head and block everyone behind it
+                if not granted and ticket in self._heap:
+                    self._heap.remove(ticket)
+                    heapq.heapify(self._heap)
+                    self._cond.notify_all()
+            wait_ms = (perf_counter() - start) * 1000.0
+            stats = self._stats.setdefault(
+                prio, {"count": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+            )
+            stats["count"] += 1
+            stats["wait_ms_total"] += wait_ms
+            stats["wait_ms_max"] = max(stats["wait_ms_max"], wait_ms)
+            # The next waiter may also fit if more than one slot is free
+            self._cond.notify_all()
+        return wait_ms
+
+    def release(self, run_ms: float, batch_size: int) -> None:
+        with self._cond:
+            self._free += 1
+            self._run_ms += run_ms
+            self._batch_items += batch_size
+            self._cond.notify_all()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            by_priority = {
+                prio: {
+                    "count": int(s["count"]),
+                    "wait_ms_avg": (
+                        s["wait_ms_total"] / s["count"] if s["count"] else 0.0
+                    ),
+                    "wait_ms_max": s["wait_ms_max"],
+                }
+                for prio, s in self._stats.items()
+            }
+            calls = sum(int(s["count"]) for s in self._stats.values())
+            return {
+                "slots": self.slots,
+                "in_use": self.slots - self._free,
+                "queued": len(self._heap),
+                "calls": calls,
+                "run_ms_total": self._run_ms,
+                "batch_items": self._batch_items,
+                "by_priority": by_priority,
+            }
+
+
+class InferenceScheduler:
+    def __init__(
+        self, slots: Dict[str, int] | None = None, torch_threads: int | None = None
+    ) -> None:
+        self._slots = dict(slots or {})
+        self._queues: Dict[str, _ModelQueue] = {}
+        self._lock = threading.Lock()
+        self._torch_threads = torch_threads
+        self._torch_configured = False
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self._queues.get(model)
+        if queue is None:
+            with self._lock:
+                queue = self._queues.get(model)
+                if queue is None:
+                    queue = _ModelQueue(model, self._slots.get(model, 1))
+                    self._queues[model] = queue
+        return queue
+
+    def torch_threads(self) -> int:
+        """Torch intra-op thread count: CPUs divided by all torch slots.
+
+        ``torch.set_num_threads`` is process-wide, not per slot. Each running
+        call parallelises over that many threads, so with every torch slot
+        busy the calls together roughly fill the CPUs without oversubscribing.
+        """
+
+        if self._torch_threads:
+            return self._torch_threads
+        torch_slots = sum(self._slots.get(m, 1) for m in TORCH_MODELS)
+        return max(1, (os.cpu_count() or 1) // max(torch_slots, 1))
+
+    def _configure_torch(self) -> None:
+        if self._torch_configured:
+            return
+        torch = sys.modules.get("torch")
+        if torch is None:
+            return
+        threads = self.torch_threads()
+        try:
+            torch.set_num_threads(threads)
+        except Exception as exc:  # pragma: no cover - depends on torch build
+            logger.warning("Could not set torch threads: %s", exc)
+        else:
+            logger.info("Torch intra-op threads set to %d (process-wide)", threads)
+        self._torch_configured = True
+
+    def pin_torch_threads(self, threads: int) -> None:
+        """Set torch's thread count now and keep ``slot`` from changing it.
+
+        The pre-fork master pins one thread so its warm-up encodes never start
+        an intra-op pool that forked workers would inherit without its threads.
+        """
+
+        try:
+            import torch
+        except ImportError:  # pragma: no cover - torch ships with the models
+            pass
+        else:
+            torch.set_num_threads(threads)
+        self._torch_configured = True
+
+    def reset_torch(self) -> None:
+        """Let the next torch slot size the thread count again (after a fork)."""
+
+        self._torch_configured = False
+
+    @contextmanager
+    def slot(
+        self, model: str, batch_size: int = 1, timeout: float | None = None
+    ) -> Iterator[float]:
+        """Hold one slot of ``model`` for the duration of the block.
+
+        Yields the time spent queued, in milliseconds. Raises ``SlotTimeout``
+        if no slot frees up within ``timeout`` seconds (``None`` waits on).
+        """
+
+        if model in TORCH_MODELS:
+            self._configure_torch()
+        queue = self._queue(model)
+        wait_ms = queue.acquire(current_priority(), timeout)
+        start = perf_counter()
+        try:
+            yield wait_ms
+        finally:
+            run_s = perf_counter() - start
+            queue.release(run_s * 1000.0, batch_size)
+            metrics.inference_wait.observe(wait_ms / 1000.0, model)
+            metrics.inference_duration.observe(run_s, model)
+            metrics.inference_batch.observe(batch_size, model)
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            queues = list(self._queues.values())
+        return {q.name: q.snapshot() for q in queues}
+
+
+def _torch_threads_from_env() -> int | None:
+    raw = os.getenv("INFERENCE_TORCH_THREADS", "").strip()
+    try:
+        value = int(raw)
+    except ValueError:
+        return None
+    return value if value > 0 else None
+
+
+scheduler = InferenceScheduler(
+    _parse_slots(os.getenv("INFERENCE_SLOTS", _DEFAULT_SLOTS_SPEC)),
+    _torch_threads_from_env(),
+)
+
+
+def _slot_gauges(field: str) -> List[Tuple[Tuple[str, ...], float]]:
+    return [((name,), stats[field]) for name, stats in scheduler.stats().items()]
+
+
+metrics.collected(
+    "inference_slots_in_use",
+    "Inference slots currently held.",
+    "gauge",
+    ("model",),
+    lambda: _slot_gauges("in_use"),
+)
+metrics.collected(
+    "inference_queued",
+    "Callers waiting for an inference slot.",
+    "gauge",
+    ("model",),
+    lambda: _slot_gauges("queued"),
+)
+
+
+def slot(model: str, batch_size: int = 1, timeout: float | None = None):
+    """Module-level shortcut for ``scheduler.slot``."""
+
+    return scheduler.slot(model, batch_size=batch_size, timeout=timeout)
+
+
+__all__ = [
+    "PRIORITY_INTERACTIVE",
+    "PRIORITY_BATCH",
+    "PRIORITY_INGEST",
+    "InferenceScheduler",
+    "SlotTimeout",
+    "current_priority",
+    "priority",
+    "reset_priority",
+    "scheduler",
+    "set_priority",
+    "slot",
+]
@@ -0,0 +1,387 @@
+"""Streaming, batched ingest into Elasticsearch.
+
+Scripts yield ``(action, text)`` pairs from a generator; ``run`` embeds the
+texts with ``app.tools.embeddings`` in length-sorted batches (similar lengths
+pad less) under the ``ingest`` inference priority, attaches the vectors and
+writes with ``helpers.parallel_bulk``. Only a bounded window of records is held
+in memory at once, so a 100k-record provider directory streams with flat
+memory. ``run`` returns throughput and peak RSS for the log line.
+
+Re-ingest is incremental: every document stores a ``content_hash`` of its
+source fields, text and embedding model. Existing hashes are fetched with
+``mget`` a window at a time, unchanged documents are skipped before embedding,
+and with ``prune_index`` set, documents whose source disappeared are deleted,
+so a refresh costs time proportional to the diff rather than the corpus.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from elasticsearch import NotFoundError, helpers
+
+from app.tools import embeddings, es_client, inference
+
+logger = logging.getLogger(__name__)
+
+Record = Tuple[Dict[str, Any], str]
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_THREADS = 4
+# Records buffered per length-sorting window, in embedding batches
+_WINDOW_BATCHES = 16
+# Ids per mget when looking up stored hashes
+_LOOKUP_WINDOW = 500
+
+HASH_FIELD = "content_hash"
+# Not part of the content: derived, or bookkeeping that changes every run
+_UNHASHED_FIELDS = {"embedding", HASH_FIELD, "updated_on"}
+
+
+@dataclass
+class IngestStats:
+    docs: int = 0
+    errors: int = 0
+    skipped: int = 0
+    deleted: int = 0
+    seconds: float = 0.0
+    peak_rss_mb: Optional[float] = None
+
+    @property
+    def docs_per_s(self) -> float:
+        return self.docs / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        rss = f"{self.peak_rss_mb:.0f} MB" if self.peak_rss_mb is not None else "n/a"
+        return (
+            f"{self.docs} docs ({self.errors} errors, {self.skipped} unchanged, "
+            f"{self.deleted} deleted) in {self.seconds:.1f}s, "
+            f"{self.docs_per_s:.0f} docs/s, peak RSS {rss}"
+        )
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, str(default))))
+    except ValueError:
+        logger.warning("Invalid %s; using %s", name, default)
+        return default
+
+
+def default_batch_size() -> int:
+    return _env_int("INGEST_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "false").strip().lower() == "true"
+
+
+def memory_text(source: Dict[str, Any]) -> str:
+    return str(source.get("name") or "")
+
+
+def public_text(source: Dict[str, Any]) -> str:
+    return "\n".join(
+        str(p)
+        for p in (source.get("title"), source.get("heading"), source.get("text"))
+        if p
+    )
+
+
+def places_text(source: Dict[str, Any]) -> str:
+    return (
+        f"{source.get('name', '')} {source.get('kind', '')} "
+        f"{' '.join(source.get('services', []))} {source.get('hours', '')}"
+    )
+
+
+# What each index kind embeds, so a re-embed job can rebuild vectors from _source
+EMBED_TEXT = {"private": memory_text, "public": public_text, "places": places_text}
+
+
+def content_hash(source: Dict[str, Any], text: str, model: Optional[str] = None) -> str:
+    """Hash of what the indexed document is built from, including the model."""
+
+    payload = {k: v for k, v in source.items() if k not in _UNHASHED_FIELDS}
+    raw = json.dumps(
+        [payload, text, model or embeddings.MODEL],
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _stored_hashes(es: Any, index: str, ids: List[str]) -> Dict[str, str]:
+    try:
+        resp = es.mget(index=index, ids=ids, source_includes=[HASH_FIELD])
+    except NotFoundError:
+        # First run: the index does not exist yet
+        return {}
+    return {
+        doc["_id"]: doc["_source"][HASH_FIELD]
+        for doc in resp["docs"]
+        if doc.get("found") and HASH_FIELD in (doc.get("_source") or {})
+    }
+
+
+def changed_records(
+    es: Any,
+    records: Iterable[Record],
+    stats: IngestStats,
+    seen: Dict[str, Set[str]],
+    force: bool = False,
+) -> Iterator[Record]:
+    """Stamp ``content_hash`` on each record and drop ones already indexed as-is.
+
+    Every record id is added to ``seen`` (per index), changed or not, so the
+    caller can prune documents that no longer have a source.
+    """
+
+    it = iter(records)
+    while True:
+        window = list(islice(it, _LOOKUP_WINDOW))
+        if not window:
+            return
+        by_index: Dict[str, List[str]] = {}
+        for action, text in window:
+            action["_source"][HASH_FIELD] = content_hash(action["_source"], text)
+            by_index.setdefault(action["_index"], []).append(action["_id"])
+            seen.setdefault(action["_index"], set()).add(action["_id"])
+        stored: Dict[Tuple[str, str], str] = {}
+        if not force:
+            for index, ids in by_index.items():
+                for doc_id, value in _stored_hashes(es, index, ids).items():
+                    stored[(index, doc_id)] = value
+        for action, text in window:
+            key = (action["_index"], action["_id"])
+            if stored.get(key) == action["_source"][HASH_FIELD]:
+                stats.skipped += 1
+                continue
+            yield action, text
+
+
+def _delete_action(index: str, hit: Dict[str, Any]) -> Dict[str, Any]:
+    action = {"_op_type": "delete", "_index": index, "_id": hit["_id"]}
+    if hit.get("_routing") is not None:
+        # Routed documents (private memory) can only be deleted with their routing
+        action["routing"] = hit["_routing"]
+    return action
+
+
+def prune(es: Any, index: str, keep: Set[str]) -> int:
+    """Delete documents in ``index`` whose id is not in ``keep``."""
+
+    stale = (
+        _delete_action(index, hit)
+        for hit in helpers.scan(
+            es, index=index, query={"query": {"match_all": {}}}, source=False
+        )
+        if hit["_id"] not in keep
+    )
+    deleted, _ = helpers.bulk(es, stale, raise_on_error=False, stats_only=True)
+    return int(deleted)
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # pragma: no cover - non-POSIX
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def embed_records(
+    records: Iterable[Record],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    model: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Yield bulk actions with ``_source.embedding`` filled in.
+
+    Records are read a window at a time and sorted by text length before
+    batching, so output order differs from input order within a window.
+    ``model`` defaults to the active embeddings model.
+    """
+
+    expected = embeddings.VEC_DIMS if model is None else embeddings.dims(model)
+    it = iter(records)
+    while True:
+        window = list(islice(it, batch_size * _WINDOW_BATCHES))
+        if not window:
+            return
+        window.sort(key=lambda record: len(record[1]))
+        for start in range(0, len(window), batch_size):
+            batch = window[start : start + batch_size]
+            # Set here rather than around the bulk call: parallel_bulk pulls
+            # from this generator on its own task-feeding thread
+            texts = [text for _, text in batch]
+            with inference.priority(inference.PRIORITY_INGEST):
+                if model is None:
+                    vectors = embeddings.embed(texts)
+                else:
+                    vectors = embeddings.embed(texts, model=model)
+            for (action, _), vector in zip(batch, vectors):
+                if len(vector) != expected:
+                    raise ValueError(
+                        f"Embedding has {len(vector)} dims, expected {expected}"
+                    )
+                action["_source"]["embedding"] = [float(x) for x in vector]
+                yield action
+
+
+def write(
+    es: Any,
+    actions: Iterable[Dict[str, Any]],
+    stats: IngestStats,
+    *,
+    chunk_size: Optional[int] = None,
+    threads: Optional[int] = None,
+) -> None:
+    """Bulk-write ``actions`` with ``parallel_bulk``, counting into ``stats``."""
+
+    chunk_size = chunk_size or _env_int("INGEST_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    threads = threads or _env_int("INGEST_THREADS", DEFAULT_THREADS)
+    errors: List[Dict[str, Any]] = []
+    for ok, item in helpers.parallel_bulk(
+        es,
+        actions,
+        thread_count=threads,
+        chunk_size=chunk_size,
+        raise_on_error=False,
+    ):
+        if ok:
+            stats.docs += 1
+        else:
+            stats.errors += 1
+            if len(errors) < 5:
+                errors.append(item)
+    for item in errors:
+        logger.warning("Bulk item failed: %s", item)
+
+
+def apply_index_settings(es: Any, index: str, phase: str) -> bool:
+    """Switch ``index`` to the ``phase`` settings; False (logged) if that fails."""
+
+    try:
+        es.indices.put_settings(
+            index=index, settings=es_client.dynamic_index_settings(phase)
+        )
+    except Exception as exc:
+        logger.warning("Could not apply %s settings to %s: %s", phase, index, exc)
+        return False
+    return True
+
+
+def is_fresh(es: Any, index: str) -> bool:
+    """True for a concrete index with no documents yet, so nothing serves from it.
+
+    An alias, or an index that already holds documents, is live; any doubt
+    (missing index, ES error) counts as live too.
+    """
+
+    try:
+        if es.indices.exists_alias(name=index):
+            return False
+        return int(es.count(index=index)["count"]) == 0
+    except Exception as exc:
+        logger.warning("Could not inspect %s; treating it as live: %s", index, exc)
+        return False
+
+
+@contextmanager
+def ingest_settings(es: Any, index: str) -> Iterator[None]:
+    """Bulk-load settings (no refresh, fewer replicas) for the ``with`` body.
+
+    Only a fresh target gets them (see ``is_fresh``): an incremental run into
+    the live index keeps its replicas and refresh interval, so it stays
+    redundant and user writes stay visible. Serving settings are restored and
+    the index refreshed on exit, also when the body fails, so a crashed ingest
+    never leaves an unrefreshed index.
+    """
+
+    applied = is_fresh(es, index) and apply_index_settings(es, index, "ingest")
+    try:
+        yield
+    finally:
+        if applied:
+            apply_index_settings(es, index, "serving")
+        es.indices.refresh(index=index)
+
+
+def run(
+    es: Any,
+    records: Iterable[Record],
+    *,
+    batch_size: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    threads: Optional[int] = None,
+    force: Optional[bool] = None,
+    prune_index: Optional[str] = None,
+) -> IngestStats:
+    """Embed and bulk-index changed ``records``; failed items are logged, not raised.
+
+    Defaults come from ``INGEST_BATCH_SIZE`` (texts per embedding call),
+    ``INGEST_CHUNK_SIZE`` (actions per bulk request), ``INGEST_THREADS``
+    (concurrent bulk requests) and ``INGEST_FORCE`` (re-embed everything).
+    With ``prune_index``, documents in that index that no record produced
+    are deleted afterwards.
+    """
+
+    batch_size = batch_size or default_batch_size()
+    if force is None:
+        force = _env_flag("INGEST_FORCE")
+
+    stats = IngestStats()
+    seen: Dict[str, Set[str]] = {}
+    started = time.perf_counter()
+    changed = changed_records(es, records, stats, seen, force=force)
+    write(
+        es,
+        embed_records(changed, batch_size),
+        stats,
+        chunk_size=chunk_size,
+        threads=threads,
+    )
+    if prune_index:
+        if seen.get(prune_index):
+            stats.deleted = prune(es, prune_index, seen[prune_index])
+        else:
+            # An empty or missing source is more likely a mistake than a wipe
+            logger.warning("No records for %s; skipping prune", prune_index)
+    stats.seconds = time.perf_counter() - started
+    stats.peak_rss_mb = peak_rss_mb()
+    return stats
+
+
+__all__ = [
+    "EMBED_TEXT",
+    "HASH_FIELD",
+    "IngestStats",
+    "Record",
+    "apply_index_settings",
+    "changed_records",
+    "content_hash",
+    "default_batch_size",
+    "embed_records",
+    "ingest_settings",
+    "is_fresh",
+    "memory_text",
+    "peak_rss_mb",
+    "places_text",
+    "prune",
+    "public_text",
+    "run",
+    "write",
+]
@@ -0,0 +1,167 @@
+"""Constant-memory readers for seed files.
+
+Seed files can be JSONL (``.jsonl``/``.ndjson``) or plain JSON, optionally
+gzip-compressed (``.gz``). JSONL is read a line at a time; a top-level JSON
+array or object is decoded incrementally with ``json.JSONDecoder.raw_decode``
+over fixed-size chunks, so only the current element is held in memory however
+large the file is.
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+from typing import IO, Any, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 16
+_JSONL_SUFFIXES = (".jsonl", ".ndjson")
+_WHITESPACE = " \t\r\n"
+_decoder = json.JSONDecoder()
+
+
+def open_text(path: str) -> IO[str]:
+    """Open ``path`` for reading text, transparently un-gzipping ``.gz`` files."""
+
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def is_jsonl(path: str) -> bool:
+    base = path[:-3] if path.endswith(".gz") else path
+    return base.endswith(_JSONL_SUFFIXES)
+
+
+def iter_jsonl(handle: IO[str]) -> Iterator[Any]:
+    """Decoded lines; blank lines are skipped and malformed ones logged and skipped."""
+
+    for lineno, line in enumerate(handle, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as exc:
+            logger.warning("Skipping malformed JSONL line %d: %s", lineno, exc)
+
+
+class _Reader:
+    """Chunked buffer with just enough lookahead for ``raw_decode``."""
+
+    def __init__(self, handle: IO[str], chunk_size: int) -> None:
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.handle.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop consumed text so the buffer stays about one element long
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character, or "" at end of input."""
+
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise json.JSONDecodeError(
+                f"Expecting {char!r}, found {found or 'end of input'!r}",
+                self.buf,
+                self.pos,
+            )
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next chunk
+            if end < len(self.buf) or not self._fill():
+                self.pos = end
+                return value
+
+
+def _iter_container(reader: _Reader, open_char: str, close_char: str) -> Iterator[None]:
+    """Position ``reader`` at each member of a JSON array/object in turn."""
+
+    reader.expect(open_char)
+    if reader.peek() == close_char:
+        reader.pos += 1
+        return
+    while True:
+        yield
+        if reader.peek() == ",":
+            reader.pos += 1
+            continue
+        reader.expect(close_char)
+        return
+
+
+def iter_json_array(handle: IO[str], chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """Elements of a top-level JSON array, one at a time."""
+
+    reader = _Reader(handle, chunk_size)
+    for _ in _iter_container(reader, "[", "]"):
+        yield reader.value()
+
+
+def iter_json_object(
+    handle: IO[str], chunk_size: int = CHUNK_SIZE
+) -> Iterator[Tuple[str, Any]]:
+    """``(key, value)`` members of a top-level JSON object, one at a time."""
+
+    reader = _Reader(handle, chunk_size)
+    for _ in _iter_container(reader, "{", "}"):
+        key = reader.value()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError(
+                "Expecting property name", reader.buf, reader.pos
+            )
+        reader.expect(":")
+        yield key, reader.value()
+
+
+def iter_records(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """Records from a JSONL file or a top-level JSON array (``.gz`` allowed)."""
+
+    with open_text(path) as handle:
+        if is_jsonl(path):
+            yield from iter_jsonl(handle)
+        else:
+            yield from iter_json_array(handle, chunk_size)
+
+
+__all__ = [
+    "CHUNK_SIZE",
+    "is_jsonl",
+    "iter_json_array",
+    "iter_json_object",
+    "iter_jsonl",
+    "iter_records",
+    "open_text",
+]
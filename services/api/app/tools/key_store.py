@@ -0,0 +1,402 @@
+"""Storage for the per-user Fernet keys behind ``app.tools.crypto``.
+
+``KEY_STORE`` picks the backend:
+
+* ``file`` (default): one ``<user_id>.key`` file per user under
+  ``data_dir/keys`` (or ``KEY_STORE_PATH``). The id is percent-encoded into
+  the file name, so ids with ``/``, ``:`` or ``@`` stay one file inside the
+  directory; plain ids keep their name. Keys written under a raw id before
+  encoding are still found.
+* ``sqlite``: a single SQLite file (``data_dir/keys.db`` or ``KEY_STORE_PATH``)
+  with every user key wrapped (Fernet-encrypted) under a master key, so
+  millions of users cost one file instead of millions of inodes. The master
+  key comes from ``KEY_STORE_MASTER_KEY``, a comma-separated list of Fernet
+  keys where the first wraps and all unwrap (for rotation). Without it a
+  master key is generated into ``data_dir/master.key``.
+
+Either way every user keeps their own key. Each store also keeps an LRU of
+ready-made ``Fernet`` instances (``KEY_CACHE_SIZE``, default 1024), so hot
+users cost no I/O per encrypt/decrypt. A cached cipher is checked against the
+store again once it is ``KEY_CACHE_TTL_S`` seconds old (default 5), so a key
+deleted by another worker stops being used within that window.
+``scripts/migrate_key_store.py`` copies a per-file layout into SQLite.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from cryptography.fernet import Fernet, MultiFernet  # type: ignore[import-not-found]
+
+from app.config import settings
+from app.tools.metrics import cache_lookups
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("file", "sqlite")
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL_S = 5.0
+
+
+def _cache_size() -> int:
+    try:
+        return max(0, int(os.getenv("KEY_CACHE_SIZE", str(DEFAULT_CACHE_SIZE))))
+    except ValueError:
+        logger.warning("Invalid KEY_CACHE_SIZE; using %s", DEFAULT_CACHE_SIZE)
+        return DEFAULT_CACHE_SIZE
+
+
+def _cache_ttl_s() -> float:
+    try:
+        return max(0.0, float(os.getenv("KEY_CACHE_TTL_S", str(DEFAULT_CACHE_TTL_S))))
+    except ValueError:
+        logger.warning("Invalid KEY_CACHE_TTL_S; using %s", DEFAULT_CACHE_TTL_S)
+        return DEFAULT_CACHE_TTL_S
+
+
+def _write_private(path: Path, data: bytes) -> bool:
+    """Create ``path`` with ``data`` unless it exists; chmod 600 best-effort."""
+
+    try:
+        with open(path, "xb") as f:
+            f.write(data)
+    except FileExistsError:
+        return False
+    try:
+        os.chmod(path, 0o600)
+    except OSError as e:
+        logger.warning("Failed to set permissions on key file %s: %s", path, e)
+    return True
+
+
+class KeyStore(ABC):
+    """Per-user keys plus an LRU of their ciphers; backends implement the I/O."""
+
+    def __init__(
+        self, cache_size: Optional[int] = None, cache_ttl_s: Optional[float] = None
+    ) -> None:
+        self.cache_size = _cache_size() if cache_size is None else cache_size
+        self.cache_ttl_s = _cache_ttl_s() if cache_ttl_s is None else cache_ttl_s
+        # user_id -> (cipher, key, monotonic time the key was last read)
+        self._ciphers: "OrderedDict[str, Tuple[Fernet, bytes, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every delete, so a miss that read a key before the delete
+        # does not cache it afterwards
+        self._deletes = 0
+
+    @abstractmethod
+    def get(self, user_id: str) -> Optional[bytes]: ...
+
+    @abstractmethod
+    def add(self, user_id: str, key: bytes) -> bytes:
+        """Store ``key`` unless the user has one; returns the stored key."""
+
+    @abstractmethod
+    def _remove(self, user_id: str) -> bool: ...
+
+    @abstractmethod
+    def users(self) -> Iterator[str]: ...
+
+    def ensure(self, user_id: str) -> bytes:
+        key = self.get(user_id)
+        if key is None:
+            # Concurrent creators all end up with whichever key was stored first
+            key = self.add(user_id, Fernet.generate_key())
+        return key
+
+    def delete(self, user_id: str) -> bool:
+        # Remove first: evicting first would let a concurrent cipher() re-read
+        # and re-cache the key before it is gone
+        removed = self._remove(user_id)
+        with self._lock:
+            self._ciphers.pop(user_id, None)
+            self._deletes += 1
+        return removed
+
+    def _cached(self, user_id: str) -> Optional[Fernet]:
+        with self._lock:
+            entry = self._ciphers.get(user_id)
+            if entry is not None:
+                self._ciphers.move_to_end(user_id)
+        if entry is None:
+            return None
+        cipher, key, checked = entry
+        now = time.monotonic()
+        if now - checked < self.cache_ttl_s:
+            return cipher
+        # Stale: another worker may have deleted (and recreated) the key
+        if self.get(user_id) != key:
+            with self._lock:
+                if self._ciphers.get(user_id) is entry:
+                    del self._ciphers[user_id]
+            return None
+        with self._lock:
+            if self._ciphers.get(user_id) is entry:
+                self._ciphers[user_id] = (cipher, key, now)
+        return cipher
+
+    def cipher(self, user_id: str) -> Fernet:
+        cipher = self._cached(user_id)
+        if cipher is not None:
+            cache_lookups.inc("key_cipher", "hit")
+            return cipher
+        cache_lookups.inc("key_cipher", "miss")
+        with self._lock:
+            deletes = self._deletes
+        key = self.ensure(user_id)
+        cipher = Fernet(key)
+        if self.cache_size:
+            with self._lock:
+                if self._deletes == deletes:
+                    self._ciphers[user_id] = (cipher, key, time.monotonic())
+                    while len(self._ciphers) > self.cache_size:
+                        self._ciphers.popitem(last=False)
+        return cipher
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._ciphers.clear()
+
+
+class FileKeyStore(KeyStore):
+    """One key file per user (the original layout)."""
+
+    def __init__(
+        self,
+        directory: Path,
+        cache_size: Optional[int] = None,
+        cache_ttl_s: Optional[float] = None,
+    ) -> None:
+        super().__init__(cache_size, cache_ttl_s)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def key_path(self, user_id: str) -> Path:
+        # Encoding leaves no separator to escape the directory with
+        return self.directory / f"{quote(user_id, safe='')}.key"
+
+    def _legacy_path(self, user_id: str) -> Optional[Path]:
+        """The unencoded ``<user_id>.key`` of older stores, where it is distinct.
+
+        None when it equals ``key_path``, would leave the directory, or could
+        be another id's encoded name (the id contains ``%``).
+        """
+
+        path = self.directory / f"{user_id}.key"
+        if "%" in user_id or path == self.key_path(user_id):
+            return None
+        if path.resolve().parent != self.directory.resolve():
+            return None
+        return path
+
+    def _paths(self, user_id: str) -> List[Path]:
+        legacy = self._legacy_path(user_id)
+        return [self.key_path(user_id)] + ([legacy] if legacy else [])
+
+    def get(self, user_id: str) -> Optional[bytes]:
+        for path in self._paths(user_id):
+            try:
+                return path.read_bytes()
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        return None
+
+    def add(self, user_id: str, key: bytes) -> bytes:
+        if _write_private(self.key_path(user_id), key):
+            return key
+        return self.key_path(user_id).read_bytes()
+
+    def _remove(self, user_id: str) -> bool:
+        removed = False
+        for path in self._paths(user_id):
+            try:
+                path.unlink()
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            removed = True
+        return removed
+
+    def users(self) -> Iterator[str]:
+        for path in sorted(self.directory.glob("*.key")):
+            yield unquote(path.stem)
+
+
+def master_key(data_dir: Optional[str] = None) -> MultiFernet:
+    """``KEY_STORE_MASTER_KEY`` (first key wraps), else ``data_dir/master.key``."""
+
+    raw = os.getenv("KEY_STORE_MASTER_KEY", "").strip()
+    if raw:
+        keys = [k.strip().encode("utf-8") for k in raw.split(",") if k.strip()]
+    else:
+        path = Path(data_dir or settings.data_dir) / "master.key"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if _write_private(path, Fernet.generate_key()):
+            logger.warning(
+                "Generated %s; set KEY_STORE_MASTER_KEY to keep the master key "
+                "away from the key store",
+                path,
+            )
+        keys = [path.read_bytes().strip()]
+    return MultiFernet([Fernet(k) for k in keys])
+
+
+class SQLiteKeyStore(KeyStore):
+    """All user keys in one SQLite file, each wrapped under the master key."""
+
+    def __init__(
+        self,
+        path: Path,
+        master: MultiFernet,
+        cache_size: Optional[int] = None,
+        cache_ttl_s: Optional[float] = None,
+    ) -> None:
+        super().__init__(cache_size, cache_ttl_s)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.master = master
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(
+            str(self.path), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        # WAL lets API workers read while another process adds keys
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS user_keys "
+            "(user_id TEXT PRIMARY KEY, wrapped BLOB NOT NULL)"
+        )
+        try:
+            os.chmod(self.path, 0o600)
+        except OSError as e:
+            logger.warning(
+                "Failed to set permissions on key store %s: %s", self.path, e
+            )
+
+    def _wrapped(self, user_id: str) -> Optional[bytes]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT wrapped FROM user_keys WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def get(self, user_id: str) -> Optional[bytes]:
+        wrapped = self._wrapped(user_id)
+        return None if wrapped is None else self.master.decrypt(wrapped)
+
+    def add(self, user_id: str, key: bytes) -> bytes:
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO user_keys (user_id, wrapped) VALUES (?, ?)",
+                (user_id, self.master.encrypt(key)),
+            )
+        stored = self.get(user_id)
+        if stored is None:
+            # Only a delete racing this add can remove the row in between
+            raise RuntimeError(f"Key for user {user_id!r} was deleted while adding it")
+        return stored
+
+    def _remove(self, user_id: str) -> bool:
+        with self._db_lock:
+            cur = self._db.execute(
+                "DELETE FROM user_keys WHERE user_id = ?", (user_id,)
+            )
+        return cur.rowcount > 0
+
+    def users(self) -> Iterator[str]:
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT user_id FROM user_keys ORDER BY user_id"
+            ).fetchall()
+        for (user_id,) in rows:
+            yield user_id
+
+    def rewrap(self) -> int:
+        """Re-wrap every key under the current first master key (rotation)."""
+
+        with self._db_lock:
+            rows = self._db.execute("SELECT user_id, wrapped FROM user_keys").fetchall()
+            self._db.execute("BEGIN")
+            for user_id, wrapped in rows:
+                self._db.execute(
+                    "UPDATE user_keys SET wrapped = ? WHERE user_id = ?",
+                    (self.master.rotate(bytes(wrapped)), user_id),
+                )
+            self._db.execute("COMMIT")
+        return len(rows)
+
+    def close(self) -> None:
+        with self._db_lock:
+            self._db.close()
+
+
+def _location(backend: str) -> Path:
+    configured = os.getenv("KEY_STORE_PATH", "").strip()
+    if configured:
+        return Path(configured)
+    name = "keys.db" if backend == "sqlite" else "keys"
+    return Path(settings.data_dir) / name
+
+
+_stores: Dict[Tuple[str, str], KeyStore] = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(backend: str, path: Path) -> KeyStore:
+    if backend == "file":
+        return FileKeyStore(path)
+    if backend == "sqlite":
+        return SQLiteKeyStore(path, master_key())
+    raise ValueError(f"Unknown KEY_STORE {backend!r}; expected one of {BACKENDS}")
+
+
+def get_store() -> KeyStore:
+    """The configured store, one instance (and cipher cache) per location."""
+
+    backend = os.getenv("KEY_STORE", "file").strip().lower() or "file"
+    path = _location(backend)
+    with _stores_lock:
+        store = _stores.get((backend, str(path)))
+        if store is None:
+            store = open_store(backend, path)
+            _stores[(backend, str(path))] = store
+    return store
+
+
+def migrate(source: KeyStore, target: KeyStore, delete_source: bool = False) -> int:
+    """Copy every key from ``source`` into ``target``; returns keys copied.
+
+    Users already in ``target`` keep their key there; a mismatch is an error,
+    since data encrypted under either key would become unreadable.
+    """
+
+    copied = 0
+    for user_id in source.users():
+        key = source.get(user_id)
+        if key is None:
+            continue
+        if target.add(user_id, key) != key:
+            raise ValueError(f"{user_id} already has a different key in the target")
+        copied += 1
+        if delete_source:
+            source.delete(user_id)
+    return copied
+
+
+__all__ = [
+    "BACKENDS",
+    "FileKeyStore",
+    "KeyStore",
+    "SQLiteKeyStore",
+    "get_store",
+    "master_key",
+    "migrate",
+    "open_store",
+]
@@ -0,0 +1,279 @@
+"""Recall/latency measurement for kNN search parameters.
+
+Used by ``scripts/bench_knn.py`` (index types) and ``scripts/bench_knn_sweep.py``
+(``k``/``num_candidates``/similarity cutoffs). Recall@k is measured against an
+exact brute-force ranking (``script_score`` with ``cosineSimilarity`` over
+every document), so it reflects what the approximate HNSW search misses on the
+live data rather than relevance. Private-memory queries pass a ``user_id`` and
+are scoped the way the API scopes them (owner filter plus routing), for the
+exact ranking as well as the kNN search.
+"""
+
+from __future__ import annotations
+
+import math
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from app.tools import jsonstream
+from app.tools.es_client import user_routing
+from app.tools.memory_ttl import not_expired
+
+# Text fields of the query sets we replay (golden inputs, risk evals, ad-hoc)
+_QUERY_FIELDS = ("query", "text", "user_query")
+
+
+@dataclass
+class SweepResult:
+    index: str
+    k: int
+    num_candidates: int
+    similarity: Optional[float]
+    recall: float
+    hits_per_query: float
+    p50_ms: float
+    p95_ms: float
+
+    def row(self) -> str:
+        cutoff = "-" if self.similarity is None else f"{self.similarity:.2f}"
+        return (
+            f"{self.index:<24} {self.k:>3} {self.num_candidates:>5} {cutoff:>6} "
+            f"{self.recall:>7.3f} {self.hits_per_query:>6.1f} "
+            f"{self.p50_ms:>7.1f} {self.p95_ms:>7.1f}"
+        )
+
+
+HEADER = (
+    f"{'index':<24} {'k':>3} {'cands':>5} {'cutoff':>6} "
+    f"{'recall':>7} {'hits':>6} {'p50 ms':>7} {'p95 ms':>7}"
+)
+
+
+def load_queries(paths: Iterable[str], limit: Optional[int] = None) -> List[str]:
+    """Distinct query texts from JSONL/JSON files, in file order."""
+
+    seen: Dict[str, None] = {}
+    for path in paths:
+        for record in jsonstream.iter_records(path):
+            if not isinstance(record, dict):
+                continue
+            text = next(
+                (record[f] for f in _QUERY_FIELDS if isinstance(record.get(f), str)),
+                "",
+            ).strip()
+            if text:
+                seen.setdefault(text, None)
+    texts = list(seen)
+    return texts[:limit] if limit else texts
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile (``q`` in 0..100); 0.0 for no values."""
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _owned(user_id: str) -> Dict[str, Any]:
+    # Same filter the memory node puts on private reads
+    return {"bool": {"filter": [{"term": {"user_id": user_id}}, not_expired()]}}
+
+
+def _scope(user_id: Optional[str]) -> Dict[str, Any]:
+    return {} if user_id is None else {"routing": user_routing(user_id)}
+
+
+def _owners(user_ids: Optional[Sequence[str]], n: int) -> List[Optional[str]]:
+    return list(user_ids) if user_ids else [None] * n
+
+
+def sample_users(es: Any, index: str, limit: int = 50) -> List[str]:
+    """Up to ``limit`` user ids with the most documents in ``index``."""
+
+    res = es.search(
+        index=index,
+        size=0,
+        aggs={"users": {"terms": {"field": "user_id", "size": limit}}},
+    )
+    return [b["key"] for b in res["aggregations"]["users"]["buckets"]]
+
+
+def exact_ids(
+    es: Any,
+    index: str,
+    vector: List[float],
+    k: int,
+    user_id: Optional[str] = None,
+) -> List[str]:
+    """Ids of the true top-``k`` documents by cosine similarity.
+
+    With ``user_id`` only that user's unexpired documents are ranked.
+    """
+
+    candidates: Dict[str, Any] = {"exists": {"field": "embedding"}}
+    if user_id is not None:
+        candidates = {"bool": {"filter": [candidates, _owned(user_id)]}}
+    res = es.search(
+        index=index,
+        size=k,
+        source=False,
+        query={
+            "script_score": {
+                "query": candidates,
+                "script": {
+                    "source": "cosineSimilarity(params.q, 'embedding') + 1.0",
+                    "params": {"q": vector},
+                },
+            }
+        },
+        **_scope(user_id),
+    )
+    return [hit["_id"] for hit in res["hits"]["hits"]]
+
+
+def knn_ids(
+    es: Any,
+    index: str,
+    vector: List[float],
+    k: int,
+    num_candidates: int,
+    similarity: Optional[float] = None,
+    user_id: Optional[str] = None,
+) -> List[str]:
+    knn: Dict[str, Any] = {
+        "field": "embedding",
+        "query_vector": vector,
+        "k": k,
+        "num_candidates": num_candidates,
+    }
+    if similarity is not None:
+        knn["similarity"] = similarity
+    if user_id is not None:
+        knn["filter"] = _owned(user_id)
+    res = es.search(index=index, size=k, source=False, knn=knn, **_scope(user_id))
+    return [hit["_id"] for hit in res["hits"]["hits"]]
+
+
+def measure(
+    es: Any,
+    index: str,
+    vectors: Sequence[List[float]],
+    truth: Sequence[Sequence[str]],
+    k: int,
+    num_candidates: int,
+    similarity: Optional[float] = None,
+    repeat: int = 5,
+    user_ids: Optional[Sequence[str]] = None,
+) -> SweepResult:
+    """Recall@k against ``truth`` (exact top-k per query) and latency percentiles.
+
+    Latency is client-side wall time over ``repeat`` runs per query, after one
+    untimed run that also supplies the recall. ``user_ids`` scopes each query
+    to its user and must match the scoping ``truth`` was computed with.
+    """
+
+    found = 0
+    returned = 0
+    expected = 0
+    timings: List[float] = []
+    owners = _owners(user_ids, len(vectors))
+    for vector, true_ids, user_id in zip(vectors, truth, owners):
+        ids = knn_ids(es, index, vector, k, num_candidates, similarity, user_id)
+        top = set(true_ids[:k])
+        found += len(set(ids) & top)
+        returned += len(ids)
+        expected += len(top)
+        for _ in range(repeat):
+            started = time.perf_counter()
+            knn_ids(es, index, vector, k, num_candidates, similarity, user_id)
+            timings.append((time.perf_counter() - started) * 1000)
+    return SweepResult(
+        index=index,
+        k=k,
+        num_candidates=num_candidates,
+        similarity=similarity,
+        recall=found / expected if expected else 0.0,
+        hits_per_query=returned / len(vectors) if vectors else 0.0,
+        p50_ms=percentile(timings, 50),
+        p95_ms=percentile(timings, 95),
+    )
+
+
+def sweep(
+    es: Any,
+    index: str,
+    vectors: Sequence[List[float]],
+    ks: Sequence[int],
+    candidates: Sequence[int],
+    similarities: Sequence[Optional[float]] = (None,),
+    repeat: int = 5,
+    user_ids: Optional[Sequence[str]] = None,
+) -> List[SweepResult]:
+    """``measure`` every ``k`` x ``num_candidates`` x cutoff combination.
+
+    Combinations with fewer candidates than ``k`` are skipped (Elasticsearch
+    rejects them). The exact ranking is computed once for the largest ``k``,
+    scoped per query by ``user_ids`` when given.
+    """
+
+    owners = _owners(user_ids, len(vectors))
+    truth = [
+        exact_ids(es, index, vector, max(ks), user_id)
+        for vector, user_id in zip(vectors, owners)
+    ]
+    results: List[SweepResult] = []
+    for k in sorted(ks):
+        for num_candidates in sorted(candidates):
+            if num_candidates < k:
+                continue
+            for similarity in similarities:
+                results.append(
+                    measure(
+                        es,
+                        index,
+                        vectors,
+                        truth,
+                        k,
+                        num_candidates,
+                        similarity,
+                        repeat,
+                        user_ids,
+                    )
+                )
+    return results
+
+
+def recommend(
+    results: Iterable[SweepResult], k: int, target_recall: float
+) -> Optional[SweepResult]:
+    """Cheapest uncut setting for ``k`` that reaches ``target_recall``.
+
+    Fewest candidates wins, then lowest p95; None if nothing reaches it.
+    """
+
+    ok = [
+        r
+        for r in results
+        if r.k == k and r.similarity is None and r.recall >= target_recall
+    ]
+    if not ok:
+        return None
+    return min(ok, key=lambda r: (r.num_candidates, r.p95_ms))
+
+
+__all__ = [
+    "HEADER",
+    "SweepResult",
+    "exact_ids",
+    "knn_ids",
+    "load_queries",
+    "measure",
+    "percentile",
+    "recommend",
+    "sample_users",
+    "sweep",
+]
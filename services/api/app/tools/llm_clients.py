@@ -0,0 +1,233 @@
+"""Long-lived LLM clients with per-request deadlines.
+
+One background event loop owns an ``AsyncOpenAI`` client and an
+``ollama.AsyncClient``; both keep pooled keep-alive HTTP connections, so calls
+no longer pay a TCP/TLS handshake (or a fresh client) per request. Graph nodes
+are sync, so they submit coroutines to that loop and wait at most the time left
+in the current request budget (``REQUEST_BUDGET_MS``, capped per call by
+``LLM_TIMEOUT_S``). When the deadline passes the call is cancelled and
+``DeadlineExceeded`` is raised so callers can fall back to templates.
+
+The deadline lives in a context var (like the inference priority), so it
+follows nodes into LangGraph's executor threads. The loop and clients are
+created lazily and re-created after a fork, so pre-fork workers never share
+sockets with the master.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.tools.metrics import llm_duration
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_REQUEST_BUDGET_MS = 30000.0
+_DEFAULT_CALL_TIMEOUT_S = 20.0
+# Extra time the caller waits for the loop to deliver the cancellation
+_CANCEL_GRACE_S = 0.5
+
+_deadline_var: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "llm_deadline", default=None
+)
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_owner_pid: Optional[int] = None
+_clients: Dict[Tuple[str, ...], Any] = {}
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request budget ran out before the LLM call could finish."""
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        logger.warning("Invalid %s; using %s", name, default)
+        return default
+
+
+def start_request_budget(
+    budget_ms: Optional[float] = None,
+) -> contextvars.Token[Optional[float]]:
+    """Start the LLM deadline clock for the current request context."""
+
+    if budget_ms is None:
+        budget_ms = _env_float("REQUEST_BUDGET_MS", _DEFAULT_REQUEST_BUDGET_MS)
+    deadline = time.monotonic() + budget_ms / 1000.0 if budget_ms > 0 else None
+    return _deadline_var.set(deadline)
+
+
+def reset_request_budget(token: contextvars.Token[Optional[float]]) -> None:
+    _deadline_var.reset(token)
+
+
+def remaining_s() -> Optional[float]:
+    """Seconds left in the request budget, or None outside a request."""
+
+    deadline = _deadline_var.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def call_timeout() -> float:
+    """Timeout for the next LLM call: the per-call cap or what is left, if less."""
+
+    cap = _env_float("LLM_TIMEOUT_S", _DEFAULT_CALL_TIMEOUT_S)
+    remaining = remaining_s()
+    if remaining is None:
+        return cap
+    if remaining <= 0:
+        raise DeadlineExceeded("request budget already spent")
+    return min(cap, remaining)
+
+
+def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _thread, _owner_pid
+    with _lock:
+        pid = os.getpid()
+        if _loop is None or _owner_pid != pid:
+            # After a fork the parent's loop thread does not exist here and its
+            # pooled connections must not be reused
+            _clients.clear()
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(
+                target=_run_loop, args=(_loop,), name="llm-clients", daemon=True
+            )
+            _thread.start()
+            _owner_pid = pid
+        return _loop
+
+
+def _run(
+    factory: Callable[[], Awaitable[Any]], timeout: float, provider: str = "-"
+) -> Any:
+    loop = _get_loop()
+
+    async def _bounded() -> Any:
+        return await asyncio.wait_for(factory(), timeout)
+
+    future = asyncio.run_coroutine_threadsafe(_bounded(), loop)
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        result = future.result(timeout + _CANCEL_GRACE_S)
+        outcome = "ok"
+        return result
+    except (asyncio.TimeoutError, concurrent.futures.TimeoutError) as exc:
+        outcome = "deadline"
+        future.cancel()
+        raise DeadlineExceeded(f"LLM call exceeded {timeout:.2f}s") from exc
+    finally:
+        llm_duration.observe(time.perf_counter() - start, provider, outcome)
+
+
+def _openai_client(api_key: str) -> Any:
+    key = ("openai", api_key)
+    client = _clients.get(key)
+    if client is None:
+        from openai import AsyncOpenAI  # type: ignore
+
+        client = AsyncOpenAI(api_key=api_key)
+        _clients[key] = client
+    return client
+
+
+def _ollama_client() -> Any:
+    host = os.getenv("OLLAMA_HOST", "")
+    key = ("ollama", host)
+    client = _clients.get(key)
+    if client is None:
+        import ollama  # type: ignore
+
+        client = ollama.AsyncClient(host=host or None)
+        _clients[key] = client
+    return client
+
+
+def openai_chat(api_key: str, model: str, messages: List[Dict[str, str]]) -> Any:
+    """Run a chat completion on the shared OpenAI client within the deadline."""
+
+    timeout = call_timeout()
+    _get_loop()
+    client = _openai_client(api_key)
+    return _run(
+        lambda: client.chat.completions.create(model=model, messages=messages),
+        timeout,
+        "openai",
+    )
+
+
+def ollama_chat(model: str, messages: List[Dict[str, str]]) -> Any:
+    """Run a chat call on the shared Ollama client within the deadline."""
+
+    timeout = call_timeout()
+    _get_loop()
+    client = _ollama_client()
+    return _run(lambda: client.chat(model=model, messages=messages), timeout, "ollama")
+
+
+def close() -> None:
+    """Close pooled connections and stop the loop (app shutdown)."""
+
+    global _loop, _thread, _owner_pid
+    with _lock:
+        loop, thread = _loop, _thread
+        clients = list(_clients.values())
+        _clients.clear()
+        _loop, _thread, _owner_pid = None, None, None
+    if loop is None:
+        return
+
+    async def _close_all() -> None:
+        for client in clients:
+            # AsyncOpenAI exposes close(); ollama only wraps an httpx client
+            closer = getattr(client, "close", None) or getattr(
+                getattr(client, "_client", None), "aclose", None
+            )
+            if closer is None:
+                continue
+            try:
+                result = closer()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as exc:  # pragma: no cover - best effort
+                logger.debug("Error closing LLM client: %s", exc)
+
+    if thread is not None and thread.is_alive():
+        try:
+            asyncio.run_coroutine_threadsafe(_close_all(), loop).result(5)
+        except Exception as exc:  # pragma: no cover - best effort
+            logger.debug("Error closing LLM clients: %s", exc)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+    if not loop.is_running():
+        loop.close()
+
+
+__all__ = [
+    "DeadlineExceeded",
+    "call_timeout",
+    "close",
+    "ollama_chat",
+    "openai_chat",
+    "remaining_s",
+    "reset_request_budget",
+    "start_request_budget",
+]
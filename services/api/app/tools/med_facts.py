@@ -2,13 +2,16 @@
 
 from __future__ import annotations
 
+import hashlib
 import json
 import os
 import logging
 from functools import lru_cache
-from typing import Dict, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+from app.tools import jsonstream
 from app.tools.language import DEFAULT_LANGUAGE
+from app.tools.spans import span
 
 _DEFAULT_FACTS_PATH = os.path.abspath(
     os.path.join(
@@ -24,22 +27,35 @@ def _resolve_path() -> str:
     return os.getenv("MED_FACTS_PATH", _DEFAULT_FACTS_PATH)
 
 
+def _iter_entries(path: str) -> Iterator[Tuple[Any, Any]]:
+    """``(ingredient, entry)`` pairs from a JSON object or JSONL of entries.
+
+    JSONL lines are entries keyed by their ``name``; either form may be gzipped.
+    """
+
+    with jsonstream.open_text(path) as handle:
+        if jsonstream.is_jsonl(path):
+            for entry in jsonstream.iter_jsonl(handle):
+                if isinstance(entry, dict):
+                    yield entry.get("name"), entry
+        else:
+            yield from jsonstream.iter_json_object(handle)
+
+
 @lru_cache(maxsize=1)
+@span("med_facts.load")
 def _load_facts() -> Dict[str, dict]:
     path = _resolve_path()
+    facts: Dict[str, dict] = {}
     try:
-        with open(path, "r", encoding="utf-8") as handle:
-            raw = json.load(handle)
+        for key, value in _iter_entries(path):
+            if not isinstance(key, str) or not isinstance(value, dict):
+                continue
+            canonical = key.lower().strip()
+            facts[canonical] = value
     except (FileNotFoundError, json.JSONDecodeError, OSError) as exc:
         logger.warning("Failed loading med facts from %s: %s", path, exc)
         return {}
-
-    facts: Dict[str, dict] = {}
-    for key, value in raw.items():
-        if not isinstance(value, dict):
-            continue
-        canonical = key.lower().strip()
-        facts[canonical] = value
     return facts
 
 
@@ -56,6 +72,25 @@ def _alias_map() -> Dict[str, str]:
     return mapping
 
 
+@lru_cache(maxsize=1)
+def facts_digest() -> str:
+    """Short content hash of the facts file (keys caches such as paraphrases)."""
+
+    path = _resolve_path()
+    try:
+        digest = hashlib.sha256()
+        with open(path, "rb") as handle:
+            for chunk in iter(lambda: handle.read(jsonstream.CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()[:16]
+    except OSError:
+        return "missing"
+
+
+def ingredients() -> List[str]:
+    return sorted(_load_facts())
+
+
 def _localize(entry: dict, language: Optional[str]) -> Tuple[str, str, str]:
     lang = language if language and language in (entry.get("onset") or {}) else None
     onset_map = entry.get("onset") or {}
@@ -113,3 +148,4 @@ def clear_cache() -> None:
 
     _load_facts.cache_clear()
     _alias_map.cache_clear()
+    facts_digest.cache_clear()
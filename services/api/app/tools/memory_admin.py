@@ -0,0 +1,171 @@
+"""Bulk export and erasure of one user's private memory.
+
+Both walk the user's documents without loading them at once: export pages
+through a point-in-time (PIT) snapshot with ``search_after`` and streams one
+NDJSON line per fact, values decrypted; erasure is a throttled
+``delete_by_query`` followed by removal of the user's key file, which leaves
+anything the delete missed unreadable. Before deleting, the user's actions
+still queued in the write-behind ``MemoryWriter`` are dropped and the index is
+refreshed, so no fact lands (or stays unsearchable) behind the delete. Requests
+carry ``routing=user_id``, so only the user's shard is touched.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+from typing import Any, Dict, Iterator, Optional
+
+from app.config import settings
+from app.tools import answer_cache, crypto
+from app.tools.es_client import user_routing
+from app.tools.memory_writer import MemoryWriter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_DELETE_RPS = 500.0
+PIT_KEEP_ALIVE = "1m"
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        logger.warning("Invalid %s; using %s", name, default)
+        return default
+
+
+def _owner_query(user_id: str) -> Dict[str, Any]:
+    return {"bool": {"filter": [{"term": {"user_id": user_id}}]}}
+
+
+def iter_user_facts(
+    es: Any, user_id: str, page_size: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """Hits for ``user_id`` from a PIT snapshot, ``page_size`` at a time.
+
+    The PIT is closed when the iterator finishes or is closed early (e.g. the
+    client disconnects mid-export).
+    """
+
+    size = page_size or max(
+        1, int(_env_number("MEMORY_EXPORT_PAGE_SIZE", DEFAULT_PAGE_SIZE))
+    )
+    pit = es.open_point_in_time(
+        index=settings.es_private_index,
+        keep_alive=PIT_KEEP_ALIVE,
+        routing=user_routing(user_id),
+    )
+    pit_id = pit["id"]
+    search_after = None
+    try:
+        while True:
+            page: Dict[str, Any] = {
+                "pit": {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE},
+                "query": _owner_query(user_id),
+                # Cheapest total order for PIT pagination
+                "sort": [{"_shard_doc": "asc"}],
+                "size": size,
+                "source_excludes": ["embedding"],
+            }
+            if search_after is not None:
+                page["search_after"] = search_after
+            resp = es.search(**page)
+            pit_id = resp.get("pit_id", pit_id)
+            hits = resp["hits"]["hits"]
+            yield from hits
+            if len(hits) < size:
+                return
+            search_after = hits[-1]["sort"]
+    finally:
+        try:
+            es.close_point_in_time(id=pit_id)
+        except Exception as exc:
+            logger.warning("Could not close PIT for memory export: %s", exc)
+
+
+def _exported(hit: Dict[str, Any], user_id: str, can_decrypt: bool) -> Dict[str, Any]:
+    fact = dict(hit.get("_source") or {})
+    fact["id"] = hit.get("_id")
+    if fact.pop("value_encrypted", False) and fact.get("value"):
+        token, fact["value"] = fact["value"], None
+        if can_decrypt:
+            try:
+                fact["value"] = crypto.decrypt_for_user(user_id, token)
+            except Exception:
+                # Key rotated or replaced: the value cannot be recovered
+                logger.warning("Could not decrypt fact %s for export", fact["id"])
+    return fact
+
+
+def export_ndjson(
+    es: Any, user_id: str, page_size: Optional[int] = None
+) -> Iterator[str]:
+    """NDJSON lines, one per fact, with values decrypted."""
+
+    # Never mint a key just to fail decrypting with it
+    can_decrypt = crypto.has_user_key(user_id)
+    count = 0
+    for hit in iter_user_facts(es, user_id, page_size):
+        count += 1
+        fact = _exported(hit, user_id, can_decrypt)
+        yield json.dumps(fact, ensure_ascii=False) + "\n"
+    logger.info("Exported %d memory facts", count)
+
+
+def delete_user_memory(
+    es: Any,
+    user_id: str,
+    requests_per_second: Optional[float] = None,
+    writer: Optional[MemoryWriter] = None,
+) -> Dict[str, Any]:
+    """Delete all of ``user_id``'s facts, then their key; counts per step.
+
+    ``requests_per_second`` (default ``MEMORY_DELETE_RPS``; ``0`` =
+    unthrottled) keeps a large erasure from saturating the cluster. The
+    user's writes queued in ``writer`` are dropped first, and this process's
+    cached answers built from their memory last.
+    """
+
+    if requests_per_second is None:
+        requests_per_second = _env_number("MEMORY_DELETE_RPS", DEFAULT_DELETE_RPS)
+    discarded = writer.discard_user(user_id) if writer is not None else 0
+    # delete_by_query only sees searchable documents; include recent writes
+    es.indices.refresh(index=settings.es_private_index)
+    resp = es.delete_by_query(
+        index=settings.es_private_index,
+        query=_owner_query(user_id),
+        routing=user_routing(user_id),
+        conflicts="proceed",
+        requests_per_second=requests_per_second if requests_per_second > 0 else -1,
+        scroll_size=int(_env_number("MEMORY_EXPORT_PAGE_SIZE", DEFAULT_PAGE_SIZE)),
+        refresh=True,
+        wait_for_completion=True,
+    )
+    failures = len(resp.get("failures") or [])
+    # Even after failures: without the key, leftover values are unreadable
+    key_removed = crypto.delete_user_key(user_id)
+    # Answers built from the erased facts must not outlive them
+    invalidated = answer_cache.cache.invalidate_user(user_id)
+    logger.info(
+        "Erased memory: %s deleted, %d queued writes dropped, %d failures, "
+        "key removed=%s, %d cached answers dropped",
+        resp.get("deleted", 0),
+        discarded,
+        failures,
+        key_removed,
+        invalidated,
+    )
+    return {
+        "ok": failures == 0,
+        "deleted": int(resp.get("deleted", 0)),
+        "discarded": discarded,
+        "failures": failures,
+        "key_removed": key_removed,
+        "invalidated": invalidated,
+    }
+
+
+__all__ = ["delete_user_memory", "export_ndjson", "iter_user_facts"]
@@ -0,0 +1,215 @@
+"""Expiry and compaction of private memory facts.
+
+Writes stamp ``updated_at`` and, when the fact has a TTL, ``expires_at``
+(``updated_at + ttl_days``). Reads skip facts whose ``expires_at`` has passed
+(``not_expired``), so stale facts stop reaching the graph at once; ``compact``
+removes them from the index in throttled ``delete_by_query`` batches,
+optionally copying them to an archive index first. Run it from cron with
+``scripts/compact_memory.py`` or in-process every
+``MEMORY_COMPACTION_INTERVAL_S`` seconds.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_DAYS = 365
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_REQUESTS_PER_SECOND = 500.0
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except ValueError:
+        logger.warning("Invalid %s; using %s", name, default)
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        logger.warning("Invalid %s; using %s", name, default)
+        return default
+
+
+def default_ttl_days() -> int:
+    """``MEMORY_TTL_DAYS``; 0 keeps facts until they are overwritten."""
+
+    return _env_int("MEMORY_TTL_DAYS", DEFAULT_TTL_DAYS)
+
+
+def stamp(
+    doc: Dict[str, Any],
+    ttl_days: Optional[int] = None,
+    now: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """Set ``updated_at``, ``ttl_days`` and ``expires_at`` on ``doc`` in place."""
+
+    now = now or datetime.now(timezone.utc)
+    ttl = default_ttl_days() if ttl_days is None else max(0, int(ttl_days))
+    doc["updated_at"] = now.isoformat()
+    doc["ttl_days"] = ttl
+    if ttl:
+        doc["expires_at"] = (now + timedelta(days=ttl)).isoformat()
+    else:
+        doc.pop("expires_at", None)
+    return doc
+
+
+def expired_query(cutoff: str = "now") -> Dict[str, Any]:
+    return {"range": {"expires_at": {"lte": cutoff}}}
+
+
+def not_expired() -> Dict[str, Any]:
+    """Filter clause for reads; facts without ``expires_at`` never expire."""
+
+    return {"bool": {"must_not": [expired_query()]}}
+
+
+@dataclass
+class CompactionStats:
+    deleted: int = 0
+    archived: int = 0
+    failures: int = 0
+    seconds: float = 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.deleted} deleted, {self.archived} archived, "
+            f"{self.failures} failures in {self.seconds:.1f}s"
+        )
+
+
+def compact(
+    es: Any,
+    *,
+    index: Optional[str] = None,
+    archive_index: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    requests_per_second: Optional[float] = None,
+    now: Optional[datetime] = None,
+) -> CompactionStats:
+    """Delete (after archiving, with ``archive_index``) facts expired by ``now``.
+
+    Both steps use one fixed cutoff, so nothing that expires in between is
+    deleted unarchived. ``batch_size`` is the scroll size per batch and
+    ``requests_per_second`` throttles Elasticsearch's batches (``-1`` or
+    ``0`` = unthrottled); defaults come from ``MEMORY_COMPACTION_BATCH_SIZE``
+    and ``MEMORY_COMPACTION_RPS``.
+    """
+
+    index = index or settings.es_private_index
+    if archive_index is None:
+        archive_index = os.getenv("MEMORY_ARCHIVE_INDEX", "").strip() or None
+    batch_size = batch_size or (
+        _env_int("MEMORY_COMPACTION_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+        or DEFAULT_BATCH_SIZE
+    )
+    if requests_per_second is None:
+        requests_per_second = _env_float(
+            "MEMORY_COMPACTION_RPS", DEFAULT_REQUESTS_PER_SECOND
+        )
+    rps = requests_per_second if requests_per_second > 0 else -1
+    cutoff = (now or datetime.now(timezone.utc)).isoformat()
+    query = expired_query(cutoff)
+
+    stats = CompactionStats()
+    started = time.perf_counter()
+    if archive_index:
+        # Routing is kept, so archived facts stay on their owner's shard
+        resp = es.reindex(
+            source={"index": index, "query": query, "size": batch_size},
+            dest={"index": archive_index, "op_type": "index"},
+            conflicts="proceed",
+            requests_per_second=rps,
+            refresh=True,
+            wait_for_completion=True,
+        )
+        stats.archived = int(resp.get("created", 0)) + int(resp.get("updated", 0))
+        stats.failures += len(resp.get("failures") or [])
+        if stats.failures:
+            # Never delete what could not be archived
+            stats.seconds = time.perf_counter() - started
+            logger.warning(
+                "Archiving expired memory failed; nothing deleted: %s",
+                resp["failures"][:3],
+            )
+            return stats
+    resp = es.delete_by_query(
+        index=index,
+        query=query,
+        conflicts="proceed",
+        scroll_size=batch_size,
+        requests_per_second=rps,
+        refresh=True,
+        wait_for_completion=True,
+    )
+    stats.deleted = int(resp.get("deleted", 0))
+    stats.failures += len(resp.get("failures") or [])
+    stats.seconds = time.perf_counter() - started
+    logger.info("Compacted %s: %s", index, stats.summary())
+    return stats
+
+
+class CompactionScheduler:
+    """Daemon thread that runs ``compact`` every ``interval_s`` seconds."""
+
+    def __init__(self, es_factory: Any, interval_s: float) -> None:
+        self.es_factory = es_factory
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._loop, name="memory-compaction", daemon=True
+        )
+        self._thread.start()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                compact(self.es_factory())
+            except Exception as exc:
+                logger.warning("Memory compaction failed: %s", exc)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+def start_scheduler(es_factory: Any) -> Optional[CompactionScheduler]:
+    """Start in-process compaction if ``MEMORY_COMPACTION_INTERVAL_S`` > 0."""
+
+    interval = _env_float("MEMORY_COMPACTION_INTERVAL_S", 0.0)
+    if interval <= 0:
+        return None
+    scheduler = CompactionScheduler(es_factory, interval)
+    scheduler.start()
+    logger.info("Memory compaction every %.0fs", interval)
+    return scheduler
+
+
+__all__ = [
+    "CompactionScheduler",
+    "CompactionStats",
+    "compact",
+    "default_ttl_days",
+    "expired_query",
+    "not_expired",
+    "stamp",
+    "start_scheduler",
+]
@@ -0,0 +1,283 @@
+"""Batched, write-behind writes of private memory facts.
+
+``/api/memory/bulk`` turns a list of medications and preferences into bulk
+actions with one embedding call and one key read per request, then hands them
+to ``MemoryWriter``. The writer queues actions and a daemon thread sends them
+with one ``helpers.bulk`` call every ``MEMORY_WRITE_FLUSH_INTERVAL_S`` seconds,
+or sooner once ``MEMORY_WRITE_MAX_BATCH`` actions are waiting. A ``wait_for``
+write flushes the queue itself with ``refresh="wait_for"``, so the caller's
+next read sees it. Once a batch lands, answer-cache entries built from the
+affected users' memory are dropped.
+
+A batch that fails to send goes back to the queue, but an action is dropped
+after ``MEMORY_WRITE_MAX_ATTEMPTS`` failed sends (counted in
+``memory_writes_dropped_total``), so an Elasticsearch outage cannot grow the
+queue without bound. ``discard_user`` drops a user's queued actions before an
+erasure, so nothing queued is written after their memory is deleted.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from elasticsearch import helpers
+
+from app.config import settings
+from app.tools import answer_cache, memory_ttl
+from app.tools.metrics import memory_writes_dropped
+from app.tools.es_client import user_routing
+from app.tools.med_normalize import normalize_medication_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL_S = 1.0
+DEFAULT_MAX_BATCH = 500
+DEFAULT_MAX_ATTEMPTS = 5
+
+_DOSE = re.compile(r"\b(\d+\s?mg|\d+\s?mcg|\d+\s?ml)\b", re.IGNORECASE)
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        logger.warning("Invalid %s; using %s", name, default)
+        return default
+
+
+def med_fact(
+    user_id: str, name: str, value_token: str, vector: Sequence[float]
+) -> Tuple[str, Dict[str, Any]]:
+    """Document id and body of a medication fact (``value_token`` encrypted)."""
+
+    base = _DOSE.sub("", name).strip().lower()
+    normalized = normalize_medication_name(name)
+    ingredient = normalized["ingredient"] if normalized else base
+    doc = {
+        "user_id": user_id,
+        "entity": "medication",
+        "name": name.strip(),
+        "normalized": {"ingredient": ingredient},
+        # Store sensitive value encrypted at rest
+        "value": value_token,
+        "value_encrypted": True,
+        "confidence": 0.95,
+        "embedding": list(vector),
+    }
+    return f"{user_id}:med:{base}", doc
+
+
+def preference_fact(
+    user_id: str, name: str, value: Any, vector: Sequence[float]
+) -> Tuple[str, Dict[str, Any]]:
+    """Document id and body of a preference (read in clear by the planner)."""
+
+    key = name.strip().lower()
+    doc = {
+        "user_id": user_id,
+        "entity": "preference",
+        "name": key,
+        "value": value,
+        "confidence": 1.0,
+        "embedding": list(vector),
+    }
+    return f"{user_id}:pref:{key}", doc
+
+
+def index_action(
+    user_id: str,
+    doc_id: str,
+    doc: Dict[str, Any],
+    ttl_days: Optional[int] = None,
+    index: Optional[str] = None,
+) -> Dict[str, Any]:
+    memory_ttl.stamp(doc, ttl_days)
+    return {
+        "_op_type": "index",
+        "_index": index or settings.es_private_index,
+        "_id": doc_id,
+        "_source": doc,
+        "routing": user_routing(user_id),
+    }
+
+
+@dataclass
+class FlushStats:
+    written: int = 0
+    errors: int = 0
+
+
+class MemoryWriter:
+    """Queue of bulk actions flushed by a daemon thread (or on demand)."""
+
+    def __init__(
+        self,
+        es_factory: Callable[[], Any],
+        flush_interval_s: Optional[float] = None,
+        max_batch: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+    ) -> None:
+        self.es_factory = es_factory
+        self.flush_interval_s = (
+            _env_number("MEMORY_WRITE_FLUSH_INTERVAL_S", DEFAULT_FLUSH_INTERVAL_S)
+            if flush_interval_s is None
+            else flush_interval_s
+        )
+        self.max_batch = max(
+            1,
+            int(
+                _env_number("MEMORY_WRITE_MAX_BATCH", DEFAULT_MAX_BATCH)
+                if max_batch is None
+                else max_batch
+            ),
+        )
+        self.max_attempts = max(
+            1,
+            int(
+                _env_number("MEMORY_WRITE_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+                if max_attempts is None
+                else max_attempts
+            ),
+        )
+        # (failed sends so far, action)
+        self._pending: List[Tuple[int, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+        # One flush at a time keeps writes to the same id in submission order
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def write_behind(self) -> bool:
+        """False with a flush interval <= 0: every submit is written at once."""
+
+        return self.flush_interval_s > 0
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def start(self) -> None:
+        if not self.write_behind or self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._loop, name="memory-writer", daemon=True
+        )
+        self._thread.start()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval_s)
+            self._wake.clear()
+            self.flush()
+
+    def submit(
+        self, actions: Sequence[Dict[str, Any]], wait_for: bool = False
+    ) -> Dict[str, Any]:
+        """Queue ``actions``; with ``wait_for`` (or no write-behind) write them now.
+
+        A synchronous write also flushes everything queued before it and
+        raises if Elasticsearch is unreachable.
+        """
+
+        with self._lock:
+            self._pending.extend((0, action) for action in actions)
+            queued = len(self._pending)
+        if wait_for or not self.write_behind:
+            stats = self.flush(refresh="wait_for" if wait_for else None, raise_=True)
+            return {
+                "ok": stats.errors == 0,
+                "written": stats.written,
+                "errors": stats.errors,
+            }
+        if queued >= self.max_batch:
+            self._wake.set()
+        return {"ok": True, "queued": len(actions)}
+
+    def flush(self, refresh: Any = None, raise_: bool = False) -> FlushStats:
+        """Send every queued action in one bulk request.
+
+        On a transport error the batch goes back to the front of the queue for
+        the next flush (writes are idempotent by id), less the actions that
+        have now failed ``max_attempts`` times.
+        """
+
+        stats = FlushStats()
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return stats
+            actions = [action for _, action in batch]
+            options = {"refresh": refresh} if refresh else {}
+            try:
+                written, errors = helpers.bulk(
+                    self.es_factory(), actions, raise_on_error=False, **options
+                )
+            except Exception:
+                retry = [(n + 1, a) for n, a in batch if n + 1 < self.max_attempts]
+                dropped = len(batch) - len(retry)
+                with self._lock:
+                    self._pending[:0] = retry
+                if dropped:
+                    memory_writes_dropped.inc("retries", amount=dropped)
+                if raise_:
+                    raise
+                logger.warning(
+                    "Memory bulk write failed; %d requeued, %d dropped after %d "
+                    "attempts",
+                    len(retry),
+                    dropped,
+                    self.max_attempts,
+                )
+                return stats
+            failed = errors if isinstance(errors, list) else []
+            stats.written = int(written)
+            stats.errors = len(failed)
+            for item in failed[:5]:
+                logger.warning("Memory bulk item failed: %s", item)
+            for user_id in {a["_source"]["user_id"] for a in actions}:
+                answer_cache.cache.invalidate_user(user_id)
+        return stats
+
+    def discard_user(self, user_id: str) -> int:
+        """Drop every queued action of ``user_id``; returns how many.
+
+        Waits for a flush in progress, so once this returns none of the user's
+        queued writes can still land (those already sent have landed).
+        """
+
+        with self._flush_lock, self._lock:
+            kept = [p for p in self._pending if p[1]["_source"]["user_id"] != user_id]
+            dropped = len(self._pending) - len(kept)
+            self._pending = kept
+        if dropped:
+            memory_writes_dropped.inc("erased", amount=dropped)
+        return dropped
+
+    def close(self) -> None:
+        """Stop the flush thread and write whatever is still queued."""
+
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        if self.pending():
+            logger.warning("%d memory writes not flushed at shutdown", self.pending())
+
+
+__all__ = [
+    "FlushStats",
+    "MemoryWriter",
+    "index_action",
+    "med_fact",
+    "preference_fact",
+]
@@ -0,0 +1,379 @@
+"""In-process metrics rendered in the Prometheus text format at ``/metrics``.
+
+A deliberately small registry (counters, gauges, histograms with fixed
+buckets) so every request can be measured without an extra dependency or an
+external collector: an observation is a dict lookup, a bisect and a few
+additions under a per-metric lock. Values that already live elsewhere (answer
+cache stats, inference queue depth) are read when ``/metrics`` is scraped.
+
+Values are per process. Under gunicorn each worker keeps its own, so scrape
+every worker (or run one) if the totals matter.
+"""
+
+from __future__ import annotations
+
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; wide enough for a 2 ms ES lookup and a 30 s LLM call
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+Labels = Tuple[str, ...]
+Sample = Tuple[Labels, float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """``(suffix, formatted labels, value)`` lines for the exposition."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, doc, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+    def items(self) -> List[Sample]:
+        with self._lock:
+            return sorted(self._values.items())
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [("", _format_labels(self.labels, k), v) for k, v in self.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: one count per bucket (+Inf last), then the sum
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            row[index] += 1
+            row[-1] += value
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            row = self._values.get(labels)
+            return int(sum(row[:-1])) if row else 0
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            items = sorted((k, list(row)) for k, row in self._values.items())
+        out: List[Tuple[str, str, float]] = []
+        names = (*self.labels, "le")
+        for key, row in items:
+            running = 0.0
+            for bound, hits in zip((*self.buckets, float("inf")), row):
+                running += hits
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                out.append(("_bucket", _format_labels(names, (*key, le)), running))
+            out.append(("_sum", _format_labels(self.labels, key), row[-1]))
+            out.append(("_count", _format_labels(self.labels, key), running))
+        return out
+
+    def time(self, *labels: str) -> "_Timer":
+        """Context manager observing the block's duration in seconds."""
+
+        return _Timer(self, labels)
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: Labels) -> None:
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.histogram.observe(perf_counter() - self.start, *self.labels)
+
+
+class Collected(Metric):
+    """Values computed at scrape time by ``collect`` (label values, value)."""
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        kind: str,
+        labels: Sequence[str],
+        collect: Callable[[], Iterable[Sample]],
+    ) -> None:
+        super().__init__(name, doc, labels)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [("", _format_labels(self.labels, k), v) for k, v in self.collect()]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Any:
+        # Last one wins, so reloading a module that owns metrics replaces them
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Metric:
+        return self._metrics[name]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name: str, doc: str, labels: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, doc, labels))
+
+
+def gauge(name: str, doc: str, labels: Sequence[str] = ()) -> Gauge:
+    return registry.register(Gauge(name, doc, labels))
+
+
+def histogram(
+    name: str,
+    doc: str,
+    labels: Sequence[str] = (),
+    buckets: Sequence[float] = LATENCY_BUCKETS,
+) -> Histogram:
+    return registry.register(Histogram(name, doc, labels, buckets))
+
+
+def collected(
+    name: str,
+    doc: str,
+    kind: str,
+    labels: Sequence[str],
+    collect: Callable[[], Iterable[Sample]],
+) -> Collected:
+    return registry.register(Collected(name, doc, kind, labels, collect))
+
+
+def render() -> str:
+    return registry.render()
+
+
+# Shared by the modules that record them; scrape-time metrics are registered
+# by their owners (answer cache, inference scheduler) to avoid import cycles.
+http_requests = counter(
+    "http_requests_total", "HTTP requests served.", ("method", "route", "status")
+)
+http_duration = histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency, until the response body is sent.",
+    ("method", "route"),
+)
+http_in_flight = gauge("http_requests_in_flight", "HTTP requests being served.")
+node_duration = histogram(
+    "graph_node_duration_seconds",
+    "Graph node latency from _wrap_node.",
+    ("node", "intent"),
+)
+node_errors = counter(
+    "graph_node_errors_total", "Graph nodes that raised.", ("node", "intent")
+)
+es_duration = histogram(
+    "es_request_duration_seconds",
+    "Elasticsearch call latency.",
+    ("index", "operation"),
+)
+es_errors = counter(
+    "es_request_errors_total",
+    "Elasticsearch calls that raised.",
+    ("index", "operation"),
+)
+inference_duration = histogram(
+    "inference_duration_seconds",
+    "Time holding an inference slot (embedding, risk NLI, ollama).",
+    ("model",),
+)
+inference_wait = histogram(
+    "inference_queue_seconds", "Time queued for an inference slot.", ("model",)
+)
+inference_batch = histogram(
+    "inference_batch_size",
+    "Items per inference call.",
+    ("model",),
+    buckets=BATCH_BUCKETS,
+)
+llm_duration = histogram(
+    "llm_request_duration_seconds",
+    "LLM call latency by provider and outcome (ok, deadline, error).",
+    ("provider", "outcome"),
+)
+cache_lookups = counter(
+    "cache_lookups_total", "Lookups in in-process caches.", ("cache", "result")
+)
+memory_writes_dropped = counter(
+    "memory_writes_dropped_total",
+    "Queued memory writes dropped (retries exhausted, or the user was erased).",
+    ("reason",),
+)
+
+
+def _hit_ratios() -> List[Sample]:
+    totals: Dict[str, float] = {}
+    hits: Dict[str, float] = {}
+    for (cache, result), count in cache_lookups.items():
+        totals[cache] = totals.get(cache, 0.0) + count
+        if result != "miss":
+            hits[cache] = hits.get(cache, 0.0) + count
+    return [((cache,), hits.get(cache, 0.0) / n) for cache, n in totals.items() if n]
+
+
+cache_hit_ratio = collected(
+    "cache_hit_ratio",
+    "Share of cache lookups that hit, since start.",
+    "gauge",
+    ("cache",),
+    _hit_ratios,
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests by route template, status and latency."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def _send(message: Any) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            elapsed = perf_counter() - start
+            http_in_flight.dec()
+            # Templates (not raw paths) keep /api/debug/trace/{rid} one series
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope.get("method", "")
+            http_requests.inc(method, route, str(status))
+            http_duration.observe(elapsed, method, route)
+
+
+__all__ = [
+    "CONTENT_TYPE",
+    "Collected",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsMiddleware",
+    "Registry",
+    "collected",
+    "counter",
+    "gauge",
+    "histogram",
+    "registry",
+    "render",
+]
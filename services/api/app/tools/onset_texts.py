@@ -0,0 +1,225 @@
+"""Precomputed onset paraphrases and onset LLM fallbacks.
+
+Onset inputs are static (``seeds/med_facts.json`` entries per ingredient and
+language), so LLM rewrites are generated once, validated, persisted in the
+SQLite file ``<data_dir>/paraphrases/onset.db`` and served from memory
+afterwards. Every worker writes single rows into the same file (WAL, like the
+SQLite key store), so concurrent warm-ups never overwrite each other and a
+write costs one upsert; entries another worker stored are picked up on the
+first local miss. An ``onset.json`` left by the earlier file layout is
+imported once.
+Paraphrase keys include the facts-file digest, so editing the facts invalidates
+them. A miss never blocks a request: the caller serves canonical text and may
+queue a background warm-up (see ``warm``), or the batch command in
+``scripts/pregen_onset_texts.py`` fills the store ahead of time.
+
+Stored values are dicts; ``{"rejected": True}`` records an output that failed
+validation so it is not retried on every request.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from app.config import settings
+from app.tools import med_facts
+
+logger = logging.getLogger(__name__)
+
+REJECTED: Dict[str, bool] = {"rejected": True}
+
+
+def paraphrase_key(ingredient: str, language: str) -> str:
+    return (
+        f"paraphrase|{ingredient.strip().lower()}|{language}|{med_facts.facts_digest()}"
+    )
+
+
+def fallback_key(ingredient: str, language: str) -> str:
+    return f"fallback|{ingredient.strip().lower()}|{language}"
+
+
+class OnsetTextStore:
+    """SQLite-backed map with an in-memory cache of the rows read so far."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        self._pruned_digest: Optional[str] = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        # WAL lets workers read while another one stores a warm-up result
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS onset_texts "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._import_legacy_json()
+
+    def _import_legacy_json(self) -> None:
+        legacy = os.path.splitext(self.path)[0] + ".json"
+        try:
+            with open(legacy, "r", encoding="utf-8") as handle:
+                raw = json.load(handle)
+        except FileNotFoundError:
+            return
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning("Failed loading onset texts from %s: %s", legacy, exc)
+            return
+        rows = [
+            (k, json.dumps(v, ensure_ascii=False))
+            for k, v in (raw.items() if isinstance(raw, dict) else [])
+            if isinstance(v, dict)
+        ]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO onset_texts (key, value) VALUES (?, ?)", rows
+            )
+        os.replace(legacy, f"{legacy}.imported")
+        logger.info("Imported %d onset texts from %s", len(rows), legacy)
+
+    def get(self, key: str) -> Tuple[bool, Optional[dict]]:
+        with self._lock:
+            if key in self._entries:
+                return True, self._entries[key]
+            row = self._db.execute(
+                "SELECT value FROM onset_texts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return False, None
+            try:
+                value = json.loads(row[0])
+            except json.JSONDecodeError:
+                logger.warning("Ignoring corrupt onset text %s", key)
+                return False, None
+            self._entries[key] = value
+            return True, value
+
+    def put(self, key: str, value: dict) -> None:
+        digest = med_facts.facts_digest()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO onset_texts (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False)),
+            )
+            self._entries[key] = value
+            if self._pruned_digest != digest:
+                # Drop paraphrases made from an older facts file (once per digest)
+                self._db.execute(
+                    "DELETE FROM onset_texts WHERE key LIKE 'paraphrase|%' "
+                    "AND key NOT LIKE ?",
+                    (f"%|{digest}",),
+                )
+                self._entries = {
+                    k: v
+                    for k, v in self._entries.items()
+                    if not k.startswith("paraphrase|") or k.endswith(f"|{digest}")
+                }
+                self._pruned_digest = digest
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(
+                self._db.execute("SELECT COUNT(*) FROM onset_texts").fetchone()[0]
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_stores: Dict[str, OnsetTextStore] = {}
+_stores_lock = threading.Lock()
+
+
+def _store_path() -> str:
+    return os.path.join(settings.data_dir, "paraphrases", "onset.db")
+
+
+def get_store() -> OnsetTextStore:
+    path = _store_path()
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = OnsetTextStore(path)
+            _stores[path] = store
+        return store
+
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="onset-warm")
+_inflight: Set[str] = set()
+_pending: Set[Future] = set()
+_warm_lock = threading.Lock()
+
+
+def warm_on_miss_enabled() -> bool:
+    return os.getenv("ONSET_WARM_ON_MISS", "true").strip().lower() == "true"
+
+
+def warm(key: str, generate: Callable[[], Optional[dict]]) -> bool:
+    """Queue ``generate`` in the background and store its result under ``key``.
+
+    ``generate`` returns the value to store, or None when the LLM was
+    unavailable (nothing is stored, so a later miss retries). Returns False
+    when warming is disabled or the key is already queued.
+    """
+
+    if not warm_on_miss_enabled():
+        return False
+    store = get_store()
+    with _warm_lock:
+        if key in _inflight:
+            return False
+        _inflight.add(key)
+
+    def _job() -> None:
+        try:
+            value = generate()
+            if value is not None:
+                store.put(key, value)
+        except Exception as exc:
+            logger.warning("Onset text warm-up for %s failed: %s", key, exc)
+        finally:
+            with _warm_lock:
+                _inflight.discard(key)
+
+    future = _executor.submit(_job)
+    with _warm_lock:
+        _pending.add(future)
+    future.add_done_callback(_discard_pending)
+    return True
+
+
+def _discard_pending(future: Future) -> None:
+    with _warm_lock:
+        _pending.discard(future)
+
+
+def drain(timeout: float = 30.0) -> None:
+    """Block until queued warm-ups finish (used by tests)."""
+
+    with _warm_lock:
+        futures = list(_pending)
+    for future in futures:
+        future.result(timeout)
+
+
+__all__ = [
+    "OnsetTextStore",
+    "REJECTED",
+    "drain",
+    "fallback_key",
+    "get_store",
+    "paraphrase_key",
+    "warm",
+    "warm_on_miss_enabled",
+]
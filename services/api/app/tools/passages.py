@@ -0,0 +1,102 @@
+"""Heading-aware passage splitting and rough token counting for KB markdown."""
+
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Tuple
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*\S)\s*$")
+_LIST_ITEM_PATTERN = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+")
+
+DEFAULT_PASSAGE_TOKENS = 120
+
+
+def count_tokens(text: str) -> int:
+    """Approximate LLM tokens as words plus punctuation marks.
+
+    Good enough to budget prompts without pulling in a model tokenizer; BPE
+    tokenizers land within ~30% of this for English and Hebrew prose.
+    """
+
+    return len(_TOKEN_PATTERN.findall(text or ""))
+
+
+def _blocks(lines: List[str]) -> List[str]:
+    """Paragraphs and list items, in order."""
+
+    blocks: List[str] = []
+    current: List[str] = []
+
+    def _flush() -> None:
+        if current:
+            blocks.append("\n".join(current).strip())
+            current.clear()
+
+    for line in lines:
+        if not line.strip():
+            _flush()
+        elif _LIST_ITEM_PATTERN.match(line):
+            _flush()
+            current.append(line.rstrip())
+        else:
+            current.append(line.rstrip())
+    _flush()
+    return [b for b in blocks if b]
+
+
+def split_passages(text: str, max_tokens: int = DEFAULT_PASSAGE_TOKENS) -> List[Dict]:
+    """Split markdown into passages that never cross a heading.
+
+    Each passage is ``{"heading", "text", "position"}`` where ``heading`` is the
+    nearest heading path (``"Fever — Home Care > When to seek care"``) and
+    ``position`` is the passage index within the document. Paragraphs and list
+    items are packed together up to ``max_tokens``; a single oversized block is
+    kept whole rather than cut mid-sentence.
+    """
+
+    sections: List[Tuple[str, List[str]]] = []
+    path: List[Tuple[int, str]] = []
+    body: List[str] = []
+
+    def _close() -> None:
+        if body:
+            sections.append((" > ".join(title for _, title in path), list(body)))
+            body.clear()
+
+    for line in (text or "").splitlines():
+        match = _HEADING_PATTERN.match(line)
+        if match:
+            _close()
+            level = len(match.group(1))
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, match.group(2)))
+            continue
+        body.append(line)
+    _close()
+
+    passages: List[Dict] = []
+    for heading, lines in sections:
+        chunk: List[str] = []
+        size = 0
+        for block in _blocks(lines):
+            tokens = count_tokens(block)
+            if chunk and size + tokens > max_tokens:
+                passages.append(
+                    {"heading": heading, "text": "\n".join(chunk), "position": 0}
+                )
+                chunk, size = [], 0
+            chunk.append(block)
+            size += tokens
+        if chunk:
+            passages.append(
+                {"heading": heading, "text": "\n".join(chunk), "position": 0}
+            )
+
+    for position, passage in enumerate(passages):
+        passage["position"] = position
+    return passages
+
+
+__all__ = ["DEFAULT_PASSAGE_TOKENS", "count_tokens", "split_passages"]
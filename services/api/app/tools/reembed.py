@@ -0,0 +1,414 @@
+"""Re-embed the indices with a new model behind aliases, without downtime.
+
+The configured index names (``ES_PRIVATE_INDEX`` etc.) are treated as aliases.
+For each one a versioned index (``<name>-<version>``) is created with the new
+model's dimensions and ``_meta.embeddings_model``, every document is copied
+from the live ``_source`` and re-embedded in batches (private memory included;
+encrypted values are copied as-is, only the plaintext ``name`` is embedded,
+and each document keeps or gains its ``user_id`` routing),
+and a few catch-up passes pick up writes that landed meanwhile. Once every
+kind is built, each gets one more catch-up pass (memory written while the
+later kinds were copying would otherwise miss the new index) and all aliases
+are swapped in one ``update_aliases`` call. A last pass after the swap copies
+documents that reached the old indices between that catch-up and the swap;
+it only adds missing documents (or newer ones, by ``updated_at``), so writes
+already made through the new alias are never overwritten or pruned. The API
+keeps serving the old indices until the swap and switches its query model on
+its next ``sync_embeddings_model`` check; memory writes embed with the model
+recorded on the index, which each worker caches for at most that long.
+
+The model is loaded strictly before any index is created: a model that fails
+to load aborts the job instead of falling back to stub vectors.
+
+A pre-alias concrete index holds the name its alias needs, so the swap removes
+it. Just before, it is made read-only and cloned to ``<name>-pre-<version>``
+as its rollback copy; writes in that short window fail rather than vanish, and
+the post-swap pass reads from the clone.
+
+New indices get the current ``ES_VECTOR_INDEX_TYPE``/``ES_HNSW_*`` vector
+options and are built under the bulk-load ``index_settings("ingest")``, then
+switched to serving settings before the swap. Running the job with the model
+the indices already use is the migration path for index settings (e.g. float
+``hnsw`` to ``int8_hnsw``): the stored vectors are copied instead of recomputed.
+
+A failed run leaves the live aliases untouched; the half-built versioned
+indices can be deleted and the job re-run.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from elasticsearch import helpers
+
+from app.tools import embeddings, es_client, ingest
+
+logger = logging.getLogger(__name__)
+
+_CATCH_UP_WINDOW = 500
+DEFAULT_CATCH_UP_PASSES = 3
+
+
+@dataclass
+class _Plan:
+    kind: str
+    alias: str
+    target: str
+    sources: List[str]
+    is_alias: bool
+    reuse_vectors: bool = False
+    stats: ingest.IngestStats = field(default_factory=ingest.IngestStats)
+
+
+def concrete_indices(es: Any, name: str) -> Tuple[List[str], bool]:
+    """Indices behind ``name`` and whether ``name`` is an alias."""
+
+    if es.indices.exists_alias(name=name):
+        return sorted(dict(es.indices.get_alias(name=name))), True
+    if es.indices.exists(index=name):
+        return [name], False
+    return [], False
+
+
+def _scan(es: Any, index: str, with_vectors: bool = False) -> Iterator[Dict[str, Any]]:
+    options: Dict[str, Any] = {} if with_vectors else {"source_excludes": ["embedding"]}
+    return iter(
+        helpers.scan(es, index=index, query={"query": {"match_all": {}}}, **options)
+    )
+
+
+def _routing(hit: Dict[str, Any], kind: str) -> Optional[str]:
+    routing = hit.get("_routing")
+    user_id = (hit.get("_source") or {}).get("user_id")
+    if routing is None and kind == "private" and user_id:
+        # Memory written before routing moves to its owner's shard
+        routing = es_client.user_routing(user_id)
+    return routing
+
+
+def _record(
+    hit: Dict[str, Any],
+    kind: str,
+    target: str,
+    model: str,
+    keep_vector: bool = False,
+) -> ingest.Record:
+    source = dict(hit.get("_source") or {})
+    if not keep_vector:
+        source.pop("embedding", None)
+    text = ingest.EMBED_TEXT[kind](source)
+    if ingest.HASH_FIELD in source:
+        # Keep incremental ingest working against the new index
+        source[ingest.HASH_FIELD] = ingest.content_hash(source, text, model)
+    action = {
+        "_op_type": "index",
+        "_index": target,
+        "_id": hit["_id"],
+        "_source": source,
+    }
+    routing = _routing(hit, kind)
+    if routing is not None:
+        action["routing"] = routing
+    return action, text
+
+
+def _stored_vectors(
+    records: Iterable[ingest.Record], expected: int
+) -> Iterator[Dict[str, Any]]:
+    for action, _ in records:
+        vector = action["_source"].get("embedding")
+        if not isinstance(vector, list) or len(vector) != expected:
+            raise ValueError(
+                f"{action['_id']} has no stored {expected}-dim embedding to reuse"
+            )
+        yield action
+
+
+def _actions(
+    plan: _Plan, records: Iterable[ingest.Record], model: str, batch_size: int
+) -> Iterator[Dict[str, Any]]:
+    """Bulk actions for ``records``: stored vectors when reusable, else embedded."""
+
+    if plan.reuse_vectors:
+        return _stored_vectors(records, embeddings.dims(model))
+    return ingest.embed_records(records, batch_size, model=model)
+
+
+def _built_with(es: Any, sources: Sequence[str], model: str) -> bool:
+    """Whether every source index records ``model`` in its ``_meta``."""
+
+    try:
+        return bool(sources) and all(
+            es_client.indexed_embeddings_model(es, source) == model
+            for source in sources
+        )
+    except Exception as exc:
+        logger.warning("Could not read the model of %s: %s", ", ".join(sources), exc)
+        return False
+
+
+def _throttle(records: Iterable[Any], max_docs_per_s: Optional[float]) -> Iterator[Any]:
+    if not max_docs_per_s or max_docs_per_s <= 0:
+        yield from records
+        return
+    started = time.monotonic()
+    for n, record in enumerate(records, start=1):
+        yield record
+        ahead = n / max_docs_per_s - (time.monotonic() - started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def _comparable(source: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    skip = {"embedding", ingest.HASH_FIELD}
+    return {k: v for k, v in (source or {}).items() if k not in skip}
+
+
+def _newer(source: Optional[Dict[str, Any]], copy: Dict[str, Any]) -> bool:
+    ours, theirs = (source or {}).get("updated_at"), copy.get("updated_at")
+    return bool(ours and theirs and str(ours) > str(theirs))
+
+
+def _catch_up_records(
+    es: Any, plan: _Plan, model: str, seen: Set[str], after_swap: bool = False
+) -> Iterator[ingest.Record]:
+    """Source docs that are missing from the target or differ from their copy.
+
+    ``after_swap`` the target takes live writes, so only missing docs and
+    docs with a newer ``updated_at`` than the target's copy qualify.
+    """
+
+    for source_index in plan.sources:
+        hits = _scan(es, source_index, with_vectors=plan.reuse_vectors)
+        while True:
+            window = list(islice(hits, _CATCH_UP_WINDOW))
+            if not window:
+                break
+            seen.update(hit["_id"] for hit in window)
+            refs = []
+            for hit in window:
+                ref = {"_id": hit["_id"]}
+                routing = _routing(hit, plan.kind)
+                if routing is not None:
+                    ref["routing"] = routing
+                refs.append(ref)
+            resp = es.mget(index=plan.target, docs=refs, source_excludes=["embedding"])
+            copies = {
+                doc["_id"]: doc.get("_source")
+                for doc in resp["docs"]
+                if doc.get("found")
+            }
+            for hit in window:
+                copy = copies.get(hit["_id"])
+                if copy is None:
+                    stale = True
+                elif after_swap:
+                    stale = _newer(hit["_source"], copy)
+                else:
+                    stale = _comparable(copy) != _comparable(hit["_source"])
+                if stale:
+                    yield _record(
+                        hit, plan.kind, plan.target, model, plan.reuse_vectors
+                    )
+
+
+def _catch_up(
+    es: Any,
+    plan: _Plan,
+    model: str,
+    options: Dict[str, Any],
+    after_swap: bool = False,
+) -> int:
+    for source_index in plan.sources:
+        es.indices.refresh(index=source_index)
+    es.indices.refresh(index=plan.target)
+    seen: Set[str] = set()
+    stats = ingest.IngestStats()
+    records = _catch_up_records(es, plan, model, seen, after_swap)
+    ingest.write(
+        es,
+        _actions(plan, records, model, options["batch_size"]),
+        stats,
+        chunk_size=options["chunk_size"],
+        threads=options["threads"],
+    )
+    # Documents deleted from the live index since they were copied (after the
+    # swap a missing source doc may be a new write, so nothing is pruned)
+    deleted = ingest.prune(es, plan.target, seen) if seen and not after_swap else 0
+    plan.stats.docs += stats.docs
+    plan.stats.errors += stats.errors
+    plan.stats.deleted += deleted
+    return stats.docs + deleted
+
+
+def _keep_copy(es: Any, index: str, version: str) -> str:
+    """Clone a pre-alias concrete index, which the swap deletes, for rollback.
+
+    Cloning needs the source read-only, so writes to it fail from here until
+    the swap points its name at the new index.
+    """
+
+    copy = f"{index}-pre-{version}"
+    es.indices.put_settings(index=index, settings={"index.blocks.write": True})
+    es.indices.clone(index=index, target=copy)
+    es.indices.put_settings(index=copy, settings={"index.blocks.write": False})
+    logger.info("Kept %s as %s for rollback", index, copy)
+    return copy
+
+
+def _swap_actions(plans: Sequence[_Plan]) -> List[Dict[str, Any]]:
+    actions: List[Dict[str, Any]] = []
+    for plan in plans:
+        for source in plan.sources:
+            if plan.is_alias:
+                actions.append({"remove": {"index": source, "alias": plan.alias}})
+            else:
+                # A pre-alias concrete index holds the name the alias needs
+                actions.append({"remove_index": {"index": source}})
+        actions.append({"add": {"index": plan.target, "alias": plan.alias}})
+    return actions
+
+
+def run(
+    es: Any,
+    model: str,
+    *,
+    version: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    threads: Optional[int] = None,
+    max_docs_per_s: Optional[float] = None,
+    catch_up_passes: int = DEFAULT_CATCH_UP_PASSES,
+    delete_old: bool = False,
+    index_type: Optional[str] = None,
+    reuse_vectors: Optional[bool] = None,
+    kinds: Optional[Sequence[str]] = None,
+) -> Dict[str, ingest.IngestStats]:
+    """Rebuild every index with ``model`` and swap the aliases; stats per kind.
+
+    A new model moves all kinds together: queries use one model, so the
+    indices must too.
+
+    ``batch_size``/``chunk_size``/``threads`` default to the ``INGEST_*``
+    settings; ``max_docs_per_s`` caps the copy rate to spare the live cluster.
+    Old indices are kept for rollback unless ``delete_old`` is set (a
+    pre-alias concrete index gives its name to the alias and is kept as a
+    ``<name>-pre-<version>`` clone). Raises before creating any index if
+    ``model`` cannot be loaded.
+
+    ``index_type`` overrides ``ES_VECTOR_INDEX_TYPE`` for the new indices.
+    ``reuse_vectors`` copies stored embeddings instead of recomputing them; by
+    default it is on for indices whose ``_meta`` already records ``model``.
+    ``kinds`` rebuilds only some indices (e.g. ``["private"]`` to move memory
+    onto user routing); that is limited to the active model.
+    """
+
+    kinds = list(kinds or es_client.INDEX_KINDS)
+    unknown = set(kinds) - set(es_client.INDEX_KINDS)
+    if unknown:
+        raise ValueError(f"Unknown index kinds: {', '.join(sorted(unknown))}")
+    if set(kinds) != set(es_client.INDEX_KINDS) and model != embeddings.MODEL:
+        raise ValueError("A new model must be applied to all indices together")
+    # Never rebuild the live indices from stub vectors of a model that failed
+    embeddings.require_model(model)
+    version = version or time.strftime("v%Y%m%d%H%M%S", time.gmtime())
+    batch_size = batch_size or ingest.default_batch_size()
+    options: Dict[str, Any] = {
+        "batch_size": batch_size,
+        "chunk_size": chunk_size,
+        "threads": threads,
+    }
+    mappings = es_client.index_mappings(
+        embeddings.dims(model), model, es_client.vector_index_options(index_type)
+    )
+    names = es_client.index_names()
+
+    plans: List[_Plan] = []
+    for kind in kinds:
+        alias = names[kind]
+        sources, is_alias = concrete_indices(es, alias)
+        plan = _Plan(kind, alias, f"{alias}-{version}", sources, is_alias)
+        if plan.target in sources:
+            raise ValueError(f"{plan.target} is already live; pick another version")
+        plan.reuse_vectors = (
+            _built_with(es, sources, model) if reuse_vectors is None else reuse_vectors
+        )
+        es.indices.create(
+            index=plan.target,
+            mappings=mappings[kind],
+            settings=es_client.index_settings("ingest"),
+        )
+        started = time.perf_counter()
+        logger.info(
+            "%s %s (%s) into %s with %s",
+            "Copying" if plan.reuse_vectors else "Re-embedding",
+            alias,
+            ", ".join(sources) or "empty",
+            plan.target,
+            model,
+        )
+        for source_index in sources:
+            records = (
+                _record(hit, kind, plan.target, model, plan.reuse_vectors)
+                for hit in _scan(es, source_index, with_vectors=plan.reuse_vectors)
+            )
+            ingest.write(
+                es,
+                _actions(plan, _throttle(records, max_docs_per_s), model, batch_size),
+                plan.stats,
+                chunk_size=chunk_size,
+                threads=threads,
+            )
+        for _ in range(catch_up_passes if sources else 0):
+            if not _catch_up(es, plan, model, options):
+                break
+        if not ingest.apply_index_settings(es, plan.target, "serving"):
+            # Serving from an index that never refreshes would hide new writes
+            raise RuntimeError(f"Could not switch {plan.target} to serving settings")
+        es.indices.refresh(index=plan.target)
+        plan.stats.seconds = time.perf_counter() - started
+        plan.stats.peak_rss_mb = ingest.peak_rss_mb()
+        logger.info("Re-embedded %s: %s", alias, plan.stats.summary())
+        plans.append(plan)
+
+    # Writes kept landing in the live indices while later kinds were copied
+    for plan in plans:
+        if plan.sources and _catch_up(es, plan, model, options):
+            es.indices.refresh(index=plan.target)
+    copies = {
+        plan.kind: _keep_copy(es, plan.sources[0], version)
+        for plan in plans
+        if plan.sources and not plan.is_alias
+    }
+    try:
+        es.indices.update_aliases(actions=_swap_actions(plans))
+    except Exception:
+        for plan in plans:
+            if plan.kind in copies:
+                es.indices.put_settings(
+                    index=plan.sources[0], settings={"index.blocks.write": False}
+                )
+        raise
+    logger.info("Swapped %s to version %s", ", ".join(p.alias for p in plans), version)
+    # This process follows immediately; API workers on their next model check
+    embeddings.set_model(model)
+
+    # Writes that reached the old indices between the last catch-up and the swap
+    for plan in plans:
+        if plan.kind in copies:
+            plan.sources = [copies[plan.kind]]
+        if plan.sources and _catch_up(es, plan, model, options, after_swap=True):
+            es.indices.refresh(index=plan.target)
+
+    if delete_old:
+        for plan in plans:
+            if plan.sources:
+                es.indices.delete(index=",".join(plan.sources))
+    return {plan.kind: plan.stats for plan in plans}
+
+
+__all__ = ["DEFAULT_CATCH_UP_PASSES", "concrete_indices", "run"]
@@ -0,0 +1,161 @@
+"""Nested timing spans for the work inside graph nodes.
+
+``span(name, **attrs)`` works as a context manager or a decorator::
+
+    with span("es.search", index="public_medical_kb") as s:
+        ...
+        s.attrs["hits"] = len(hits)
+
+    @span("llm.ollama")
+    def _call_ollama(...): ...
+
+Spans opened while another is active become its children; the current span
+travels in a context var, so it follows nodes into LangGraph's executor
+threads like the request id does. ``_wrap_node`` opens one span per node and
+copies its children into the node's ``debug.trace`` entry.
+
+With ``SPANS_EXPORT_PATH`` set, every finished top-level span (normally one
+per node run) is also appended to that file as a JSON line with its request
+id and nested spans.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from time import perf_counter
+from typing import IO, Any, Dict, Iterator, List, Optional
+
+from app.config.logging import get_request_id
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ("name", "attrs", "children", "error", "start", "elapsed_ms")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.children: List["Span"] = []
+        self.error = False
+        self.start = perf_counter()
+        self.elapsed_ms = 0.0
+
+    def self_ms(self) -> float:
+        """Time not covered by child spans (the span's own work)."""
+
+        return max(0.0, self.elapsed_ms - sum(c.elapsed_ms for c in self.children))
+
+    def to_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"name": self.name, "elapsed_ms": self.elapsed_ms}
+        if self.attrs:
+            out["attrs"] = self.attrs
+        if self.error:
+            out["error"] = True
+        if self.children:
+            out["spans"] = [c.to_dict() for c in self.children]
+        return out
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "span", default=None
+)
+
+
+def current() -> Optional[Span]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Span]:
+    parent = _current.get()
+    s = Span(name, attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException:
+        s.error = True
+        raise
+    finally:
+        s.elapsed_ms = (perf_counter() - s.start) * 1000.0
+        _current.reset(token)
+        if parent is not None:
+            parent.children.append(s)
+        else:
+            _export(s)
+
+
+class JsonLinesExporter:
+    """Appends one JSON object per top-level span to ``path``."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._file: Optional[IO[str]] = None
+
+    def export(self, s: Span) -> None:
+        record = {
+            "ts": time.time(),
+            "request_id": get_request_id(),
+            **s.to_dict(),
+        }
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                # Line-buffered so the file can be tailed while the API runs
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_exporter: Optional[JsonLinesExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def _get_exporter() -> Optional[JsonLinesExporter]:
+    global _exporter
+    path = os.getenv("SPANS_EXPORT_PATH", "").strip()
+    exporter = _exporter
+    if exporter is not None and exporter.path == path:
+        return exporter
+    with _exporter_lock:
+        if _exporter is not None and _exporter.path != path:
+            _exporter.close()
+            _exporter = None
+        if path and _exporter is None:
+            _exporter = JsonLinesExporter(path)
+        return _exporter
+
+
+def _export(s: Span) -> None:
+    exporter = _get_exporter()
+    if exporter is None:
+        return
+    try:
+        exporter.export(s)
+    except OSError as exc:
+        logger.warning("Failed exporting span %s: %s", s.name, exc)
+
+
+def close() -> None:
+    """Close the export file (app shutdown)."""
+
+    global _exporter
+    with _exporter_lock:
+        if _exporter is not None:
+            _exporter.close()
+            _exporter = None
+
+
+__all__ = ["JsonLinesExporter", "Span", "close", "current", "span"]
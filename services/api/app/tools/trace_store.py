@@ -0,0 +1,248 @@
+"""Per-request traces and rolling per-node latency, for ``/api/debug``.
+
+``traces`` keeps the node trace of the last ``TRACE_STORE_SIZE`` graph runs
+(default 256) keyed by request id, so concurrent requests no longer overwrite
+each other's debug view. ``latency`` keeps the last ``TRACE_LATENCY_WINDOW``
+node timings (default 1000) per node and intent, fed by ``_wrap_node``, and
+reports p50/p95/p99 and error counts over that window: enough to see which
+node regressed under load, and for which kind of query.
+
+``profile`` keeps, over the same window, each node's thread CPU time and (with
+``TRACE_MEMORY=true``) the bytes it left allocated and its peak above the
+starting point, as measured by ``tracemalloc``. CPU-heavy nodes are worth
+optimizing; nodes whose wall time is mostly waiting want concurrency instead.
+tracemalloc is process-wide and slows allocation noticeably, so memory
+figures are for profiling runs and are only exact when nodes do not overlap.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import tracemalloc
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 256
+DEFAULT_WINDOW = 1000
+# Nodes that run before the supervisor classifies the query
+UNCLASSIFIED = "unclassified"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, str(default))))
+    except ValueError:
+        logger.warning("Invalid %s; using %s", name, default)
+        return default
+
+
+def percentile(ordered: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted, non-empty sequence."""
+
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+class TraceStore:
+    """The most recent run records, keyed by request id (oldest evicted first)."""
+
+    def __init__(self, size: Optional[int] = None) -> None:
+        self.size = _env_int("TRACE_STORE_SIZE", DEFAULT_SIZE) if size is None else size
+        self._records: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, request_id: str, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._records.pop(request_id, None)
+            self._records[request_id] = record
+            while len(self._records) > self.size:
+                self._records.popitem(last=False)
+
+    def get(self, request_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._records.get(request_id)
+
+    def request_ids(self) -> List[str]:
+        """Stored request ids, newest first."""
+
+        with self._lock:
+            return list(reversed(self._records))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+
+class NodeLatency:
+    """Rolling window of node timings and errors per (node, intent)."""
+
+    def __init__(self, window: Optional[int] = None) -> None:
+        self.window = (
+            _env_int("TRACE_LATENCY_WINDOW", DEFAULT_WINDOW)
+            if window is None
+            else window
+        )
+        self._samples: Dict[Tuple[str, str], Deque[Tuple[float, bool]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(
+        self, node: str, intent: Optional[str], elapsed_ms: float, error: bool = False
+    ) -> None:
+        key = (node, intent or UNCLASSIFIED)
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append((elapsed_ms, error))
+
+    @staticmethod
+    def _summary(samples: Sequence[Tuple[float, bool]]) -> Dict[str, Any]:
+        ordered = sorted(ms for ms, _ in samples)
+        return {
+            "count": len(ordered),
+            "errors": sum(1 for _, error in samples if error),
+            "p50_ms": percentile(ordered, 50),
+            "p95_ms": percentile(ordered, 95),
+            "p99_ms": percentile(ordered, 99),
+            "max_ms": ordered[-1],
+        }
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Per node: the summary over all intents plus one per intent."""
+
+        with self._lock:
+            copied = {key: list(samples) for key, samples in self._samples.items()}
+        by_node: Dict[str, Dict[str, List[Tuple[float, bool]]]] = {}
+        for (node, intent), samples in copied.items():
+            by_node.setdefault(node, {})[intent] = samples
+        return {
+            node: {
+                **self._summary([s for samples in intents.values() for s in samples]),
+                "by_intent": {
+                    intent: self._summary(samples)
+                    for intent, samples in sorted(intents.items())
+                },
+            }
+            for node, intents in sorted(by_node.items())
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+def memory_tracking() -> bool:
+    return os.getenv("TRACE_MEMORY", "false").strip().lower() == "true"
+
+
+def memory_start() -> Optional[int]:
+    """Traced bytes now, with the peak reset; ``None`` unless ``TRACE_MEMORY``."""
+
+    if not memory_tracking():
+        return None
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def memory_stop(start: Optional[int]) -> Dict[str, int]:
+    """``alloc_bytes`` (net, may be negative) and ``peak_bytes`` since ``start``."""
+
+    if start is None or not tracemalloc.is_tracing():
+        return {}
+    current, peak = tracemalloc.get_traced_memory()
+    return {"alloc_bytes": current - start, "peak_bytes": max(0, peak - start)}
+
+
+class NodeProfile:
+    """Rolling window of wall time, CPU time and memory per node run."""
+
+    def __init__(self, window: Optional[int] = None) -> None:
+        self.window = (
+            _env_int("TRACE_LATENCY_WINDOW", DEFAULT_WINDOW)
+            if window is None
+            else window
+        )
+        self._samples: Dict[
+            str, Deque[Tuple[float, float, Optional[int], Optional[int]]]
+        ] = {}
+        self._lock = threading.Lock()
+
+    def observe(
+        self,
+        node: str,
+        wall_ms: float,
+        cpu_ms: float,
+        alloc_bytes: Optional[int] = None,
+        peak_bytes: Optional[int] = None,
+    ) -> None:
+        with self._lock:
+            samples = self._samples.get(node)
+            if samples is None:
+                samples = self._samples[node] = deque(maxlen=self.window)
+            samples.append((wall_ms, cpu_ms, alloc_bytes, peak_bytes))
+
+    @staticmethod
+    def _summary(
+        node: str, samples: Sequence[Tuple[float, float, Optional[int], Optional[int]]]
+    ) -> Dict[str, Any]:
+        runs = len(samples)
+        wall = sum(s[0] for s in samples) / runs
+        cpu = sum(s[1] for s in samples) / runs
+        out: Dict[str, Any] = {
+            "node": node,
+            "runs": runs,
+            "wall_ms_avg": wall,
+            "cpu_ms_avg": cpu,
+            # Near 1: CPU bound; near 0: mostly waiting on ES, LLM or a slot
+            "cpu_share": min(1.0, cpu / wall) if wall else 0.0,
+        }
+        measured = [s for s in samples if s[2] is not None]
+        if measured:
+            out["alloc_bytes_avg"] = sum(s[2] or 0 for s in measured) / len(measured)
+            out["peak_bytes_avg"] = sum(s[3] or 0 for s in measured) / len(measured)
+            out["peak_bytes_max"] = max(s[3] or 0 for s in measured)
+        return out
+
+    def ranking(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Node summaries ranked by mean CPU per run, and by mean peak memory."""
+
+        with self._lock:
+            copied = {node: list(samples) for node, samples in self._samples.items()}
+        nodes = [self._summary(node, samples) for node, samples in copied.items()]
+        return {
+            "by_cpu": sorted(nodes, key=lambda n: n["cpu_ms_avg"], reverse=True),
+            "by_memory": sorted(
+                (n for n in nodes if "peak_bytes_avg" in n),
+                key=lambda n: n["peak_bytes_avg"],
+                reverse=True,
+            ),
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+traces = TraceStore()
+latency = NodeLatency()
+profile = NodeProfile()
+
+
+__all__ = [
+    "NodeLatency",
+    "NodeProfile",
+    "TraceStore",
+    "latency",
+    "memory_start",
+    "memory_stop",
+    "memory_tracking",
+    "percentile",
+    "profile",
+    "traces",
+]
@@ -47,6 +47,10 @@ def set_test_env(monkeypatch, tmp_path):
     # Mock settings directly to ensure they are set before configure_logging is called
     monkeypatch.setattr(settings, "data_dir", str(tmp_path))
     monkeypatch.setattr(settings, "log_file", str(tmp_path / "test_api.log"))
+    # Per-index write model cache is process-wide; start every test empty
+    from app.tools import es_client
+
+    monkeypatch.setattr(es_client, "_write_models", {})
 
 
 @pytest.fixture(autouse=True)  # Apply automatically to all tests
@@ -98,11 +102,12 @@ def fake_embed(monkeypatch):
 class _FakeES:
     def __init__(self):
         self.calls = []
+        self.routing = []  # routing passed with each search/index call
         self.handlers = []  # list of (predicate, response)
         self.indices = self._Indices()
 
     class _Indices:
-        def create(self, index, body):
+        def create(self, index, body=None, **kwargs):
             pass
 
         def exists(self, index):
@@ -116,6 +121,7 @@ class _FakeES:
 
     def search(self, index: str, body: dict, **kwargs):
         self.calls.append((index, json.loads(json.dumps(body))))
+        self.routing.append(kwargs.get("routing"))
         for pred, resp in self.handlers:
             try:
                 if pred(index, body):
@@ -125,8 +131,9 @@ class _FakeES:
         # default empty
         return {"hits": {"hits": []}}
 
-    def index(self, index: str, id: str, document: dict):
+    def index(self, index: str, id: str, document: dict, **kwargs):
         self.calls.append(("index", index, id, document))
+        self.routing.append(kwargs.get("routing"))
 
     def msearch(self, body):
         self.calls.append(("msearch", json.loads(json.dumps(body))))
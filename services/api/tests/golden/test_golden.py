@@ -84,12 +84,11 @@ def test_golden_cases(
         def _prefs_pred(index: str, body: Dict[str, Any]) -> bool:
             if not index.endswith("private_user_memory"):
                 return False
-            term = body.get("query", {}).get("term")
-            if term and term.get("user_id") == user_id:
+            owner = {"term": {"user_id": user_id}}
+            if owner in body.get("query", {}).get("bool", {}).get("filter", []):
                 return True
             knn = body.get("knn", {})
-            filt_term = knn.get("filter", {}).get("term", {})
-            return filt_term.get("user_id") == user_id
+            return owner in knn.get("filter", {}).get("bool", {}).get("filter", [])
 
         fake_es.add_handler(_prefs_pred, _preferences_hits(user_id, preferences))
 
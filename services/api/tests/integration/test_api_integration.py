@@ -1,6 +1,8 @@
 import pytest
 from unittest.mock import patch
 
+from app.tools import memory_admin, memory_ttl, memory_writer
+
 
 def test_healthz(client):
     r = client.get("/healthz")
@@ -75,6 +77,99 @@ def test_add_med_endpoint(mock_get_es_client, mock_embed, client):
     args, kwargs = mock_get_es_client.return_value.index.call_args
     assert kwargs["document"]["name"] == "Ibuprofen 200mg"
     assert kwargs["document"]["normalized"]["ingredient"] == "ibuprofen"
+    assert kwargs["routing"] == "test"
+    assert kwargs["document"]["updated_at"]
+    assert kwargs["document"]["ttl_days"] == memory_ttl.default_ttl_days()
+
+
+@patch("app.main.embed", return_value=[[0.1, 0.2, 0.3]])
+@patch("app.main.get_es_client")
+def test_memory_writes_embed_with_the_private_index_model(
+    mock_get_es_client, mock_embed, client
+):
+    from app.tools import embeddings, es_client
+
+    # A re-embed swap this worker has not synced to yet
+    mock_get_es_client.return_value.indices.get_mapping.return_value = {
+        "user_private_memory-v2": {"mappings": {"_meta": {"embeddings_model": "new"}}}
+    }
+    payload = {"user_id": "test", "name": "Ibuprofen 200mg"}
+    assert client.post("/api/memory/add_med", json=payload).status_code == 200
+    assert mock_embed.call_args.kwargs == {"model": "new"}
+    # Cached per index: the next write makes no mapping round trip
+    assert client.post("/api/memory/add_med", json=payload).status_code == 200
+    assert mock_get_es_client.return_value.indices.get_mapping.call_count == 1
+
+    # Unreadable mapping with nothing cached: the active model
+    es_client._write_models.clear()
+    mock_get_es_client.return_value.indices.get_mapping.side_effect = RuntimeError
+    assert client.post("/api/memory/add_med", json=payload).status_code == 200
+    assert mock_embed.call_args.kwargs == {"model": embeddings.MODEL}
+
+
+@patch("app.main.embed", return_value=[[0.1, 0.2, 0.3]])
+@patch("app.main.get_es_client")
+def test_add_med_ttl_override(mock_get_es_client, mock_embed, client):
+    payload = {"user_id": "test", "name": "Amoxicillin", "ttl_days": 0}
+    assert client.post("/api/memory/add_med", json=payload).status_code == 200
+    doc = mock_get_es_client.return_value.index.call_args.kwargs["document"]
+    assert doc["ttl_days"] == 0 and "expires_at" not in doc
+
+    payload["ttl_days"] = -1
+    assert client.post("/api/memory/add_med", json=payload).status_code == 422
+
+
+@patch("app.main.get_es_client")
+def test_memory_bulk_endpoint(mock_get_es_client, client, monkeypatch):
+    from app.tools import crypto
+
+    batches = []
+
+    def fake_bulk(es, actions, raise_on_error=True, **options):
+        batches.append((list(actions), options))
+        return len(batches[-1][0]), []
+
+    monkeypatch.setattr(memory_writer.helpers, "bulk", fake_bulk)
+    embedded = []
+    monkeypatch.setattr(
+        "app.main.embed",
+        lambda texts, model=None: embedded.append(texts) or [[0.0]] * len(texts),
+    )
+    payload = {
+        "user_id": "bulk-user",
+        "meds": [
+            {"name": "Ibuprofen 200mg", "value": "1 tab"},
+            {"name": "Warfarin", "ttl_days": 30},
+        ],
+        "preferences": [{"name": "preferred_kinds", "value": "lab"}],
+        "ttl_days": 0,
+        "wait_for": True,
+    }
+    r = client.post("/api/memory/bulk", json=payload)
+    assert r.json() == {"ok": True, "written": 3, "errors": 0}
+    assert embedded == [["Ibuprofen 200mg", "Warfarin", "preferred_kinds"]]
+
+    actions, options = batches[0]
+    assert options == {"refresh": "wait_for"}
+    assert {a["routing"] for a in actions} == {"bulk-user"}
+    ibu, warf, pref = (a["_source"] for a in actions)
+    assert crypto.decrypt_for_user("bulk-user", ibu["value"]) == "1 tab"
+    assert ibu["ttl_days"] == 0 and warf["ttl_days"] == 30
+    assert warf["value"] == "" and pref["value"] == "lab"
+
+    # Without wait_for the facts are queued and written by the flush thread
+    payload.update(wait_for=False, meds=[])
+    assert client.post("/api/memory/bulk", json=payload).json() == {
+        "ok": True,
+        "queued": 1,
+    }
+    client.app.state.memory_writer.flush()
+    assert len(batches) == 2
+
+    assert client.post("/api/memory/bulk", json={"user_id": "u"}).json() == {
+        "ok": True,
+        "queued": 0,
+    }
 
 
 @patch("app.main.embed", return_value=[[0.1, 0.2, 0.3]])
@@ -90,6 +185,7 @@ def test_add_med_encrypted_value(mock_embed, client, fake_es):
     index_calls = [c for c in fake_es.calls if c and c[0] == "index"]
     assert index_calls, "Expected at least one index call"
     _, _, _, doc = index_calls[-1]
+    assert fake_es.routing[-1] == user_id
     assert doc.get("user_id") == user_id
     assert doc.get("name") == "Ibuprofen 200mg"
     assert doc.get("value_encrypted") is True
@@ -239,6 +335,76 @@ def test_debug_endpoints_after_run(client, fake_es, fake_pipe, sample_docs):
     assert isinstance(risk_payload["labels"], list)
 
 
+def test_debug_trace_by_request_id_and_latency(client, fake_es, fake_pipe, sample_docs):
+    hits, fever_doc, _, _, _ = sample_docs
+    fake_es.add_handler(
+        lambda index, body: index.endswith("public_medical_kb"),
+        hits([fever_doc]),
+    )
+    fake_pipe.run(urgent_care=0.1, see_doctor=0.2, self_care=0.7, info_only=0.0)
+
+    payload = {"user_id": "trace-user", "query": "I have a fever"}
+    for rid in ("trace-a", "trace-b"):
+        r = client.post("/api/graph/run", headers={"X-Request-ID": rid}, json=payload)
+        assert r.status_code == 200
+
+    record = client.get("/api/debug/trace/trace-a").json()
+    assert record["request_id"] == "trace-a"
+    assert record["intent"] == "symptom"
+    assert [e["node"] for e in record["trace"]][:2] == ["scrub", "supervisor"]
+    assert client.get("/api/debug/trace").json()["recent"][:2] == [
+        "trace-b",
+        "trace-a",
+    ]
+    assert client.get("/api/debug/trace/unknown").status_code == 404
+
+    assert all("cpu_ms" in entry for entry in record["trace"])
+    prof = client.get("/api/debug/profile").json()
+    assert prof["memory_tracking"] is False and prof["by_memory"] == []
+    cpu = [n["cpu_ms_avg"] for n in prof["by_cpu"]]
+    assert cpu == sorted(cpu, reverse=True)
+    assert "health" in {n["node"] for n in prof["by_cpu"]}
+
+    latency = client.get("/api/debug/latency").json()
+    health = latency["nodes"]["health"]
+    assert health["by_intent"]["symptom"]["count"] >= 2
+    assert set(health) >= {"p50_ms", "p95_ms", "p99_ms", "errors"}
+
+
+def test_metrics_endpoint_after_run(client, fake_es, fake_pipe):
+    fake_pipe.run(urgent_care=0.1, see_doctor=0.1, self_care=0.8, info_only=0.0)
+    payload = {"user_id": "metrics-user", "query": "I have a fever"}
+    assert client.post("/api/graph/run", json=payload).status_code == 200
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = r.text
+    assert (
+        'http_requests_total{method="POST",route="/api/graph/run",status="200"}' in text
+    )
+    assert 'graph_node_duration_seconds_count{node="health",intent="symptom"}' in text
+    assert 'inference_duration_seconds_count{model="risk_ml"}' in text
+    assert "http_requests_in_flight 1" in text  # the scrape itself
+    assert "# TYPE inference_queued gauge" in text
+
+
+def test_debug_inference_reports_interactive_queue_stats(client, fake_es, fake_pipe):
+    fake_pipe.run(urgent_care=0.1, see_doctor=0.1, self_care=0.8, info_only=0.0)
+
+    payload = {"user_id": "sched-user", "query": "I have a fever"}
+    assert client.post("/api/graph/run", json=payload).status_code == 200
+
+    r = client.get("/api/debug/inference")
+    assert r.status_code == 200
+    data = r.json()
+    assert data["torch_threads"] >= 1
+    risk = data["models"]["risk_ml"]
+    assert risk["in_use"] == 0
+    assert risk["by_priority"]["interactive"]["count"] >= 1
+    assert "wait_ms_avg" in risk["by_priority"]["interactive"]
+
+
 def test_enforce_non_empty_query(client):
     payload = {"user_id": "test-user", "query": ""}
     r = client.post("/api/graph/run", json=payload)
@@ -272,18 +438,17 @@ def test_e2e_medication_interaction_flow(
 
     def memory_search_predicate(index, body):
         if index == "private_user_memory":
-            term_query = body.get("query", {}).get("term", {})
-            if term_query.get("user_id") == user_id:
+            filters = body.get("query", {}).get("bool", {}).get("filter", [])
+            if {"term": {"user_id": user_id}} in filters:
                 return True
         return False
 
+    def owned_by(owner):
+        return {"query": {"bool": {"filter": [{"term": {"user_id": owner}}]}}}
+
     # Cover predicate branches (positive/negative) for coverage
-    assert memory_search_predicate(
-        "private_user_memory", {"query": {"term": {"user_id": user_id}}}
-    )
-    assert not memory_search_predicate(
-        "private_user_memory", {"query": {"term": {"user_id": "other"}}}
-    )
+    assert memory_search_predicate("private_user_memory", owned_by(user_id))
+    assert not memory_search_predicate("private_user_memory", owned_by("other"))
 
     fake_es.add_handler(
         memory_search_predicate,
@@ -401,3 +566,42 @@ def test_e2e_medication_interaction_flow(
     assert len(set(citations)) == len(citations), "Citations should be deduplicated"
     assert "utm_" not in "".join(citations)
     assert all("#" not in c for c in citations)
+
+
+@patch("app.main.get_es_client")
+def test_memory_export_and_delete_endpoints(mock_get_es_client, client, monkeypatch):
+    monkeypatch.setattr(
+        memory_admin,
+        "export_ndjson",
+        lambda es, user_id: iter([f'{{"id": "{user_id}:1"}}\n']),
+    )
+    monkeypatch.setattr(
+        memory_admin,
+        "delete_user_memory",
+        lambda es, user_id, writer: {"ok": True, "deleted": 1, "user": user_id},
+    )
+
+    r = client.get("/api/memory/export", params={"user_id": "exp"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    assert r.text == '{"id": "exp:1"}\n'
+    assert client.get("/api/memory/export").status_code == 422
+
+    r = client.post("/api/memory/delete", json={"user_id": "exp"})
+    assert r.json() == {"ok": True, "deleted": 1, "user": "exp"}
+    assert client.post("/api/memory/delete", json={"user_id": ""}).status_code == 422
+
+
+@pytest.mark.parametrize("user_id", ["alice@example.com", "tenant:42"])
+def test_memory_endpoints_accept_user_ids_with_any_characters(
+    client, monkeypatch, user_id
+):
+    monkeypatch.setattr(
+        memory_admin,
+        "delete_user_memory",
+        lambda es, user_id, writer: {"ok": True, "user": user_id},
+    )
+
+    r = client.post("/api/memory/delete", json={"user_id": user_id})
+
+    assert r.json() == {"ok": True, "user": user_id}
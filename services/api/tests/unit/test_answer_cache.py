@@ -0,0 +1,207 @@
+import pytest
+
+from app.graph.nodes import answer_gen
+from app.graph.state import BodyState
+from app.tools import answer_cache
+from app.tools.answer_cache import AnswerCache
+
+
+def _gate(**overrides):
+    args = dict(
+        provider="ollama",
+        model="llama3",
+        language="en",
+        citations=["https://a", "https://b"],
+        triggers=[],
+        scope=answer_cache.SHARED_SCOPE,
+    )
+    args.update(overrides)
+    return answer_cache.make_gate(**args)
+
+
+def test_exact_hit_and_semantic_hit_within_gate():
+    cache = AnswerCache(max_entries=4, ttl_s=60, similarity=0.9)
+    cache.put("k1", "answer", _gate(), [1.0, 0.0, 0.0])
+
+    assert cache.get("k1") == "answer"
+    assert cache.get("other") is None
+    answer, score = cache.get_similar([0.99, 0.05, 0.0], _gate())
+    assert answer == "answer" and score > 0.9
+
+    stats = cache.stats()
+    assert stats["exact_hits"] == 1
+    assert stats["semantic_hits"] == 1
+    assert stats["hit_rate"] == 1.0
+
+
+def test_semantic_lookup_requires_identical_gate():
+    cache = AnswerCache(similarity=0.9)
+    # Citation order does not matter, the set does
+    cache.put("k1", "answer", _gate(citations=["https://b", "https://a"]), [1, 0, 0])
+
+    assert cache.get_similar([1, 0, 0], _gate()) is not None
+    assert cache.get_similar([1, 0, 0], _gate(citations=["https://a"])) is None
+    assert cache.get_similar([1, 0, 0], _gate(triggers=["chest_pain"])) is None
+    assert cache.get_similar([0, 1, 0], _gate()) is None
+    assert cache.get_similar([0, 0, 0], _gate()) is None
+    assert cache.stats()["misses"] == 4
+
+
+def test_ttl_expiry_and_lru_eviction(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now[0])
+    cache = AnswerCache(max_entries=2, ttl_s=10, similarity=0.9)
+
+    cache.put("a", "A", _gate(), [1, 0, 0])
+    cache.put("b", "B", _gate(), [0, 1, 0])
+    assert cache.get("a") == "A"  # a is now most recently used
+    cache.put("c", "C", _gate(), [0, 0, 1])
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+
+    now[0] += 11
+    assert cache.get("a") is None
+    assert cache.get_similar([0, 0, 1], _gate()) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_scope_isolates_personal_memory_facts():
+    facts = [{"entity": "medication", "name": "ibuprofen"}]
+    assert answer_cache.scope_for("u1", []) == answer_cache.SHARED_SCOPE
+    personal = answer_cache.scope_for("u1", facts)
+    assert personal.startswith("user:u1:")
+    assert answer_cache.scope_for("u2", facts) != personal
+    assert answer_cache.exact_key("p", "m", "en", "q", personal) != (
+        answer_cache.exact_key("p", "m", "en", "q")
+    )
+
+
+def test_invalidate_user_drops_only_that_users_entries():
+    cache = AnswerCache()
+    mine = answer_cache.scope_for("u1", [{"name": "ibuprofen"}])
+    theirs = answer_cache.scope_for("u10", [{"name": "ibuprofen"}])
+    cache.put("mine", "a", _gate(scope=mine))
+    cache.put("theirs", "b", _gate(scope=theirs))
+    cache.put("shared", "c", _gate())
+
+    assert cache.invalidate_user("u1") == 1
+    assert cache.get("mine") is None
+    assert cache.get("theirs") == "b" and cache.get("shared") == "c"
+    assert cache.stats()["invalidated"] == 1
+
+
+@pytest.fixture
+def enabled_cache(monkeypatch):
+    monkeypatch.setenv("ANSWER_CACHE_ENABLED", "true")
+    monkeypatch.setenv("LLM_PROVIDER", "ollama")
+    monkeypatch.setattr(answer_cache, "cache", AnswerCache(similarity=0.9))
+    calls = []
+
+    def fake_generate(provider, prompt, language):
+        calls.append(prompt)
+        return f"LLM answer {len(calls)}"
+
+    monkeypatch.setattr(answer_gen, "_generate_with_provider", fake_generate)
+    return calls
+
+
+def _state(query, user_id="u1", memory_facts=None):
+    return BodyState(
+        user_id=user_id,
+        user_query=query,
+        public_snippets=[
+            {"title": "Fever", "text": "Rest.", "source_url": "https://kb/fever"}
+        ],
+        citations=["https://kb/fever"],
+        memory_facts=memory_facts or [],
+        messages=[],
+    )
+
+
+def test_answer_gen_serves_exact_then_semantic_hits(enabled_cache):
+    first = answer_gen.run(_state("I have a fever"))
+    assert first["debug"]["answer_cache"]["result"] == "miss"
+
+    again = answer_gen.run(_state("I have a fever", user_id="u2"))
+    assert again["debug"]["answer_cache"]["result"] == "exact"
+
+    # Same embedding bucket in the test stub, different wording
+    similar = answer_gen.run(_state("fever since last night"))
+    info = similar["debug"]["answer_cache"]
+    assert info["result"] == "semantic"
+    assert info["hit_rate"] == pytest.approx(2 / 3, rel=1e-3)
+    assert "LLM answer 1" in similar["messages"][-1]["content"]
+    assert len(enabled_cache) == 1
+
+
+def test_answer_gen_never_shares_personal_entries(enabled_cache):
+    facts = [{"entity": "medication", "name": "warfarin"}]
+    answer_gen.run(_state("I have a fever", memory_facts=facts))
+    other = answer_gen.run(_state("I have a fever", user_id="u2", memory_facts=facts))
+
+    assert other["debug"]["answer_cache"]["result"] == "miss"
+    assert len(enabled_cache) == 2
+
+
+def test_answer_cache_disabled_by_default(monkeypatch):
+    monkeypatch.setenv("LLM_PROVIDER", "ollama")
+    monkeypatch.setattr(answer_gen, "_generate_with_provider", lambda *a: "LLM answer")
+    out = answer_gen.run(_state("I have a fever"))
+    assert "answer_cache" not in out.get("debug", {})
+
+
+def test_cache_clear_resets_entries_and_stats():
+    cache = AnswerCache()
+    cache.put("k", "answer", _gate(), [1.0, 0.0])
+    cache.get("k")
+    cache.clear()
+
+    stats = cache.stats()
+    assert stats["entries"] == 0
+    assert stats["exact_hits"] == 0 and stats["stores"] == 0
+    assert cache.get_similar(None, _gate()) is None
+
+
+def test_env_number_falls_back_on_invalid(monkeypatch, caplog):
+    monkeypatch.setenv("ANSWER_CACHE_TTL_S", "soon")
+    caplog.set_level("WARNING")
+    assert answer_cache._env_number("ANSWER_CACHE_TTL_S", 60.0) == 60.0
+    assert "Invalid ANSWER_CACHE_TTL_S" in caplog.text
+
+
+def test_exact_hit_skips_prompt_build_and_embedding(enabled_cache, monkeypatch):
+    embedded = []
+    real_embed = answer_gen.embeddings.embed
+
+    def counting_embed(texts, *args, **kwargs):
+        embedded.append(list(texts))
+        return real_embed(texts, *args, **kwargs)
+
+    monkeypatch.setattr(answer_gen.embeddings, "embed", counting_embed)
+    monkeypatch.setenv("PROMPT_TOKEN_BUDGET", "60")
+    state = _state("I have a fever")
+    state["public_snippets"][0]["text"] = "\n\n".join(
+        f"Passage {i} about fever care and fluids." * 4 for i in range(6)
+    )
+
+    first = answer_gen.run(state)
+    assert first["debug"]["answer_cache"]["result"] == "miss"
+    assert "prompt_passages" in first["debug"]
+    # The query is embedded once and reused for passage ranking
+    assert sum(batch.count("I have a fever") for batch in embedded) == 1
+
+    embedded.clear()
+    built = []
+    real_build = answer_gen._build_prompt
+    monkeypatch.setattr(
+        answer_gen,
+        "_build_prompt",
+        lambda *a, **k: built.append(1) or real_build(*a, **k),
+    )
+    again_state = _state("I have a fever", user_id="u2")
+    again_state["public_snippets"] = state["public_snippets"]
+    again = answer_gen.run(again_state)
+
+    assert again["debug"]["answer_cache"]["result"] == "exact"
+    assert embedded == [] and built == []
+    assert len(enabled_cache) == 1
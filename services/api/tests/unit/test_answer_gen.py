@@ -1,13 +1,15 @@
+import asyncio
 import os
 import builtins
 import sys
+import time
 import json
 
 import pytest
 
 from app.graph.nodes import answer_gen
 from app.graph.state import BodyState
-from app.tools import med_facts
+from app.tools import llm_clients, med_facts, onset_texts
 
 
 def test_answer_gen_skips_when_provider_none(monkeypatch):
@@ -50,6 +52,18 @@ def test_answer_gen_meds_onset_uses_med_facts(monkeypatch):
     assert citations[0].startswith("https://")
 
 
+def _onset_state():
+    return BodyState(
+        user_query="אקמול מתי משפיע",
+        user_query_redacted="אקמול מתי משפיע",
+        intent="meds",
+        sub_intent="onset",
+        language="he",
+        debug={"normalized_query_meds": ["acetaminophen"]},
+        messages=[],
+    )
+
+
 def test_answer_gen_meds_onset_paraphrases_when_enabled(monkeypatch):
     med_facts.clear_cache()
     monkeypatch.setenv("PARAPHRASE_ONSET", "true")
@@ -65,17 +79,12 @@ def test_answer_gen_meds_onset_paraphrases_when_enabled(monkeypatch):
 
     monkeypatch.setattr(answer_gen, "_call_ollama", fake_call)
 
-    state = BodyState(
-        user_query="אקמול מתי משפיע",
-        user_query_redacted="אקמול מתי משפיע",
-        intent="meds",
-        sub_intent="onset",
-        language="he",
-        debug={"normalized_query_meds": ["acetaminophen"]},
-        messages=[],
-    )
+    # First request is served canonical text and queues the paraphrase
+    first = answer_gen.run(_onset_state())
+    assert "עקבו אחר ההרגשה" not in first["messages"][-1]["content"]
+    onset_texts.drain()
 
-    out = answer_gen.run(state)
+    out = answer_gen.run(_onset_state())
     content = out["messages"][-1]["content"]
 
     assert "עקבו אחר ההרגשה" in content
@@ -96,29 +105,25 @@ def test_answer_gen_meds_onset_paraphrase_rejects_new_numbers(monkeypatch):
         }
         return json.dumps(payload)
 
-    monkeypatch.setattr(answer_gen, "_call_ollama", bad_call)
-
-    state = BodyState(
-        user_query="אקמול מתי משפיע",
-        user_query_redacted="אקמול מתי משפיע",
-        intent="meds",
-        sub_intent="onset",
-        language="he",
-        debug={"normalized_query_meds": ["acetaminophen"]},
-        messages=[],
+    calls = []
+    monkeypatch.setattr(
+        answer_gen, "_call_ollama", lambda p, lang: calls.append(p) or bad_call(p, lang)
     )
 
-    out = answer_gen.run(state)
+    answer_gen.run(_onset_state())
+    onset_texts.drain()
+    out = answer_gen.run(_onset_state())
     content = out["messages"][-1]["content"]
 
+    # The rejection is stored, so the LLM is not asked again
+    assert len(calls) == 1
+
     # Falls back to canonical wording when validation fails
     assert "45" not in content
     assert "אקמול בדרך כלל" in content
 
 
-def test_paraphrase_helper_handles_code_fence(monkeypatch):
-    monkeypatch.setenv("PARAPHRASE_ONSET", "true")
-
+def test_paraphrase_entry_handles_code_fence(monkeypatch):
     def fenced_call(prompt: str, language: str):
         return '```json\n{"summary": "איבופרופן מפחית כאב תוך 20–30 דקות.", "follow_up": ""}\n```'
 
@@ -128,14 +133,13 @@ def test_paraphrase_helper_handles_code_fence(monkeypatch):
         "follow_up": "",
     }
 
-    summary, follow_up = answer_gen._paraphrase_onset_fact(fact, "he")
+    entry = answer_gen._paraphrase_entry(fact, "he")
+    summary, follow_up = entry["summary"], entry["follow_up"]
     assert "20" in summary and "30" in summary
-    assert follow_up is None
+    assert follow_up == ""
 
 
-def test_paraphrase_helper_rejects_invalid_json(monkeypatch):
-    monkeypatch.setenv("PARAPHRASE_ONSET", "true")
-
+def test_paraphrase_entry_rejects_invalid_json(monkeypatch):
     monkeypatch.setattr(answer_gen, "_call_ollama", lambda prompt, language: "not-json")
 
     fact = {
@@ -143,12 +147,10 @@ def test_paraphrase_helper_rejects_invalid_json(monkeypatch):
         "follow_up": "אם אין שיפור תוך כשעה, פנו לרופא.",
     }
 
-    assert answer_gen._paraphrase_onset_fact(fact, "he") is None
+    assert answer_gen._paraphrase_entry(fact, "he") == onset_texts.REJECTED
 
 
-def test_paraphrase_helper_blocks_new_numbers_when_none_present(monkeypatch):
-    monkeypatch.setenv("PARAPHRASE_ONSET", "true")
-
+def test_paraphrase_entry_blocks_new_numbers_when_none_present(monkeypatch):
     def introduce_number(prompt: str, language: str):
         return json.dumps({"summary": "התרופה פועלת תוך 5 דקות.", "follow_up": ""})
 
@@ -156,12 +158,10 @@ def test_paraphrase_helper_blocks_new_numbers_when_none_present(monkeypatch):
 
     fact = {"summary": "התרופה פועלת במהירות.", "follow_up": ""}
 
-    assert answer_gen._paraphrase_onset_fact(fact, "he") is None
+    assert answer_gen._paraphrase_entry(fact, "he") == onset_texts.REJECTED
 
 
-def test_paraphrase_helper_parses_embedded_json(monkeypatch):
-    monkeypatch.setenv("PARAPHRASE_ONSET", "true")
-
+def test_paraphrase_entry_parses_embedded_json(monkeypatch):
     def embedded(prompt: str, language: str):
         return 'prefix {"summary": "Ibuprofen eases symptoms within 20–30 minutes.", "follow_up": "Follow up if symptoms persist."} suffix'
 
@@ -172,14 +172,13 @@ def test_paraphrase_helper_parses_embedded_json(monkeypatch):
         "follow_up": "If there is no improvement after about an hour or symptoms worsen, speak with a clinician.",
     }
 
-    summary, follow_up = answer_gen._paraphrase_onset_fact(fact, "en")
+    entry = answer_gen._paraphrase_entry(fact, "en")
+    summary, follow_up = entry["summary"], entry["follow_up"]
     assert "20" in summary and "30" in summary
     assert "Follow up" in follow_up
 
 
-def test_paraphrase_helper_handles_invalid_embedded_json(monkeypatch):
-    monkeypatch.setenv("PARAPHRASE_ONSET", "true")
-
+def test_paraphrase_entry_handles_invalid_embedded_json(monkeypatch):
     def invalid(prompt: str, language: str):
         return 'prefix {"summary": } suffix'
 
@@ -190,12 +189,10 @@ def test_paraphrase_helper_handles_invalid_embedded_json(monkeypatch):
         "follow_up": "If there is no improvement after about an hour or symptoms worsen, speak with a clinician.",
     }
 
-    assert answer_gen._paraphrase_onset_fact(fact, "en") is None
+    assert answer_gen._paraphrase_entry(fact, "en") == onset_texts.REJECTED
 
 
-def test_paraphrase_helper_requires_summary(monkeypatch):
-    monkeypatch.setenv("PARAPHRASE_ONSET", "true")
-
+def test_paraphrase_entry_requires_summary(monkeypatch):
     def fail(prompt: str, language: str):  # pragma: no cover
         raise AssertionError("_call_ollama should not run when summary missing")
 
@@ -203,12 +200,10 @@ def test_paraphrase_helper_requires_summary(monkeypatch):
 
     fact = {"summary": "", "follow_up": ""}
 
-    assert answer_gen._paraphrase_onset_fact(fact, "he") is None
-
+    assert answer_gen._paraphrase_entry(fact, "he") == onset_texts.REJECTED
 
-def test_paraphrase_helper_returns_none_when_call_fails(monkeypatch):
-    monkeypatch.setenv("PARAPHRASE_ONSET", "true")
 
+def test_paraphrase_entry_returns_none_when_call_fails(monkeypatch):
     monkeypatch.setattr(answer_gen, "_call_ollama", lambda prompt, language: None)
 
     fact = {
@@ -216,12 +211,10 @@ def test_paraphrase_helper_returns_none_when_call_fails(monkeypatch):
         "follow_up": "אם אין שיפור תוך כשעה, פנו לרופא.",
     }
 
-    assert answer_gen._paraphrase_onset_fact(fact, "he") is None
-
+    assert answer_gen._paraphrase_entry(fact, "he") is None
 
-def test_paraphrase_helper_handles_null_follow_up(monkeypatch):
-    monkeypatch.setenv("PARAPHRASE_ONSET", "true")
 
+def test_paraphrase_entry_handles_null_follow_up(monkeypatch):
     def null_follow(prompt: str, language: str):
         return json.dumps(
             {
@@ -237,14 +230,13 @@ def test_paraphrase_helper_handles_null_follow_up(monkeypatch):
         "follow_up": "If you do not feel better after about an hour or symptoms worsen, contact a clinician.",
     }
 
-    summary, follow_up = answer_gen._paraphrase_onset_fact(fact, "en")
+    entry = answer_gen._paraphrase_entry(fact, "en")
+    summary, follow_up = entry["summary"], entry["follow_up"]
     assert "30" in summary and "60" in summary
-    assert follow_up is None
-
+    assert follow_up == ""
 
-def test_paraphrase_helper_rejects_non_string_summary(monkeypatch):
-    monkeypatch.setenv("PARAPHRASE_ONSET", "true")
 
+def test_paraphrase_entry_rejects_non_string_summary(monkeypatch):
     def bad_summary(prompt: str, language: str):
         return json.dumps({"summary": 123, "follow_up": "test"})
 
@@ -255,12 +247,10 @@ def test_paraphrase_helper_rejects_non_string_summary(monkeypatch):
         "follow_up": "If you do not feel better after about an hour or symptoms worsen, contact a clinician.",
     }
 
-    assert answer_gen._paraphrase_onset_fact(fact, "en") is None
+    assert answer_gen._paraphrase_entry(fact, "en") == onset_texts.REJECTED
 
 
-def test_paraphrase_helper_drops_non_string_follow_up(monkeypatch):
-    monkeypatch.setenv("PARAPHRASE_ONSET", "true")
-
+def test_paraphrase_entry_drops_non_string_follow_up(monkeypatch):
     def bad_follow(prompt: str, language: str):
         return json.dumps(
             {
@@ -276,9 +266,10 @@ def test_paraphrase_helper_drops_non_string_follow_up(monkeypatch):
         "follow_up": "If you do not feel better after about an hour or symptoms worsen, contact a clinician.",
     }
 
-    summary, follow_up = answer_gen._paraphrase_onset_fact(fact, "en")
+    entry = answer_gen._paraphrase_entry(fact, "en")
+    summary, follow_up = entry["summary"], entry["follow_up"]
     assert "30" in summary and "60" in summary
-    assert follow_up is None
+    assert follow_up == ""
 
 
 def test_onset_llm_fallback_generates_neutral_text(monkeypatch):
@@ -308,10 +299,15 @@ def test_onset_llm_fallback_generates_neutral_text(monkeypatch):
         messages=[],
     )
 
+    first = answer_gen.run(dict(state))
+    assert "Keep track of how you feel" not in first["messages"][-1]["content"]
+    onset_texts.drain()
+
     out = answer_gen.run(state)
     message = out["messages"][-1]
 
     assert "Keep track of how you feel" in message["content"]
+    assert "When will ibuprofen start working?" in captured["prompt"]
     assert answer_gen.LANG_CONFIG["en"]["disclaimer"] in message["content"]
     assert out.get("citations") in (None, [])
     assert captured["provider"] == "ollama"
@@ -343,6 +339,8 @@ def test_onset_llm_fallback_rejects_numeric_output(monkeypatch):
         messages=[],
     )
 
+    answer_gen.run(dict(state, messages=[]))
+    onset_texts.drain()
     out = answer_gen.run(state)
     message = out["messages"][-1]
 
@@ -540,84 +538,159 @@ def test_call_ollama_success(monkeypatch):
 
     system_prompts = []
 
-    def fake_chat(model: str, messages):  # type: ignore[override]
-        messages_seen["model"] = model
-        messages_seen["messages"] = messages
-        if messages:
-            system_prompts.append(messages[0]["content"])
-        return {"message": {"content": "Generated"}}
+    class FakeAsyncClient:
+        def __init__(self, host=None):
+            self.host = host
+
+        async def chat(self, model: str, messages):  # type: ignore[override]
+            messages_seen["model"] = model
+            messages_seen["messages"] = messages
+            if messages:
+                system_prompts.append(messages[0]["content"])
+            return {"message": {"content": "Generated"}}
 
-    module = types.SimpleNamespace(chat=fake_chat)
+    module = types.SimpleNamespace(AsyncClient=FakeAsyncClient)
     monkeypatch.setitem(sys.modules, "ollama", module)
+    monkeypatch.setattr(llm_clients, "_clients", {})
     monkeypatch.setenv("OLLAMA_MODEL", "mini")
 
-    try:
-        content = answer_gen._call_ollama("prompt text", "he")
-        assert content == "Generated"
-        assert messages_seen["model"] == "mini"
-        assert system_prompts == [answer_gen._system_prompt("he")]
-    finally:
-        sys.modules.pop("ollama", None)
+    content = answer_gen._call_ollama("prompt text", "he")
+    assert content == "Generated"
+    assert messages_seen["model"] == "mini"
+    assert system_prompts == [answer_gen._system_prompt("he")]
 
 
-def test_call_openai_success(monkeypatch):
+def _fake_openai_module(create):
     import types
 
-    captured_messages = {}
-
     class FakeCompletions:
-        def create(self, model, messages):  # type: ignore[override]
-            assert model == "gpt-4o-mini"
-            captured_messages["messages"] = messages
+        async def create(self, model, messages):  # type: ignore[override]
+            return create(model, messages)
 
-            class Choice:
-                message = types.SimpleNamespace(content="OpenAI response")
+    class FakeAsyncOpenAI:
+        instances = 0
 
-            return types.SimpleNamespace(choices=[Choice()])
-
-    class FakeClient:
         def __init__(self, api_key):
             assert api_key == "secret"
+            FakeAsyncOpenAI.instances += 1
             self.chat = types.SimpleNamespace(completions=FakeCompletions())
 
-    module = types.SimpleNamespace(OpenAI=FakeClient)
+    return types.SimpleNamespace(AsyncOpenAI=FakeAsyncOpenAI)
+
+
+def test_call_openai_success(monkeypatch):
+    import types
+
+    captured_messages = {}
+
+    def create(model, messages):
+        assert model == "gpt-4o-mini"
+        captured_messages["messages"] = messages
+
+        class Choice:
+            message = types.SimpleNamespace(content="OpenAI response")
+
+        return types.SimpleNamespace(choices=[Choice()])
+
+    module = _fake_openai_module(create)
     monkeypatch.setitem(sys.modules, "openai", module)
+    monkeypatch.setattr(llm_clients, "_clients", {})
     monkeypatch.setenv("OPENAI_API_KEY", "secret")
 
-    try:
-        content = answer_gen._call_openai("Tell me", "he")
-        assert content == "OpenAI response"
-        assert captured_messages["messages"][0]["content"] == answer_gen._system_prompt(
-            "he"
-        )
-    finally:
-        sys.modules.pop("openai", None)
-        monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    content = answer_gen._call_openai("Tell me", "he")
+    assert content == "OpenAI response"
+    assert captured_messages["messages"][0]["content"] == answer_gen._system_prompt(
+        "he"
+    )
+    # The client is built once and reused across calls
+    assert answer_gen._call_openai("Again", "en") == "OpenAI response"
+    assert module.AsyncOpenAI.instances == 1
 
 
 def test_call_openai_handles_empty_choices(monkeypatch):
     import types
 
-    class FakeCompletions:
-        def create(self, model, messages):  # type: ignore[override]
-            assert model == "gpt-4o-mini"
-            return types.SimpleNamespace(choices=[])
+    def create(model, messages):
+        assert model == "gpt-4o-mini"
+        return types.SimpleNamespace(choices=[])
 
-    class FakeClient:
-        def __init__(self, api_key):
-            assert api_key == "secret"
-            self.chat = types.SimpleNamespace(completions=FakeCompletions())
+    monkeypatch.setitem(sys.modules, "openai", _fake_openai_module(create))
+    monkeypatch.setattr(llm_clients, "_clients", {})
+    monkeypatch.setenv("OPENAI_API_KEY", "secret")
 
-    module = types.SimpleNamespace(OpenAI=FakeClient)
-    monkeypatch.setitem(sys.modules, "openai", module)
+    content = answer_gen._call_openai("Summarise", "en")
+    assert content is None
+
+
+def test_llm_deadline_falls_back_to_snippet_summary(monkeypatch):
+    import types
+
+    class SlowAsyncClient:
+        def __init__(self, host=None):
+            pass
+
+        async def chat(self, model, messages):  # type: ignore[override]
+            await asyncio.sleep(5)
+            return {"message": {"content": "too late"}}
+
+    monkeypatch.setitem(
+        sys.modules, "ollama", types.SimpleNamespace(AsyncClient=SlowAsyncClient)
+    )
+    monkeypatch.setattr(llm_clients, "_clients", {})
+    monkeypatch.setenv("LLM_PROVIDER", "ollama")
+
+    state = BodyState(
+        user_query="How to manage a fever?",
+        public_snippets=[
+            {
+                "title": "Fever guidance",
+                "text": "Rest and drink fluids.",
+                "source_url": "https://example.com/fever",
+            }
+        ],
+        citations=["https://example.com/fever"],
+        messages=[],
+    )
+    token = llm_clients.start_request_budget(100)
+    try:
+        out = answer_gen.run(state)
+    finally:
+        llm_clients.reset_request_budget(token)
+
+    content = out["messages"][-1]["content"]
+    assert "too late" not in content
+    assert "Fever guidance" in content
+
+
+def test_openai_deadline_returns_none(monkeypatch):
+    def expired(*args, **kwargs):
+        raise llm_clients.DeadlineExceeded("request budget spent")
+
+    monkeypatch.setattr(llm_clients, "openai_chat", expired)
     monkeypatch.setenv("OPENAI_API_KEY", "secret")
 
+    assert answer_gen._call_openai("Summarise", "en") is None
+
+
+def test_ollama_slot_wait_is_bounded_by_request_budget(monkeypatch):
+    from app.tools import inference
+
+    def never_called(*args, **kwargs):  # pragma: no cover - slot never granted
+        raise AssertionError("ollama_chat should not run without a slot")
+
+    monkeypatch.setattr(llm_clients, "ollama_chat", never_called)
+    monkeypatch.setattr(
+        inference, "scheduler", inference.InferenceScheduler({"ollama": 1})
+    )
+    token = llm_clients.start_request_budget(50)
     try:
-        content = answer_gen._call_openai("Summarise", "en")
-        assert content is None
+        with inference.slot("ollama"):
+            start = time.monotonic()
+            assert answer_gen._call_ollama("Summarise", "en") is None
+            assert time.monotonic() - start < 5
     finally:
-        sys.modules.pop("openai", None)
-        monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+        llm_clients.reset_request_budget(token)
+    assert inference.scheduler.stats()["ollama"]["queued"] == 0
 
 
 def test_load_templates_unknown_extension_plain(tmp_path):
@@ -941,3 +1014,82 @@ def test_fallback_message_empty_when_no_data():
     msg = answer_gen._fallback_message(state)
     # Should return the language-specific empty recap string
     assert isinstance(msg, str) and len(msg) > 0
+
+
+def test_build_prompt_keeps_everything_within_budget():
+    state = BodyState(
+        user_query="fever",
+        public_snippets=[{"title": "X", "section": "s", "text": "Short"}],
+    )
+    prompt = answer_gen._build_prompt(state)
+    assert "[1] X - s: Short" in prompt
+    assert state["debug"]["prompt_tokens"] > 0
+    assert "prompt_passages" not in state["debug"]
+
+
+def test_build_prompt_trims_to_best_passages_and_keeps_numbering(monkeypatch):
+    monkeypatch.setenv("PROMPT_TOKEN_BUDGET", "80")
+    filler = "\n\n".join(f"Unrelated paragraph {i} " + "lorem " * 20 for i in range(3))
+    state = BodyState(
+        user_query="I have a fever",
+        public_snippets=[
+            {"title": "Other", "section": "general", "text": "# Other\n" + filler},
+            {
+                "title": "Fever",
+                "section": "general",
+                "text": "# Fever\n"
+                + filler
+                + "\n\n## Care\nFever care: rest and fluids.",
+            },
+        ],
+    )
+
+    prompt = answer_gen._build_prompt(state)
+
+    assert "[2] Fever - general: Fever care: rest and fluids." in prompt
+    assert "[1]" not in prompt
+    assert state["debug"]["prompt_passages"] == {"kept": 1, "total": 3}
+    assert state["debug"]["prompt_tokens"] <= 80
+
+
+def test_prompt_token_budget_parsing(monkeypatch):
+    monkeypatch.setenv("PROMPT_TOKEN_BUDGET", "lots")
+    assert answer_gen._prompt_token_budget() == 0
+    monkeypatch.setenv("PROMPT_TOKEN_BUDGET", "-5")
+    assert answer_gen._prompt_token_budget() == 0
+
+
+def test_extractive_provider_answers_without_llm(monkeypatch):
+    monkeypatch.setenv("LLM_PROVIDER", "extractive")
+
+    def fail_generate(provider, prompt, language):  # pragma: no cover
+        raise AssertionError("extractive mode must not call an LLM")
+
+    monkeypatch.setattr(answer_gen, "_generate_with_provider", fail_generate)
+    state = BodyState(
+        user_query="How do I treat a fever?",
+        public_snippets=[
+            {"title": "Other", "text": "Book a lab appointment early."},
+            {"title": "Fever", "text": "Fever usually improves with rest and fluids."},
+        ],
+        citations=["file://other.md", "file://fever.md"],
+        messages=[],
+    )
+
+    out = answer_gen.run(state)
+    content = out["messages"][-1]["content"]
+
+    assert "- Fever usually improves with rest and fluids. [2]" in content
+    assert "Key points:" in content
+    assert answer_gen.DISCLAIMER in content
+
+
+def test_extractive_provider_without_snippets_uses_template(monkeypatch):
+    monkeypatch.setenv("LLM_PROVIDER", "extractive")
+    out = answer_gen.run(BodyState(user_query="I have a fever", messages=[]))
+    assert answer_gen.DISCLAIMER in out["messages"][-1]["content"]
+
+
+def test_env_int_falls_back_on_invalid(monkeypatch):
+    monkeypatch.setenv("EXTRACTIVE_MAX_CHARS", "lots")
+    assert answer_gen._env_int("EXTRACTIVE_MAX_CHARS", 600) == 600
@@ -1,5 +1,14 @@
-from app.graph.build import _route_after_memory
+import logging
+import tracemalloc
+
+import pytest
+
+from app.config.logging import RequestIdFilter
+from app.graph import build
+from app.graph.build import _route_after_memory, _wrap_node
 from app.graph.state import BodyState
+from app.tools import spans
+from app.tools.trace_store import NodeLatency, NodeProfile
 
 
 def test_route_after_memory_to_health():
@@ -20,3 +29,86 @@ def test_route_after_memory_to_planner_default():
     assert _route_after_memory(s) == "planner"
     s = {"user_query": "x"}  # no intent key
     assert _route_after_memory(s) == "planner"
+
+
+def test_wrap_node_tags_log_records_with_node_name():
+    seen = []
+
+    def node(state):
+        rec = logging.LogRecord("x", logging.INFO, __file__, 0, "msg", (), None)
+        RequestIdFilter().filter(rec)
+        seen.append(rec.node)
+        return state
+
+    out = _wrap_node("planner", node)({"user_query": "x"})
+    assert seen == ["planner"]
+    assert out["debug"]["trace"][0]["node"] == "planner"
+
+    rec = logging.LogRecord("x", logging.INFO, __file__, 0, "msg", (), None)
+    RequestIdFilter().filter(rec)
+    assert rec.node == "-"
+
+
+def test_wrap_node_feeds_latency_by_intent_and_counts_errors(monkeypatch):
+    stats = NodeLatency(window=10)
+    monkeypatch.setattr(build, "latency", stats)
+
+    def classify(state):
+        state["intent"] = "meds"
+        return state
+
+    def boom(state):
+        raise RuntimeError("down")
+
+    _wrap_node("supervisor", classify)({"user_query": "x"})
+    with pytest.raises(RuntimeError):
+        _wrap_node("places", boom)({"user_query": "x", "intent": "appointment"})
+
+    snap = stats.snapshot()
+    assert list(snap["supervisor"]["by_intent"]) == ["meds"]
+    assert snap["supervisor"]["errors"] == 0
+    assert snap["places"]["by_intent"]["appointment"]["errors"] == 1
+
+
+def test_wrap_node_nests_tool_spans_in_trace():
+    def node(state):
+        with spans.span("embed", batch=1):
+            pass
+        with spans.span("es.search", index="kb"):
+            with spans.span("inner"):
+                pass
+        return state
+
+    out = _wrap_node("health", node)({"user_query": "x"})
+    entry = out["debug"]["trace"][0]
+    assert [s["name"] for s in entry["spans"]] == ["embed", "es.search"]
+    assert entry["spans"][1]["spans"][0]["name"] == "inner"
+    assert 0 <= entry["self_ms"] <= entry["elapsed_ms"]
+
+    plain = _wrap_node("scrub", lambda s: s)({"user_query": "x"})
+    assert "spans" not in plain["debug"]["trace"][0]
+
+
+def test_wrap_node_records_cpu_and_opt_in_memory(monkeypatch):
+    stats = NodeProfile(window=10)
+    monkeypatch.setattr(build, "profile", stats)
+
+    def busy(state):
+        state["blob"] = bytearray(1 << 20)
+        sum(range(20000))
+        return state
+
+    entry = _wrap_node("answer_gen", busy)({"user_query": "x"})["debug"]["trace"][0]
+    assert 0 < entry["cpu_ms"] and "peak_bytes" not in entry
+
+    monkeypatch.setenv("TRACE_MEMORY", "true")
+    was_tracing = tracemalloc.is_tracing()
+    try:
+        entry = _wrap_node("answer_gen", busy)({"user_query": "x"})["debug"]["trace"][0]
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    assert entry["peak_bytes"] >= 1 << 20 and entry["alloc_bytes"] >= 1 << 20
+    ranked = stats.ranking()
+    assert ranked["by_cpu"][0]["runs"] == 2
+    assert ranked["by_memory"][0]["peak_bytes_max"] >= 1 << 20
@@ -1,6 +1,6 @@
 from pathlib import Path
 
-from app.tools import crypto
+from app.tools import crypto, key_store
 from app.config import settings
 
 
@@ -36,7 +36,7 @@ def test_ensure_user_key_warns_on_chmod_failure(monkeypatch, tmp_path, caplog):
     def boom(*_args, **_kwargs):
         raise OSError("chmod unsupported")
 
-    monkeypatch.setattr(crypto.os, "chmod", boom)
+    monkeypatch.setattr(key_store.os, "chmod", boom)
 
     caplog.set_level("WARNING")
     key = crypto.ensure_user_key("chmod-user")
@@ -44,3 +44,13 @@ def test_ensure_user_key_warns_on_chmod_failure(monkeypatch, tmp_path, caplog):
     # Key is still generated even if chmod fails
     assert key
     assert "Failed to set permissions" in caplog.text
+
+
+def test_delete_user_key(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    crypto.ensure_user_key("gone-user")
+    assert crypto.has_user_key("gone-user")
+
+    assert crypto.delete_user_key("gone-user") is True
+    assert not crypto.has_user_key("gone-user")
+    assert crypto.delete_user_key("gone-user") is False
@@ -1,5 +1,7 @@
 from unittest.mock import patch
 
+import pytest
+
 from app.tools.embeddings import embed
 
 
@@ -102,3 +104,53 @@ def test_embed_real_mode(monkeypatch):
         # Restore stub for other tests
         monkeypatch.setenv("EMBEDDINGS_MODEL", "__stub__")
         importlib.reload(app.tools.embeddings)
+
+
+def test_set_model_switches_active_model(monkeypatch):
+    import importlib
+    import app.tools.embeddings as emb
+
+    monkeypatch.setenv("EMBEDDINGS_MODEL", "__stub__")
+    importlib.reload(emb)
+
+    class SmallModel:
+        def encode(self, texts, normalize_embeddings=True):
+            return [[0.6, 0.8] for _ in texts]
+
+    with patch.object(emb, "SentenceTransformer", return_value=SmallModel()):
+        assert emb.embed(["x"], model="small")[0] == [0.6, 0.8]
+        assert emb.MODEL == "__stub__"
+        emb.set_model("small")
+
+    try:
+        assert emb.MODEL == "small" and emb.VEC_DIMS == 2
+        assert emb.embed(["x"]) == [[0.6, 0.8]]
+        assert emb.dims("__stub__") == 384
+    finally:
+        importlib.reload(emb)
+
+
+def test_require_model_raises_instead_of_falling_back(monkeypatch):
+    import app.tools.embeddings as emb
+
+    with patch.object(emb, "SentenceTransformer", side_effect=OSError("no such")):
+        # The lenient path serves stub vectors for a model that did not load
+        assert len(emb._backend("typo/not-a-model")(["x"])[0]) == 384
+        with pytest.raises(OSError, match="no such"):
+            emb.require_model("typo/not-a-model")
+
+    class SmallModel:
+        def encode(self, texts, normalize_embeddings=True):
+            return [[0.6, 0.8] for _ in texts]
+
+    try:
+        with patch.object(emb, "SentenceTransformer", return_value=SmallModel()):
+            emb.require_model("typo/not-a-model")
+        # The fallback is replaced by the model once it loads
+        assert emb.dims("typo/not-a-model") == 2
+        emb.require_model("typo/not-a-model")
+        emb.require_model(emb.STUB_MODEL)
+    finally:
+        for cache in (emb._backends, emb._dims):
+            cache.pop("typo/not-a-model", None)
+        emb._fallbacks.discard("typo/not-a-model")
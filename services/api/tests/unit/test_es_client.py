@@ -1,3 +1,4 @@
+import threading
 import pytest
 from elastic_transport import ConnectionError
 from unittest.mock import MagicMock
@@ -33,6 +34,14 @@ def test_ensure_indices_creates_missing_es_client_direct(monkeypatch):
 
     es_client.ensure_indices()
     assert mock_es_client.indices.create.call_count == 3
+    kwargs = mock_es_client.indices.create.call_args.kwargs
+    assert kwargs["settings"] == es_client.index_settings("serving")
+    template = mock_es_client.indices.put_index_template.call_args.kwargs
+    assert template["index_patterns"] == [
+        es_client.settings.es_private_index,
+        f"{es_client.settings.es_private_index}-*",
+    ]
+    assert template["template"]["mappings"]["_routing"] == {"required": True}
 
 
 def test_ensure_indices_does_not_create_existing_es_client_direct(monkeypatch):
@@ -85,3 +94,201 @@ def test_get_es_client_fails_after_retries(monkeypatch):
         es_client.get_es_client()
 
     assert mock_es_class.call_count == 20
+
+
+def test_index_mappings_record_model_and_dims():
+    mappings = es_client.index_mappings(512, "small-model")
+    assert set(mappings) == set(es_client.INDEX_KINDS)
+    for mapping in mappings.values():
+        assert mapping["_meta"] == {"embeddings_model": "small-model"}
+        assert mapping["properties"]["embedding"]["dims"] == 512
+        assert mapping["properties"]["embedding"]["index_options"]["type"] == (
+            "int8_hnsw"
+        )
+    assert mappings["private"]["_routing"] == {"required": True}
+    assert "_routing" not in mappings["public"]
+
+
+def test_vector_index_options_from_env(monkeypatch, caplog):
+    monkeypatch.setenv("ES_HNSW_M", "32")
+    monkeypatch.setenv("ES_HNSW_EF_CONSTRUCTION", "200")
+    assert es_client.vector_index_options() == {
+        "type": "int8_hnsw",
+        "m": 32,
+        "ef_construction": 200,
+    }
+    assert es_client.vector_index_options("int8_flat") == {"type": "int8_flat"}
+
+    monkeypatch.setenv("ES_VECTOR_INDEX_TYPE", "HNSW")
+    assert es_client.vector_index_options()["type"] == "hnsw"
+
+    monkeypatch.setenv("ES_VECTOR_INDEX_TYPE", "bbq")
+    monkeypatch.setenv("ES_HNSW_M", "lots")
+    caplog.set_level("WARNING")
+    assert es_client.vector_index_options() == {
+        "type": "int8_hnsw",
+        "m": 16,
+        "ef_construction": 200,
+    }
+    assert "Unknown ES_VECTOR_INDEX_TYPE" in caplog.text
+    assert "Invalid ES_HNSW_M" in caplog.text
+
+
+def test_index_settings_per_phase(monkeypatch):
+    assert es_client.index_settings() == {
+        "number_of_shards": 1,
+        "number_of_replicas": 1,
+        "refresh_interval": "1s",
+    }
+    assert es_client.dynamic_index_settings("ingest") == {
+        "number_of_replicas": 0,
+        "refresh_interval": "-1",
+    }
+
+    monkeypatch.setenv("ES_NUMBER_OF_SHARDS", "3")
+    monkeypatch.setenv("ES_NUMBER_OF_REPLICAS", "2")
+    monkeypatch.setenv("ES_REFRESH_INTERVAL", "5s")
+    monkeypatch.setenv("ES_INGEST_REPLICAS", "1")
+    monkeypatch.setenv("ES_INGEST_REFRESH_INTERVAL", "30s")
+    assert es_client.index_settings("serving") == {
+        "number_of_shards": 3,
+        "number_of_replicas": 2,
+        "refresh_interval": "5s",
+    }
+    assert es_client.index_settings("ingest")["refresh_interval"] == "30s"
+    with pytest.raises(ValueError, match="Unknown index phase"):
+        es_client.index_settings("warm")
+
+
+def test_sync_embeddings_model_follows_index_meta(monkeypatch):
+    from app.tools import embeddings
+
+    switched = []
+    monkeypatch.setattr(embeddings, "set_model", switched.append)
+    monkeypatch.setattr(es_client, "_model_checked_at", None)
+    mock_es = MagicMock()
+    mock_es.indices.get_mapping.return_value = {
+        "public_medical_kb-v2": {"mappings": {"_meta": {"embeddings_model": "new"}}}
+    }
+
+    assert es_client.sync_embeddings_model(mock_es) == "new"
+    # Throttled until the interval passes
+    assert es_client.sync_embeddings_model(mock_es) is None
+    assert switched == ["new"]
+
+    mock_es.indices.get_mapping.return_value = {"idx": {"mappings": {}}}
+    assert es_client.sync_embeddings_model(mock_es, force=True) is None
+
+    mock_es.indices.get_mapping.side_effect = RuntimeError("no cluster")
+    assert es_client.sync_embeddings_model(mock_es, force=True) is None
+
+
+def test_sync_embeddings_model_needs_connection_and_interval(monkeypatch):
+    monkeypatch.setattr(es_client, "_es_client", None)
+    assert es_client.sync_embeddings_model() is None
+
+    monkeypatch.setenv("EMBEDDINGS_MODEL_SYNC_S", "0")
+    mock_es = MagicMock()
+    assert es_client.sync_embeddings_model(mock_es) is None
+    mock_es.indices.get_mapping.assert_not_called()
+
+    monkeypatch.setenv("EMBEDDINGS_MODEL_SYNC_S", "soon")
+    assert es_client._model_sync_interval_s() == 30.0
+
+
+def test_model_sync_thread_runs_in_background(monkeypatch):
+    calls = []
+    ran = threading.Event()
+
+    def fake_sync(es=None, force=False):
+        calls.append(force)
+        ran.set()
+        raise RuntimeError("cluster away")
+
+    monkeypatch.setattr(es_client, "sync_embeddings_model", fake_sync)
+    monkeypatch.setenv("EMBEDDINGS_MODEL_SYNC_S", "0.01")
+
+    sync = es_client.start_model_sync()
+    assert sync is not None
+    assert ran.wait(5)
+    sync.stop()
+    assert calls[0] is True
+
+    monkeypatch.setenv("EMBEDDINGS_MODEL_SYNC_S", "0")
+    assert es_client.start_model_sync() is None
+
+
+def test_write_embeddings_model_reads_index_meta(monkeypatch):
+    from app.tools import embeddings
+
+    monkeypatch.setattr(es_client, "_write_models", {})
+    mock_es = MagicMock()
+    mock_es.indices.get_mapping.return_value = {
+        "user_private_memory-v2": {"mappings": {"_meta": {"embeddings_model": "new"}}}
+    }
+    assert es_client.write_embeddings_model(mock_es, "user_private_memory") == "new"
+    mock_es.indices.get_mapping.assert_called_with(index="user_private_memory")
+
+    mock_es.indices.get_mapping.return_value = {"idx": {"mappings": {}}}
+    assert es_client.write_embeddings_model(mock_es, "idx") == embeddings.MODEL
+
+
+def test_write_embeddings_model_is_cached_until_interval_or_swap(monkeypatch):
+    from app.tools import embeddings
+
+    now = [0.0]
+    monkeypatch.setattr(es_client.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(es_client, "_write_models", {})
+    monkeypatch.setattr(es_client, "_model_checked_at", None)
+    monkeypatch.setattr(embeddings, "set_model", lambda model: None)
+    monkeypatch.setenv("EMBEDDINGS_MODEL_SYNC_S", "10")
+    mock_es = MagicMock()
+    meta = mock_es.indices.get_mapping
+    meta.return_value = {"idx-v1": {"mappings": {"_meta": {"embeddings_model": "a"}}}}
+
+    assert es_client.write_embeddings_model(mock_es, "idx") == "a"
+    now[0] = 9.0
+    assert es_client.write_embeddings_model(mock_es, "idx") == "a"
+    assert meta.call_count == 1
+
+    # Expired: re-read, and a failed read keeps the last known model
+    now[0] = 10.0
+    meta.side_effect = RuntimeError("no cluster")
+    assert es_client.write_embeddings_model(mock_es, "idx") == "a"
+    meta.side_effect = None
+    meta.return_value = {"idx-v2": {"mappings": {"_meta": {"embeddings_model": "b"}}}}
+    assert es_client.write_embeddings_model(mock_es, "idx") == "b"
+
+    # A swap seen by the model sync drops the cache at once
+    meta.return_value = {"idx-v3": {"mappings": {"_meta": {"embeddings_model": "c"}}}}
+    assert es_client.sync_embeddings_model(mock_es, force=True) == "c"
+    assert es_client.write_embeddings_model(mock_es, "idx") == "c"
+
+    monkeypatch.setenv("EMBEDDINGS_MODEL_SYNC_S", "0")
+    calls = meta.call_count
+    now[0] = 10.0 + es_client.DEFAULT_MODEL_SYNC_S - 1
+    assert es_client.write_embeddings_model(mock_es, "idx") == "c"
+    assert meta.call_count == calls
+
+
+def test_knn_clause_uses_settings_per_kind(monkeypatch):
+    from app.config import settings
+
+    clause = es_client.knn_clause("private", [0.1], filter={"term": {"user_id": "u"}})
+    assert clause == {
+        "field": "embedding",
+        "query_vector": [0.1],
+        "k": settings.knn_private_k,
+        "num_candidates": settings.knn_private_num_candidates,
+        "filter": {"term": {"user_id": "u"}},
+    }
+
+    monkeypatch.setattr(settings, "knn_places_k", 20)
+    monkeypatch.setattr(settings, "knn_places_num_candidates", 10)
+    monkeypatch.setattr(settings, "knn_places_similarity", 0.4)
+    clause = es_client.knn_clause("places", [0.1])
+    assert (clause["k"], clause["num_candidates"], clause["similarity"]) == (
+        20,
+        20,
+        0.4,
+    )
@@ -0,0 +1,82 @@
+import numpy as np
+
+from app.tools import embeddings, extractive
+
+FEVER = {
+    "title": "Fever",
+    "language": "en",
+    "text": "# Fever\n- Hydrate well and rest.\n- Book an appointment if it lasts.",
+}
+PAIN = {
+    "title": "Pain",
+    "language": "en",
+    "text": "Headache pain often eases with rest. Lab tests are rarely needed.",
+}
+
+
+def test_split_sentences_strips_markdown_and_headings():
+    text = "# Title\n- Hydrate well; rest in bed.\n1. Call a doctor now. Ok.\n> Quoted advice here."
+    assert extractive.split_sentences(text) == [
+        "Hydrate well; rest in bed.",
+        "Call a doctor now.",
+        "Quoted advice here.",
+    ]
+
+
+def test_summarize_picks_query_sentences_and_keeps_indices():
+    extractive.clear_cache()
+    picked = extractive.summarize("appointment", [FEVER, PAIN], max_sentences=2)
+
+    # fake_embed maps "book"/"lab" to the appointment axis
+    assert picked == [
+        (1, "Book an appointment if it lasts."),
+        (2, "Lab tests are rarely needed."),
+    ]
+
+
+def test_summarize_respects_char_budget_and_language():
+    he_doc = {"language": "he", "text": "כאב ראש חולף לרוב עם מנוחה."}
+    picked = extractive.summarize("headache pain", [PAIN, he_doc], language="he")
+    assert picked == [(2, "כאב ראש חולף לרוב עם מנוחה.")]
+
+    short = extractive.summarize("headache pain", [FEVER, PAIN], max_chars=10)
+    assert len(short) == 1  # best sentence kept even when over budget
+
+
+def test_summarize_handles_empty_inputs():
+    assert extractive.summarize("fever", []) == []
+    assert extractive.summarize("", [FEVER]) == []
+
+
+def test_sentence_vectors_are_cached(monkeypatch):
+    extractive.clear_cache()
+    calls = []
+    real = embeddings.embed
+
+    def counting(texts):
+        calls.append(list(texts))
+        return real(texts)
+
+    monkeypatch.setattr(embeddings, "embed", counting)
+    first = extractive._sentence_vectors(["Hydrate well and rest.", "Lab work."])
+    second = extractive._sentence_vectors(["Lab work.", "Hydrate well and rest."])
+
+    assert calls == [["Hydrate well and rest.", "Lab work."]]
+    assert np.allclose(first[::-1], second)
+
+
+def test_summarize_skips_duplicates_and_mismatched_vectors(monkeypatch):
+    extractive.clear_cache()
+    dup = {"language": "en", "text": "Lab tests are rarely needed."}
+    picked = extractive.summarize("lab", [PAIN, dup])
+    assert [s for _, s in picked].count("Lab tests are rarely needed.") == 1
+    assert all(idx == 1 for idx, _ in picked)
+
+    def mismatched(texts):
+        return [[1.0, 0.0] if t == "fever" else [1.0, 0.0, 0.0] for t in texts]
+
+    monkeypatch.setattr(embeddings, "MODEL", "other-model")
+    monkeypatch.setattr(extractive, "_VECTOR_CACHE_SIZE", 1)
+    monkeypatch.setattr(embeddings, "embed", mismatched)
+    assert extractive.summarize("fever", [FEVER, PAIN]) == []
+    assert len(extractive._vector_cache) == 1
@@ -493,3 +493,98 @@ def test_fetch_registry_docs_ignores_non_dict_refs():
     es = MagicMock()
     docs = health._fetch_registry_docs(es, ["bad_ref", None])
     assert docs == []
+
+
+def _passage(doc_id, position, text, **extra):
+    return {
+        "doc_id": doc_id,
+        "position": position,
+        "heading": f"H{position}",
+        "text": text,
+        "title": doc_id.title(),
+        "source_url": f"file://{doc_id}.md",
+        **extra,
+    }
+
+
+def test_collapse_passages_groups_by_parent_in_rank_order():
+    hits = [
+        _passage("fever", 2, "Seek care."),
+        {"title": "Legacy", "text": "Whole doc"},
+        _passage("ibuprofen", 0, "Take with food."),
+        _passage("fever", 0, "Hydrate."),
+    ]
+
+    docs = health._collapse_passages(hits)
+
+    assert [d["title"] for d in docs] == ["Fever", "Legacy", "Ibuprofen"]
+    assert docs[0]["text"] == "Hydrate.\n\nSeek care."
+    assert docs[0]["passages"] == [0, 2]
+    assert "heading" not in docs[0]
+    assert health._collapse_passages(hits, limit=1) == docs[:1]
+
+
+def test_health_knn_collapses_passage_hits(fake_es):
+    fake_es.add_handler(
+        lambda index, body: "knn" in body,
+        {
+            "hits": {
+                "hits": [
+                    {"_source": _passage("fever", 1, "Rest.")},
+                    {"_source": _passage("fever", 0, "Hydrate.")},
+                ]
+            }
+        },
+    )
+
+    out = health.run({"user_query": "fever", "messages": []}, es_client=fake_es)
+
+    snippets = out["public_snippets"]
+    assert len(snippets) == 1
+    assert snippets[0]["text"] == "Hydrate.\n\nRest."
+    assert out["citations"] == ["file://fever.md"]
+    knn_body = next(body for _, body in fake_es.calls if "knn" in body)
+    assert knn_body["knn"]["k"] == health.PASSAGE_HITS
+    assert knn_body["size"] == health.PASSAGE_HITS
+
+
+def test_health_requests_every_knn_hit_when_k_exceeds_passage_hits(
+    fake_es, monkeypatch
+):
+    monkeypatch.setattr(settings, "knn_public_k", 32)
+    fake_es.add_handler(lambda index, body: True, {"hits": {"hits": []}})
+
+    health.run({"user_query": "fever", "messages": []}, es_client=fake_es)
+
+    bodies = [body for _, body in fake_es.calls if isinstance(body, dict)]
+    knn_body = next(body for body in bodies if "knn" in body)
+    assert knn_body["knn"]["k"] == 32
+    assert knn_body["size"] == 32
+    bm25_body = next(
+        body
+        for body in bodies
+        if "minimum_should_match" in body.get("query", {}).get("bool", {})
+    )
+    assert bm25_body["size"] == 32
+
+
+def test_fetch_registry_docs_merges_passages_of_referenced_doc():
+    es = MagicMock()
+    es.msearch.return_value = {
+        "responses": [
+            {
+                "hits": {
+                    "hits": [
+                        {"_source": _passage("fever", 1, "Rest.")},
+                        {"_source": _passage("fever", 0, "Hydrate.")},
+                    ]
+                }
+            }
+        ]
+    }
+
+    docs = health._fetch_registry_docs(es, [{"source_url": "file://fever.md"}])
+
+    assert [d["text"] for d in docs] == ["Hydrate.\n\nRest."]
+    query = es.msearch.call_args.kwargs["body"][1]
+    assert query["size"] == health.REGISTRY_PASSAGES
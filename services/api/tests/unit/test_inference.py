@@ -0,0 +1,202 @@
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+from app.tools import inference
+from app.tools.inference import InferenceScheduler
+
+
+def test_parse_slots_skips_invalid_entries(caplog):
+    caplog.set_level("WARNING")
+    parsed = inference._parse_slots("embed:2, risk_ml:x,ollama:0,bad,nli:3")
+    assert parsed == {"embed": 2, "nli": 3}
+    assert "Invalid slot count" in caplog.text
+
+
+def test_priority_context_manager_restores_default():
+    assert inference.current_priority() == inference.PRIORITY_BATCH
+    with inference.priority(inference.PRIORITY_INTERACTIVE):
+        assert inference.current_priority() == inference.PRIORITY_INTERACTIVE
+    assert inference.current_priority() == inference.PRIORITY_BATCH
+
+
+def test_set_priority_rejects_unknown_class():
+    with pytest.raises(ValueError):
+        inference.set_priority("urgent")
+
+
+def test_slot_records_stats_per_priority():
+    sched = InferenceScheduler({"embed": 1}, torch_threads=1)
+    with inference.priority(inference.PRIORITY_INTERACTIVE):
+        with sched.slot("embed", batch_size=4) as wait_ms:
+            assert wait_ms >= 0.0
+            assert sched.stats()["embed"]["in_use"] == 1
+    with sched.slot("embed"):
+        pass
+
+    stats = sched.stats()["embed"]
+    assert stats["slots"] == 1
+    assert stats["in_use"] == 0
+    assert stats["calls"] == 2
+    assert stats["batch_items"] == 5
+    assert set(stats["by_priority"]) == {"interactive", "batch"}
+    assert stats["by_priority"]["interactive"]["count"] == 1
+
+
+def test_unknown_model_defaults_to_one_slot():
+    sched = InferenceScheduler({})
+    with sched.slot("custom"):
+        assert sched.stats()["custom"]["slots"] == 1
+
+
+def _waiter(sched, prio, order, started):
+    def run():
+        with inference.priority(prio):
+            started.release()
+            with sched.slot("risk_ml"):
+                order.append(prio)
+
+    return threading.Thread(target=run)
+
+
+def test_interactive_waiters_jump_ahead_of_queued_batch_work():
+    sched = InferenceScheduler({"risk_ml": 1}, torch_threads=1)
+    order: list[str] = []
+    started = threading.Semaphore(0)
+
+    with sched.slot("risk_ml"):
+        ingest = _waiter(sched, inference.PRIORITY_INGEST, order, started)
+        batch = _waiter(sched, inference.PRIORITY_BATCH, order, started)
+        interactive = _waiter(sched, inference.PRIORITY_INTERACTIVE, order, started)
+        for expected_queued, t in enumerate((ingest, batch, interactive), start=1):
+            t.start()
+            started.acquire()
+            # Park each thread in the queue before adding the next one
+            deadline = time.monotonic() + 5
+            while sched.stats()["risk_ml"]["queued"] < expected_queued:
+                assert time.monotonic() < deadline
+                time.sleep(0.005)
+
+    for t in (ingest, batch, interactive):
+        t.join(timeout=5)
+
+    assert order == ["interactive", "batch", "ingest"]
+    waits = sched.stats()["risk_ml"]["by_priority"]
+    assert waits["ingest"]["wait_ms_max"] >= waits["interactive"]["wait_ms_max"]
+
+
+def test_torch_threads_split_cpus_across_torch_slots(monkeypatch):
+    monkeypatch.setattr(inference.os, "cpu_count", lambda: 8)
+    assert InferenceScheduler({"embed": 2, "risk_ml": 2}).torch_threads() == 2
+    assert InferenceScheduler({"embed": 16}).torch_threads() == 1
+    assert InferenceScheduler({}, torch_threads=3).torch_threads() == 3
+
+
+def test_torch_threads_applied_once_when_torch_loaded(monkeypatch):
+    calls = []
+    fake_torch = types.SimpleNamespace(set_num_threads=calls.append)
+    monkeypatch.setitem(sys.modules, "torch", fake_torch)
+    sched = InferenceScheduler({"embed": 1}, torch_threads=2)
+
+    with sched.slot("ollama"):
+        pass
+    assert calls == []
+    with sched.slot("embed"):
+        pass
+    with sched.slot("embed"):
+        pass
+    assert calls == [2]
+
+
+def test_torch_threads_deferred_until_torch_imported(monkeypatch):
+    monkeypatch.delitem(sys.modules, "torch", raising=False)
+    sched = InferenceScheduler({"embed": 1}, torch_threads=2)
+    with sched.slot("embed"):
+        pass
+    assert sched._torch_configured is False
+
+
+def test_torch_threads_env_parsing(monkeypatch):
+    monkeypatch.setenv("INFERENCE_TORCH_THREADS", "4")
+    assert inference._torch_threads_from_env() == 4
+    monkeypatch.setenv("INFERENCE_TORCH_THREADS", "0")
+    assert inference._torch_threads_from_env() is None
+    monkeypatch.setenv("INFERENCE_TORCH_THREADS", "lots")
+    assert inference._torch_threads_from_env() is None
+
+
+def test_module_slot_uses_shared_scheduler():
+    before = inference.scheduler.stats().get("ollama", {}).get("calls", 0)
+    with inference.slot("ollama"):
+        pass
+    assert inference.scheduler.stats()["ollama"]["calls"] == before + 1
+
+
+def test_pin_and_reset_torch_threads(monkeypatch):
+    import torch
+
+    calls = []
+    monkeypatch.setattr(torch, "set_num_threads", calls.append)
+    sched = InferenceScheduler({"embed": 1}, torch_threads=4)
+
+    sched.pin_torch_threads(1)
+    with sched.slot("embed"):
+        pass
+    assert calls == [1]
+
+    sched.reset_torch()
+    with sched.slot("embed"):
+        pass
+    assert calls == [1, 4]
+
+
+def test_slot_timeout_raises_and_frees_the_queue_head():
+    sched = InferenceScheduler({"ollama": 1})
+    order: list[str] = []
+
+    with sched.slot("ollama"):
+        with inference.priority(inference.PRIORITY_INGEST):
+            behind = threading.Thread(target=lambda: _hold(sched, order))
+            behind.start()
+        deadline = time.monotonic() + 5
+        while sched.stats()["ollama"]["queued"] < 1:
+            assert time.monotonic() < deadline
+            time.sleep(0.005)
+        # An interactive caller jumps to the head, then gives up
+        with inference.priority(inference.PRIORITY_INTERACTIVE):
+            with pytest.raises(inference.SlotTimeout):
+                with sched.slot("ollama", timeout=0.05):
+                    pass  # pragma: no cover - never granted
+        assert sched.stats()["ollama"]["queued"] == 1
+
+    behind.join(timeout=5)
+    assert order == ["granted"]
+    assert sched.stats()["ollama"]["queued"] == 0
+
+
+def _hold(sched, order):
+    with sched.slot("ollama"):
+        order.append("granted")
+
+
+def test_interrupted_waiter_does_not_block_later_callers():
+    sched = InferenceScheduler({"embed": 1})
+    queue = sched._queue("embed")
+    queue.acquire("batch")
+
+    real_wait = queue._cond.wait
+
+    def interrupted(timeout=None):
+        queue._cond.wait = real_wait
+        raise KeyboardInterrupt
+
+    queue._cond.wait = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        queue.acquire("interactive")
+    assert queue.snapshot()["queued"] == 0
+
+    queue.release(0.0, 1)
+    assert queue.acquire("batch", timeout=1.0) >= 0.0
@@ -0,0 +1,241 @@
+import pytest
+from elasticsearch import NotFoundError
+
+from app.tools import embeddings, inference, ingest
+
+
+def _records(texts):
+    for i, text in enumerate(texts):
+        yield {"_op_type": "index", "_index": "idx", "_id": str(i), "_source": {}}, text
+
+
+class HashStore:
+    """Minimal ES stand-in for the mget hash lookup."""
+
+    def __init__(self, hashes=None, missing=False):
+        self.hashes = hashes or {}
+        self.missing = missing
+        self.mgets = []
+
+    def mget(self, index, ids, source_includes):
+        self.mgets.append(list(ids))
+        if self.missing:
+            raise NotFoundError("index_not_found_exception", None, None)  # type: ignore[arg-type]
+        return {
+            "docs": [
+                (
+                    {
+                        "_id": i,
+                        "found": True,
+                        "_source": {"content_hash": self.hashes[i]},
+                    }
+                    if i in self.hashes
+                    else {"_id": i, "found": False}
+                )
+                for i in ids
+            ]
+        }
+
+
+@pytest.fixture()
+def three_dims(monkeypatch):
+    monkeypatch.setattr(embeddings, "VEC_DIMS", 3)
+
+
+def test_embed_records_batches_by_length_under_ingest_priority(monkeypatch, three_dims):
+    batches = []
+
+    def _embed(texts):
+        batches.append((list(texts), inference.current_priority()))
+        return [[1.0, 0.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(embeddings, "embed", _embed)
+    texts = ["fever and pain", "lab", "medication refill", "ok"]
+
+    actions = list(ingest.embed_records(_records(texts), batch_size=2))
+
+    assert [b[0] for b in batches] == [
+        ["ok", "lab"],
+        ["fever and pain", "medication refill"],
+    ]
+    assert {b[1] for b in batches} == {inference.PRIORITY_INGEST}
+    assert sorted(a["_id"] for a in actions) == ["0", "1", "2", "3"]
+    assert all(a["_source"]["embedding"] == [1.0, 0.0, 0.0] for a in actions)
+
+
+def test_embed_records_rejects_wrong_dimensions(monkeypatch):
+    monkeypatch.setattr(embeddings, "VEC_DIMS", 384)
+    with pytest.raises(ValueError, match="expected 384"):
+        list(ingest.embed_records(_records(["fever"])))
+
+
+def test_run_streams_into_parallel_bulk_and_reports(monkeypatch, three_dims, caplog):
+    seen = {}
+
+    def fake_parallel_bulk(es, actions, thread_count, chunk_size, raise_on_error):
+        seen.update(thread_count=thread_count, chunk_size=chunk_size)
+        assert not isinstance(actions, list)  # streamed, not materialised
+        for action in actions:
+            if action["_id"] == "1":
+                yield False, {"index": {"_id": "1", "error": "mapper_parsing"}}
+            else:
+                yield True, {"index": {"_id": action["_id"]}}
+
+    monkeypatch.setattr(ingest.helpers, "parallel_bulk", fake_parallel_bulk)
+    monkeypatch.setenv("INGEST_THREADS", "3")
+    monkeypatch.setenv("INGEST_CHUNK_SIZE", "bad")
+    caplog.set_level("WARNING")
+
+    stats = ingest.run(HashStore(), _records(["fever", "lab", "pill"]))
+
+    assert seen == {"thread_count": 3, "chunk_size": ingest.DEFAULT_CHUNK_SIZE}
+    assert (stats.docs, stats.errors) == (2, 1)
+    assert stats.peak_rss_mb and stats.peak_rss_mb > 0
+    assert "docs/s" in stats.summary()
+    assert "Bulk item failed" in caplog.text
+    assert "Invalid INGEST_CHUNK_SIZE" in caplog.text
+
+
+def test_ingest_stats_summary_without_measurements():
+    stats = ingest.IngestStats()
+    assert stats.docs_per_s == 0.0
+    assert "peak RSS n/a" in stats.summary()
+
+
+def test_content_hash_ignores_bookkeeping_fields(monkeypatch):
+    base = ingest.content_hash({"name": "Clinic", "updated_on": "2024-01-01"}, "x")
+    assert base == ingest.content_hash(
+        {"name": "Clinic", "updated_on": "2025-06-01", "embedding": [1.0]}, "x"
+    )
+    assert base != ingest.content_hash({"name": "Clinic B"}, "x")
+    assert base != ingest.content_hash({"name": "Clinic"}, "y")
+
+    monkeypatch.setattr(embeddings, "MODEL", "another-model")
+    assert base != ingest.content_hash({"name": "Clinic"}, "x")
+
+
+def test_changed_records_skips_unchanged_and_tracks_seen():
+    unchanged = ingest.content_hash({}, "fever")
+    es = HashStore({"0": unchanged, "1": "outdated"})
+    stats = ingest.IngestStats()
+    seen: dict = {}
+
+    out = list(
+        ingest.changed_records(es, _records(["fever", "lab", "pill"]), stats, seen)
+    )
+
+    assert [a["_id"] for a, _ in out] == ["1", "2"]
+    assert all(a["_source"]["content_hash"] for a, _ in out)
+    assert stats.skipped == 1
+    assert seen == {"idx": {"0", "1", "2"}}
+
+    forced = list(
+        ingest.changed_records(es, _records(["fever"]), ingest.IngestStats(), {}, True)
+    )
+    assert len(forced) == 1 and len(es.mgets) == 1
+
+
+def test_changed_records_first_run_without_index():
+    es = HashStore(missing=True)
+    out = list(
+        ingest.changed_records(es, _records(["fever"]), ingest.IngestStats(), {})
+    )
+    assert len(out) == 1
+
+
+def test_run_prunes_documents_without_source(monkeypatch, three_dims):
+    deleted = []
+
+    def fake_scan(es, index, query, source):
+        return iter([{"_id": "0"}, {"_id": "gone"}, {"_id": "legacy"}])
+
+    def fake_bulk(es, actions, raise_on_error, stats_only):
+        deleted.extend(a["_id"] for a in actions)
+        return len(deleted), 0
+
+    monkeypatch.setattr(
+        ingest.helpers,
+        "parallel_bulk",
+        lambda es, actions, **kw: ((True, {}) for _ in actions),
+    )
+    monkeypatch.setattr(ingest.helpers, "scan", fake_scan)
+    monkeypatch.setattr(ingest.helpers, "bulk", fake_bulk)
+    es = HashStore({"0": ingest.content_hash({}, "fever")})
+
+    stats = ingest.run(es, _records(["fever", "lab"]), prune_index="idx")
+
+    assert (stats.docs, stats.skipped, stats.deleted) == (1, 1, 2)
+    assert deleted == ["gone", "legacy"]
+
+
+def test_run_skips_prune_when_source_is_empty(monkeypatch, caplog):
+    monkeypatch.setattr(
+        ingest.helpers, "parallel_bulk", lambda es, actions, **kw: iter(())
+    )
+    monkeypatch.setattr(
+        ingest.helpers, "scan", lambda *a, **kw: pytest.fail("should not scan")
+    )
+    caplog.set_level("WARNING")
+
+    stats = ingest.run(HashStore(), iter(()), prune_index="idx")
+
+    assert stats.deleted == 0
+    assert "skipping prune" in caplog.text
+
+
+class SettingsES:
+    def __init__(self, fail=False, alias=False, docs=0):
+        self.calls = []
+        self.fail = fail
+        self.alias = alias
+        self.docs = docs
+        self.indices = self
+
+    def exists_alias(self, name):
+        return self.alias
+
+    def count(self, index):
+        if self.fail:
+            raise RuntimeError("no such index")
+        return {"count": self.docs}
+
+    def put_settings(self, index, settings):
+        if self.fail:
+            raise RuntimeError("no such index")
+        self.calls.append(("settings", index, settings["refresh_interval"]))
+
+    def refresh(self, index):
+        self.calls.append(("refresh", index))
+
+
+def test_ingest_settings_restores_serving_settings_on_error():
+    es = SettingsES()
+    with pytest.raises(RuntimeError, match="boom"):
+        with ingest.ingest_settings(es, "idx"):
+            assert es.calls == [("settings", "idx", "-1")]
+            raise RuntimeError("boom")
+    assert es.calls[1:] == [("settings", "idx", "1s"), ("refresh", "idx")]
+
+
+@pytest.mark.parametrize("live", [SettingsES(alias=True), SettingsES(docs=12)])
+def test_ingest_settings_leave_live_index_alone(live):
+    # Incremental runs into a serving alias or populated index keep replicas
+    # and refresh, so user writes stay visible and redundant
+    with ingest.ingest_settings(live, "idx"):
+        assert live.calls == []
+    assert live.calls == [("refresh", "idx")]
+
+
+def test_ingest_settings_tolerates_missing_index(caplog):
+    es = SettingsES(fail=True)
+    caplog.set_level("WARNING")
+    with ingest.ingest_settings(es, "idx"):
+        pass
+    assert es.calls == [("refresh", "idx")]
+    assert "treating it as live" in caplog.text
+
+
+def test_apply_index_settings_logs_failure(caplog):
+    caplog.set_level("WARNING")
+    assert ingest.apply_index_settings(SettingsES(fail=True), "idx", "ingest") is False
+    assert "Could not apply ingest settings to idx" in caplog.text
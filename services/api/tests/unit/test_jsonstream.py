@@ -0,0 +1,71 @@
+import gzip
+import io
+import json
+
+import pytest
+
+from app.tools import jsonstream
+
+RECORDS = [
+    {"name": "Clinic A", "geo": {"lat": 32.08, "lon": 34.78}, "services": ["lab"]},
+    {"name": "קופת חולים", "rating": 12345, "open": True, "note": None},
+    [1, 2.5, "x"],
+    -17,
+]
+
+
+def test_iter_json_array_decodes_across_tiny_chunks():
+    text = json.dumps(RECORDS, ensure_ascii=False, indent=2)
+    # A 3-char chunk splits every string, object and number mid-token
+    assert list(jsonstream.iter_json_array(io.StringIO(text), chunk_size=3)) == RECORDS
+    assert list(jsonstream.iter_json_array(io.StringIO(" [ ] "))) == []
+
+
+def test_iter_json_array_keeps_buffer_small(monkeypatch):
+    reader_sizes = []
+    real_value = jsonstream._Reader.value
+
+    def tracking(self):
+        reader_sizes.append(len(self.buf))
+        return real_value(self)
+
+    items = [{"id": i, "text": "x" * 50} for i in range(2000)]
+    handle = io.StringIO(json.dumps(items))
+    monkeypatch.setattr(jsonstream._Reader, "value", tracking)
+
+    assert sum(1 for _ in jsonstream.iter_json_array(handle, chunk_size=256)) == 2000
+    assert max(reader_sizes) < 512
+
+
+def test_iter_json_object_yields_members():
+    text = json.dumps({"a": {"x": 1}, "b": [1, 2], "c": "done"})
+    assert list(jsonstream.iter_json_object(io.StringIO(text), chunk_size=4)) == [
+        ("a", {"x": 1}),
+        ("b", [1, 2]),
+        ("c", "done"),
+    ]
+
+
+@pytest.mark.parametrize("text", ["[1, 2", "[1 2]", "{1: 2}", '{"a" 1}', "", "{"])
+def test_iter_json_rejects_malformed(text):
+    reader = (
+        jsonstream.iter_json_object
+        if text.startswith("{")
+        else jsonstream.iter_json_array
+    )
+    with pytest.raises(json.JSONDecodeError):
+        list(reader(io.StringIO(text)))
+
+
+def test_iter_records_reads_gzipped_jsonl_and_json(tmp_path, caplog):
+    jsonl = tmp_path / "providers.jsonl.gz"
+    with gzip.open(jsonl, "wt", encoding="utf-8") as handle:
+        handle.write('{"name": "A"}\n\nnot json\n{"name": "B"}\n')
+    array = tmp_path / "providers.json"
+    array.write_text(json.dumps([{"name": "C"}]), encoding="utf-8")
+    caplog.set_level("WARNING")
+
+    assert list(jsonstream.iter_records(str(jsonl))) == [{"name": "A"}, {"name": "B"}]
+    assert "malformed JSONL line 3" in caplog.text
+    assert list(jsonstream.iter_records(str(array))) == [{"name": "C"}]
+    assert jsonstream.is_jsonl("x.ndjson") and not jsonstream.is_jsonl("x.json.gz")
@@ -0,0 +1,244 @@
+import threading
+
+import pytest
+from cryptography.fernet import Fernet, MultiFernet
+
+from app.config import settings
+from app.tools import crypto, key_store
+from app.tools.key_store import FileKeyStore, SQLiteKeyStore
+
+
+@pytest.fixture
+def master():
+    return MultiFernet([Fernet(Fernet.generate_key())])
+
+
+def test_cipher_is_cached_per_user_with_lru_eviction(tmp_path, monkeypatch):
+    store = FileKeyStore(tmp_path, cache_size=2)
+    reads = []
+    original = store.get
+    monkeypatch.setattr(store, "get", lambda u: reads.append(u) or original(u))
+
+    a = store.cipher("a")
+    assert store.cipher("a") is a and reads == ["a"]
+    store.cipher("b")
+    store.cipher("a")  # refreshes a, so b is evicted next
+    store.cipher("c")
+    assert list(store._ciphers) == ["a", "c"]
+    assert store.cipher("a") is a
+
+    store.cipher("b")
+    assert reads.count("b") == 2
+
+
+def test_delete_drops_cached_cipher(tmp_path):
+    store = FileKeyStore(tmp_path)
+    token = store.cipher("u").encrypt(b"x")
+    assert store.delete("u") is True
+    assert "u" not in store._ciphers
+    # A fresh key is made on next use; old data stays unreadable
+    with pytest.raises(Exception):
+        store.cipher("u").decrypt(token)
+    assert store.delete("nobody") is False
+
+
+def test_delete_removes_the_key_before_evicting_its_cipher(tmp_path, monkeypatch):
+    store = FileKeyStore(tmp_path)
+    store.cipher("u")
+    cached_at_removal = []
+    original = store._remove
+    monkeypatch.setattr(
+        store,
+        "_remove",
+        lambda u: cached_at_removal.append(u in store._ciphers) or original(u),
+    )
+
+    store.delete("u")
+
+    assert cached_at_removal == [True] and "u" not in store._ciphers
+
+
+def test_miss_racing_a_delete_does_not_cache_the_deleted_key(tmp_path, monkeypatch):
+    store = FileKeyStore(tmp_path)
+    store.ensure("u")
+    original = store.get
+
+    def get_then_delete(user_id):
+        key = original(user_id)
+        store.delete(user_id)  # lands while the miss is building its cipher
+        return key
+
+    monkeypatch.setattr(store, "get", get_then_delete)
+    store.cipher("u")
+
+    assert "u" not in store._ciphers
+
+
+def test_cached_cipher_is_revalidated_after_ttl(tmp_path, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(key_store.time, "monotonic", lambda: now[0])
+    worker_a = FileKeyStore(tmp_path, cache_ttl_s=5)
+    worker_b = FileKeyStore(tmp_path, cache_ttl_s=5)
+    old = worker_a.cipher("u")
+    token = old.encrypt(b"x")
+
+    now[0] += 4
+    assert worker_a.cipher("u") is old  # within the TTL: no store read
+    now[0] += 2
+    assert worker_a.cipher("u") is old  # revalidated: the key is unchanged
+
+    worker_b.delete("u")
+    assert worker_a.cipher("u") is old
+    now[0] += 6
+    fresh = worker_a.cipher("u")
+    assert fresh is not old
+    with pytest.raises(Exception):
+        fresh.decrypt(token)
+    assert worker_b.get("u") == worker_a.get("u")
+
+
+@pytest.mark.parametrize("user_id", ["../victim", "a/b", "..", "a@b.c", "x:1"])
+def test_file_store_keeps_every_user_id_inside_its_directory(tmp_path, user_id):
+    store = FileKeyStore(tmp_path / "keys")
+
+    key = store.ensure(user_id)
+
+    assert store.key_path(user_id).parent == tmp_path / "keys"
+    assert [p.parent for p in (tmp_path / "keys").iterdir()] == [tmp_path / "keys"]
+    assert not (tmp_path / "victim.key").exists()
+    assert store.get(user_id) == key and list(store.users()) == [user_id]
+    assert store.delete(user_id) is True and store.get(user_id) is None
+
+
+def test_file_store_reads_and_deletes_legacy_unencoded_files(tmp_path):
+    store = FileKeyStore(tmp_path)
+    legacy = Fernet.generate_key()
+    (tmp_path / "a@b.key").write_bytes(legacy)
+    (tmp_path / "50%.key").write_bytes(legacy)
+
+    assert store.key_path("plain-id.1").name == "plain-id.1.key"
+    assert store.key_path("a@b").name == "a%40b.key"
+    assert store.get("a@b") == store.ensure("a@b") == legacy
+    assert not store.key_path("a@b").exists()
+    # A raw name with % could be another id's encoded one, so it is not read
+    assert store.get("50%") is None
+
+    assert store.delete("a@b") is True
+    assert not (tmp_path / "a@b.key").exists()
+
+
+def test_zero_cache_size_disables_caching(tmp_path):
+    store = FileKeyStore(tmp_path, cache_size=0)
+    assert store.cipher("u") is not store.cipher("u")
+
+
+def test_sqlite_store_wraps_keys_under_master(tmp_path, master):
+    store = SQLiteKeyStore(tmp_path / "keys.db", master)
+    key = store.ensure("u1")
+    assert store.ensure("u1") == key
+    assert store.get("nobody") is None
+
+    wrapped = store._wrapped("u1")
+    assert wrapped != key and master.decrypt(wrapped) == key
+    assert list(store.users()) == ["u1"]
+    assert store.delete("u1") is True and store.delete("u1") is False
+    store.close()
+
+    # Same file, another master key: the keys cannot be unwrapped
+    other = SQLiteKeyStore(
+        tmp_path / "keys.db", MultiFernet([Fernet(Fernet.generate_key())])
+    )
+    other.add("u2", Fernet.generate_key())
+    reopened = SQLiteKeyStore(tmp_path / "keys.db", master)
+    with pytest.raises(Exception):
+        reopened.get("u2")
+
+
+def test_sqlite_add_raises_if_the_row_vanishes(tmp_path, master, monkeypatch):
+    store = SQLiteKeyStore(tmp_path / "keys.db", master)
+    # A delete landing between the insert and the read back
+    monkeypatch.setattr(store, "get", lambda user_id: None)
+
+    with pytest.raises(RuntimeError, match="deleted"):
+        store.add("u", Fernet.generate_key())
+
+
+def test_key_store_backends_must_implement_the_io():
+    with pytest.raises(TypeError):
+        key_store.KeyStore()  # type: ignore[abstract]
+
+
+def test_concurrent_creation_converges_on_one_key(tmp_path, master):
+    stores = [FileKeyStore(tmp_path / "files"), SQLiteKeyStore(tmp_path / "k", master)]
+    for store in stores:
+        keys = []
+        threads = [
+            threading.Thread(target=lambda: keys.append(store.ensure("u")))
+            for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(set(keys)) == 1
+
+
+def test_rewrap_moves_keys_to_the_new_master(tmp_path, master):
+    store = SQLiteKeyStore(tmp_path / "keys.db", master)
+    key = store.ensure("u")
+    new = Fernet(Fernet.generate_key())
+    rotated = SQLiteKeyStore(tmp_path / "keys.db", MultiFernet([new, *master._fernets]))
+    assert rotated.rewrap() == 1
+    assert new.decrypt(rotated._wrapped("u")) == key
+    assert SQLiteKeyStore(tmp_path / "keys.db", MultiFernet([new])).get("u") == key
+
+
+def test_migrate_copies_file_keys_into_sqlite(tmp_path, master):
+    files = FileKeyStore(tmp_path / "keys")
+    k1, k2 = files.ensure("u1"), files.ensure("u2")
+    db = SQLiteKeyStore(tmp_path / "keys.db", master)
+    db.add("u2", k2)
+
+    assert key_store.migrate(files, db, delete_source=True) == 2
+    assert db.get("u1") == k1 and db.get("u2") == k2
+    assert list(files.users()) == []
+
+    files.ensure("u1")
+    with pytest.raises(ValueError, match="different key"):
+        key_store.migrate(files, db)
+
+
+def test_get_store_from_env(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    assert isinstance(key_store.get_store(), FileKeyStore)
+    assert key_store.get_store() is key_store.get_store()
+
+    monkeypatch.setenv("KEY_STORE", "sqlite")
+    store = key_store.get_store()
+    assert isinstance(store, SQLiteKeyStore)
+    assert store.path == tmp_path / "keys.db"
+    assert (tmp_path / "master.key").exists() and "KEY_STORE_MASTER_KEY" in caplog.text
+
+    token = crypto.encrypt_for_user("u", "secret")
+    assert crypto.decrypt_for_user("u", token) == "secret"
+    assert crypto.has_user_key("u") and not (tmp_path / "keys" / "u.key").exists()
+
+    monkeypatch.setenv("KEY_STORE", "dbm")
+    with pytest.raises(ValueError, match="Unknown KEY_STORE"):
+        key_store.get_store()
+
+
+def test_master_key_from_env_and_cache_size_fallback(tmp_path, monkeypatch, caplog):
+    first, second = Fernet.generate_key(), Fernet.generate_key()
+    monkeypatch.setenv("KEY_STORE_MASTER_KEY", f"{first.decode()}, {second.decode()}")
+    master = key_store.master_key(str(tmp_path))
+    assert Fernet(first).decrypt(master.encrypt(b"k")) == b"k"
+    assert master.decrypt(Fernet(second).encrypt(b"k")) == b"k"
+    assert not (tmp_path / "master.key").exists()
+
+    monkeypatch.setenv("KEY_CACHE_SIZE", "lots")
+    assert FileKeyStore(tmp_path).cache_size == key_store.DEFAULT_CACHE_SIZE
+    assert "Invalid KEY_CACHE_SIZE" in caplog.text
+    monkeypatch.setenv("KEY_CACHE_TTL_S", "soon")
+    assert FileKeyStore(tmp_path).cache_ttl_s == key_store.DEFAULT_CACHE_TTL_S
+    assert "Invalid KEY_CACHE_TTL_S" in caplog.text
@@ -0,0 +1,159 @@
+import json
+
+import pytest
+
+from app.tools import knn_bench
+
+
+class RankingES:
+    """Exact search ranks by id; kNN misses ``missed`` unless candidates >= 32."""
+
+    def __init__(self, ids, missed=None):
+        self.ids = ids
+        self.missed = missed
+        self.knn_calls = []
+
+    def search(self, index, size, source, query=None, knn=None, routing=None):
+        ids = list(self.ids)
+        if knn is not None:
+            self.knn_calls.append(knn)
+            if knn["num_candidates"] < 32 and self.missed in ids:
+                ids.remove(self.missed)
+            if knn.get("similarity") is not None:
+                ids = ids[:1]
+        return {"hits": {"hits": [{"_id": i} for i in ids[:size]]}}
+
+
+def test_load_queries_reads_query_and_text_fields(tmp_path):
+    golden = tmp_path / "inputs.jsonl"
+    golden.write_text(
+        "\n".join(
+            json.dumps(r)
+            for r in [
+                {"id": "a", "query": "fever at night"},
+                {"id": "b", "query": "  "},
+                {"id": "c", "query": "fever at night"},
+            ]
+        )
+    )
+    evals = tmp_path / "evals.json"
+    evals.write_text(json.dumps([{"text": "chest pain"}, "not a record"]))
+
+    assert knn_bench.load_queries([str(golden), str(evals)]) == [
+        "fever at night",
+        "chest pain",
+    ]
+    assert knn_bench.load_queries([str(golden), str(evals)], limit=1) == [
+        "fever at night"
+    ]
+
+
+def test_percentile_nearest_rank():
+    assert knn_bench.percentile([], 95) == 0.0
+    assert knn_bench.percentile([3.0, 1.0, 2.0], 50) == 2.0
+    assert knn_bench.percentile([float(i) for i in range(1, 21)], 95) == 19.0
+    assert knn_bench.percentile([5.0], 0) == 5.0
+
+
+def test_sweep_reports_recall_and_recommends_cheapest():
+    es = RankingES(["d1", "d2", "d3", "d4"], missed="d2")
+
+    results = knn_bench.sweep(
+        es,
+        "idx",
+        [[1.0, 0.0]],
+        ks=[2, 8],
+        candidates=[4, 16, 32],
+        repeat=2,
+        similarities=[None, 0.5],
+    )
+
+    by_key = {(r.k, r.num_candidates, r.similarity): r for r in results}
+    # num_candidates below k is skipped
+    assert (8, 4, None) not in by_key
+    assert by_key[(2, 4, None)].recall == pytest.approx(0.5)
+    assert by_key[(2, 32, None)].recall == 1.0
+    assert by_key[(2, 32, 0.5)].hits_per_query == 1.0
+    assert es.knn_calls[-1]["similarity"] == 0.5
+    assert "idx" in by_key[(2, 4, None)].row()
+    assert knn_bench.HEADER.split()[0] == "index"
+
+    best = knn_bench.recommend(results, 2, 0.95)
+    assert (best.k, best.num_candidates, best.similarity) == (2, 32, None)
+    assert knn_bench.recommend(results, 8, 1.01) is None
+
+
+def test_measure_without_queries():
+    result = knn_bench.measure(RankingES([]), "idx", [], [], k=4, num_candidates=8)
+    assert (result.recall, result.hits_per_query, result.p95_ms) == (0.0, 0.0, 0.0)
+
+
+class OwnedES:
+    """Documents owned by users; exact and kNN search honour the owner filter."""
+
+    def __init__(self, owners):
+        self.owners = owners
+        self.calls = []
+
+    @staticmethod
+    def _owner(clause):
+        for part in clause["bool"]["filter"]:
+            if "term" in part:
+                return part["term"]["user_id"]
+            if "bool" in part:
+                return OwnedES._owner(part)
+        return None
+
+    def search(self, index, size, source=True, query=None, knn=None, **kw):
+        self.calls.append({"query": query, "knn": knn, **kw})
+        if "aggs" in kw:
+            users = sorted(set(self.owners.values()))
+            return {"aggregations": {"users": {"buckets": [{"key": u} for u in users]}}}
+        if knn is not None:
+            owner = self._owner(knn["filter"]) if "filter" in knn else None
+        else:
+            inner = query["script_score"]["query"]
+            owner = self._owner(inner) if "bool" in inner else None
+        ids = [d for d, u in self.owners.items() if owner in (None, u)]
+        return {"hits": {"hits": [{"_id": i} for i in ids[:size]]}}
+
+
+def test_sweep_scopes_truth_and_knn_to_each_user():
+    es = OwnedES({"a1": "alice", "b1": "bob", "a2": "alice", "b2": "bob"})
+
+    users = knn_bench.sample_users(es, "private", limit=10)
+    results = knn_bench.sweep(
+        es,
+        "private",
+        [[1.0], [0.0]],
+        ks=[2],
+        candidates=[8],
+        repeat=1,
+        user_ids=users,
+    )
+
+    assert users == ["alice", "bob"]
+    assert results[0].recall == 1.0
+    exact = [c for c in es.calls if c["query"] and "script_score" in c["query"]]
+    assert [c["routing"] for c in exact] == ["alice", "bob"]
+    knn = [c for c in es.calls if c["knn"] is not None]
+    assert {c["routing"] for c in knn} == {"alice", "bob"}
+    assert all("filter" in c["knn"] for c in knn)
+
+
+def test_unscoped_truth_would_miss_the_filtered_knn_hits():
+    es = OwnedES({"b1": "bob", "a1": "alice", "a2": "alice"})
+
+    truth = [knn_bench.exact_ids(es, "private", [1.0], 2)]
+    result = knn_bench.measure(
+        es,
+        "private",
+        [[1.0]],
+        truth,
+        k=2,
+        num_candidates=8,
+        repeat=1,
+        user_ids=["alice"],
+    )
+
+    assert result.recall == pytest.approx(0.5)
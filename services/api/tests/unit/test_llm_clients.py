@@ -0,0 +1,124 @@
+import asyncio
+import sys
+import time
+import types
+
+import pytest
+
+from app.tools import llm_clients, metrics
+
+
+@pytest.fixture(autouse=True)
+def _fresh_clients(monkeypatch):
+    monkeypatch.setattr(llm_clients, "_clients", {})
+    yield
+    llm_clients.close()
+
+
+def test_call_timeout_outside_request_uses_cap(monkeypatch):
+    monkeypatch.setenv("LLM_TIMEOUT_S", "7")
+    assert llm_clients.remaining_s() is None
+    assert llm_clients.call_timeout() == 7.0
+
+
+def test_call_timeout_shrinks_with_request_budget(monkeypatch):
+    monkeypatch.setenv("LLM_TIMEOUT_S", "7")
+    token = llm_clients.start_request_budget(2000)
+    try:
+        assert 0 < llm_clients.call_timeout() <= 2.0
+    finally:
+        llm_clients.reset_request_budget(token)
+
+
+def test_call_timeout_raises_once_budget_spent():
+    token = llm_clients.start_request_budget(1)
+    try:
+        time.sleep(0.01)
+        with pytest.raises(llm_clients.DeadlineExceeded):
+            llm_clients.call_timeout()
+    finally:
+        llm_clients.reset_request_budget(token)
+
+
+def test_budget_env_and_invalid_values(monkeypatch, caplog):
+    monkeypatch.setenv("REQUEST_BUDGET_MS", "0")
+    token = llm_clients.start_request_budget()
+    assert llm_clients.remaining_s() is None
+    llm_clients.reset_request_budget(token)
+
+    caplog.set_level("WARNING")
+    monkeypatch.setenv("LLM_TIMEOUT_S", "soon")
+    assert llm_clients.call_timeout() == llm_clients._DEFAULT_CALL_TIMEOUT_S
+    assert "Invalid LLM_TIMEOUT_S" in caplog.text
+
+
+def test_ollama_client_is_reused_and_cancelled_on_deadline(monkeypatch):
+    created = []
+    cancelled = []
+
+    class FakeAsyncClient:
+        def __init__(self, host=None):
+            created.append(host)
+
+        async def chat(self, model, messages):
+            if model == "slow":
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled.append(model)
+                    raise
+            return {"message": {"content": model}}
+
+    monkeypatch.setitem(
+        sys.modules, "ollama", types.SimpleNamespace(AsyncClient=FakeAsyncClient)
+    )
+    ok = metrics.llm_duration.count("ollama", "ok")
+    missed = metrics.llm_duration.count("ollama", "deadline")
+
+    assert llm_clients.ollama_chat("fast", [])["message"]["content"] == "fast"
+    token = llm_clients.start_request_budget(50)
+    try:
+        with pytest.raises(llm_clients.DeadlineExceeded):
+            llm_clients.ollama_chat("slow", [])
+    finally:
+        llm_clients.reset_request_budget(token)
+
+    assert created == [None]
+    assert metrics.llm_duration.count("ollama", "ok") == ok + 1
+    assert metrics.llm_duration.count("ollama", "deadline") == missed + 1
+    deadline = time.monotonic() + 2
+    while not cancelled and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cancelled == ["slow"]
+
+
+def test_loop_recreated_after_fork(monkeypatch):
+    loop = llm_clients._get_loop()
+    llm_clients._clients[("ollama", "")] = object()
+    assert llm_clients._get_loop() is loop
+
+    monkeypatch.setattr(llm_clients.os, "getpid", lambda: -1)
+    assert llm_clients._get_loop() is not loop
+    assert llm_clients._clients == {}
+
+
+def test_close_closes_clients_and_stops_loop():
+    closed = []
+
+    class AsyncCloser:
+        async def close(self):
+            closed.append("openai")
+
+    class HttpxWrapper:
+        _client = types.SimpleNamespace(aclose=lambda: closed.append("ollama"))
+
+    loop = llm_clients._get_loop()
+    llm_clients._clients[("openai", "k")] = AsyncCloser()
+    llm_clients._clients[("ollama", "")] = HttpxWrapper()
+
+    llm_clients.close()
+
+    assert sorted(closed) == ["ollama", "openai"]
+    assert loop.is_closed()
+    assert llm_clients._loop is None
+    llm_clients.close()  # idempotent
@@ -1,3 +1,4 @@
+import json
 import logging
 from io import StringIO
 import os
@@ -6,12 +7,19 @@ from pathlib import Path
 
 import pytest
 
+from app.config import logging as logging_config
 from app.config.logging import (
     configure_logging,
     _resolve_log_dir,
     set_request_id,
     clear_request_id,
+    set_node,
+    reset_node,
+    stop_logging,
+    JsonFormatter,
     RequestIdFilter,
+    log_payload,
+    payload_sampled,
 )
 
 
@@ -32,6 +40,8 @@ def reset_logging_and_env():
         del os.environ["APP_DATA_DIR"]
     if "LOG_LEVEL" in os.environ:
         del os.environ["LOG_LEVEL"]
+    yield
+    stop_logging()
 
 
 def test_resolve_log_dir_explicit_env_var(monkeypatch):
@@ -119,6 +129,21 @@ def test_configure_logging_root_logger_level():
 
 
 def test_configure_logging_handlers_present():
+    configure_logging()
+    root_logger = logging.getLogger()
+    # Request threads only enqueue; the listener owns the file and stream handlers
+    assert len(root_logger.handlers) == 1
+    assert isinstance(root_logger.handlers[0], logging.handlers.QueueHandler)
+    listener = logging_config._listener
+    assert listener is not None
+    assert any(
+        isinstance(h, logging.handlers.RotatingFileHandler) for h in listener.handlers
+    )
+    assert any(isinstance(h, logging.StreamHandler) for h in listener.handlers)
+
+
+def test_configure_logging_without_queue(monkeypatch):
+    monkeypatch.setenv("LOG_QUEUE", "false")
     configure_logging()
     root_logger = logging.getLogger()
     # Should have a file handler and a stream handler
@@ -128,6 +153,7 @@ def test_configure_logging_handlers_present():
         for h in root_logger.handlers
     )
     assert any(isinstance(h, logging.StreamHandler) for h in root_logger.handlers)
+    assert logging_config._listener is None
 
 
 def test_configure_logging_log_level_from_env_var(monkeypatch):
@@ -151,14 +177,11 @@ def test_configure_logging_clears_existing_handlers():
     # After configuration, dummy handler should be removed
     assert dummy_handler not in root_logger.handlers
 
-    # We expect 2 handlers (file and stream) from configure_logging
-    # Filter out any handlers that pytest's caplog might have added
-    # (caplog adds handlers to the root logger, which are not cleared by logging.shutdown())
-    configured_handlers = [
-        h
-        for h in root_logger.handlers
-        if isinstance(h, (logging.handlers.RotatingFileHandler, logging.StreamHandler))
+    # We expect 2 handlers (file and stream) behind the queue
+    assert [type(h) for h in root_logger.handlers] == [
+        logging_config._SnapshotQueueHandler
     ]
+    configured_handlers = list(logging_config._listener.handlers)
 
     assert len(configured_handlers) == 2
     assert any(
@@ -227,3 +250,168 @@ def test_request_id_filter_direct():
     rec2 = logging.LogRecord("x", logging.INFO, __file__, 0, "msg2", (), None)
     assert f.filter(rec2) is True
     assert getattr(rec2, "request_id", "") == "rid-xyz"
+
+
+def test_queued_records_reach_the_file_with_request_context(monkeypatch, tmp_path):
+    monkeypatch.setenv("APP_LOG_DIR", str(tmp_path))
+    logfile = configure_logging()
+    set_request_id("rid-q")
+    token = set_node("planner")
+    try:
+        logging.getLogger("test.queue").info("queued %s", "line")
+    finally:
+        reset_node(token)
+        clear_request_id()
+    stop_logging()
+
+    assert "rid=rid-q queued line" in logfile.read_text()
+    # After stopping, the handlers write directly again
+    root_logger = logging.getLogger()
+    assert not any(
+        isinstance(h, logging.handlers.QueueHandler) for h in root_logger.handlers
+    )
+    logging.getLogger("test.queue").warning("after stop")
+    assert "after stop" in logfile.read_text()
+
+
+def test_json_format_carries_request_id_and_node(monkeypatch, tmp_path):
+    monkeypatch.setenv("APP_LOG_DIR", str(tmp_path))
+    monkeypatch.setenv("LOG_FORMAT", "json")
+    logfile = configure_logging()
+    set_request_id("rid-json")
+    token = set_node("risk_ml")
+    try:
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            logging.getLogger("test.json").exception("failed %d", 3)
+    finally:
+        reset_node(token)
+        clear_request_id()
+    stop_logging()
+
+    lines = [json.loads(line) for line in logfile.read_text().splitlines()]
+    record = next(r for r in lines if r["logger"] == "test.json")
+    assert record["request_id"] == "rid-json" and record["node"] == "risk_ml"
+    assert record["level"] == "ERROR"
+    # The traceback is rendered by the listener's formatter, not the queue handler
+    assert record["message"] == "failed 3" and "ValueError" in record["exc_info"]
+
+
+def test_queue_handler_snapshots_args_without_formatting():
+    handler = logging_config._SnapshotQueueHandler(None)
+    handler.setFormatter(JsonFormatter())
+    items = ["a"]
+    rec = logging.LogRecord("x", logging.ERROR, __file__, 0, "items=%s", (items,), None)
+    try:
+        raise KeyError("k")
+    except KeyError:
+        import sys
+
+        rec.exc_info = sys.exc_info()
+
+    queued = handler.prepare(rec)
+    items.append("b")
+
+    assert queued is not rec and queued.getMessage() == "items=['a']"
+    assert queued.exc_info is rec.exc_info and queued.exc_text is None
+
+
+def test_json_formatter_includes_exception_when_unqueued():
+    rec = logging.LogRecord("x", logging.ERROR, __file__, 0, "boom", (), None)
+    try:
+        raise KeyError("k")
+    except KeyError:
+        import sys
+
+        rec.exc_info = sys.exc_info()
+    out = json.loads(JsonFormatter().format(rec))
+    assert out["node"] == "-" and "KeyError" in out["exc_info"]
+
+
+def _payload_lines(caplog, logger, rids, *payload):
+    caplog.clear()
+    for rid in rids:
+        set_request_id(rid)
+        log_payload(logger, "payload %s", *payload)
+    clear_request_id()
+    return [r.getMessage() for r in caplog.records]
+
+
+def test_log_payload_in_full_by_default(caplog):
+    logger = logging.getLogger("app.graph.nodes.places")
+    caplog.set_level(logging.DEBUG)
+    big = [{"name": f"clinic {i}"} for i in range(50)]
+    assert _payload_lines(caplog, logger, ["r1"], big) == [f"payload {big}"]
+
+    caplog.set_level(logging.INFO)
+    assert _payload_lines(caplog, logger, ["r1"], big) == []
+
+
+def test_unsampled_requests_get_bounded_summaries(monkeypatch, caplog):
+    monkeypatch.setenv("LOG_PAYLOAD_SAMPLE", "app.graph.nodes.places=0,*=1")
+    monkeypatch.setenv("LOG_PAYLOAD_MAX_CHARS", "40")
+    caplog.set_level(logging.DEBUG)
+    big = [{"name": "x" * 500, "i": i} for i in range(50)]
+
+    (line,) = _payload_lines(
+        caplog, logging.getLogger("app.graph.nodes.places"), ["r"], big
+    )
+    assert line == f"payload {str(big)[:40]}...[truncated]"
+    # Other loggers fall back to the "*" rate and stay in full
+    (line,) = _payload_lines(caplog, logging.getLogger("app.main"), ["r"], big)
+    assert line == f"payload {big}"
+
+    monkeypatch.setenv("LOG_PAYLOAD_MAX_CHARS", "0")
+    logger = logging.getLogger("app.graph.nodes.places")
+    assert _payload_lines(caplog, logger, ["r"], big) == []
+
+
+def test_sampling_by_request_id_hash_is_consistent_across_loggers(monkeypatch):
+    monkeypatch.setenv("LOG_PAYLOAD_SAMPLE", "4")
+    rids = [f"rid-{i}" for i in range(400)]
+    picked = []
+    for rid in rids:
+        set_request_id(rid)
+        places = payload_sampled("app.graph.nodes.places")
+        assert payload_sampled("app.graph.nodes.risk_ml") == places
+        picked.append(places)
+    clear_request_id()
+    assert 50 < sum(picked) < 150
+    # Same request id, same decision
+    set_request_id(rids[picked.index(True)])
+    assert payload_sampled("app.graph.nodes.planner")
+    clear_request_id()
+    assert not payload_sampled("app.graph.nodes.planner")
+
+
+def test_sampling_by_arrival_count(monkeypatch):
+    monkeypatch.setenv("LOG_PAYLOAD_SAMPLE", "app.graph=3")
+    monkeypatch.setenv("LOG_PAYLOAD_SAMPLE_BY", "count")
+    picked = []
+    for _ in range(9):
+        set_request_id("same-rid")
+        picked.append(payload_sampled("app.graph.nodes.places"))
+    clear_request_id()
+    assert sum(picked) == 3
+    assert payload_sampled("app.other")  # no match, default rate 1
+
+
+def test_invalid_sample_spec_and_max_chars(monkeypatch, caplog):
+    monkeypatch.setenv("LOG_PAYLOAD_SAMPLE", "app.x=often,*=0")
+    monkeypatch.setenv("LOG_PAYLOAD_MAX_CHARS", "lots")
+    caplog.set_level(logging.DEBUG)
+    assert not payload_sampled("app.x")
+    assert "Invalid LOG_PAYLOAD_SAMPLE entry" in caplog.text
+    (line,) = _payload_lines(caplog, logging.getLogger("app.x"), ["r"], "y" * 500)
+    assert line == "payload " + "y" * 200 + "...[truncated]"
+
+
+def test_clip_matches_repr_prefix_and_stops_early():
+    from app.config.logging import _clip
+
+    small = {"a": [1, (2, "x")], "b": None}
+    assert _clip(small, 100) == repr(small)
+    big = {"hits": [{"name": "n" * 30, "i": i} for i in range(1000)]}
+    assert _clip(big, 50) == repr(big)[:50] + "...[truncated]"
+    assert _clip(["z" * 500], 10) == repr(["z" * 500])[:10] + "...[truncated]"
@@ -105,3 +105,23 @@ def test_onset_for_requires_summary(monkeypatch, tmp_path):
 
     monkeypatch.setattr(med_facts, "_resolve_path", lambda: str(path))
     assert med_facts.onset_for("empty") is None
+
+
+def test_load_facts_from_gzipped_jsonl(monkeypatch, tmp_path):
+    import gzip
+
+    path = tmp_path / "facts.jsonl.gz"
+    entry = {
+        "name": "Naproxen",
+        "aliases": ["aleve"],
+        "onset": {"en": {"summary": "Starts within an hour.", "follow_up": "Call."}},
+        "source_url": "https://example.org/naproxen",
+    }
+    with gzip.open(path, "wt", encoding="utf-8") as handle:
+        handle.write(json.dumps(entry) + "\n" + json.dumps(["not", "an entry"]) + "\n")
+    monkeypatch.setenv("MED_FACTS_PATH", str(path))
+    med_facts.clear_cache()
+
+    assert med_facts.ingredients() == ["naproxen"]
+    assert med_facts.onset_for("aleve", language="en") is not None
+    med_facts.clear_cache()
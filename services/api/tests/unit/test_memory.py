@@ -3,6 +3,7 @@ from unittest.mock import patch, MagicMock
 from app.graph.nodes import memory
 from app.graph.state import BodyState
 from app.config import settings
+from app.tools import memory_ttl
 
 
 def test_memory_run(fake_es, monkeypatch):
@@ -41,7 +42,11 @@ def test_memory_run(fake_es, monkeypatch):
     mock_embed.assert_not_called()
     search_body = fake_es.search.call_args.kwargs["body"]
     assert "knn" not in search_body
-    assert search_body["query"]["term"]["user_id"] == "test-user"
+    filters = search_body["query"]["bool"]["filter"]
+    assert {"term": {"user_id": "test-user"}} in filters
+    # Expired facts are skipped on read
+    assert memory_ttl.not_expired() in filters
+    assert fake_es.search.call_args.kwargs["routing"] == "test-user"
 
     fake_es.search.assert_called_once()
 
@@ -0,0 +1,188 @@
+import json
+from types import SimpleNamespace
+
+from app.config import settings
+from app.tools import answer_cache, crypto, memory_admin, memory_writer
+from app.tools.answer_cache import AnswerCache
+from app.tools.memory_writer import MemoryWriter
+
+
+class PitES:
+    """Serves ``docs`` through a PIT in pages, like search_after would."""
+
+    def __init__(self, docs, delete_resp=None):
+        self.docs = docs
+        self.delete_resp = delete_resp or {"deleted": len(docs)}
+        self.searches = []
+        self.opened = []
+        self.closed = []
+        self.deletes = []
+        self.refreshed = []
+        self.indices = SimpleNamespace(
+            refresh=lambda index: self.refreshed.append(index)
+        )
+
+    def open_point_in_time(self, index, keep_alive, routing):
+        self.opened.append((index, routing))
+        return {"id": "pit-0"}
+
+    def search(self, pit, query, sort, size, source_excludes, search_after=None):
+        self.searches.append({"pit": pit["id"], "search_after": search_after})
+        start = 0 if search_after is None else search_after[0] + 1
+        hits = [
+            {"_id": doc_id, "_source": dict(source), "sort": [n]}
+            for n, (doc_id, source) in enumerate(self.docs)
+        ][start : start + size]
+        return {"pit_id": f"pit-{len(self.searches)}", "hits": {"hits": hits}}
+
+    def close_point_in_time(self, id):
+        self.closed.append(id)
+
+    def delete_by_query(self, **kwargs):
+        self.deletes.append(kwargs)
+        return self.delete_resp
+
+
+def test_export_pages_through_pit_and_decrypts(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    token = crypto.encrypt_for_user("u1", "1 tab daily")
+    docs = [
+        (
+            f"u1:med:{n}",
+            {
+                "user_id": "u1",
+                "name": f"Med {n}",
+                "value": token,
+                "value_encrypted": True,
+            },
+        )
+        for n in range(5)
+    ]
+    es = PitES(docs)
+
+    lines = list(memory_admin.export_ndjson(es, "u1", page_size=2))
+
+    facts = [json.loads(line) for line in lines]
+    assert [f["id"] for f in facts] == [doc_id for doc_id, _ in docs]
+    assert {f["value"] for f in facts} == {"1 tab daily"}
+    assert "value_encrypted" not in facts[0]
+    assert all(line.endswith("\n") for line in lines)
+    # Routed to the user's shard; the refreshed PIT id is reused and closed
+    assert es.opened == [(settings.es_private_index, "u1")]
+    assert [s["pit"] for s in es.searches] == ["pit-0", "pit-1", "pit-2"]
+    assert [s["search_after"] for s in es.searches] == [None, [1], [3]]
+    assert es.closed == ["pit-3"]
+
+
+def test_export_without_key_does_not_create_one(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    es = PitES(
+        [("u2:med:x", {"user_id": "u2", "value": "tok", "value_encrypted": True})]
+    )
+
+    (line,) = memory_admin.export_ndjson(es, "u2", page_size=10)
+
+    assert json.loads(line)["value"] is None
+    assert not crypto.has_user_key("u2")
+
+
+def test_export_marks_undecryptable_values_and_closes_pit_early(
+    monkeypatch, tmp_path, caplog
+):
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    crypto.ensure_user_key("u3")
+    es = PitES(
+        [
+            ("a", {"value": "not-a-token", "value_encrypted": True}),
+            ("b", {"value": "plain"}),
+        ]
+    )
+    caplog.set_level("WARNING")
+
+    stream = memory_admin.export_ndjson(es, "u3", page_size=1)
+    first = json.loads(next(stream))
+    stream.close()
+
+    assert first["value"] is None
+    assert "Could not decrypt fact a" in caplog.text
+    assert es.closed == ["pit-1"]
+
+
+def test_close_pit_failure_is_logged(caplog):
+    es = PitES([])
+
+    def broken(id):
+        raise RuntimeError("pit expired")
+
+    es.close_point_in_time = broken
+    caplog.set_level("WARNING")
+    assert list(memory_admin.iter_user_facts(es, "u", page_size=5)) == []
+    assert "Could not close PIT" in caplog.text
+
+
+def test_delete_user_memory_throttles_and_removes_key(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    monkeypatch.setenv("MEMORY_DELETE_RPS", "0")
+    crypto.ensure_user_key("u4")
+    es = PitES([("a", {})], delete_resp={"deleted": 1, "failures": [{"id": "b"}]})
+
+    result = memory_admin.delete_user_memory(es, "u4")
+
+    assert result == {
+        "ok": False,
+        "deleted": 1,
+        "discarded": 0,
+        "failures": 1,
+        "key_removed": True,
+        "invalidated": 0,
+    }
+    assert es.refreshed == [settings.es_private_index]
+    (call,) = es.deletes
+    assert call["routing"] == "u4"
+    assert call["requests_per_second"] == -1
+    assert call["query"]["bool"]["filter"] == [{"term": {"user_id": "u4"}}]
+    assert not crypto.has_user_key("u4")
+
+    again = memory_admin.delete_user_memory(es, "u4", requests_per_second=100)
+    assert again["key_removed"] is False
+    assert es.deletes[-1]["requests_per_second"] == 100
+
+
+def test_delete_drops_the_users_queued_writes_first(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    written = []
+    monkeypatch.setattr(
+        memory_writer.helpers,
+        "bulk",
+        lambda es, actions, **kw: (written.extend(actions), (len(actions), []))[1],
+    )
+    writer = MemoryWriter(lambda: "es", flush_interval_s=60)
+    for user_id in ("u5", "u6", "u5"):
+        _, doc = memory_writer.preference_fact(user_id, "kind", "lab", [0.1])
+        writer.submit([memory_writer.index_action(user_id, f"{user_id}:p", doc)])
+    es = PitES([])
+
+    result = memory_admin.delete_user_memory(es, "u5", writer=writer)
+
+    assert result["discarded"] == 2 and writer.pending() == 1
+    writer.flush()
+    assert [a["_source"]["user_id"] for a in written] == ["u6"]
+
+
+def test_delete_drops_cached_answers_built_from_the_users_memory(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    cache = AnswerCache()
+    monkeypatch.setattr(answer_cache, "cache", cache)
+    for user_id in ("u7", "u8"):
+        scope = answer_cache.scope_for(user_id, [{"name": "ibuprofen"}])
+        cache.put(
+            user_id,
+            f"answer for {user_id}",
+            answer_cache.make_gate("p", "m", "en", [], [], scope),
+        )
+
+    result = memory_admin.delete_user_memory(PitES([]), "u7")
+
+    assert result["invalidated"] == 1
+    assert cache.get("u7") is None
+    assert cache.get("u8") == "answer for u8"
@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.tools import memory_ttl
+
+NOW = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+class CompactES:
+    def __init__(self, reindex_resp=None, delete_resp=None):
+        self.reindex_resp = reindex_resp or {"created": 2, "updated": 1}
+        self.delete_resp = delete_resp or {"deleted": 3}
+        self.calls = []
+
+    def reindex(self, **kwargs):
+        self.calls.append(("reindex", kwargs))
+        return self.reindex_resp
+
+    def delete_by_query(self, **kwargs):
+        self.calls.append(("delete_by_query", kwargs))
+        return self.delete_resp
+
+
+def test_stamp_sets_expiry_from_ttl(monkeypatch):
+    doc = memory_ttl.stamp({}, 30, now=NOW)
+    assert doc == {
+        "updated_at": "2026-03-01T12:00:00+00:00",
+        "ttl_days": 30,
+        "expires_at": "2026-03-31T12:00:00+00:00",
+    }
+
+    # 0 keeps the fact and clears an older expiry
+    assert "expires_at" not in memory_ttl.stamp(dict(doc), 0, now=NOW)
+
+    monkeypatch.setenv("MEMORY_TTL_DAYS", "7")
+    assert memory_ttl.stamp({}, now=NOW)["expires_at"].startswith("2026-03-08")
+    monkeypatch.setenv("MEMORY_TTL_DAYS", "soon")
+    assert memory_ttl.default_ttl_days() == memory_ttl.DEFAULT_TTL_DAYS
+
+
+def test_not_expired_excludes_past_expiry():
+    assert memory_ttl.not_expired() == {
+        "bool": {"must_not": [{"range": {"expires_at": {"lte": "now"}}}]}
+    }
+
+
+def test_compact_deletes_with_fixed_cutoff_and_throttle(monkeypatch):
+    monkeypatch.delenv("MEMORY_ARCHIVE_INDEX", raising=False)
+    monkeypatch.setenv("MEMORY_COMPACTION_RPS", "50")
+    es = CompactES()
+
+    stats = memory_ttl.compact(es, index="mem", now=NOW)
+
+    assert (stats.deleted, stats.archived, stats.failures) == (3, 0, 0)
+    ((op, kwargs),) = es.calls
+    assert op == "delete_by_query"
+    assert kwargs["query"] == {
+        "range": {"expires_at": {"lte": "2026-03-01T12:00:00+00:00"}}
+    }
+    assert kwargs["requests_per_second"] == 50.0
+    assert kwargs["scroll_size"] == memory_ttl.DEFAULT_BATCH_SIZE
+    assert "3 deleted" in stats.summary()
+
+
+def test_compact_archives_before_deleting(monkeypatch):
+    monkeypatch.setenv("MEMORY_ARCHIVE_INDEX", "mem-archive")
+    es = CompactES()
+
+    stats = memory_ttl.compact(
+        es, index="mem", batch_size=10, requests_per_second=0, now=NOW
+    )
+
+    assert [op for op, _ in es.calls] == ["reindex", "delete_by_query"]
+    reindex = es.calls[0][1]
+    assert reindex["dest"]["index"] == "mem-archive"
+    assert reindex["source"]["query"] == es.calls[1][1]["query"]
+    assert reindex["requests_per_second"] == -1
+    assert (stats.archived, stats.deleted) == (3, 3)
+
+
+def test_compact_keeps_facts_that_failed_to_archive(caplog):
+    es = CompactES(reindex_resp={"created": 1, "failures": [{"id": "x"}]})
+    caplog.set_level("WARNING")
+
+    stats = memory_ttl.compact(es, index="mem", archive_index="arch", now=NOW)
+
+    assert [op for op, _ in es.calls] == ["reindex"]
+    assert (stats.archived, stats.deleted, stats.failures) == (1, 0, 1)
+    assert "nothing deleted" in caplog.text
+
+
+def test_scheduler_runs_until_stopped(monkeypatch):
+    runs = []
+
+    def fake_compact(es):
+        runs.append(es)
+        if len(runs) == 1:
+            raise RuntimeError("cluster busy")
+        if len(runs) >= 2:
+            scheduler._stop.set()
+        return memory_ttl.CompactionStats()
+
+    monkeypatch.setattr(memory_ttl, "compact", fake_compact)
+    monkeypatch.setenv("MEMORY_COMPACTION_INTERVAL_S", "0.01")
+
+    scheduler = memory_ttl.start_scheduler(lambda: "es")
+    assert scheduler is not None
+    scheduler._thread.join(timeout=2)
+    scheduler.stop()
+    assert runs == ["es", "es"]
+
+
+@pytest.mark.parametrize("value", ["0", "never"])
+def test_scheduler_disabled_by_default(monkeypatch, value):
+    monkeypatch.setenv("MEMORY_COMPACTION_INTERVAL_S", value)
+    assert memory_ttl.start_scheduler(lambda: None) is None
@@ -0,0 +1,203 @@
+import threading
+
+import pytest
+
+from app.tools import answer_cache, memory_writer, metrics
+from app.tools.answer_cache import AnswerCache
+from app.tools.memory_writer import MemoryWriter
+
+
+class BulkRecorder:
+    def __init__(self, fail=0, errors=()):
+        self.batches = []
+        self.options = []
+        self.fail = fail
+        self.errors = list(errors)
+        self.called = threading.Event()
+
+    def __call__(self, es, actions, raise_on_error=True, **options):
+        assert raise_on_error is False
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("es down")
+        batch = list(actions)
+        self.batches.append(batch)
+        self.options.append(options)
+        self.called.set()
+        return len(batch) - len(self.errors), self.errors
+
+
+@pytest.fixture
+def bulk(monkeypatch):
+    recorder = BulkRecorder()
+    monkeypatch.setattr(memory_writer.helpers, "bulk", recorder)
+    return recorder
+
+
+def _action(user_id="u1", doc_id="u1:med:a"):
+    _, doc = memory_writer.med_fact(user_id, "Ibuprofen 200mg", "tok", [0.1])
+    return memory_writer.index_action(user_id, doc_id, doc, ttl_days=0)
+
+
+def test_med_and_preference_facts_share_add_med_shape():
+    doc_id, doc = memory_writer.med_fact("u1", " Ibuprofen 200mg ", "tok", (1, 0))
+    assert doc_id == "u1:med:ibuprofen"
+    assert doc["normalized"] == {"ingredient": "ibuprofen"}
+    assert doc["value"] == "tok" and doc["value_encrypted"] is True
+    assert doc["embedding"] == [1, 0]
+
+    doc_id, doc = memory_writer.preference_fact("u1", "Preferred_Kinds", "lab", [0])
+    assert doc_id == "u1:pref:preferred_kinds"
+    assert doc["entity"] == "preference" and doc["value"] == "lab"
+
+    action = memory_writer.index_action("u1", doc_id, doc, ttl_days=0)
+    assert action["routing"] == "u1" and action["_index"] == "private_user_memory"
+    assert action["_source"]["ttl_days"] == 0 and "updated_at" in action["_source"]
+
+
+def test_submit_queues_until_flush(bulk):
+    writer = MemoryWriter(lambda: "es", flush_interval_s=60, max_batch=10)
+    assert writer.submit([_action(), _action(doc_id="u1:med:b")]) == {
+        "ok": True,
+        "queued": 2,
+    }
+    assert bulk.batches == [] and writer.pending() == 2
+
+    stats = writer.flush()
+    assert (stats.written, stats.errors) == (2, 0)
+    assert len(bulk.batches[0]) == 2 and bulk.options == [{}]
+    assert writer.pending() == 0
+    assert writer.flush().written == 0
+
+
+def test_wait_for_flushes_earlier_writes_in_order(bulk):
+    writer = MemoryWriter(lambda: "es", flush_interval_s=60)
+    writer.submit([_action(doc_id="first")])
+    result = writer.submit([_action(doc_id="second")], wait_for=True)
+
+    assert result == {"ok": True, "written": 2, "errors": 0}
+    assert [a["_id"] for a in bulk.batches[0]] == ["first", "second"]
+    assert bulk.options == [{"refresh": "wait_for"}]
+
+
+def test_zero_interval_writes_synchronously_without_refresh(bulk):
+    writer = MemoryWriter(lambda: "es", flush_interval_s=0)
+    writer.start()
+    assert writer._thread is None
+    assert writer.submit([_action()])["written"] == 1
+    assert bulk.options == [{}]
+
+
+def test_failed_flush_requeues_and_item_errors_are_reported(monkeypatch, caplog):
+    recorder = BulkRecorder(fail=1, errors=[{"index": {"status": 400}}])
+    monkeypatch.setattr(memory_writer.helpers, "bulk", recorder)
+    writer = MemoryWriter(lambda: "es", flush_interval_s=60)
+    writer.submit([_action(doc_id="a")])
+    writer.submit([_action(doc_id="b")])
+
+    assert writer.flush().written == 0
+    assert "requeued" in caplog.text and writer.pending() == 2
+
+    stats = writer.flush()
+    assert (stats.written, stats.errors) == (1, 1)
+    assert [a["_id"] for a in recorder.batches[0]] == ["a", "b"]
+
+
+def test_failed_flushes_drop_actions_after_max_attempts(monkeypatch, caplog):
+    monkeypatch.setattr(memory_writer.helpers, "bulk", BulkRecorder(fail=3))
+    before = metrics.memory_writes_dropped.value("retries")
+    writer = MemoryWriter(lambda: "es", flush_interval_s=60, max_attempts=2)
+    writer.submit([_action(doc_id="a")])
+    writer.flush()
+    writer.submit([_action(doc_id="b")])
+
+    writer.flush()
+    assert writer.pending() == 1  # "a" failed twice, "b" once
+    assert "1 requeued, 1 dropped after 2 attempts" in caplog.text
+    writer.flush()
+    assert writer.pending() == 0
+    assert metrics.memory_writes_dropped.value("retries") == before + 2
+
+
+def test_discard_user_waits_for_a_running_flush(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    sent = []
+
+    def slow_bulk(es, actions, **kw):
+        started.set()
+        release.wait(5)
+        sent.extend(a["_id"] for a in actions)
+        return len(actions), []
+
+    monkeypatch.setattr(memory_writer.helpers, "bulk", slow_bulk)
+    writer = MemoryWriter(lambda: "es", flush_interval_s=60)
+    writer.submit([_action(doc_id="inflight")])
+    flusher = threading.Thread(target=writer.flush)
+    flusher.start()
+    assert started.wait(5)
+    writer.submit([_action(doc_id="queued"), _action("u2", "u2:med:a")])
+
+    done = []
+    discarder = threading.Thread(target=lambda: done.append(writer.discard_user("u1")))
+    discarder.start()
+    discarder.join(0.2)
+    assert done == []  # blocked until the in-flight batch has landed
+    release.set()
+    flusher.join(5)
+    discarder.join(5)
+
+    assert done == [1] and sent == ["inflight"]
+    assert writer.pending() == 1
+
+
+def test_wait_for_raises_when_es_is_down(monkeypatch):
+    monkeypatch.setattr(memory_writer.helpers, "bulk", BulkRecorder(fail=1))
+    writer = MemoryWriter(lambda: "es", flush_interval_s=60)
+    with pytest.raises(ConnectionError):
+        writer.submit([_action()], wait_for=True)
+    assert writer.pending() == 1
+
+
+def test_flush_invalidates_cached_answers_of_written_users(bulk, monkeypatch):
+    cache = AnswerCache()
+    monkeypatch.setattr(answer_cache, "cache", cache)
+    scope = answer_cache.scope_for("u1", [{"name": "ibuprofen"}])
+    gate = answer_cache.make_gate("p", "m", "en", [], [], scope)
+    cache.put("k", "old answer", gate)
+
+    writer = MemoryWriter(lambda: "es", flush_interval_s=60)
+    writer.submit([_action()])
+    assert cache.get("k") == "old answer"
+    writer.flush()
+    assert cache.get("k") is None
+
+
+def test_thread_flushes_full_batches_and_close_drains(bulk):
+    writer = MemoryWriter(lambda: "es", flush_interval_s=60, max_batch=2)
+    writer.start()
+    writer.submit([_action(doc_id="a"), _action(doc_id="b")])
+    assert bulk.called.wait(5)
+
+    writer.submit([_action(doc_id="c")])
+    writer.close()
+    assert [a["_id"] for batch in bulk.batches for a in batch] == ["a", "b", "c"]
+    assert writer._thread is None
+
+
+def test_close_warns_about_unflushed_writes(monkeypatch, caplog):
+    monkeypatch.setattr(memory_writer.helpers, "bulk", BulkRecorder(fail=1))
+    writer = MemoryWriter(lambda: "es", flush_interval_s=60)
+    writer.submit([_action()])
+    writer.close()
+    assert "1 memory writes not flushed" in caplog.text
+
+
+def test_settings_from_env(monkeypatch, caplog):
+    monkeypatch.setenv("MEMORY_WRITE_FLUSH_INTERVAL_S", "0.25")
+    monkeypatch.setenv("MEMORY_WRITE_MAX_BATCH", "bad")
+    monkeypatch.setenv("MEMORY_WRITE_MAX_ATTEMPTS", "0")
+    writer = MemoryWriter(lambda: "es")
+    assert writer.flush_interval_s == 0.25
+    assert writer.max_attempts == 1
+    assert writer.max_batch == memory_writer.DEFAULT_MAX_BATCH
+    assert "Invalid MEMORY_WRITE_MAX_BATCH" in caplog.text
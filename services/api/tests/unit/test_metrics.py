@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from app.tools import es_client, inference, key_store, metrics
+from app.tools.answer_cache import AnswerCache
+
+# Bound at import: the integration fixtures patch es_client.Elasticsearch
+from app.tools.es_client import Elasticsearch
+from app.tools.metrics import Counter, Histogram, MetricsMiddleware, Registry
+
+
+def test_counter_and_gauge_render_with_escaped_labels():
+    reg = Registry()
+    hits = reg.register(Counter("hits_total", "Hits.", ("route",)))
+    hits.inc('/a"b')
+    hits.inc('/a"b', amount=2)
+    live = reg.register(metrics.Gauge("live", "Live."))
+    live.inc()
+    live.dec()
+    live.set(value=3)
+
+    text = reg.render()
+    assert "# TYPE hits_total counter" in text
+    assert 'hits_total{route="/a\\"b"} 3.0' in text
+    assert "# TYPE live gauge\nlive 3" in text
+    assert text.endswith("\n")
+
+
+def test_metric_kinds_must_provide_samples():
+    with pytest.raises(TypeError):
+        metrics.Metric("m", "doc")  # type: ignore[abstract]
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram("lat_seconds", "Latency.", ("node",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 7.0):
+        h.observe(value, "places")
+    with h.time("planner"):
+        pass
+
+    lines = h.render().splitlines()
+    assert 'lat_seconds_bucket{node="places",le="0.1"} 2.0' in lines
+    assert 'lat_seconds_bucket{node="places",le="1.0"} 3.0' in lines
+    assert 'lat_seconds_bucket{node="places",le="+Inf"} 4.0' in lines
+    assert 'lat_seconds_sum{node="places"} 7.65' in lines
+    assert 'lat_seconds_count{node="places"} 4.0' in lines
+    assert h.count("places") == 4 and h.count("planner") == 1
+
+
+def test_cache_hit_ratio_per_cache(tmp_path):
+    cache = AnswerCache()
+    before = dict(metrics._hit_ratios())
+    cache.get("missing")  # exact misses are not counted; the semantic level is
+    assert cache.get_similar([1.0, 0.0], ("g",)) is None
+    cache.put("k", "answer", ("g",), [1.0, 0.0])
+    cache.get("k")
+    cache.get_similar([1.0, 0.0], ("g",))
+    assert metrics.cache_lookups.value("answer", "exact_hit") >= 1
+
+    store = key_store.FileKeyStore(tmp_path)
+    store.cipher("u")
+    store.cipher("u")
+    ratios = dict(metrics._hit_ratios())
+    assert ratios[("key_cipher",)] > 0
+    assert ("answer",) in ratios and ratios != before
+    assert 'cache_hit_ratio{cache="answer"}' in metrics.render()
+
+
+def test_es_calls_are_timed_by_index_and_operation(monkeypatch):
+    def fake_perform(self, method, path, **kwargs):
+        if kwargs.get("endpoint_id") == "count":
+            raise RuntimeError("down")
+        return {"hits": {"hits": []}}
+
+    monkeypatch.setattr(es_client._Elasticsearch, "perform_request", fake_perform)
+    es = Elasticsearch("http://localhost:9200")
+    searched = metrics.es_duration.count("kb", "search")
+    failed = metrics.es_errors.value("kb", "count")
+
+    es.search(index="kb", query={"match_all": {}})
+    try:
+        es.count(index="kb")
+    except RuntimeError:
+        pass
+    assert metrics.es_duration.count("kb", "search") == searched + 1
+    assert metrics.es_errors.value("kb", "count") == failed + 1
+
+
+def test_inference_slots_record_time_and_batch_size():
+    batches = metrics.inference_batch.count("metrics-test")
+    with inference.slot("metrics-test", batch_size=16):
+        assert 'inference_slots_in_use{model="metrics-test"} 1' in metrics.render()
+    assert metrics.inference_batch.count("metrics-test") == batches + 1
+    assert metrics.inference_duration.count("metrics-test") == batches + 1
+
+
+def test_middleware_counts_unmatched_and_failing_requests():
+    async def app(scope, receive, send):
+        if scope.get("path") == "/boom":
+            raise RuntimeError("boom")
+        await send({"type": "http.response.start", "status": 204})
+
+    async def send(message):
+        pass
+
+    middleware = MetricsMiddleware(app)
+    before = metrics.http_requests.value("GET", "unmatched", "500")
+    asyncio.run(middleware({"type": "http", "method": "GET", "path": "/x"}, None, send))
+    try:
+        asyncio.run(
+            middleware({"type": "http", "method": "GET", "path": "/boom"}, None, send)
+        )
+    except RuntimeError:
+        pass
+    asyncio.run(middleware({"type": "lifespan"}, None, send))
+    assert metrics.http_requests.value("GET", "unmatched", "204") >= 1
+    assert metrics.http_requests.value("GET", "unmatched", "500") == before + 1
@@ -0,0 +1,156 @@
+import json
+import threading
+
+from app.graph.nodes import answer_gen
+from app.tools import med_facts, onset_texts
+from app.tools.onset_texts import OnsetTextStore
+
+
+def test_store_persists_and_reloads(tmp_path):
+    path = str(tmp_path / "paraphrases" / "onset.db")
+    store = OnsetTextStore(path)
+    assert store.get("fallback|x|en") == (False, None)
+
+    store.put("fallback|x|en", {"text": "Monitor symptoms."})
+
+    reloaded = OnsetTextStore(path)
+    assert reloaded.get("fallback|x|en") == (True, {"text": "Monitor symptoms."})
+    assert len(reloaded) == 1
+
+
+def test_concurrent_writers_keep_each_others_entries(tmp_path):
+    path = str(tmp_path / "onset.db")
+    # Two workers, each with its own open store on the shared file
+    first, second = OnsetTextStore(path), OnsetTextStore(path)
+    assert second.get("fallback|a|en") == (False, None)
+
+    first.put("fallback|a|en", {"text": "a"})
+    second.put("fallback|b|en", {"text": "b"})
+
+    # A local miss reads the row the other worker stored
+    assert second.get("fallback|a|en") == (True, {"text": "a"})
+    assert OnsetTextStore(path).get("fallback|b|en") == (True, {"text": "b"})
+    assert len(first) == 2
+
+
+def test_store_imports_legacy_json_once(tmp_path):
+    legacy = tmp_path / "onset.json"
+    legacy.write_text(
+        json.dumps({"fallback|x|en": {"text": "old"}, "bad": "not a dict"}),
+        encoding="utf-8",
+    )
+
+    store = OnsetTextStore(str(tmp_path / "onset.db"))
+
+    assert store.get("fallback|x|en") == (True, {"text": "old"})
+    assert len(store) == 1
+    assert not legacy.exists() and (tmp_path / "onset.json.imported").exists()
+
+
+def test_store_ignores_corrupt_legacy_file(tmp_path, caplog):
+    (tmp_path / "onset.json").write_text("{not json", encoding="utf-8")
+    caplog.set_level("WARNING")
+
+    assert OnsetTextStore(str(tmp_path / "onset.db")).get("k") == (False, None)
+    assert "Failed loading onset texts" in caplog.text
+
+
+def test_store_skips_corrupt_row(tmp_path, caplog):
+    store = OnsetTextStore(str(tmp_path / "onset.db"))
+    store._db.execute("INSERT INTO onset_texts VALUES ('k', '{broken')")
+    caplog.set_level("WARNING")
+
+    assert store.get("k") == (False, None)
+    assert "Ignoring corrupt onset text k" in caplog.text
+    store.close()
+
+
+def test_paraphrase_keys_follow_facts_digest(monkeypatch, tmp_path):
+    facts = tmp_path / "facts.json"
+    facts.write_text(json.dumps({"ibuprofen": {}}), encoding="utf-8")
+    monkeypatch.setenv("MED_FACTS_PATH", str(facts))
+    med_facts.clear_cache()
+    store = onset_texts.get_store()
+
+    old_key = onset_texts.paraphrase_key("Ibuprofen", "en")
+    store.put(old_key, {"summary": "old"})
+
+    facts.write_text(json.dumps({"ibuprofen": {"aliases": []}}), encoding="utf-8")
+    med_facts.clear_cache()
+    new_key = onset_texts.paraphrase_key("ibuprofen", "en")
+    assert new_key != old_key
+
+    store.put(new_key, {"summary": "new"})
+    # Entries built from the previous facts file are dropped on write
+    assert store.get(old_key) == (False, None)
+    med_facts.clear_cache()
+
+
+def test_warm_dedupes_inflight_keys_and_skips_failed_generation():
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append("slow")
+        release.wait(5)
+        return {"text": "done"}
+
+    assert onset_texts.warm("fallback|a|en", slow) is True
+    assert onset_texts.warm("fallback|a|en", slow) is False
+    assert onset_texts.warm("fallback|b|en", lambda: None) is True
+    release.set()
+    onset_texts.drain()
+
+    store = onset_texts.get_store()
+    assert calls == ["slow"]
+    assert store.get("fallback|a|en") == (True, {"text": "done"})
+    assert store.get("fallback|b|en") == (False, None)
+
+
+def test_warm_can_be_disabled(monkeypatch):
+    monkeypatch.setenv("ONSET_WARM_ON_MISS", "false")
+    assert onset_texts.warm("fallback|a|en", lambda: {"text": "x"}) is False
+
+
+def test_precompute_onset_texts_fills_store(monkeypatch):
+    med_facts.clear_cache()
+    monkeypatch.setenv("LLM_PROVIDER", "ollama")
+
+    def fake_call(prompt, language):
+        if "Original summary" in prompt:
+            return "not json"
+        return None
+
+    monkeypatch.setattr(answer_gen, "_call_ollama", fake_call)
+    monkeypatch.setattr(
+        answer_gen,
+        "_generate_with_provider",
+        lambda provider, prompt, lang: "Please check with your clinician.",
+    )
+
+    counts = answer_gen.precompute_onset_texts(["en"], ["", "naproxen"])
+
+    assert counts["rejected"] == len(med_facts.ingredients())
+    assert counts["stored"] == 2
+    store = onset_texts.get_store()
+    assert store.get(onset_texts.fallback_key("naproxen", "en")) == (
+        True,
+        {"text": "Please check with your clinician."},
+    )
+
+    again = answer_gen.precompute_onset_texts(["en"], ["naproxen"])
+    assert again["stored"] == 0
+    assert again["skipped"] == counts["rejected"] + 1
+
+
+def test_warm_logs_failed_generation(caplog):
+    caplog.set_level("WARNING")
+
+    def boom():
+        raise RuntimeError("llm down")
+
+    assert onset_texts.warm("fallback|boom|en", boom)
+    onset_texts.drain()
+
+    assert "warm-up for fallback|boom|en failed" in caplog.text
+    assert onset_texts.get_store().get("fallback|boom|en") == (False, None)
@@ -0,0 +1,46 @@
+from app.tools import passages
+
+DOC = """# Fever — Home Care
+Intro paragraph about fever.
+
+## At home
+- Hydrate well; rest; light clothing.
+- Acetaminophen can reduce fever.
+
+## When to seek care
+Seek urgent care for chest pain or confusion.
+
+# Appendix
+Notes.
+"""
+
+
+def test_count_tokens_counts_words_and_punctuation():
+    assert passages.count_tokens("Hydrate well; rest.") == 5
+    assert passages.count_tokens("") == 0
+    assert passages.count_tokens("יש לי חום") == 3
+
+
+def test_split_passages_follows_headings():
+    out = passages.split_passages(DOC)
+
+    assert [p["heading"] for p in out] == [
+        "Fever — Home Care",
+        "Fever — Home Care > At home",
+        "Fever — Home Care > When to seek care",
+        "Appendix",
+    ]
+    assert [p["position"] for p in out] == [0, 1, 2, 3]
+    assert out[1]["text"].startswith("- Hydrate well")
+    assert "Acetaminophen" in out[1]["text"]
+
+
+def test_split_passages_packs_blocks_up_to_budget():
+    text = "# T\n" + "\n".join(f"- item {i} is here" for i in range(6))
+    out = passages.split_passages(text, max_tokens=10)
+
+    assert len(out) == 3
+    assert all(p["heading"] == "T" for p in out)
+    # Oversized single blocks stay whole
+    big = passages.split_passages("word " * 50, max_tokens=10)
+    assert len(big) == 1 and big[0]["heading"] == ""
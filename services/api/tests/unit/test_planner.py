@@ -267,6 +267,7 @@ def test_planner_fetches_preferences_when_missing(monkeypatch):
 
         def search(self, *args, **kwargs):
             self.called = True
+            self.routing = kwargs.get("routing")
             return {
                 "hits": {
                     "hits": [
@@ -300,5 +301,6 @@ def test_planner_fetches_preferences_when_missing(monkeypatch):
     new_state = planner.run(state, es_client=dummy_es)
 
     assert dummy_es.called
+    assert dummy_es.routing == "user-123"
     assert new_state["preferences"]["preferred_kinds"] == ["clinic"]
     assert new_state["plan"]["provider"]["name"] == "Clinic Pref"
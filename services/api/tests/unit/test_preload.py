@@ -0,0 +1,143 @@
+import gc
+import importlib
+
+import pytest
+
+from app import preload
+
+
+@pytest.mark.parametrize(
+    "raw,expected",
+    [("true", "master"), ("MASTER", "master"), ("worker", "worker"), ("false", "off")],
+)
+def test_preload_mode_parsing(monkeypatch, raw, expected):
+    monkeypatch.setenv("PRELOAD_MODELS", raw)
+    assert preload.preload_mode() == expected
+    assert preload.preload_enabled() is (expected == "master")
+
+
+def test_preload_models_runs_real_steps(monkeypatch):
+    from app.graph.nodes import risk_ml
+
+    calls = []
+    monkeypatch.setattr(risk_ml, "_get_pipe", lambda: calls.append("pipe"))
+
+    timings = preload.preload_models()
+
+    assert set(timings) == {"embeddings", "exemplars", "risk_pipeline", "seed_data"}
+    assert calls == ["pipe"]
+
+
+def test_preload_models_skips_failing_step(monkeypatch, caplog):
+    def boom():
+        raise RuntimeError("no model")
+
+    monkeypatch.setattr(preload, "_STEPS", (("broken", boom), ("ok", lambda: None)))
+    caplog.set_level("WARNING")
+
+    timings = preload.preload_models()
+
+    assert list(timings) == ["ok"]
+    assert "Preload step broken failed" in caplog.text
+
+
+def test_freeze_heap_uses_gc_freeze(monkeypatch):
+    calls = []
+    monkeypatch.setattr(preload.gc, "freeze", lambda: calls.append("freeze"))
+    monkeypatch.setattr(preload.gc, "get_freeze_count", lambda: 42)
+
+    assert preload.freeze_heap() == 42
+    assert calls == ["freeze"]
+
+
+def _reload_conf(monkeypatch, mode):
+    monkeypatch.setenv("PRELOAD_MODELS", mode)
+    import app.gunicorn_conf as conf
+
+    return importlib.reload(conf)
+
+
+def test_gunicorn_hooks_master_mode(monkeypatch):
+    conf = _reload_conf(monkeypatch, "true")
+    events = []
+    monkeypatch.setattr(
+        conf, "preload_models", lambda master=False: events.append(("preload", master))
+    )
+    monkeypatch.setattr(conf, "freeze_heap", lambda: events.append("freeze"))
+    monkeypatch.setattr(conf, "warm_worker", lambda: events.append("warm"))
+    monkeypatch.setattr(conf.gc, "disable", lambda: events.append("gc_off"))
+    monkeypatch.setattr(conf.gc, "enable", lambda: events.append("gc_on"))
+
+    assert conf.preload_app is True
+    assert conf.worker_class == "uvicorn.workers.UvicornWorker"
+    conf.on_starting(None)
+    conf.pre_fork(None, None)
+    conf.post_worker_init(None)
+
+    assert events == ["gc_off", ("preload", True), "freeze", "gc_on", "warm"]
+
+
+def test_gunicorn_master_collector_back_on_after_fork_prep(monkeypatch):
+    conf = _reload_conf(monkeypatch, "true")
+    monkeypatch.setattr(conf, "preload_models", lambda master=False: {})
+    monkeypatch.setattr(conf, "freeze_heap", lambda: 0)
+    was_enabled = gc.isenabled()
+    try:
+        conf.on_starting(None)
+        assert gc.isenabled() is False
+        # pre_fork runs in the master: it must not stay collector-less
+        conf.pre_fork(None, None)
+        assert gc.isenabled() is True
+    finally:
+        if was_enabled:
+            gc.enable()
+        else:  # pragma: no cover - pytest runs with the collector on
+            gc.disable()
+
+
+def test_preload_models_in_master_pins_one_torch_thread(monkeypatch):
+    from app.tools import inference
+
+    calls = []
+    monkeypatch.setattr(inference.scheduler, "pin_torch_threads", calls.append)
+    monkeypatch.setattr(preload, "_STEPS", ())
+
+    preload.preload_models(master=True)
+    preload.preload_models()
+
+    assert calls == [1]
+
+
+def test_warm_worker_resets_torch_and_encodes(monkeypatch, caplog):
+    from app.tools import inference
+
+    events = []
+    monkeypatch.setattr(
+        inference.scheduler, "reset_torch", lambda: events.append("reset")
+    )
+    monkeypatch.setattr(preload, "_load_embeddings", lambda: events.append("encode"))
+
+    preload.warm_worker()
+    assert events == ["reset", "encode"]
+
+    def boom():
+        raise RuntimeError("no model")
+
+    monkeypatch.setattr(preload, "_load_embeddings", boom)
+    caplog.set_level("WARNING")
+    preload.warm_worker()
+    assert "Worker warm-up failed" in caplog.text
+
+
+def test_gunicorn_hooks_worker_mode(monkeypatch):
+    conf = _reload_conf(monkeypatch, "worker")
+    events = []
+    monkeypatch.setattr(conf, "preload_models", lambda: events.append("preload"))
+    monkeypatch.setattr(conf, "freeze_heap", lambda: events.append("freeze"))
+
+    assert conf.preload_app is False
+    conf.on_starting(None)
+    conf.pre_fork(None, None)
+    conf.post_worker_init(None)
+
+    assert events == ["preload"]
@@ -0,0 +1,428 @@
+import pytest
+
+from app.config import settings
+from app.tools import embeddings, es_client, ingest, reembed
+
+
+class MemoryES:
+    """In-memory cluster with just the index/alias calls the job makes."""
+
+    def __init__(self):
+        self.docs = {}  # index -> {id: source}
+        self.mappings = {}
+        self.settings = {}
+        self.aliases = {}  # alias -> set of indices
+        self.routing = {}  # (index, id) -> routing
+        self.alias_updates = []
+        self.on_refresh = None
+        self.on_swap = None
+        self.indices = self._Indices(self)
+
+    class _Indices:
+        def __init__(self, outer):
+            self.outer = outer
+
+        def exists_alias(self, name):
+            return name in self.outer.aliases
+
+        def get_alias(self, name):
+            return {i: {"aliases": {name: {}}} for i in self.outer.aliases[name]}
+
+        def exists(self, index):
+            return index in self.outer.docs or index in self.outer.aliases
+
+        def create(self, index, mappings, settings):
+            self.outer.docs[index] = {}
+            self.outer.mappings[index] = mappings
+            self.outer.settings[index] = dict(settings)
+
+        def put_settings(self, index, settings):
+            self.outer.settings.setdefault(index, {}).update(settings)
+
+        def clone(self, index, target):
+            outer = self.outer
+            outer.docs[target] = {k: dict(v) for k, v in outer.docs[index].items()}
+            outer.mappings[target] = outer.mappings.get(index, {})
+            outer.settings[target] = dict(outer.settings.get(index, {}))
+            for (name, doc_id), routing in list(outer.routing.items()):
+                if name == index:
+                    outer.routing[(target, doc_id)] = routing
+
+        def get_mapping(self, index):
+            return {index: {"mappings": self.outer.mappings.get(index, {})}}
+
+        def refresh(self, index):
+            if self.outer.on_refresh:
+                self.outer.on_refresh(index)
+
+        def update_aliases(self, actions):
+            if self.outer.on_swap:
+                self.outer.on_swap()
+            self.outer.alias_updates.append(actions)
+            for action in actions:
+                ((op, args),) = action.items()
+                if op == "remove":
+                    self.outer.aliases[args["alias"]].discard(args["index"])
+                elif op == "remove_index":
+                    del self.outer.docs[args["index"]]
+                else:
+                    self.outer.aliases.setdefault(args["alias"], set()).add(
+                        args["index"]
+                    )
+
+        def delete(self, index):
+            for name in index.split(","):
+                del self.outer.docs[name]
+
+    def resolve(self, name):
+        return sorted(self.aliases[name]) if name in self.aliases else [name]
+
+    def mget(self, index, docs, source_excludes=None):
+        name = self.resolve(index)[0]
+        store = self.docs[name]
+        ids = []
+        for ref in docs:
+            if ref["_id"] in store:
+                assert ref.get("routing") == self.routing.get((name, ref["_id"]))
+            ids.append(ref["_id"])
+        return {
+            "docs": [
+                (
+                    {"_id": i, "found": True, "_source": dict(store[i])}
+                    if i in store
+                    else {"_id": i, "found": False}
+                )
+                for i in ids
+            ]
+        }
+
+
+@pytest.fixture()
+def cluster(monkeypatch):
+    es = MemoryES()
+
+    def fake_scan(client, index, query, **kwargs):
+        for doc_id, source in list(es.docs[index].items()):
+            hit = {"_id": doc_id, "_source": dict(source)}
+            if (index, doc_id) in es.routing:
+                hit["_routing"] = es.routing[(index, doc_id)]
+            yield hit
+
+    def fake_bulk(client, actions, **kwargs):
+        for action in actions:
+            name = es.resolve(action["_index"])[0]
+            store = es.docs[name]
+            if action.get("_op_type") == "delete":
+                assert action.get("routing") == es.routing.get((name, action["_id"]))
+                store.pop(action["_id"], None)
+            else:
+                store[action["_id"]] = action["_source"]
+                if "routing" in action:
+                    es.routing[(name, action["_id"])] = action["routing"]
+            yield True, {}
+
+    def fake_plain_bulk(client, actions, **kwargs):
+        count = sum(1 for _ in fake_bulk(client, actions))
+        return count, 0
+
+    monkeypatch.setattr(reembed.helpers, "scan", fake_scan)
+    monkeypatch.setattr(ingest.helpers, "parallel_bulk", fake_bulk)
+    monkeypatch.setattr(ingest.helpers, "bulk", fake_plain_bulk)
+
+    def fake_embed(texts, model=None):
+        return [[float(len(t)), 1.0] for t in texts]
+
+    monkeypatch.setattr(embeddings, "embed", fake_embed)
+    monkeypatch.setattr(embeddings, "dims", lambda model=None: 2)
+    monkeypatch.setattr(embeddings, "require_model", lambda model: None)
+    set_models = []
+    monkeypatch.setattr(embeddings, "set_model", set_models.append)
+    es.set_models = set_models
+    return es
+
+
+def _seed(es):
+    es.docs[settings.es_private_index] = {
+        "u1:med:ibuprofen": {
+            "user_id": "u1",
+            "name": "Ibuprofen",
+            "value": "gAAAA-encrypted",
+            "embedding": [0.0] * 384,
+        }
+    }
+    es.docs[settings.es_public_index] = {
+        "doc:0": {
+            "title": "Fever",
+            "heading": "At home",
+            "text": "Rest.",
+            "content_hash": "old",
+            "embedding": [0.0] * 384,
+        }
+    }
+    es.docs["providers_places-v1"] = {
+        "p1": {"name": "Clinic", "kind": "clinic", "services": ["lab"], "hours": ""}
+    }
+    es.aliases[settings.es_places_index] = {"providers_places-v1"}
+
+
+def test_reembed_copies_every_index_and_swaps_aliases(cluster):
+    _seed(cluster)
+
+    stats = reembed.run(cluster, "small-model", version="v2")
+
+    private = f"{settings.es_private_index}-v2"
+    public = f"{settings.es_public_index}-v2"
+    assert {k: s.docs for k, s in stats.items()} == {
+        "private": 1,
+        "public": 1,
+        "places": 1,
+    }
+    # Private memory keeps its encrypted value; only the name is embedded
+    doc = cluster.docs[private]["u1:med:ibuprofen"]
+    assert doc["value"] == "gAAAA-encrypted"
+    # Pre-routing memory is routed by its owner; other kinds stay unrouted
+    assert cluster.routing[(private, "u1:med:ibuprofen")] == "u1"
+    assert (public, "doc:0") not in cluster.routing
+    assert doc["embedding"] == [9.0, 1.0]
+    kb = cluster.docs[public]["doc:0"]
+    assert kb["embedding"] == [float(len("Fever\nAt home\nRest.")), 1.0]
+    assert kb["content_hash"] == ingest.content_hash(
+        kb, "Fever\nAt home\nRest.", "small-model"
+    )
+    assert cluster.mappings[public]["_meta"] == {"embeddings_model": "small-model"}
+    assert cluster.mappings[public]["properties"]["embedding"]["dims"] == 2
+    # Built under bulk-load settings, serving settings before the swap
+    assert cluster.settings[public] == es_client.index_settings("serving")
+
+    # One atomic swap; concrete pre-alias indices give up their name
+    assert len(cluster.alias_updates) == 1
+    assert {"remove_index": {"index": settings.es_public_index}} in (
+        cluster.alias_updates[0]
+    )
+    assert cluster.aliases[settings.es_public_index] == {public}
+    assert cluster.aliases[settings.es_places_index] == {"providers_places-v2"}
+    # Versioned old index kept for rollback; pre-alias ones as a clone
+    assert "providers_places-v1" in cluster.docs
+    rollback = f"{settings.es_public_index}-pre-v2"
+    assert cluster.docs[rollback]["doc:0"]["content_hash"] == "old"
+    assert cluster.settings[rollback]["index.blocks.write"] is False
+    assert cluster.set_models == ["small-model"]
+
+
+def test_reembed_catches_up_on_writes_during_copy(cluster):
+    _seed(cluster)
+    live = cluster.docs[settings.es_private_index]
+    writes = iter(
+        [
+            lambda: live.update(
+                {"u2:med:warfarin": {"user_id": "u2", "name": "Warfarin"}}
+            ),
+            lambda: live.pop("u1:med:ibuprofen"),
+        ]
+    )
+
+    def concurrent_write(index):
+        if index == settings.es_private_index:
+            next(writes, lambda: None)()
+
+    cluster.on_refresh = concurrent_write
+
+    stats = reembed.run(cluster, "small-model", version="v2", delete_old=True)
+
+    copied = cluster.docs[f"{settings.es_private_index}-v2"]
+    assert set(copied) == {"u2:med:warfarin"}
+    assert stats["private"].deleted == 1
+    assert "providers_places-v1" not in cluster.docs
+
+
+def test_reembed_final_catch_up_keeps_memory_written_during_later_kinds(cluster):
+    _seed(cluster)
+    live = cluster.docs[settings.es_private_index]
+    private = f"{settings.es_private_index}-v2"
+    written = []
+
+    def write_while_public_copies(index):
+        # The private copy is done by the time the public index catches up
+        if index == settings.es_public_index and not written:
+            assert private in cluster.docs
+            live["u3:med:metformin"] = {"user_id": "u3", "name": "Metformin"}
+            written.append(index)
+
+    cluster.on_refresh = write_while_public_copies
+
+    reembed.run(cluster, "small-model", version="v2")
+
+    assert written
+    # The pre-alias concrete index is gone; the late write survived the swap
+    assert settings.es_private_index not in cluster.docs
+    assert cluster.aliases[settings.es_private_index] == {private}
+    assert cluster.docs[private]["u3:med:metformin"]["name"] == "Metformin"
+    assert cluster.routing[(private, "u3:med:metformin")] == "u3"
+
+
+def test_writes_between_final_catch_up_and_swap_are_copied_after_it(cluster):
+    _seed(cluster)
+    private = f"{settings.es_private_index}-v2"
+    old_places = cluster.docs["providers_places-v1"]
+
+    def write_late():
+        # Lands after the final catch-up: in the blocked-to-be source, which
+        # the clone keeps, and in the aliased places index
+        cluster.docs[f"{settings.es_private_index}-pre-v2"]["u4:med:late"] = {
+            "user_id": "u4",
+            "name": "Late",
+            "updated_at": "2026-01-01T00:00:00+00:00",
+        }
+        cluster.routing[(f"{settings.es_private_index}-pre-v2", "u4:med:late")] = "u4"
+        old_places["p2"] = {"name": "Lab", "kind": "lab", "services": [], "hours": ""}
+        # An update of a copied doc that is older than a post-swap write
+        old_places["p1"]["hours"] = "9-5"
+
+    cluster.on_swap = write_late
+    refreshes = []
+
+    def write_after_swap(index):
+        # The first refresh of the post-swap pass: a new doc written through
+        # the alias must survive (nothing is pruned after the swap)
+        if index == f"{settings.es_private_index}-pre-v2" and not refreshes:
+            cluster.docs[private]["u5:med:new"] = {"user_id": "u5", "name": "New"}
+            cluster.routing[(private, "u5:med:new")] = "u5"
+            refreshes.append(index)
+
+    cluster.on_refresh = write_after_swap
+
+    reembed.run(cluster, "small-model", version="v2")
+
+    assert cluster.docs[private]["u4:med:late"]["name"] == "Late"
+    assert cluster.routing[(private, "u4:med:late")] == "u4"
+    assert "u5:med:new" in cluster.docs[private]
+    places = cluster.docs["providers_places-v2"]
+    assert "p2" in places
+    # Without updated_at an existing copy is left alone after the swap
+    assert places["p1"]["hours"] == ""
+
+
+def test_model_that_fails_to_load_aborts_before_building(cluster, monkeypatch):
+    _seed(cluster)
+
+    def broken(model):
+        raise OSError(f"{model} not found")
+
+    monkeypatch.setattr(embeddings, "require_model", broken)
+    before = set(cluster.docs)
+
+    with pytest.raises(OSError, match="typo/not-a-model"):
+        reembed.run(cluster, "typo/not-a-model", version="v2")
+
+    assert set(cluster.docs) == before
+    assert cluster.alias_updates == [] and cluster.set_models == []
+
+
+def test_reembed_refuses_to_overwrite_live_version(cluster):
+    _seed(cluster)
+    with pytest.raises(ValueError, match="already live"):
+        reembed.run(cluster, "small-model", version="v1")
+    assert cluster.alias_updates == []
+
+
+def test_same_model_migrates_settings_by_copying_vectors(cluster, monkeypatch):
+    _seed(cluster)
+    for name in (settings.es_private_index, settings.es_public_index):
+        for doc in cluster.docs[name].values():
+            doc["embedding"] = [0.5, 0.5]
+        cluster.mappings[name] = {"_meta": {"embeddings_model": "small-model"}}
+    # The pre-_meta places index is re-embedded as usual
+    embedded = []
+    real_embed = embeddings.embed
+
+    def counting_embed(texts, model=None):
+        embedded.extend(texts)
+        return real_embed(texts, model)
+
+    monkeypatch.setattr(embeddings, "embed", counting_embed)
+
+    reembed.run(cluster, "small-model", version="v2", index_type="hnsw")
+
+    private = cluster.docs[f"{settings.es_private_index}-v2"]
+    assert private["u1:med:ibuprofen"]["embedding"] == [0.5, 0.5]
+    assert cluster.docs[f"{settings.es_public_index}-v2"]["doc:0"]["embedding"] == [
+        0.5,
+        0.5,
+    ]
+    assert embedded == [ingest.places_text(cluster.docs["providers_places-v1"]["p1"])]
+    mapping = cluster.mappings[f"{settings.es_public_index}-v2"]
+    assert mapping["properties"]["embedding"]["index_options"]["type"] == "hnsw"
+
+
+def test_reuse_vectors_rejects_missing_or_wrong_size_vectors(cluster):
+    _seed(cluster)
+    with pytest.raises(ValueError, match="no stored 2-dim embedding"):
+        reembed.run(cluster, "small-model", version="v2", reuse_vectors=True)
+    assert cluster.alias_updates == []
+
+
+def test_serving_settings_failure_aborts_before_swap(cluster, monkeypatch):
+    _seed(cluster)
+    monkeypatch.setattr(ingest, "apply_index_settings", lambda *a: False)
+    with pytest.raises(RuntimeError, match="serving settings"):
+        reembed.run(cluster, "small-model", version="v2")
+    assert cluster.alias_updates == []
+
+
+def test_unreadable_source_mapping_falls_back_to_embedding(cluster, caplog):
+    _seed(cluster)
+
+    def broken(index):
+        raise RuntimeError("mapping unavailable")
+
+    cluster.indices.get_mapping = broken
+    caplog.set_level("WARNING")
+    reembed.run(cluster, "small-model", version="v2")
+    assert "Could not read the model" in caplog.text
+
+
+def test_private_only_rebuild_keeps_routing_and_model(cluster, monkeypatch):
+    _seed(cluster)
+    monkeypatch.setattr(embeddings, "MODEL", "small-model")
+    cluster.routing[(settings.es_private_index, "u1:med:ibuprofen")] = "u1"
+    live = cluster.docs[settings.es_private_index]
+    live["u2:med:warfarin"] = {"user_id": "u2", "name": "Warfarin"}
+    writes = iter([lambda: live.pop("u1:med:ibuprofen")])
+
+    def concurrent_delete(index):
+        if index == settings.es_private_index:
+            next(writes, lambda: None)()
+
+    cluster.on_refresh = concurrent_delete
+
+    stats = reembed.run(cluster, "small-model", version="v2", kinds=["private"])
+
+    assert set(stats) == {"private"}
+    # The catch-up prune deleted the routed copy with its routing
+    assert stats["private"].deleted == 1
+    assert set(cluster.docs[f"{settings.es_private_index}-v2"]) == {"u2:med:warfarin"}
+    ((swap),) = cluster.alias_updates
+    assert {a.get("add", {}).get("alias") for a in swap} == {
+        None,
+        settings.es_private_index,
+    }
+    assert settings.es_public_index in cluster.docs
+
+
+def test_partial_rebuild_rejects_new_model_and_unknown_kinds(cluster):
+    _seed(cluster)
+    with pytest.raises(ValueError, match="all indices together"):
+        reembed.run(cluster, "other-model", version="v2", kinds=["private"])
+    with pytest.raises(ValueError, match="Unknown index kinds: memory"):
+        reembed.run(cluster, embeddings.MODEL, version="v2", kinds=["memory"])
+    assert cluster.alias_updates == []
+
+
+def test_throttle_caps_rate(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(reembed.time, "sleep", sleeps.append)
+    monkeypatch.setattr(reembed.time, "monotonic", lambda: 0.0)
+
+    assert list(reembed._throttle(range(3), 10)) == [0, 1, 2]
+    assert sleeps == pytest.approx([0.1, 0.2, 0.3])
+    assert list(reembed._throttle(range(2), None)) == [0, 1]
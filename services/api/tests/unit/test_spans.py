@@ -0,0 +1,111 @@
+import json
+import threading
+
+import pytest
+
+from app.config.logging import clear_request_id, set_request_id
+from app.tools import es_client, spans
+from app.tools.spans import span
+
+# Bound at import: the integration fixtures patch es_client.Elasticsearch
+from app.tools.es_client import Elasticsearch
+
+
+@pytest.fixture(autouse=True)
+def _no_export(monkeypatch):
+    monkeypatch.delenv("SPANS_EXPORT_PATH", raising=False)
+    yield
+    spans.close()
+
+
+def test_spans_nest_and_record_attrs_and_errors():
+    with span("health") as root:
+        with span("embed", batch=2) as s:
+            s.attrs["queued_ms"] = 0.5
+        with pytest.raises(ValueError):
+            with span("es.search", index="kb"):
+                with span("inner"):
+                    raise ValueError("boom")
+    assert spans.current() is None
+
+    out = root.to_dict()
+    assert [c["name"] for c in out["spans"]] == ["embed", "es.search"]
+    assert out["spans"][0]["attrs"] == {"batch": 2, "queued_ms": 0.5}
+    failed = out["spans"][1]
+    assert failed["error"] is True and failed["spans"][0]["error"] is True
+    assert 0 <= root.self_ms() <= root.elapsed_ms
+
+
+def test_decorator_opens_a_fresh_span_per_call():
+    @span("load")
+    def load(n):
+        return spans.current()
+
+    with span("node") as root:
+        first, second = load(1), load(2)
+    assert first is not second
+    assert [c.name for c in root.children] == ["load", "load"]
+
+
+def test_threads_keep_their_own_parent():
+    seen = []
+
+    def worker():
+        seen.append(spans.current())
+
+    with span("node"):
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join()
+    assert seen == [None]
+
+
+def test_exporter_writes_top_level_spans_as_json_lines(tmp_path, monkeypatch):
+    path = tmp_path / "spans.jsonl"
+    monkeypatch.setenv("SPANS_EXPORT_PATH", str(path))
+    set_request_id("rid-1")
+    try:
+        with span("places"):
+            with span("search_providers"):
+                pass
+        with span("planner"):
+            pass
+    finally:
+        clear_request_id()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r["name"] for r in lines] == ["places", "planner"]
+    assert lines[0]["request_id"] == "rid-1"
+    assert lines[0]["spans"][0]["name"] == "search_providers"
+
+    # A new path switches files; unset turns exporting off
+    other = tmp_path / "other.jsonl"
+    monkeypatch.setenv("SPANS_EXPORT_PATH", str(other))
+    with span("critic"):
+        pass
+    monkeypatch.delenv("SPANS_EXPORT_PATH")
+    with span("scrub"):
+        pass
+    assert len(path.read_text().splitlines()) == 2
+    assert [json.loads(x)["name"] for x in other.read_text().splitlines()] == ["critic"]
+
+
+def test_export_failure_is_logged_not_raised(tmp_path, monkeypatch, caplog):
+    monkeypatch.setenv("SPANS_EXPORT_PATH", str(tmp_path / "missing" / "s.jsonl"))
+    with span("node"):
+        pass
+    assert "Failed exporting span node" in caplog.text
+
+
+def test_es_calls_are_spans_tagged_with_index_and_knn(monkeypatch):
+    monkeypatch.setattr(
+        es_client._Elasticsearch, "perform_request", lambda *a, **k: {"hits": {}}
+    )
+    es = Elasticsearch("http://localhost:9200")
+    with span("health") as root:
+        es.search(index="kb", knn={"field": "embedding", "k": 1})
+        es.search(index="kb", query={"match_all": {}})
+    assert [(c.name, c.attrs) for c in root.children] == [
+        ("es.search", {"index": "kb", "knn": True}),
+        ("es.search", {"index": "kb"}),
+    ]
@@ -306,3 +306,29 @@ def test_watches_exemplars_for_changes(monkeypatch, tmp_path):
     monkeypatch.setenv("INTENT_EXEMPLARS_PATH", str(second))
 
     assert sup.detect_intent("book a follow-up appointment") == "appointment"
+
+
+def test_load_exemplars_from_gzipped_jsonl(monkeypatch, tmp_path):
+    import gzip
+    import importlib
+
+    file_path = tmp_path / "exemplars.jsonl.gz"
+    with gzip.open(file_path, "wt", encoding="utf-8") as handle:
+        handle.write('{"intent": "meds", "text": "refill please"}\n')
+    monkeypatch.setenv("INTENT_EXEMPLARS_PATH", str(file_path))
+
+    importlib.reload(supervisor)
+
+    assert supervisor._EXEMPLARS == {"meds": ["refill please"]}
+
+
+def test_exemplar_vectors_follow_embeddings_model_switch(monkeypatch):
+    from app.tools import embeddings
+
+    monkeypatch.setattr(supervisor, "_EX_VECS", {})
+    monkeypatch.setattr(embeddings, "MODEL", "switched-model")
+
+    supervisor.detect_intent("I have a fever")
+
+    assert supervisor._EX_MODEL == "switched-model"
+    assert supervisor._EX_VECS
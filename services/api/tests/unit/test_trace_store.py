@@ -0,0 +1,107 @@
+import tracemalloc
+
+from app.tools import trace_store
+from app.tools.trace_store import NodeLatency, NodeProfile, TraceStore, percentile
+
+
+def test_percentile_is_nearest_rank():
+    ordered = [float(n) for n in range(1, 101)]
+    assert percentile(ordered, 50) == 50.0
+    assert percentile(ordered, 95) == 95.0
+    assert percentile(ordered, 99) == 99.0
+    assert percentile([7.0], 99) == 7.0
+
+
+def test_trace_store_evicts_oldest():
+    store = TraceStore(size=2)
+    store.put("a", {"n": 1})
+    store.put("b", {"n": 2})
+    store.put("a", {"n": 3})  # re-put refreshes a, so b goes next
+    store.put("c", {"n": 4})
+    assert store.get("b") is None
+    assert store.get("a") == {"n": 3}
+    assert store.request_ids() == ["c", "a"]
+    store.clear()
+    assert store.request_ids() == []
+
+
+def test_latency_summaries_by_node_and_intent():
+    stats = NodeLatency(window=100)
+    for ms in range(1, 101):
+        stats.observe("places", "appointment", float(ms))
+    stats.observe("places", "symptom", 500.0, error=True)
+    stats.observe("scrub", None, 2.0)
+
+    snap = stats.snapshot()
+    assert list(snap) == ["places", "scrub"]
+    places = snap["places"]
+    assert places["count"] == 101 and places["errors"] == 1
+    assert places["max_ms"] == 500.0
+    by_intent = places["by_intent"]
+    assert by_intent["appointment"]["p50_ms"] == 50.0
+    assert by_intent["appointment"]["p99_ms"] == 99.0
+    assert by_intent["symptom"] == {
+        "count": 1,
+        "errors": 1,
+        "p50_ms": 500.0,
+        "p95_ms": 500.0,
+        "p99_ms": 500.0,
+        "max_ms": 500.0,
+    }
+    assert list(snap["scrub"]["by_intent"]) == [trace_store.UNCLASSIFIED]
+
+
+def test_latency_window_is_rolling():
+    stats = NodeLatency(window=3)
+    for ms in (100.0, 1.0, 2.0, 3.0):
+        stats.observe("planner", "meds", ms)
+    assert stats.snapshot()["planner"]["max_ms"] == 3.0
+    stats.clear()
+    assert stats.snapshot() == {}
+
+
+def test_sizes_from_env(monkeypatch, caplog):
+    monkeypatch.setenv("TRACE_STORE_SIZE", "8")
+    monkeypatch.setenv("TRACE_LATENCY_WINDOW", "many")
+    assert TraceStore().size == 8
+    assert NodeLatency().window == trace_store.DEFAULT_WINDOW
+    assert "Invalid TRACE_LATENCY_WINDOW" in caplog.text
+
+
+def test_profile_ranks_nodes_by_cpu_and_memory():
+    stats = NodeProfile(window=10)
+    stats.observe("answer_gen", 100.0, 90.0, 1000, 5000)
+    stats.observe("answer_gen", 120.0, 110.0, 3000, 7000)
+    stats.observe("health", 300.0, 15.0, 200, 9000)
+    stats.observe("scrub", 1.0, 0.5)
+
+    ranked = stats.ranking()
+    assert [n["node"] for n in ranked["by_cpu"]] == ["answer_gen", "health", "scrub"]
+    top = ranked["by_cpu"][0]
+    assert top["runs"] == 2 and top["cpu_ms_avg"] == 100.0
+    assert top["alloc_bytes_avg"] == 2000 and top["peak_bytes_max"] == 7000
+    health = ranked["by_cpu"][1]
+    assert health["cpu_share"] == 0.05  # mostly waiting: a concurrency candidate
+    assert [n["node"] for n in ranked["by_memory"]] == ["health", "answer_gen"]
+    assert "peak_bytes_avg" not in ranked["by_cpu"][2]
+
+    stats.clear()
+    assert stats.ranking() == {"by_cpu": [], "by_memory": []}
+
+
+def test_memory_accounting_is_opt_in(monkeypatch):
+    assert trace_store.memory_start() is None
+    assert trace_store.memory_stop(None) == {}
+
+    monkeypatch.setenv("TRACE_MEMORY", "true")
+    was_tracing = tracemalloc.is_tracing()
+    try:
+        start = trace_store.memory_start()
+        assert start is not None and tracemalloc.is_tracing()
+        block = bytearray(1 << 20)
+        used = trace_store.memory_stop(start)
+        assert used["peak_bytes"] >= 1 << 20 and used["alloc_bytes"] >= 1 << 20
+        del block
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()